@@ -0,0 +1,249 @@
+import os
+import sys
+import time
+import asyncio
+import threading
+import configparser
+from contextlib import contextmanager, asynccontextmanager
+
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+
+logger = telemetry.get_logger("adaptive_limiter")
+
+# 未在配置中指定时的并发上下限
+DEFAULT_MIN_LIMIT = 1
+DEFAULT_MAX_LIMIT = 256
+# 加性增：每完成一整个窗口的成功请求，上限加 1
+INCREASE = 1.0
+# 乘性减：遇到 429 / 超时 / 延迟膨胀时上限乘以该系数
+DECREASE_FACTOR = 0.7
+# 近期延迟超过基线的多少倍视为排队（None 关闭延迟判断）
+LATENCY_TOLERANCE = 2.0
+# 延迟至少增加这么多秒才视为膨胀（忽略毫秒级请求的抖动）
+LATENCY_SLACK = 0.05
+# 近期延迟的指数平滑系数
+SHORT_SMOOTHING = 0.2
+# 基线延迟（近似最小延迟）每个样本向上漂移的比例，使其能跟上服务端真实变慢
+BASELINE_DRIFT = 0.01
+# 判断延迟膨胀前需要的成功样本数
+MIN_SAMPLES = 10
+# 异步等待名额时两次检查之间的间隔（秒）
+POLL_INTERVAL = 0.01
+# 视为服务端过载、需要降低并发的失败
+DROP_OUTCOMES = {"rate_limited", "timeout", "http_502", "http_503", "http_504"}
+
+
+class AdaptiveLimiter:
+    """
+    AIMD concurrency window of one provider in this process.
+
+    The window grows by INCREASE per window of successful requests while it is in use and the
+    smoothed latency stays within LATENCY_TOLERANCE of the baseline; it shrinks by DECREASE_FACTOR
+    on 429s, timeouts, 502-504 and latency inflation. Failures of requests sent before the last
+    decrease do not shrink it again, so one burst of 429s counts as one congestion event.
+    """
+
+    def __init__(self, provider, initial=4, min_limit=DEFAULT_MIN_LIMIT, max_limit=DEFAULT_MAX_LIMIT,
+                 latency_tolerance=LATENCY_TOLERANCE, registry=None):
+        """
+        Args:
+            provider: Provider name (metric label)
+            initial: Starting concurrency limit
+            min_limit / max_limit: Bounds of the limit
+            latency_tolerance: Shrink when the smoothed latency exceeds this multiple of the baseline
+                (None only reacts to errors)
+            registry: MetricsRegistry to report to (defaults to telemetry.METRICS)
+        """
+        self.provider = provider
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.latency_tolerance = latency_tolerance
+        self.registry = registry or telemetry.METRICS
+        self.condition = threading.Condition()
+        self.in_flight = 0
+        self.baseline = None
+        self.smoothed = None
+        self.samples = 0
+        self.last_decrease = 0.0
+        self._publish()
+
+    def _publish(self):
+        self.registry.set("llm_concurrency_limit", int(self.limit), provider=self.provider)
+        self.registry.set("llm_concurrency_in_flight", self.in_flight, provider=self.provider)
+
+    def try_acquire(self):
+        """Take a slot if the window has room; returns the start time or None"""
+        with self.condition:
+            if self.in_flight >= int(self.limit):
+                return None
+            self.in_flight += 1
+            self._publish()
+            return time.time()
+
+    def acquire(self):
+        """Block until the window has room; returns the start time to pass to release"""
+        with self.condition:
+            while self.in_flight >= int(self.limit):
+                self.condition.wait()
+            self.in_flight += 1
+            self._publish()
+            return time.time()
+
+    async def acquire_async(self):
+        """Async version of acquire"""
+        while True:
+            start = self.try_acquire()
+            if start is not None:
+                return start
+            await asyncio.sleep(POLL_INTERVAL)
+
+    def release(self, start, error=None, latency=True):
+        """
+        Free a slot and adapt the limit.
+
+        Args:
+            start: Value returned by acquire
+            error: Exception of a failed attempt (None on success)
+            latency: Use the duration of this request as a latency sample (False for streams,
+                whose duration depends on the output length)
+        """
+        now = time.time()
+        with self.condition:
+            self.in_flight -= 1
+            if error is not None:
+                outcome = telemetry.classify_error(error)
+                if outcome in DROP_OUTCOMES and start >= self.last_decrease:
+                    self._decrease(outcome, now)
+            elif latency:
+                self._on_success(now - start, start, now)
+            else:
+                self._increase()
+            self._publish()
+            self.condition.notify_all()
+
+    def cancel(self):
+        """Free a slot without adapting the limit (cancelled or interrupted attempt)"""
+        with self.condition:
+            self.in_flight -= 1
+            self._publish()
+            self.condition.notify_all()
+
+    def _increase(self):
+        # 只有窗口确实被用到一半以上时才增长（in_flight 已减去本请求），避免空闲时上限无限增大
+        if (self.in_flight + 1) * 2 >= self.limit:
+            self.limit = min(self.max_limit, self.limit + INCREASE / self.limit)
+
+    def _on_success(self, elapsed, start, now):
+        self.samples += 1
+        if self.baseline is None or elapsed < self.baseline:
+            self.baseline = elapsed
+        else:
+            self.baseline += (elapsed - self.baseline) * BASELINE_DRIFT
+        self.smoothed = elapsed if self.smoothed is None else \
+            self.smoothed + (elapsed - self.smoothed) * SHORT_SMOOTHING
+
+        if (self.latency_tolerance and self.samples >= MIN_SAMPLES
+                and self.smoothed > self.baseline * self.latency_tolerance
+                and self.smoothed - self.baseline > LATENCY_SLACK):
+            if start >= self.last_decrease:
+                self._decrease("latency", now)
+            return
+        self._increase()
+
+    def _decrease(self, reason, now):
+        previous = self.limit
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        self.last_decrease = now
+        if reason == "latency":
+            # 降低并发后重新测量近期延迟
+            self.smoothed = self.baseline
+        self.registry.inc("llm_concurrency_decreases_total", provider=self.provider, reason=reason)
+        logger.debug("%s concurrency limit %.1f -> %.1f (%s)", self.provider, previous, self.limit, reason)
+
+    def get_stats(self):
+        with self.condition:
+            return {"limit": int(self.limit), "in_flight": self.in_flight, "baseline_latency": self.baseline,
+                    "smoothed_latency": self.smoothed}
+
+
+def load_limiters():
+    """Read optional adaptive_concurrency (initial limit) / adaptive_min_concurrency / adaptive_max_concurrency"""
+    limiters = {}
+    config = configparser.ConfigParser()
+    try:
+        config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.provider_env'))
+        for provider in config.sections():
+            section = config[provider]
+            if "adaptive_concurrency" in section:
+                limiters[provider] = AdaptiveLimiter(
+                    provider, section.getint("adaptive_concurrency"),
+                    section.getint("adaptive_min_concurrency", DEFAULT_MIN_LIMIT),
+                    section.getint("adaptive_max_concurrency", DEFAULT_MAX_LIMIT))
+    except Exception as e:
+        logger.error("Error loading adaptive concurrency limits: %s", e)
+    return limiters
+
+
+LIMITERS = load_limiters()
+
+
+def configure(provider, initial=None, min_limit=DEFAULT_MIN_LIMIT, max_limit=DEFAULT_MAX_LIMIT, **options):
+    """Enable (or with initial=None, disable) adaptive concurrency for a provider in this process"""
+    if initial is None:
+        LIMITERS.pop(provider, None)
+        return None
+    limiter = LIMITERS[provider] = AdaptiveLimiter(provider, initial, min_limit, max_limit, **options)
+    return limiter
+
+
+@contextmanager
+def slot(provider, latency=True):
+    """
+    Hold a slot of the provider's adaptive concurrency window for one upstream attempt
+    (no-op for providers without adaptive concurrency).
+
+    Take it before the cross-process rate_limiter.slot: requests queued on the window then hold
+    no RPM/TPM tokens or shared in-flight permits. Time spent waiting for the rate limiter counts
+    as latency, so sustained throttling also narrows the window.
+
+    Usage:
+        with adaptive_limiter.slot(provider_name), rate_limiter.slot(provider_name, tokens) as permit:
+            completion = client.chat.completions.create(...)
+    """
+    limiter = LIMITERS.get(provider)
+    if limiter is None:
+        yield
+        return
+    start = limiter.acquire()
+    try:
+        yield
+    except Exception as e:
+        limiter.release(start, e)
+        raise
+    except BaseException:
+        limiter.cancel()
+        raise
+    limiter.release(start, latency=latency)
+
+
+@asynccontextmanager
+async def slot_async(provider, latency=True):
+    """Async version of slot"""
+    limiter = LIMITERS.get(provider)
+    if limiter is None:
+        yield
+        return
+    start = await limiter.acquire_async()
+    try:
+        yield
+    except Exception as e:
+        limiter.release(start, e)
+        raise
+    except BaseException:
+        limiter.cancel()
+        raise
+    limiter.release(start, latency=latency)
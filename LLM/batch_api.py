@@ -0,0 +1,224 @@
+import os
+import sys
+import json
+import time
+import logging
+
+from openai.types.chat import ChatCompletion
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from LLM.openai_based_api import build_request, build_response, parse_completion
+
+logger = telemetry.get_logger("batch_api")
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+# OpenAI Batch API 限制：单个文件最多50000个请求、200MB
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 190 * 1024 * 1024
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+def build_batch_line(spec, custom_id):
+    """
+    Build one JSONL batch request line from a process_content style spec.
+
+    Args:
+        spec: Dictionary with process_content arguments (user_prompt, model and optionally
+              content, system_prompt, history, max_tokens, response_format, n, temperature, tools,
+              tool_choice, prompt_cache, logprobs)
+        custom_id: Identifier used to match the result back to the request
+
+    Returns:
+        The JSON line (without trailing newline)
+    """
+    body = build_request(spec["model"], spec["user_prompt"], spec.get("content"), spec.get("system_prompt"),
+                         spec.get("history"), spec.get("max_tokens"), spec.get("response_format"), spec.get("n", 1),
+                         spec.get("temperature"), spec.get("tools"), spec.get("tool_choice"), spec.get("prompt_cache"),
+                         spec.get("logprobs", False))
+    return json.dumps({"custom_id": custom_id, "method": "POST", "url": BATCH_ENDPOINT, "body": body},
+                      ensure_ascii=False)
+
+
+def write_batch_files(specs, output_dir, prefix="batch"):
+    """
+    Write request specs into one or more JSONL batch files within the provider limits.
+
+    Specs without a "custom_id" key get "request-<index>".
+
+    Returns:
+        List of (file path, list of custom_ids in that file)
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    files = []
+    handle = None
+    ids = []
+    size = 0
+
+    def open_next():
+        path = os.path.join(output_dir, f"{prefix}-{len(files):04d}.jsonl")
+        files.append((path, []))
+        return open(path, "w", encoding="utf-8"), files[-1][1]
+
+    try:
+        for index, spec in enumerate(specs):
+            custom_id = spec.get("custom_id", f"request-{index}")
+            line = build_batch_line(spec, custom_id) + "\n"
+            line_size = len(line.encode("utf-8"))
+            if handle is None or len(ids) >= MAX_REQUESTS_PER_FILE or size + line_size > MAX_BYTES_PER_FILE:
+                if handle is not None:
+                    handle.close()
+                handle, ids = open_next()
+                size = 0
+            handle.write(line)
+            ids.append(custom_id)
+            size += line_size
+    finally:
+        if handle is not None:
+            handle.close()
+
+    return files
+
+
+def submit_batch(provider_name, path, completion_window="24h", metadata=None):
+    """Upload a batch file and create the batch job, returning the Batch object"""
+    client = openai_based_api.get_openai_client(provider_name)
+    with open(path, "rb") as f:
+        input_file = client.files.create(file=f, purpose="batch")
+    batch = client.batches.create(
+        input_file_id=input_file.id,
+        endpoint=BATCH_ENDPOINT,
+        completion_window=completion_window,
+        metadata=metadata
+    )
+    logger.info("Submitted batch %s (%s) to %s", batch.id, os.path.basename(path), provider_name)
+    return batch
+
+
+def wait_for_batch(provider_name, batch_id, poll_interval=60, timeout=None):
+    """
+    Poll a batch until it reaches a terminal status.
+
+    Args:
+        provider_name: Name of the provider
+        batch_id: The batch to poll
+        poll_interval: Seconds between two polls
+        timeout: Optional maximum number of seconds to wait
+
+    Returns:
+        The final Batch object
+
+    Raises:
+        TimeoutError: If the batch is not finished within timeout
+    """
+    client = openai_based_api.get_openai_client(provider_name)
+    start_time = time.time()
+    status = None
+    while True:
+        batch = client.batches.retrieve(batch_id)
+        counts = batch.request_counts
+        progress = f" ({counts.completed}/{counts.total} completed, {counts.failed} failed)" if counts else ""
+        # 状态变化记为 info，每次轮询的进度只在 debug 级别输出
+        logger.log(logging.INFO if batch.status != status else logging.DEBUG,
+                   "Batch %s: %s%s", batch_id, batch.status, progress)
+        status = batch.status
+        if batch.status in TERMINAL_STATUSES:
+            return batch
+        if timeout is not None and time.time() - start_time > timeout:
+            raise TimeoutError(f"Batch {batch_id} not finished after {timeout} seconds")
+        time.sleep(poll_interval)
+
+
+def iter_file_lines(client, file_id):
+    """Stream the lines of a provider file without loading it into memory"""
+    with client.files.with_streaming_response.content(file_id) as response:
+        for line in response.iter_lines():
+            if line.strip():
+                yield line
+
+
+def error_response(elapsed_time, error):
+    """Response dict of a failed request: the keys of build_response plus an error entry"""
+    response = build_response("", None, 0, 0, elapsed_time)
+    response["error"] = error
+    return response
+
+
+def parse_batch_line(line, elapsed_time):
+    """
+    Convert one output/error line into (custom_id, response dict).
+
+    Successful lines get the same keys as process_content; failed ones get "result": ""
+    and an "error" entry.
+    """
+    record = json.loads(line)
+    custom_id = record["custom_id"]
+    response = record.get("response") or {}
+    if record.get("error") or response.get("status_code") != 200:
+        error = record.get("error") or response.get("body", {}).get("error")
+        return custom_id, error_response(elapsed_time, error)
+
+    parsed = parse_completion(ChatCompletion.model_validate(response["body"]))
+    return custom_id, build_response(parsed["result"], parsed["tool_calls"], parsed["input_tokens"],
+                                     parsed["output_tokens"], elapsed_time, parsed["cached_tokens"],
+                                     parsed["choices"])
+
+
+def iter_batch_results(provider_name, batch, elapsed_time=None, custom_ids=None):
+    """
+    Stream the results of a finished batch as (custom_id, response dict).
+
+    elapsed_time of each response is the wall-clock time of the whole batch, since the
+    provider does not report per-request latency. Requests listed in custom_ids that have
+    no line in the output or error file (e.g. in a failed, expired or cancelled batch)
+    get an error response with code "batch_<status>".
+    """
+    client = openai_based_api.get_openai_client(provider_name)
+    if elapsed_time is None and batch.completed_at:
+        elapsed_time = float(batch.completed_at - batch.created_at)
+    seen = set()
+    for file_id in (batch.output_file_id, batch.error_file_id):
+        if not file_id:
+            continue
+        for line in iter_file_lines(client, file_id):
+            custom_id, response = parse_batch_line(line, elapsed_time)
+            seen.add(custom_id)
+            yield custom_id, response
+
+    for custom_id in custom_ids or ():
+        if custom_id not in seen:
+            yield custom_id, error_response(elapsed_time, {
+                "code": f"batch_{batch.status}",
+                "message": f"Batch {batch.id} ended with status {batch.status} without a result for this request"})
+
+
+def process_content_batch(provider_name, specs, output_dir, poll_interval=60, completion_window="24h", timeout=None):
+    """
+    Run process_content style requests through the provider's Batch API.
+
+    All batch files are submitted first, then polled in turn; results are streamed back
+    as soon as each batch finishes.
+
+    Args:
+        provider_name: Name of the provider to use
+        specs: Iterable of request specs (see build_batch_line), optionally with "custom_id"
+        output_dir: Directory where the JSONL batch files are written
+        poll_interval: Seconds between two status polls
+        completion_window: Batch completion window
+        timeout: Optional maximum number of seconds to wait for each batch
+
+    Yields:
+        (custom_id, response dict) with the same keys as process_content, once for every
+        request; failed requests have "result": "" and an "error" entry
+    """
+    start_time = time.time()
+    batches = [(submit_batch(provider_name, path, completion_window), ids)
+               for path, ids in write_batch_files(specs, output_dir)]
+
+    for batch, ids in batches:
+        batch = wait_for_batch(provider_name, batch.id, poll_interval, timeout)
+        if batch.status != "completed":
+            logger.warning("Batch %s ended with status %s", batch.id, batch.status)
+        yield from iter_batch_results(provider_name, batch, time.time() - start_time, ids)
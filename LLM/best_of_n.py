@@ -0,0 +1,193 @@
+import os
+import sys
+import json
+import time
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from LLM.structured_output import strip_code_fence, get_schema, validate_schema
+
+logger = telemetry.get_logger("best_of_n")
+
+DEFAULT_N = 4
+# 不支持 n 参数（只返回一个 choice）的服务商；运行中检测到的服务商也会加入，之后直接并行请求
+SINGLE_CHOICE_PROVIDERS = set()
+
+
+# ----- 打分函数：输入一个 choice，分数越高越好 -----
+
+def json_scorer(choice):
+    """1.0 when the result parses as JSON (code fences allowed), otherwise 0.0"""
+    try:
+        json.loads(strip_code_fence(choice["result"]))
+    except (json.JSONDecodeError, TypeError):
+        return 0.0
+    return 1.0
+
+
+def schema_scorer(schema):
+    """
+    Build a scorer for a JSON schema: 0.0 for invalid JSON, otherwise 1 / (1 + number of
+    validation errors), so a fully valid result scores 1.0.
+    """
+    def score(choice):
+        try:
+            parsed = json.loads(strip_code_fence(choice["result"]))
+        except (json.JSONDecodeError, TypeError):
+            return 0.0
+        return 1.0 / (1 + len(validate_schema(parsed, schema)))
+    return score
+
+
+def logprob_scorer(choice):
+    """Sum of the token log probabilities (requires logprobs=True)"""
+    return choice.get("logprob_sum", -math.inf)
+
+
+logprob_scorer.needs_logprobs = True
+
+
+def lexicographic(*scorers):
+    """Combine scorers: compare by the first, break ties with the next ones"""
+    def score(choice):
+        return tuple(scorer(choice) for scorer in scorers)
+    score.needs_logprobs = any(getattr(scorer, "needs_logprobs", False) for scorer in scorers)
+    return score
+
+
+SCORERS = {"json": json_scorer, "logprob": logprob_scorer}
+
+
+def resolve_scorer(scorer, response_format=None):
+    """Accept a scorer callable or a name: "json", "logprob", "schema" (uses response_format)"""
+    if callable(scorer):
+        return scorer
+    if scorer == "schema":
+        schema = get_schema(response_format)
+        if schema is None:
+            raise ValueError('scorer "schema" requires a json_schema response_format')
+        return schema_scorer(schema)
+    if scorer not in SCORERS:
+        raise ValueError(f"Unknown scorer '{scorer}'. Available: {list(SCORERS) + ['schema']}")
+    return SCORERS[scorer]
+
+
+def choices_of(response):
+    """All choices of a process_content response (a single-choice response has no "choices" key)"""
+    if response.get("choices"):
+        return response["choices"]
+    choice = {"index": 0, "result": response["result"], "tool_calls": response.get("tool_calls"),
+              "finish_reason": None}
+    if "logprob_sum" in response:
+        choice["logprob_sum"] = response["logprob_sum"]
+    return [choice]
+
+
+def generate_choices(provider_name, user_prompt, model, n=DEFAULT_N, parallel=None, max_workers=None, **kwargs):
+    """
+    Get n choices for one prompt.
+
+    A single request with n is sent first; when the provider returns fewer choices (it
+    ignores n), the remaining ones are requested in parallel with n=1 and the provider is
+    remembered in SINGLE_CHOICE_PROVIDERS so later calls go parallel right away.
+
+    Args:
+        provider_name, user_prompt, model: As for process_content
+        n: Number of choices
+        parallel: Force (True) or forbid (False) parallel single-choice requests;
+            None decides from SINGLE_CHOICE_PROVIDERS
+        max_workers: Maximum concurrent requests in parallel mode (default n)
+        **kwargs: Other process_content arguments
+
+    Returns:
+        process_content style dict with "choices" (re-indexed 0..n-1) and token counts summed
+        over all requests
+    """
+    start_time = time.time()
+    if parallel is None:
+        parallel = provider_name in SINGLE_CHOICE_PROVIDERS
+    # 并行的相同请求需要各自采样，不能被合并
+    kwargs["coalesce"] = False
+
+    responses = []
+    missing = n
+    if not parallel:
+        response = openai_based_api.process_content(provider_name, user_prompt, model, n=n, **kwargs)
+        responses.append(response)
+        missing = n - len(choices_of(response))
+        if missing > 0:
+            logger.info("%s returned %d of %d choices, requesting the rest in parallel", provider_name,
+                        n - missing, n)
+            SINGLE_CHOICE_PROVIDERS.add(provider_name)
+
+    if missing > 0:
+        def request(_):
+            return openai_based_api.process_content(provider_name, user_prompt, model, n=1, **kwargs)
+
+        errors = []
+        with ThreadPoolExecutor(max_workers=max_workers or missing) as executor:
+            futures = [executor.submit(request, i) for i in range(missing)]
+            for future in futures:
+                try:
+                    responses.append(future.result())
+                except Exception as e:
+                    errors.append(e)
+        if not responses:
+            raise errors[0]
+        if errors:
+            logger.warning("%d of %d parallel requests to %s failed: %s", len(errors), missing, provider_name,
+                           errors[0])
+
+    choices = []
+    for response in responses:
+        for choice in choices_of(response):
+            choices.append(dict(choice, index=len(choices)))
+
+    combined = dict(responses[0])
+    for key in ("input_tokens", "output_tokens", "cached_tokens", "uncached_input_tokens"):
+        combined[key] = sum(response.get(key, 0) for response in responses)
+    combined["choices"] = choices
+    combined["requests"] = len(responses)
+    combined["elapsed_time"] = time.time() - start_time
+    return combined
+
+
+def process_content_best_of_n(provider_name, user_prompt, model, n=DEFAULT_N, scorer="json", parallel=None,
+                              **kwargs):
+    """
+    Generate n choices and return the best one according to a local scorer.
+
+    Args:
+        provider_name, user_prompt, model: As for process_content
+        n: Number of candidates
+        scorer: Callable(choice) -> comparable score, or "json", "schema", "logprob";
+            scorers with needs_logprobs = True turn on logprobs
+        parallel: See generate_choices
+        **kwargs: Other process_content arguments (temperature > 0 is recommended)
+
+    Returns:
+        process_content style dict whose "result"/"tool_calls" are the winner's, plus
+        "best_index", "scores" and all "choices" (each with its "score"); ties go to the
+        earliest choice
+    """
+    scorer = resolve_scorer(scorer, kwargs.get("response_format"))
+    if getattr(scorer, "needs_logprobs", False):
+        kwargs["logprobs"] = True
+
+    response = generate_choices(provider_name, user_prompt, model, n, parallel, **kwargs)
+    choices = [dict(choice, score=scorer(choice)) for choice in response["choices"]]
+    best = max(choices, key=lambda choice: choice["score"])
+
+    response = dict(response, result=best["result"], choices=choices, best_index=best["index"],
+                    scores=[choice["score"] for choice in choices])
+    response.pop("tool_calls", None)
+    if best["tool_calls"]:
+        response["tool_calls"] = best["tool_calls"]
+    if "logprob_sum" in best:
+        response["logprob_sum"] = best["logprob_sum"]
+    logger.info("Best of %d from %s: choice %d (score %s)", len(choices), provider_name, best["index"], best["score"])
+    return response
@@ -0,0 +1,466 @@
+import io
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import base64
+import asyncio
+import atexit
+import hashlib
+import datetime
+import itertools
+import threading
+from collections import defaultdict, deque
+from urllib.parse import urlsplit, parse_qsl, urlencode
+
+try:
+    import httpx2
+except ImportError:
+    httpx2 = None
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import requests
+    import requests.adapters
+    import requests.structures
+except ImportError:
+    requests = None
+
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+
+logger = telemetry.get_logger("cassette")
+
+# 默认的录像目录（按测试脚本名保存为 <name>.jsonl.gz）
+CASSETTE_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "test_case", "cassettes")
+CASSETTE_VERSION = 1
+# 计算请求指纹前从 JSON 请求体和查询参数中去掉的字段（密钥不进入录像，也不影响匹配）
+REDACTED_FIELDS = {"api_key", "app_secret", "app_id", "access_token", "refresh_token", "tenant_access_token",
+                   "app_access_token", "key", "token"}
+# 写入录像前从 JSON 响应体中去掉的字段（不含泛用的 key / token：logprobs 等正常结果里也有这两个字段）
+REDACTED_RESPONSE_FIELDS = REDACTED_FIELDS - {"key", "token"}
+# 录像中保留的响应头，其余（日期、请求 ID、cookie 等）丢弃
+KEPT_HEADERS = {"content-type", "retry-after", "x-ratelimit-remaining-requests", "x-ratelimit-remaining-tokens"}
+# 回放时默认跳过的失败响应：录制时重试成功的请求回放时不再等待退避
+ERROR_STATUSES = {408, 429, 500, 502, 503, 504}
+
+
+class CassetteMiss(BaseException):
+    """
+    No recorded interaction matches a request in replay mode.
+
+    Derives from BaseException so that the retry loops (which catch Exception) fail at once
+    instead of backing off: a missing recording is a setup error, not a transient API error.
+    """
+
+
+def _redact(value, fields=REDACTED_FIELDS):
+    if isinstance(value, dict):
+        return {k: "<redacted>" if k.lower() in fields else _redact(v, fields) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_redact(v, fields) for v in value]
+    return value
+
+
+def _redact_body(data):
+    """Redact the secrets of a JSON response body; other bodies are returned unchanged"""
+    try:
+        body = json.loads(data)
+    except (ValueError, UnicodeDecodeError):
+        return data
+    redacted = _redact(body, REDACTED_RESPONSE_FIELDS)
+    if redacted == body:
+        return data
+    return json.dumps(redacted, ensure_ascii=False).encode("utf-8")
+
+
+def request_key(method, url, body):
+    """
+    Fingerprint of a request: method, host and path, redacted query and a hash of the redacted body.
+
+    Returns:
+        (exact key, loose key); the loose key only contains method and path and is used as fallback
+        for requests whose body changes between runs (timestamps, generated IDs)
+    """
+    parts = urlsplit(str(url))
+    query = urlencode(sorted(_redact(dict(parse_qsl(parts.query))).items()))
+    loose = f"{method.upper()} {parts.netloc}{parts.path}"
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    body = body or b""
+    try:
+        body = json.dumps(_redact(json.loads(body)), sort_keys=True, ensure_ascii=False).encode("utf-8")
+    except (ValueError, UnicodeDecodeError):
+        pass
+    digest = hashlib.sha256(body).hexdigest()[:16]
+    return f"{loose}?{query} {digest}", loose
+
+
+def encode_chunk(delay, data):
+    """[delay in ms, text] or [delay in ms, base64, 1] for binary data"""
+    delay = round(delay * 1000)
+    try:
+        return [delay, data.decode("utf-8")]
+    except UnicodeDecodeError:
+        return [delay, base64.b64encode(data).decode("ascii"), 1]
+
+
+def decode_chunk(chunk):
+    data = base64.b64decode(chunk[1]) if len(chunk) > 2 else chunk[1].encode("utf-8")
+    return chunk[0] / 1000, data
+
+
+def _kept_headers(headers):
+    return {k.lower(): v for k, v in headers.items() if k.lower() in KEPT_HEADERS}
+
+
+def _is_stream(headers):
+    return "text/event-stream" in headers.get("content-type", "")
+
+
+class _Recording:
+    """Collects the body chunks of one recorded response as the caller reads them"""
+
+    def __init__(self, cassette, interaction, start):
+        self.cassette = cassette
+        self.interaction = interaction
+        self.last = start
+        self.chunks = []
+        self.finished = False
+
+    def add(self, data):
+        now = time.time()
+        if data:
+            self.chunks.append((now - self.last, data))
+        self.last = now
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        chunks = self.chunks
+        if not _is_stream(self.interaction["headers"]) and len(chunks) > 1:
+            # 非流式响应只保留整体耗时，合并为一个分块
+            chunks = [(sum(delay for delay, _ in chunks), b"".join(data for _, data in chunks))]
+        if not _is_stream(self.interaction["headers"]) and chunks:
+            # 响应体中的令牌（如飞书的 tenant_access_token）不写入录像
+            chunks = [(chunks[0][0], _redact_body(chunks[0][1]))]
+        self.interaction["chunks"] = [encode_chunk(delay, data) for delay, data in chunks]
+        self.cassette.add(self.interaction)
+
+
+# 响应流需要是 httpx 的字节流类型，同一个类同时支持同步和异步读取
+_STREAM_BASES = tuple(cls for module in (httpx2, httpx) if module is not None
+                      for cls in (module.SyncByteStream, module.AsyncByteStream))
+
+if _STREAM_BASES:
+    class _RecordingStream(*_STREAM_BASES):
+        """Wraps a transport response stream; passes chunks through and records them"""
+
+        def __init__(self, stream, recording):
+            self.stream = stream
+            self.recording = recording
+
+        def __iter__(self):
+            for data in self.stream:
+                self.recording.add(data)
+                yield data
+            self.recording.finish()
+
+        async def __aiter__(self):
+            async for data in self.stream:
+                self.recording.add(data)
+                yield data
+            self.recording.finish()
+
+        def close(self):
+            self.recording.finish()
+            self.stream.close()
+
+        async def aclose(self):
+            self.recording.finish()
+            await self.stream.aclose()
+
+    class _ReplayStream(*_STREAM_BASES):
+        """Serves recorded chunks, optionally with their original delays"""
+
+        def __init__(self, chunks, latency):
+            self.chunks = chunks
+            self.latency = latency
+
+        def __iter__(self):
+            for chunk in self.chunks:
+                delay, data = decode_chunk(chunk)
+                if self.latency and delay:
+                    time.sleep(delay)
+                yield data
+
+        async def __aiter__(self):
+            for chunk in self.chunks:
+                delay, data = decode_chunk(chunk)
+                if self.latency and delay:
+                    await asyncio.sleep(delay)
+                yield data
+
+        def close(self):
+            pass
+
+        async def aclose(self):
+            pass
+
+
+class Cassette:
+    """
+    Records the HTTP traffic of the OpenAI client (httpx2 / httpx transports) and of requests
+    (DashScope, Feishu) into a gzip compressed JSON lines file, and serves it back offline.
+
+    Requests are matched by method, URL and a hash of the redacted body; identical requests are
+    replayed in recorded order. API keys, request headers and most response headers are not stored,
+    and the tokens in JSON response bodies (REDACTED_RESPONSE_FIELDS) are replaced by "<redacted>".
+    Requests whose body changes between runs (timestamps, generated IDs) fall back to the next
+    unused interaction with the same method and path, with a warning. The cassette is process
+    wide (it patches the transport classes) and is not shared with forked worker processes.
+
+    Usage:
+        with Cassette("test_case/cassettes/simple_test.jsonl.gz", mode="auto"):
+            response = process_content("YUNWU-Dev", "strawberry中有几个r？", "gpt-4.1-2025-04-14")
+    """
+
+    _active = None
+    _patched = {}
+
+    def __init__(self, path, mode="auto", replay_latency=False, skip_errors=True, strict=False):
+        """
+        Args:
+            path: Cassette file (.jsonl.gz)
+            mode: "record" (call upstream and overwrite the file), "replay" (never call upstream)
+                or "auto" (replay when the file exists, otherwise record)
+            replay_latency: Sleep the recorded time to headers and between chunks when replaying
+            skip_errors: When replaying, skip recorded 429 / 5xx / timeout responses that were
+                followed by a retry of the same request, so the retry loops do not back off
+            strict: Only replay interactions whose request body matches exactly
+        """
+        if mode not in ("record", "replay", "auto"):
+            raise ValueError(f"Unknown cassette mode: {mode}")
+        if mode == "auto":
+            mode = "replay" if os.path.exists(path) else "record"
+        self.path = path
+        self.mode = mode
+        self.replay_latency = replay_latency
+        self.skip_errors = skip_errors
+        self.strict = strict
+        self.lock = threading.Lock()
+        self.order = itertools.count()
+        self.interactions = []
+        self.exact = defaultdict(deque)
+        self.loose = defaultdict(deque)
+        self.stats = {"recorded": 0, "replayed": 0, "loose_matches": 0, "skipped_errors": 0}
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+        with gzip.open(self.path, "rt", encoding="utf-8") as f:
+            header = json.loads(f.readline())
+            if header.get("version") != CASSETTE_VERSION:
+                raise ValueError(f"Unsupported cassette version in {self.path}: {header.get('version')}")
+            self.interactions = [json.loads(line) for line in f if line.strip()]
+        for interaction in self.interactions:
+            interaction["used"] = False
+            self.exact[interaction["key"]].append(interaction)
+            self.loose[interaction["loose"]].append(interaction)
+        logger.info("Loaded %d interactions from %s", len(self.interactions), self.path)
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self.lock:
+            interactions = sorted(self.interactions, key=lambda i: i["order"])
+        with gzip.open(self.path, "wt", encoding="utf-8", compresslevel=9) as f:
+            f.write(json.dumps({"version": CASSETTE_VERSION, "recorded": datetime.datetime.now().isoformat(
+                timespec="seconds")}) + "\n")
+            for interaction in interactions:
+                interaction = {k: v for k, v in interaction.items() if k != "order"}
+                f.write(json.dumps(interaction, ensure_ascii=False, separators=(",", ":")) + "\n")
+        logger.info("Recorded %d interactions to %s", len(interactions), self.path)
+
+    def add(self, interaction):
+        with self.lock:
+            self.interactions.append(interaction)
+            self.stats["recorded"] += 1
+
+    def start_recording(self, method, url, body, status, headers, elapsed, start):
+        key, loose = request_key(method, url, body)
+        # 按请求发出的顺序保存，与响应读完的先后无关
+        interaction = {"order": next(self.order), "key": key, "loose": loose, "status": status,
+                       "headers": _kept_headers(headers), "elapsed": round(elapsed, 3)}
+        return _Recording(self, interaction, start)
+
+    def match(self, method, url, body):
+        """Next unused recorded interaction for a request; raises CassetteMiss if there is none"""
+        key, loose = request_key(method, url, body)
+        with self.lock:
+            for queue in (self.exact.get(key), None if self.strict else self.loose.get(loose)):
+                while queue and queue[0]["used"]:
+                    queue.popleft()
+                if not queue:
+                    continue
+                interaction = queue.popleft()
+                if interaction["key"] != key:
+                    self.stats["loose_matches"] += 1
+                    logger.warning("Request body of %s differs from the recording, replaying by path", loose)
+                # 跳过之后被重试的失败响应
+                while self.skip_errors and interaction["status"] in ERROR_STATUSES and queue:
+                    interaction["used"] = True
+                    self.stats["skipped_errors"] += 1
+                    interaction = queue.popleft()
+                interaction["used"] = True
+                self.stats["replayed"] += 1
+                return interaction
+        raise CassetteMiss(f"No recorded interaction for {key} in {self.path}")
+
+    # --- httpx2 / httpx ---
+
+    def _httpx_send(self, module, original, transport, request):
+        if self.mode == "replay":
+            interaction = self.match(request.method, request.url, request.read())
+            if self.replay_latency:
+                time.sleep(interaction["elapsed"])
+            return module.Response(interaction["status"], headers=interaction["headers"], request=request,
+                                   stream=_ReplayStream(interaction["chunks"], self.replay_latency))
+        start = time.time()
+        response = original(transport, request)
+        now = time.time()
+        recording = self.start_recording(request.method, request.url, request.read(), response.status_code,
+                                         response.headers, now - start, now)
+        response.stream = _RecordingStream(response.stream, recording)
+        return response
+
+    async def _httpx_send_async(self, module, original, transport, request):
+        if self.mode == "replay":
+            interaction = self.match(request.method, request.url, await request.aread())
+            if self.replay_latency:
+                await asyncio.sleep(interaction["elapsed"])
+            return module.Response(interaction["status"], headers=interaction["headers"], request=request,
+                                   stream=_ReplayStream(interaction["chunks"], self.replay_latency))
+        start = time.time()
+        response = await original(transport, request)
+        now = time.time()
+        recording = self.start_recording(request.method, request.url, await request.aread(),
+                                         response.status_code, response.headers, now - start, now)
+        response.stream = _RecordingStream(response.stream, recording)
+        return response
+
+    # --- requests ---
+
+    def _requests_send(self, original, adapter, request, **kwargs):
+        if self.mode == "replay":
+            interaction = self.match(request.method, request.url, request.body)
+            body = b"".join(decode_chunk(chunk)[1] for chunk in interaction["chunks"])
+            delay = interaction["elapsed"] + sum(chunk[0] for chunk in interaction["chunks"]) / 1000
+            if self.replay_latency:
+                time.sleep(delay)
+            response = requests.Response()
+            response.status_code = interaction["status"]
+            response.headers = requests.structures.CaseInsensitiveDict(interaction["headers"])
+            response.raw = io.BytesIO(body)
+            response._content = body
+            response._content_consumed = True
+            response.encoding = requests.utils.get_encoding_from_headers(response.headers)
+            response.url = request.url
+            response.request = request
+            response.connection = adapter
+            response.elapsed = datetime.timedelta(seconds=delay)
+            return response
+        start = time.time()
+        response = original(adapter, request, **kwargs)
+        now = time.time()
+        recording = self.start_recording(request.method, request.url, request.body, response.status_code,
+                                         response.headers, now - start, now)
+        # 录制时读完整个响应体（流式响应在录制模式下不再逐块交付给调用方）
+        for data in response.iter_content(chunk_size=None):
+            recording.add(data)
+        response._content = b"".join(data for _, data in recording.chunks)
+        response._content_consumed = True
+        recording.finish()
+        return response
+
+    # --- installation ---
+
+    def install(self):
+        """Patch the transports; only one cassette can be active at a time"""
+        if Cassette._active is not None:
+            raise RuntimeError(f"Cassette {Cassette._active.path} is already active")
+        Cassette._active = self
+        for module in (httpx2, httpx):
+            if module is None:
+                continue
+            send = module.HTTPTransport.handle_request
+            send_async = module.AsyncHTTPTransport.handle_async_request
+            Cassette._patched[(module.HTTPTransport, "handle_request")] = send
+            Cassette._patched[(module.AsyncHTTPTransport, "handle_async_request")] = send_async
+            module.HTTPTransport.handle_request = (
+                lambda transport, request, module=module, send=send:
+                self._httpx_send(module, send, transport, request))
+            module.AsyncHTTPTransport.handle_async_request = (
+                lambda transport, request, module=module, send=send_async:
+                self._httpx_send_async(module, send, transport, request))
+        if requests is not None:
+            send = requests.adapters.HTTPAdapter.send
+            Cassette._patched[(requests.adapters.HTTPAdapter, "send")] = send
+            requests.adapters.HTTPAdapter.send = (
+                lambda adapter, request, **kwargs: self._requests_send(send, adapter, request, **kwargs))
+        logger.debug("Cassette %s active in %s mode", self.path, self.mode)
+        return self
+
+    def uninstall(self):
+        """Restore the transports and write the cassette in record mode"""
+        if Cassette._active is not self:
+            return
+        for (cls, name), original in Cassette._patched.items():
+            setattr(cls, name, original)
+        Cassette._patched = {}
+        Cassette._active = None
+        if self.mode == "record":
+            # 调用方没有读完或关闭的响应也保存已收到的部分
+            self.save()
+        elif self.stats["replayed"] < len(self.interactions) - self.stats["skipped_errors"]:
+            logger.debug("%d recorded interactions were not replayed from %s",
+                         len(self.interactions) - self.stats["skipped_errors"] - self.stats["replayed"], self.path)
+
+    def __enter__(self):
+        return self.install()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.uninstall()
+
+
+def from_env(script, directory=CASSETTE_DIR):
+    """
+    Activate a cassette for the whole process when LLM_CASSETTE_MODE is set (record / replay / auto).
+
+    The cassette is LLM_CASSETTE if set, otherwise <directory>/<script name>.jsonl.gz;
+    LLM_CASSETTE_LATENCY=1 replays the recorded latency. Does nothing if the mode is not set or a
+    cassette is already active. The cassette is saved when the process exits.
+
+    Usage (at the top of a live test script):
+        cassette.from_env(__file__)
+
+    Returns:
+        The active Cassette or None
+    """
+    mode = os.environ.get("LLM_CASSETTE_MODE", "").strip().lower()
+    if not mode or mode == "off" or Cassette._active is not None:
+        return Cassette._active
+    name = re.sub(r"\.py$", "", os.path.basename(script))
+    path = os.environ.get("LLM_CASSETTE") or os.path.join(directory, f"{name}.jsonl.gz")
+    latency = os.environ.get("LLM_CASSETTE_LATENCY", "").strip().lower() in ("1", "true", "yes")
+    active = Cassette(path, mode, replay_latency=latency).install()
+    atexit.register(active.uninstall)
+    return active
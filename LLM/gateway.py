@@ -0,0 +1,415 @@
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to sys.path to import the LLM and embedding modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from LLM.map_reduce import count_tokens
+from embedding import openai_based_embedding
+
+logger = telemetry.get_logger("gateway")
+
+# 收集嵌入请求的时间窗口（秒）：窗口内到达的同模型请求合并为一次上游调用
+DEFAULT_BATCH_WINDOW = 0.01
+# 每次上游调用最多的输入条数（DashScope text-embedding-v3 为 10，OpenAI 为 2048）
+DEFAULT_MAX_BATCH_INPUTS = 10
+DEFAULT_MAX_WORKERS = 16
+# 嵌入结果缓存的条目数（0 表示不缓存）
+DEFAULT_CACHE_SIZE = 100000
+
+
+class EmbeddingBatcher:
+    """
+    Merges small embedding requests into upstream batches.
+
+    Requests for the same (provider, model, dimensions, encoding_format) that arrive within
+    window seconds of each other are sent as one process_embedding call (split into slices of
+    max_batch_inputs), and the vectors are handed back to each request in order. Identical
+    texts are sent once, and results are kept in an LRU cache shared by all clients.
+
+    Usage:
+        batcher = EmbeddingBatcher(window=0.01)
+        result = batcher.submit("ALIYUN", "text-embedding-v3", ["文本"], dimensions=1024).result()
+    """
+
+    def __init__(self, window=DEFAULT_BATCH_WINDOW, max_batch_inputs=DEFAULT_MAX_BATCH_INPUTS,
+                 max_workers=DEFAULT_MAX_WORKERS, cache_size=DEFAULT_CACHE_SIZE):
+        self.window = window
+        self.max_batch_inputs = max_batch_inputs
+        self.cache_size = cache_size
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.cache = OrderedDict()
+        self.stats = {"requests": 0, "inputs": 0, "cache_hits": 0, "upstream_calls": 0, "upstream_inputs": 0}
+
+    def cache_get(self, key):
+        if key in self.cache:
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        return None
+
+    def cache_put(self, key, embedding):
+        if self.cache_size <= 0:
+            return
+        self.cache[key] = embedding
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+
+    def submit(self, provider_name, model, inputs, dimensions=None, encoding_format="float"):
+        """
+        Queue one embedding request.
+
+        Args:
+            inputs: List of texts (or token arrays)
+
+        Returns:
+            Future resolving to {"embeddings": [...], "prompt_tokens": estimated tokens of the inputs}
+        """
+        group = (provider_name, model, dimensions, encoding_format)
+        keys = [json.dumps([group, text], ensure_ascii=False) for text in inputs]
+        future = Future()
+        request = {"inputs": inputs, "keys": keys, "embeddings": [None] * len(inputs), "future": future}
+        flush = None
+        with self.lock:
+            self.stats["requests"] += 1
+            self.stats["inputs"] += len(inputs)
+            missing = []
+            for i, key in enumerate(keys):
+                cached = self.cache_get(key)
+                if cached is None:
+                    missing.append(i)
+                else:
+                    request["embeddings"][i] = cached
+                    self.stats["cache_hits"] += 1
+            if not missing:
+                self.resolve(request)
+                return future
+            request["missing"] = missing
+            batch = self.pending.get(group)
+            if batch is None:
+                batch = self.pending[group] = {"requests": [], "inputs": 0}
+                timer = threading.Timer(self.window, self.flush, (group, batch))
+                timer.daemon = True
+                batch["timer"] = timer
+                timer.start()
+            batch["requests"].append(request)
+            batch["inputs"] += len(missing)
+            if batch["inputs"] >= self.max_batch_inputs:
+                flush = batch
+        if flush is not None:
+            flush["timer"].cancel()
+            self.flush(group, flush)
+        return future
+
+    def resolve(self, request):
+        tokens = sum(count_tokens(text) if isinstance(text, str) else len(text) for text in request["inputs"])
+        request["future"].set_result({"embeddings": request["embeddings"], "prompt_tokens": tokens})
+
+    def flush(self, group, batch):
+        """Detach a batch from the pending table and send it upstream in the worker pool"""
+        with self.lock:
+            if self.pending.get(group) is not batch:
+                return
+            del self.pending[group]
+        self.executor.submit(self.send_batch, group, batch["requests"])
+
+    def send_batch(self, group, requests):
+        provider_name, model, dimensions, encoding_format = group
+        # 同一批内相同的文本只发送一次
+        unique = OrderedDict()
+        for request in requests:
+            for i in request["missing"]:
+                unique.setdefault(request["keys"][i], request["inputs"][i])
+        keys, texts = list(unique), list(unique.values())
+        try:
+            embeddings = {}
+            slices = [(start, texts[start:start + self.max_batch_inputs])
+                      for start in range(0, len(texts), self.max_batch_inputs)]
+            for start, chunk in slices:
+                response = openai_based_embedding.process_embedding(provider_name, model, chunk, dimensions,
+                                                                    encoding_format, coalesce=False)
+                for item in response["result"].data:
+                    embeddings[keys[start + item.index]] = item.embedding
+                telemetry.METRICS.observe("gateway_embedding_batch_inputs", len(chunk), provider=provider_name,
+                                          model=model)
+            with self.lock:
+                self.stats["upstream_calls"] += len(slices)
+                self.stats["upstream_inputs"] += len(texts)
+                for key, embedding in embeddings.items():
+                    self.cache_put(key, embedding)
+            logger.debug("Sent %d inputs from %d requests to %s in %d call(s)", len(texts), len(requests),
+                         provider_name, len(slices))
+        except Exception as e:
+            logger.warning("Embedding batch of %d inputs to %s failed: %s", len(texts), provider_name, e)
+            for request in requests:
+                request["future"].set_exception(e)
+            return
+        for request in requests:
+            for i in request["missing"]:
+                request["embeddings"][i] = embeddings[request["keys"][i]]
+            self.resolve(request)
+
+    def close(self):
+        with self.lock:
+            batches = list(self.pending.items())
+        for group, batch in batches:
+            batch["timer"].cancel()
+            self.flush(group, batch)
+        self.executor.shutdown(wait=True)
+
+
+def completion_body(response, model):
+    """OpenAI chat.completion JSON for a process_content response"""
+    choices = response.get("choices") or [{"index": 0, "result": response["result"],
+                                           "tool_calls": response.get("tool_calls"), "finish_reason": None}]
+    body_choices = []
+    for choice in choices:
+        message = {"role": "assistant", "content": choice["result"]}
+        if choice.get("tool_calls"):
+            message["tool_calls"] = [call.model_dump(exclude_none=True) for call in choice["tool_calls"]]
+        finish_reason = choice.get("finish_reason") or ("tool_calls" if choice.get("tool_calls") else "stop")
+        body_choices.append({"index": choice["index"], "message": message, "finish_reason": finish_reason})
+    return {"id": f"chatcmpl-{uuid.uuid4().hex[:24]}", "object": "chat.completion", "created": int(time.time()),
+            "model": model, "choices": body_choices, "usage": usage_body(response)}
+
+
+def usage_body(response):
+    return {"prompt_tokens": response["input_tokens"], "completion_tokens": response["output_tokens"],
+            "total_tokens": response["input_tokens"] + response["output_tokens"],
+            "prompt_tokens_details": {"cached_tokens": response.get("cached_tokens", 0)}}
+
+
+class GatewayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def send_json(self, payload, status=200):
+        data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_error_json(self, status, message, error_type="invalid_request_error"):
+        self.send_json({"error": {"message": message, "type": error_type}}, status)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):x}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def send_event(self, payload):
+        self.send_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+    def provider_name(self):
+        """X-Provider header, else an API key naming a provider, else the gateway default"""
+        gateway = self.server.gateway
+        provider = self.headers.get("X-Provider")
+        if not provider:
+            token = self.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+            provider = token if token in openai_based_api.PROVIDERS else gateway.default_provider
+        return provider
+
+    def do_GET(self):
+        if self.path == "/gateway/stats":
+            return self.send_json(self.server.gateway.get_stats())
+        if self.path == "/v1/models":
+            return self.send_json({"object": "list", "data": [
+                {"id": name, "object": "model", "owned_by": "gateway"} for name in openai_based_api.PROVIDERS]})
+        self.send_error_json(404, f"Unknown path {self.path}")
+
+    def do_POST(self):
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            body = json.loads(self.rfile.read(length) or b"{}")
+        except json.JSONDecodeError as e:
+            return self.send_error_json(400, f"Invalid JSON body: {e}")
+        provider = self.provider_name()
+        if not body.get("model"):
+            return self.send_error_json(400, "model is required")
+        if provider not in openai_based_api.PROVIDERS:
+            return self.send_error_json(400, f"Unknown provider '{provider}'")
+        try:
+            if self.path == "/v1/embeddings":
+                self.handle_embeddings(provider, body)
+            elif self.path == "/v1/chat/completions":
+                self.handle_chat(provider, body)
+            else:
+                self.send_error_json(404, f"Unknown path {self.path}")
+        except Exception as e:
+            logger.warning("Gateway request to %s failed: %s", provider, e)
+            self.send_error_json(502, f"Upstream error: {type(e).__name__}: {e}", "upstream_error")
+
+    def handle_embeddings(self, provider, body):
+        inputs = body.get("input", "")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        future = self.server.gateway.batcher.submit(provider, body["model"], inputs, body.get("dimensions"),
+                                                    body.get("encoding_format", "float"))
+        result = future.result()
+        data = [{"object": "embedding", "index": i, "embedding": embedding}
+                for i, embedding in enumerate(result["embeddings"])]
+        self.send_json({"object": "list", "data": data, "model": body["model"],
+                        "usage": {"prompt_tokens": result["prompt_tokens"], "total_tokens": result["prompt_tokens"]}})
+
+    def handle_chat(self, provider, body):
+        model = body["model"]
+        kwargs = {"history": body.get("messages", []),
+                  "max_tokens": body.get("max_tokens") or body.get("max_completion_tokens"),
+                  "response_format": body.get("response_format"), "temperature": body.get("temperature"),
+                  "tools": body.get("tools"), "tool_choice": body.get("tool_choice")}
+        if not body.get("stream"):
+            response = openai_based_api.process_content(provider, "", model, n=body.get("n") or 1,
+                                                        logprobs=bool(body.get("logprobs")), **kwargs)
+            return self.send_json(completion_body(response, model))
+
+        events = openai_based_api.stream_content(provider, "", model, **kwargs)
+        first = next(events)
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            return {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()),
+                    "model": model, "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+
+        try:
+            self.send_event(chunk({"role": "assistant", "content": ""}))
+            for event in self.chain(first, events):
+                if event["type"] == "delta":
+                    self.send_event(chunk({"content": event["content"]}))
+                elif event["type"] == "tool_call":
+                    call = event["tool_call"].model_dump(exclude_none=True)
+                    self.send_event(chunk({"tool_calls": [dict(call, index=event["index"])]}))
+                elif event["type"] == "done":
+                    response = event["response"]
+                    self.send_event(chunk({}, "tool_calls" if response.get("tool_calls") else "stop"))
+                    if (body.get("stream_options") or {}).get("include_usage"):
+                        self.send_event(dict(chunk({}), choices=[], usage=usage_body(response)))
+            self.send_chunk(b"data: [DONE]\n\n")
+        except Exception as e:
+            # 状态行已经发出：不能再返回 502，改为发送 SSE error 事件并结束分块响应
+            logger.warning("Gateway stream from %s failed: %s", provider, e)
+            self.close_connection = True
+            error = {"error": {"message": f"Upstream error: {type(e).__name__}: {e}", "type": "upstream_error"}}
+            try:
+                self.send_chunk(f"event: error\ndata: {json.dumps(error, ensure_ascii=False)}\n\n".encode("utf-8"))
+                self.send_chunk(b"")
+            except OSError:
+                pass
+            return
+        self.send_chunk(b"")
+
+    @staticmethod
+    def chain(first, events):
+        yield first
+        yield from events
+
+
+class Gateway:
+    """
+    Long-running local OpenAI-compatible gateway in front of process_content and
+    process_embedding.
+
+    All workers on a node point a provider at the gateway instead of the upstream API, so
+    they share one set of pooled HTTP clients, the in-flight request coalescing, the
+    embedding cache and the embedding micro-batching. The upstream provider is taken from
+    the X-Provider header, from an API key that names a provider, or the default provider.
+
+    .provider_env entry for the workers:
+        [GATEWAY]
+        api_key = ALIYUN
+        base_url = http://127.0.0.1:8700/v1
+
+    Usage:
+        with Gateway(default_provider="ALIYUN", port=8700) as gateway:
+            ...
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, default_provider=None, window=DEFAULT_BATCH_WINDOW,
+                 max_batch_inputs=DEFAULT_MAX_BATCH_INPUTS, max_workers=DEFAULT_MAX_WORKERS,
+                 cache_size=DEFAULT_CACHE_SIZE):
+        self.default_provider = default_provider
+        self.batcher = EmbeddingBatcher(window, max_batch_inputs, max_workers, cache_size)
+        self.httpd = ThreadingHTTPServer((host, port), GatewayHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.gateway = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def get_stats(self):
+        with self.batcher.lock:
+            stats = dict(self.batcher.stats)
+        stats["cache_entries"] = len(self.batcher.cache)
+        stats["inputs_per_upstream_call"] = (stats["upstream_inputs"] / stats["upstream_calls"]
+                                             if stats["upstream_calls"] else 0.0)
+        return stats
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        self.batcher.close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible gateway with embedding micro-batching")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8700)
+    parser.add_argument("--provider", help="Provider used when a request does not name one")
+    parser.add_argument("--window", type=float, default=DEFAULT_BATCH_WINDOW,
+                        help="Seconds to collect embedding requests before sending a batch")
+    parser.add_argument("--max-batch-inputs", type=int, default=DEFAULT_MAX_BATCH_INPUTS)
+    parser.add_argument("--max-workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--cache-size", type=int, default=DEFAULT_CACHE_SIZE)
+    parser.add_argument("--log-level", default="INFO")
+    args = parser.parse_args()
+
+    telemetry.configure_logging(args.log_level)
+    gateway = Gateway(args.host, args.port, args.provider, args.window, args.max_batch_inputs, args.max_workers,
+                      args.cache_size)
+    print(f"Gateway listening on {gateway.url} (OpenAI base_url: {gateway.base_url})", flush=True)
+    try:
+        gateway.serve_forever()
+    except KeyboardInterrupt:
+        gateway.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,437 @@
+import os
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import asyncio
+import argparse
+import importlib
+import threading
+import multiprocessing
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+
+logger = telemetry.get_logger("job_queue")
+
+DEFAULT_QUEUE = "default"
+# 租约时长（秒）：worker 崩溃后，任务在租约过期后重新可被领取
+DEFAULT_VISIBILITY_TIMEOUT = 300.0
+DEFAULT_MAX_ATTEMPTS = 3
+# 失败重试的退避时间：RETRY_DELAY * 2^(attempts - 1) 秒
+RETRY_DELAY = 5.0
+DEFAULT_CONCURRENCY = 8
+DEFAULT_POLL_INTERVAL = 1.0
+# 统计吞吐量的时间窗口（秒）
+THROUGHPUT_WINDOW = 60.0
+STATUSES = ("pending", "leased", "done", "failed")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    queue TEXT NOT NULL,
+    job_key TEXT NOT NULL,
+    spec TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    max_attempts INTEGER NOT NULL,
+    available_at REAL NOT NULL,
+    lease_owner TEXT,
+    lease_expires REAL,
+    created_at REAL NOT NULL,
+    finished_at REAL,
+    worker TEXT,
+    result TEXT,
+    error TEXT,
+    UNIQUE (queue, job_key)
+);
+CREATE INDEX IF NOT EXISTS jobs_ready ON jobs (queue, status, available_at);
+CREATE INDEX IF NOT EXISTS jobs_finished ON jobs (queue, finished_at);
+"""
+
+
+def encode_result(response):
+    """JSON for a process_content response (SDK objects such as tool calls are dumped to dicts)"""
+    return json.dumps(response, ensure_ascii=False, default=lambda value: value.model_dump(exclude_none=True))
+
+
+class JobQueue:
+    """
+    Durable job queue in a local SQLite file, safe to share between processes.
+
+    Jobs move pending -> leased -> done / failed. A leased job that is neither acked nor
+    failed before its lease expires (the worker crashed or hung) is handed out again.
+    Results are written once: a late ack for a job that is already done is ignored.
+
+    Usage:
+        queue = JobQueue("jobs.db")
+        queue.enqueue({"user_prompt": "...", "model": "gpt-4.1"}, key="doc-1")
+        for job in queue.lease("worker-1", limit=8):
+            queue.ack(job["id"], "worker-1", response)
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, isolation_level=None, check_same_thread=False)
+        self.conn.row_factory = sqlite3.Row
+        # WAL 模式下读写互不阻塞，多个进程可以同时访问
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+
+    def _transaction(self, fn):
+        """Run fn(conn) inside BEGIN IMMEDIATE so concurrent leases never hand out the same job"""
+        with self.lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn(self.conn)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+            return result
+
+    def enqueue(self, spec, key=None, queue=DEFAULT_QUEUE, max_attempts=DEFAULT_MAX_ATTEMPTS):
+        """
+        Add a job; enqueueing an existing key again is a no-op.
+
+        Args:
+            spec: JSON-serializable process_content arguments (optionally with "provider")
+            key: Unique job key (defaults to spec["custom_id"] or a random id)
+
+        Returns:
+            True if the job was added
+        """
+        return self.enqueue_many([spec], queue, max_attempts, keys=[key]) == 1
+
+    def enqueue_many(self, specs, queue=DEFAULT_QUEUE, max_attempts=DEFAULT_MAX_ATTEMPTS, keys=None):
+        """Add many jobs in one transaction and return how many were new"""
+        now = time.time()
+        rows = []
+        for i, spec in enumerate(specs):
+            key = (keys[i] if keys else None) or spec.get("custom_id") or uuid.uuid4().hex
+            rows.append((queue, key, json.dumps(spec, ensure_ascii=False), max_attempts, now, now))
+
+        def insert(conn):
+            before = conn.total_changes
+            conn.executemany("INSERT OR IGNORE INTO jobs (queue, job_key, spec, max_attempts, available_at, created_at) "
+                             "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            return conn.total_changes - before
+        return self._transaction(insert)
+
+    def lease(self, owner, limit=1, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, queue=DEFAULT_QUEUE):
+        """
+        Take up to limit ready jobs: pending ones whose retry delay has passed and leased ones
+        whose lease expired. Jobs that used up max_attempts by expiring are marked failed.
+
+        Returns:
+            List of {"id", "key", "spec", "attempts"}
+        """
+        def take(conn):
+            now = time.time()
+            conn.execute("UPDATE jobs SET status = 'failed', error = 'lease expired', finished_at = ?, "
+                         "lease_owner = NULL WHERE queue = ? AND status = 'leased' AND lease_expires <= ? "
+                         "AND attempts >= max_attempts", (now, queue, now))
+            rows = conn.execute(
+                "SELECT id, job_key, spec, attempts FROM jobs WHERE queue = ? AND "
+                "((status = 'pending' AND available_at <= ?) OR (status = 'leased' AND lease_expires <= ?)) "
+                "ORDER BY id LIMIT ?", (queue, now, now, limit)).fetchall()
+            conn.executemany("UPDATE jobs SET status = 'leased', lease_owner = ?, lease_expires = ?, "
+                             "attempts = attempts + 1 WHERE id = ?",
+                             [(owner, now + visibility_timeout, row["id"]) for row in rows])
+            return [{"id": row["id"], "key": row["job_key"], "spec": json.loads(row["spec"]),
+                     "attempts": row["attempts"] + 1} for row in rows]
+        return self._transaction(take)
+
+    def extend(self, job_ids, owner, visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT):
+        """Renew the leases a worker still holds (heartbeat)"""
+        if not job_ids:
+            return
+        expires = time.time() + visibility_timeout
+        self._transaction(lambda conn: conn.executemany(
+            "UPDATE jobs SET lease_expires = ? WHERE id = ? AND lease_owner = ? AND status = 'leased'",
+            [(expires, job_id, owner) for job_id in job_ids]))
+
+    def ack(self, job_id, owner, response):
+        """
+        Store the result of a job. Idempotent: the first result wins, even when it comes from
+        a worker whose lease already expired.
+
+        Returns:
+            True if this call stored the result
+        """
+        encoded = encode_result(response)
+
+        def write(conn):
+            cursor = conn.execute("UPDATE jobs SET status = 'done', result = ?, error = NULL, finished_at = ?, "
+                                  "worker = ?, lease_owner = NULL WHERE id = ? AND status != 'done'",
+                                  (encoded, time.time(), owner, job_id))
+            return cursor.rowcount == 1
+        return self._transaction(write)
+
+    def fail(self, job_id, owner, error, retry_delay=RETRY_DELAY):
+        """
+        Record a failed attempt: the job goes back to pending after an exponential delay, or
+        to failed once max_attempts is used up. Ignored if owner no longer holds the lease.
+
+        Returns:
+            The new status, or None if ignored
+        """
+        def update(conn):
+            row = conn.execute("SELECT attempts, max_attempts FROM jobs WHERE id = ? AND lease_owner = ? "
+                               "AND status = 'leased'", (job_id, owner)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            if row["attempts"] >= row["max_attempts"]:
+                conn.execute("UPDATE jobs SET status = 'failed', error = ?, finished_at = ?, worker = ?, "
+                             "lease_owner = NULL WHERE id = ?", (str(error), now, owner, job_id))
+                return "failed"
+            delay = retry_delay * (2 ** (row["attempts"] - 1))
+            conn.execute("UPDATE jobs SET status = 'pending', error = ?, available_at = ?, lease_owner = NULL "
+                         "WHERE id = ?", (str(error), now + delay, job_id))
+            return "pending"
+        return self._transaction(update)
+
+    def retry_failed(self, queue=DEFAULT_QUEUE):
+        """Put failed jobs back to pending with a fresh attempt count"""
+        return self._transaction(lambda conn: conn.execute(
+            "UPDATE jobs SET status = 'pending', attempts = 0, available_at = ?, finished_at = NULL "
+            "WHERE queue = ? AND status = 'failed'", (time.time(), queue)).rowcount)
+
+    def status(self, queue=DEFAULT_QUEUE, window=THROUGHPUT_WINDOW):
+        """
+        Progress of a queue.
+
+        Returns:
+            Dict with counts per status, "total", "throughput" (jobs/s finished in the last
+            window seconds), "eta_seconds", "oldest_pending_age" and "workers" (done per worker)
+        """
+        now = time.time()
+        with self.lock:
+            counts = dict(self.conn.execute("SELECT status, COUNT(*) FROM jobs WHERE queue = ? GROUP BY status",
+                                            (queue,)).fetchall())
+            recent = self.conn.execute("SELECT COUNT(*), MIN(finished_at) FROM jobs WHERE queue = ? "
+                                       "AND status = 'done' AND finished_at >= ?", (queue, now - window)).fetchone()
+            oldest = self.conn.execute("SELECT MIN(created_at) FROM jobs WHERE queue = ? AND status = 'pending'",
+                                       (queue,)).fetchone()[0]
+            workers = dict(self.conn.execute("SELECT worker, COUNT(*) FROM jobs WHERE queue = ? AND status = 'done' "
+                                             "GROUP BY worker", (queue,)).fetchall())
+        status = {name: counts.get(name, 0) for name in STATUSES}
+        status["total"] = sum(counts.values())
+        finished, first = recent[0], recent[1]
+        # 只有刚开始运行时，窗口按第一个完成的任务计算
+        span = min(window, now - first) if first else window
+        status["throughput"] = finished / span if finished and span > 0 else 0.0
+        remaining = status["pending"] + status["leased"]
+        status["eta_seconds"] = remaining / status["throughput"] if status["throughput"] else None
+        status["oldest_pending_age"] = now - oldest if oldest else None
+        status["workers"] = workers
+        return status
+
+    def results(self, queue=DEFAULT_QUEUE):
+        """Yield (key, response dict) of finished jobs in enqueue order"""
+        with self.lock:
+            rows = self.conn.execute("SELECT job_key, result FROM jobs WHERE queue = ? AND status = 'done' "
+                                     "ORDER BY id", (queue,)).fetchall()
+        for row in rows:
+            yield row["job_key"], json.loads(row["result"])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+# ---------------------------------------------------------------------------
+# Workers
+# ---------------------------------------------------------------------------
+
+def load_callable(path):
+    """Resolve "module:function" (e.g. "my_pipeline:parse") to the function"""
+    module_name, _, name = path.partition(":")
+    return getattr(importlib.import_module(module_name), name)
+
+
+async def run_job(queue, job, owner, provider_name, postprocess):
+    spec = dict(job["spec"])
+    spec.pop("custom_id", None)
+    provider = spec.pop("provider", None) or provider_name
+    try:
+        response = await openai_based_api.process_content_async(provider, coalesce=False, **spec)
+        if postprocess is not None:
+            response = postprocess(response)
+        stored = await asyncio.to_thread(queue.ack, job["id"], owner, response)
+        telemetry.METRICS.inc("job_queue_jobs_total", outcome="done" if stored else "duplicate")
+    except Exception as e:
+        logger.warning("Job %s failed (attempt %d): %s", job["key"], job["attempts"], e)
+        status = await asyncio.to_thread(queue.fail, job["id"], owner, f"{type(e).__name__}: {e}")
+        telemetry.METRICS.inc("job_queue_jobs_total", outcome="failed" if status == "failed" else "retried")
+
+
+async def work(db_path, provider_name, concurrency=DEFAULT_CONCURRENCY, queue_name=DEFAULT_QUEUE,
+               visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, poll_interval=DEFAULT_POLL_INTERVAL, exit_when_empty=True,
+               postprocess=None, owner=None):
+    """
+    Consume jobs with up to concurrency concurrent process_content_async calls.
+
+    Leases are renewed every visibility_timeout / 3 seconds while their jobs run, so only
+    a dead worker lets them expire.
+
+    Returns:
+        Number of jobs this worker finished (done or failed)
+    """
+    owner = owner or f"{socket.gethostname()}-{os.getpid()}"
+    postprocess = load_callable(postprocess) if isinstance(postprocess, str) else postprocess
+    queue = JobQueue(db_path)
+    running = {}
+    finished = 0
+    last_heartbeat = time.time()
+    try:
+        while True:
+            free = concurrency - len(running)
+            jobs = await asyncio.to_thread(queue.lease, owner, free, visibility_timeout, queue_name) if free else []
+            for job in jobs:
+                running[job["id"]] = asyncio.create_task(run_job(queue, job, owner, provider_name, postprocess))
+            if not running:
+                if exit_when_empty:
+                    # 其他 worker 持有的租约可能过期，等所有任务都结束后再退出
+                    status = await asyncio.to_thread(queue.status, queue_name)
+                    if status["pending"] == 0 and status["leased"] == 0:
+                        break
+                await asyncio.sleep(poll_interval)
+                continue
+            done, _ = await asyncio.wait(running.values(), timeout=poll_interval, return_when=asyncio.FIRST_COMPLETED)
+            for job_id in [job_id for job_id, task in running.items() if task in done]:
+                running.pop(job_id)
+                finished += 1
+            if time.time() - last_heartbeat > visibility_timeout / 3:
+                await asyncio.to_thread(queue.extend, list(running), owner, visibility_timeout)
+                last_heartbeat = time.time()
+    finally:
+        if running:
+            await asyncio.gather(*running.values(), return_exceptions=True)
+        queue.close()
+    logger.info("Worker %s finished %d jobs", owner, finished)
+    return finished
+
+
+def worker_main(db_path, provider_name, concurrency, queue_name, visibility_timeout, poll_interval, exit_when_empty,
+                postprocess, providers, index):
+    """Entry point of one worker process"""
+    openai_based_api.PROVIDERS.update(providers or {})
+    owner = f"{socket.gethostname()}-{os.getpid()}-{index}"
+    asyncio.run(work(db_path, provider_name, concurrency, queue_name, visibility_timeout, poll_interval,
+                     exit_when_empty, postprocess, owner))
+
+
+def run_worker_pool(db_path, provider_name, processes=None, concurrency=DEFAULT_CONCURRENCY, queue_name=DEFAULT_QUEUE,
+                    visibility_timeout=DEFAULT_VISIBILITY_TIMEOUT, poll_interval=DEFAULT_POLL_INTERVAL,
+                    exit_when_empty=True, postprocess=None, providers=None, status_interval=None):
+    """
+    Start processes worker processes, each running concurrency concurrent jobs, and wait for them.
+
+    Args:
+        db_path: SQLite file of the queue
+        provider_name: Provider for jobs whose spec has no "provider"
+        processes: Number of worker processes (default: CPU count)
+        postprocess: Optional "module:function" applied to each response inside the worker
+            (parsing / post-processing runs on all cores)
+        providers: Extra PROVIDERS entries installed in each worker (e.g. a local gateway)
+        status_interval: Print the queue status every this many seconds while waiting
+
+    Returns:
+        Final queue status
+    """
+    processes = processes or os.cpu_count() or 1
+    JobQueue(db_path).close()
+    workers = [multiprocessing.Process(target=worker_main, args=(
+        db_path, provider_name, concurrency, queue_name, visibility_timeout, poll_interval, exit_when_empty,
+        postprocess, providers, index)) for index in range(processes)]
+    for worker in workers:
+        worker.start()
+    queue = JobQueue(db_path)
+    try:
+        while any(worker.is_alive() for worker in workers):
+            for worker in workers:
+                worker.join(timeout=status_interval or 1.0)
+            if status_interval:
+                print(format_status(queue.status(queue_name)), flush=True)
+        return queue.status(queue_name)
+    finally:
+        queue.close()
+
+
+def format_status(status):
+    eta = f"{status['eta_seconds']:.0f}s" if status["eta_seconds"] is not None else "-"
+    return (f"total {status['total']}  pending {status['pending']}  leased {status['leased']}  "
+            f"done {status['done']}  failed {status['failed']}  {status['throughput']:.2f} jobs/s  eta {eta}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="SQLite-backed job queue for process_content")
+    parser.add_argument("--db", required=True, help="SQLite file of the queue")
+    parser.add_argument("--queue", default=DEFAULT_QUEUE)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    enqueue = subparsers.add_parser("enqueue", help="Add jobs from a JSONL file of process_content specs")
+    enqueue.add_argument("specs")
+    enqueue.add_argument("--max-attempts", type=int, default=DEFAULT_MAX_ATTEMPTS)
+
+    work_parser = subparsers.add_parser("work", help="Run a pool of worker processes")
+    work_parser.add_argument("--provider", required=True)
+    work_parser.add_argument("--processes", type=int)
+    work_parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY)
+    work_parser.add_argument("--visibility-timeout", type=float, default=DEFAULT_VISIBILITY_TIMEOUT)
+    work_parser.add_argument("--postprocess", help="module:function applied to each response")
+    work_parser.add_argument("--keep-running", action="store_true", help="Wait for new jobs instead of exiting")
+    work_parser.add_argument("--status-interval", type=float, default=10.0)
+
+    status_parser = subparsers.add_parser("status", help="Show progress and throughput")
+    status_parser.add_argument("--watch", type=float, help="Refresh every this many seconds")
+
+    subparsers.add_parser("retry-failed", help="Put failed jobs back into the queue")
+
+    export = subparsers.add_parser("export", help="Write finished results as JSONL")
+    export.add_argument("output")
+    args = parser.parse_args()
+
+    if args.command == "work":
+        status = run_worker_pool(args.db, args.provider, args.processes, args.concurrency, args.queue,
+                                 args.visibility_timeout, exit_when_empty=not args.keep_running,
+                                 postprocess=args.postprocess, status_interval=args.status_interval)
+        print(format_status(status))
+        return
+
+    queue = JobQueue(args.db)
+    try:
+        if args.command == "enqueue":
+            with open(args.specs, encoding="utf-8") as f:
+                specs = [json.loads(line) for line in f if line.strip()]
+            added = queue.enqueue_many(specs, args.queue, args.max_attempts)
+            print(f"Added {added} of {len(specs)} jobs")
+        elif args.command == "status":
+            while True:
+                status = queue.status(args.queue)
+                print(format_status(status), flush=True)
+                for worker, count in sorted(status["workers"].items()):
+                    print(f"  {worker}: {count} done")
+                if not args.watch:
+                    break
+                time.sleep(args.watch)
+        elif args.command == "retry-failed":
+            print(f"Requeued {queue.retry_failed(args.queue)} jobs")
+        elif args.command == "export":
+            with open(args.output, "w", encoding="utf-8") as f:
+                for key, response in queue.results(args.queue):
+                    f.write(json.dumps({"custom_id": key, "response": response}, ensure_ascii=False) + "\n")
+    finally:
+        queue.close()
+
+
+if __name__ == "__main__":
+    main()
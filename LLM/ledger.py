@@ -0,0 +1,320 @@
+import os
+import sys
+import time
+import json
+import sqlite3
+import threading
+import contextvars
+from contextlib import contextmanager
+
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+
+logger = telemetry.get_logger("ledger")
+
+# 每百万 token 的价格（美元），按模型名前缀匹配（最长前缀优先）
+# cached_input: 命中上游前缀缓存的输入 token 价格；image / video_second: 多模态向量按张 / 按秒计费
+DEFAULT_PRICES = {
+    "gpt-4.1-nano": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "gpt-4.1-mini": {"input": 0.40, "cached_input": 0.10, "output": 1.60},
+    "gpt-4.1": {"input": 2.00, "cached_input": 0.50, "output": 8.00},
+    "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+    "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    "o3-mini": {"input": 1.10, "cached_input": 0.55, "output": 4.40},
+    "o4-mini": {"input": 1.10, "cached_input": 0.275, "output": 4.40},
+    "gemini-2.5-pro": {"input": 1.25, "cached_input": 0.31, "output": 10.00},
+    "gemini-2.5-flash": {"input": 0.30, "cached_input": 0.075, "output": 2.50},
+    "gemini-2.0-flash": {"input": 0.10, "cached_input": 0.025, "output": 0.40},
+    "claude-opus-4": {"input": 15.00, "cached_input": 1.50, "output": 75.00},
+    "claude-sonnet-4": {"input": 3.00, "cached_input": 0.30, "output": 15.00},
+    "claude-3-7-sonnet": {"input": 3.00, "cached_input": 0.30, "output": 15.00},
+    "claude-3-5-sonnet": {"input": 3.00, "cached_input": 0.30, "output": 15.00},
+    "claude-3-5-haiku": {"input": 0.80, "cached_input": 0.08, "output": 4.00},
+    "text-embedding-3-small": {"input": 0.02},
+    "text-embedding-3-large": {"input": 0.13},
+    "text-embedding-ada-002": {"input": 0.10},
+}
+# 价格表未给出 cached_input 时，缓存命中的输入 token 按此比例计费
+DEFAULT_CACHED_INPUT_FACTOR = 0.5
+DEFAULT_FLUSH_INTERVAL = 30.0
+
+FIELDS = ("calls", "input_tokens", "cached_tokens", "output_tokens", "image_count", "video_duration", "cost")
+
+
+class BudgetExceeded(Exception):
+    """Raised before a call when a budget with action="reject" is used up"""
+
+    def __init__(self, budget):
+        super().__init__(f"Budget '{budget.name}' exceeded: spent {budget.spent_cost:.4f} USD / "
+                         f"{budget.spent_tokens} tokens")
+        self.budget = budget
+
+
+def get_price(model, prices=None):
+    """Return the price entry of a model (USD per 1M tokens), or None when unknown"""
+    prices = prices or DEFAULT_PRICES
+    matches = [prefix for prefix in prices if str(model).startswith(prefix)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def estimate_cost(model, input_tokens=0, output_tokens=0, cached_tokens=0, image_count=0, video_duration=0,
+                  prices=None):
+    """
+    Cost in USD of one call, or None when the model has no price.
+
+    input_tokens includes cached_tokens (as reported in usage.prompt_tokens); cached tokens
+    are billed at the cached_input price.
+    """
+    price = get_price(model, prices)
+    if price is None:
+        return None
+    cached_price = price.get("cached_input", price.get("input", 0.0) * DEFAULT_CACHED_INPUT_FACTOR)
+    cost = ((input_tokens - cached_tokens) * price.get("input", 0.0) + cached_tokens * cached_price +
+            output_tokens * price.get("output", 0.0)) / 1_000_000
+    return cost + image_count * price.get("image", 0.0) + video_duration * price.get("video_second", 0.0)
+
+
+class Budget:
+    """A spending limit (USD and/or tokens) over the calls matching provider/model/tag"""
+
+    def __init__(self, name, limit_cost=None, limit_tokens=None, provider=None, model=None, tag=None,
+                 period=None, action="reject", throttle_delay=1.0):
+        if action not in ("reject", "throttle"):
+            raise ValueError("action must be 'reject' or 'throttle'")
+        self.name = name
+        self.limit_cost = limit_cost
+        self.limit_tokens = limit_tokens
+        self.provider = provider
+        self.model = model
+        self.tag = tag
+        self.period = period
+        self.action = action
+        self.throttle_delay = throttle_delay
+        self.window_start = time.time()
+        self.spent_cost = 0.0
+        self.spent_tokens = 0
+
+    def matches(self, provider, model, tags):
+        return ((self.provider is None or self.provider == provider) and
+                (self.model is None or self.model == model) and
+                (self.tag is None or self.tag in tags))
+
+    def roll_window(self, now):
+        if self.period and now - self.window_start >= self.period:
+            self.window_start = now - (now - self.window_start) % self.period
+            self.spent_cost = 0.0
+            self.spent_tokens = 0
+
+    @property
+    def exceeded(self):
+        return ((self.limit_cost is not None and self.spent_cost >= self.limit_cost) or
+                (self.limit_tokens is not None and self.spent_tokens >= self.limit_tokens))
+
+
+class Ledger:
+    """
+    Thread-safe usage and cost ledger for completions and embeddings.
+
+    record() only updates in-memory totals and appends to a pending list under a lock;
+    a background thread writes pending entries to SQLite every flush_interval seconds.
+    """
+
+    def __init__(self, db_path=None, prices=None, flush_interval=DEFAULT_FLUSH_INTERVAL):
+        """
+        Args:
+            db_path: Optional SQLite file the entries are flushed to
+            prices: Optional price table merged over DEFAULT_PRICES
+            flush_interval: Seconds between background flushes (None disables the thread)
+        """
+        self.db_path = db_path
+        self.prices = dict(DEFAULT_PRICES, **(prices or {}))
+        self.lock = threading.Lock()
+        self.totals = {}
+        self.pending = []
+        self.budgets = []
+        self.stop_event = threading.Event()
+        self.flush_thread = None
+        if db_path:
+            with sqlite3.connect(db_path) as conn:
+                conn.execute("""CREATE TABLE IF NOT EXISTS usage (
+                    ts REAL, provider TEXT, model TEXT, kind TEXT, tags TEXT,
+                    input_tokens INTEGER, cached_tokens INTEGER, output_tokens INTEGER,
+                    image_count INTEGER, video_duration REAL, cost REAL)""")
+            if flush_interval:
+                self.flush_thread = threading.Thread(target=self._flush_loop, args=(flush_interval,), daemon=True)
+                self.flush_thread.start()
+
+    def record(self, provider, model, kind="chat", input_tokens=0, output_tokens=0, cached_tokens=0,
+               image_count=0, video_duration=0, tags=None, cost=None):
+        """Record the usage of one call and return its cost (None when the model has no price)"""
+        input_tokens, output_tokens = input_tokens or 0, output_tokens or 0
+        cached_tokens, image_count, video_duration = cached_tokens or 0, image_count or 0, video_duration or 0
+        tags = tuple(sorted(set(tags if tags is not None else current_tags())))
+        if cost is None:
+            cost = estimate_cost(model, input_tokens, output_tokens, cached_tokens, image_count, video_duration,
+                                 self.prices)
+        now = time.time()
+        key = (provider, str(model), kind, tags)
+        values = (1, input_tokens, cached_tokens, output_tokens, image_count, video_duration, cost or 0.0)
+        with self.lock:
+            totals = self.totals.get(key)
+            if totals is None:
+                totals = self.totals[key] = [0] * len(FIELDS)
+            for i, value in enumerate(values):
+                totals[i] += value
+            for budget in self.budgets:
+                if budget.matches(provider, model, tags):
+                    budget.roll_window(now)
+                    budget.spent_cost += cost or 0.0
+                    budget.spent_tokens += input_tokens + output_tokens
+            if self.db_path:
+                self.pending.append((now, provider, str(model), kind, json.dumps(tags), input_tokens, cached_tokens,
+                                     output_tokens, image_count, video_duration, cost))
+        return cost
+
+    def query(self, provider=None, model=None, kind=None, tag=None):
+        """Sum usage over the calls matching all given filters"""
+        result = dict.fromkeys(FIELDS, 0)
+        with self.lock:
+            for (p, m, k, tags), totals in self.totals.items():
+                if ((provider is None or p == provider) and (model is None or m == model) and
+                        (kind is None or k == kind) and (tag is None or tag in tags)):
+                    for field, value in zip(FIELDS, totals):
+                        result[field] += value
+        return result
+
+    def breakdown(self, by="model"):
+        """Totals grouped by "provider", "model", "kind" or "tag" """
+        index = {"provider": 0, "model": 1, "kind": 2}
+        groups = {}
+        with self.lock:
+            for key, totals in self.totals.items():
+                names = key[3] if by == "tag" else (key[index[by]],)
+                for name in names:
+                    group = groups.setdefault(name, dict.fromkeys(FIELDS, 0))
+                    for field, value in zip(FIELDS, totals):
+                        group[field] += value
+        return groups
+
+    def add_budget(self, name, limit_cost=None, limit_tokens=None, provider=None, model=None, tag=None,
+                   period=None, action="reject", throttle_delay=1.0):
+        """
+        Add a budget checked by check() before every call.
+
+        Args:
+            name: Budget name used in errors and logs
+            limit_cost: Maximum spend in USD
+            limit_tokens: Maximum input + output tokens
+            provider / model / tag: Only calls matching these filters count towards the budget
+            period: Optional window length in seconds after which the spend resets
+            action: "reject" raises BudgetExceeded, "throttle" delays each call by throttle_delay seconds
+        """
+        budget = Budget(name, limit_cost, limit_tokens, provider, model, tag, period, action, throttle_delay)
+        with self.lock:
+            self.budgets.append(budget)
+        return budget
+
+    def check(self, provider, model, tags=None):
+        """
+        Enforce budgets before a call.
+
+        Returns:
+            Seconds the caller should wait (0 when no throttling budget is exceeded)
+
+        Raises:
+            BudgetExceeded when a matching budget with action="reject" is used up
+        """
+        tags = tuple(tags if tags is not None else current_tags())
+        delay = 0.0
+        now = time.time()
+        with self.lock:
+            for budget in self.budgets:
+                if not budget.matches(provider, model, tags):
+                    continue
+                budget.roll_window(now)
+                if budget.exceeded:
+                    if budget.action == "reject":
+                        raise BudgetExceeded(budget)
+                    delay = max(delay, budget.throttle_delay)
+        if delay:
+            logger.warning("Budget exceeded for %s/%s, throttling for %.2f seconds", provider, model, delay)
+        return delay
+
+    def flush(self):
+        """Write pending entries to SQLite"""
+        with self.lock:
+            pending, self.pending = self.pending, []
+        if not pending or not self.db_path:
+            return 0
+        with sqlite3.connect(self.db_path) as conn:
+            conn.executemany("INSERT INTO usage VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", pending)
+        return len(pending)
+
+    def _flush_loop(self, interval):
+        while not self.stop_event.wait(interval):
+            try:
+                self.flush()
+            except Exception as e:
+                logger.error("Ledger flush failed: %s", e)
+
+    def close(self):
+        self.stop_event.set()
+        if self.flush_thread:
+            self.flush_thread.join()
+        self.flush()
+
+
+# ---------------------------------------------------------------------------
+# Default ledger used by process_content / stream_content / process_embedding
+# ---------------------------------------------------------------------------
+
+_default_ledger = None
+_tags = contextvars.ContextVar("ledger_tags", default=())
+
+
+def set_default_ledger(ledger):
+    """Install the ledger the API modules record to (None disables recording)"""
+    global _default_ledger
+    _default_ledger = ledger
+    return ledger
+
+
+def get_default_ledger():
+    return _default_ledger
+
+
+def current_tags():
+    return _tags.get()
+
+
+@contextmanager
+def tags(*names):
+    """Attach tags to every call recorded inside the block (nested blocks accumulate tags)"""
+    token = _tags.set(tuple(dict.fromkeys(_tags.get() + names)))
+    try:
+        yield
+    finally:
+        _tags.reset(token)
+
+
+def budget_delay(provider, model):
+    """Enforce the default ledger's budgets and return the throttle delay (for async callers)"""
+    if _default_ledger is None:
+        return 0.0
+    return _default_ledger.check(provider, model)
+
+
+def check_budget(provider, model):
+    """Enforce the default ledger's budgets; sleeps when throttled"""
+    delay = budget_delay(provider, model)
+    if delay:
+        time.sleep(delay)
+
+
+def record_usage(provider, model, kind="chat", **usage):
+    """Record usage on the default ledger (no-op when none is installed)"""
+    if _default_ledger is None:
+        return None
+    return _default_ledger.record(provider, model, kind, **usage)
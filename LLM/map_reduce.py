@@ -0,0 +1,221 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from LLM.openai_based_api import encoding
+
+# 默认分块参数（以token计）
+DEFAULT_CHUNK_TOKENS = 6000
+DEFAULT_OVERLAP_TOKENS = 200
+DEFAULT_MAX_WORKERS = 4
+# 递归reduce的最大层数，防止部分结果过长时无限递归
+MAX_REDUCE_DEPTH = 3
+
+# 在这些字符之后切分，尽量避免把句子切成两半
+BOUNDARY_CHARS = "\n。！？；.!?;"
+
+DEFAULT_REDUCE_PROMPT = (
+    "The content below contains partial answers, each produced from one consecutive part of a longer document "
+    "for the same task. Merge them into a single, coherent final answer to the task, removing duplicates "
+    "introduced by overlapping parts.\n\n-----Task START-----\n{user_prompt}\n-----Task END-----"
+)
+
+
+def count_tokens(text):
+    """Count tokens of a text with the shared tiktoken encoder"""
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def chunk_content(content, chunk_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS):
+    """
+    Split content into token-bounded, overlapping chunks.
+
+    Chunks are cut on token boundaries and, where possible, right after a newline or
+    sentence terminator found in the last fifth of the window. Slicing is done on the
+    original string using tiktoken offsets, so multi-byte characters are never broken.
+
+    Args:
+        content: The text to split
+        chunk_tokens: Maximum number of tokens per chunk
+        overlap_tokens: Number of tokens shared by two consecutive chunks
+
+    Returns:
+        List of chunk strings (a single element if content fits in one chunk)
+    """
+    if chunk_tokens <= 0:
+        raise ValueError("chunk_tokens must be positive")
+    if overlap_tokens < 0 or overlap_tokens >= chunk_tokens:
+        raise ValueError("overlap_tokens must be in [0, chunk_tokens)")
+
+    tokens = encoding.encode(content, disallowed_special=())
+    total = len(tokens)
+    if total <= chunk_tokens:
+        return [content] if content else []
+
+    _, offsets = encoding.decode_with_offsets(tokens)
+
+    chunks = []
+    start = 0
+    while start < total:
+        end = min(start + chunk_tokens, total)
+        if end < total:
+            # 在窗口末尾的1/5范围内寻找自然边界
+            floor = max(start + overlap_tokens + 1, end - chunk_tokens // 5)
+            for candidate in range(end, floor - 1, -1):
+                char_pos = offsets[candidate]
+                if char_pos > 0 and content[char_pos - 1] in BOUNDARY_CHARS:
+                    end = candidate
+                    break
+
+        char_start = offsets[start]
+        char_end = offsets[end] if end < total else len(content)
+        chunks.append(content[char_start:char_end])
+
+        if end >= total:
+            break
+        start = end - overlap_tokens
+
+    return chunks
+
+
+def _default_reduce_prompt(user_prompt):
+    return DEFAULT_REDUCE_PROMPT.format(user_prompt=user_prompt)
+
+
+def iter_map_reduce(provider_name, user_prompt, model, content, system_prompt=None, reduce_prompt=None, reduce_fn=None,
+                    chunk_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS, max_workers=DEFAULT_MAX_WORKERS,
+                    max_tokens=None, temperature=None, _depth=0):
+    """
+    Run map-reduce over long content and yield progress events as they happen.
+
+    Every chunk is sent concurrently with the same user_prompt (and system_prompt). The
+    partial answers are then combined by the reduce step: reduce_fn if given (a local
+    callable receiving the list of map responses and returning the final text), otherwise
+    one more model call with reduce_prompt. If the partial answers themselves do not fit
+    in one chunk, the reduce step is applied recursively.
+
+    Events are dictionaries with an "event" key:
+        {"event": "chunked", "total_chunks": N, "total_tokens": T}
+        {"event": "map", "index": i, "completed": k, "total_chunks": N, "response": {...}}
+        {"event": "reduce", "partials": N}
+        {"event": "done", "response": {...}}
+
+    Args:
+        provider_name: Name of the provider to use
+        user_prompt: The prompt applied to each chunk
+        model: The model to use
+        content: The (long) content to process
+        system_prompt: Optional system prompt used for map calls
+        reduce_prompt: Optional prompt for the model-based reduce step
+        reduce_fn: Optional local reduce callable, takes precedence over reduce_prompt
+        chunk_tokens: Maximum number of tokens per chunk
+        overlap_tokens: Number of tokens shared by consecutive chunks
+        max_workers: Maximum number of concurrent map requests
+        max_tokens: Optional max tokens for each response
+        temperature: Optional temperature setting
+
+    Yields:
+        Progress event dictionaries, the last one being the "done" event
+    """
+    start_time = time.time()
+
+    chunks = chunk_content(content, chunk_tokens, overlap_tokens)
+    yield {"event": "chunked", "total_chunks": len(chunks), "total_tokens": count_tokens(content)}
+
+    call_params = {
+        "provider_name": provider_name,
+        "model": model,
+        "system_prompt": system_prompt,
+        "max_tokens": max_tokens,
+        "temperature": temperature,
+    }
+
+    # 内容足够短时直接走单次请求
+    if len(chunks) <= 1:
+        response = openai_based_api.process_content(user_prompt=user_prompt, content=content, **call_params)
+        response["chunks"] = 1
+        yield {"event": "map", "index": 0, "completed": 1, "total_chunks": 1, "response": response}
+        yield {"event": "done", "response": response}
+        return
+
+    map_results = [None] * len(chunks)
+    completed = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {
+            executor.submit(openai_based_api.process_content, user_prompt=user_prompt, content=chunk, **call_params): index
+            for index, chunk in enumerate(chunks)
+        }
+        for future in as_completed(futures):
+            index = futures[future]
+            map_results[index] = future.result()
+            completed += 1
+            yield {"event": "map", "index": index, "completed": completed, "total_chunks": len(chunks),
+                   "response": map_results[index]}
+
+    input_tokens = sum(r["input_tokens"] for r in map_results)
+    output_tokens = sum(r["output_tokens"] for r in map_results)
+
+    yield {"event": "reduce", "partials": len(map_results)}
+
+    if reduce_fn is not None:
+        result = reduce_fn(map_results)
+    else:
+        partials = "\n\n".join(
+            f"-----Part {i + 1}/{len(map_results)}-----\n{r['result']}" for i, r in enumerate(map_results)
+        )
+        prompt = reduce_prompt or _default_reduce_prompt(user_prompt)
+        if count_tokens(partials) > chunk_tokens and _depth < MAX_REDUCE_DEPTH:
+            # 部分结果仍然过长，对其再做一次map-reduce
+            reduce_response = None
+            for event in iter_map_reduce(provider_name, prompt, model, partials, reduce_prompt=prompt,
+                                         chunk_tokens=chunk_tokens, overlap_tokens=overlap_tokens,
+                                         max_workers=max_workers, max_tokens=max_tokens,
+                                         temperature=temperature, _depth=_depth + 1):
+                if event["event"] == "done":
+                    reduce_response = event["response"]
+        else:
+            reduce_response = openai_based_api.process_content(user_prompt=prompt, content=partials,
+                                                               provider_name=provider_name, model=model,
+                                                               max_tokens=max_tokens, temperature=temperature)
+        result = reduce_response["result"]
+        input_tokens += reduce_response["input_tokens"]
+        output_tokens += reduce_response["output_tokens"]
+
+    response_data = {
+        "result": result,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "elapsed_time": time.time() - start_time,
+        "chunks": len(chunks),
+        "map_results": map_results,
+    }
+    yield {"event": "done", "response": response_data}
+
+
+def process_content_map_reduce(provider_name, user_prompt, model, content, progress_callback=None, **kwargs):
+    """
+    Process long content with map-reduce and return the final response.
+
+    Args:
+        provider_name: Name of the provider to use
+        user_prompt: The prompt applied to each chunk
+        model: The model to use
+        content: The (long) content to process
+        progress_callback: Optional callable receiving every progress event (see iter_map_reduce)
+        **kwargs: Any other argument accepted by iter_map_reduce
+
+    Returns:
+        Dictionary with the same keys as process_content, plus "chunks" and "map_results"
+    """
+    response = None
+    for event in iter_map_reduce(provider_name, user_prompt, model, content, **kwargs):
+        if progress_callback:
+            progress_callback(event)
+        if event["event"] == "done":
+            response = event["response"]
+    return response
@@ -0,0 +1,247 @@
+import os
+import sys
+import csv
+import json
+import time
+import hashlib
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from LLM.ledger import DEFAULT_PRICES, get_price, estimate_cost
+
+DEFAULT_PROVIDER_LIMIT = 2
+DEFAULT_MAX_WORKERS = 8
+
+
+def parse_target(target):
+    """Accept "PROVIDER:model" or {"provider", "model"}"""
+    if isinstance(target, dict):
+        return target["provider"], target["model"]
+    provider, model = target.split(":", 1)
+    return provider, model
+
+
+def parse_prompt(prompt, index):
+    """Accept a plain string or {"name", "user_prompt", "system_prompt", "content"}"""
+    if isinstance(prompt, str):
+        return {"name": f"prompt-{index + 1}", "user_prompt": prompt}
+    prompt = dict(prompt)
+    prompt.setdefault("name", f"prompt-{index + 1}")
+    return prompt
+
+
+def cell_key(provider, model, prompt, params):
+    """Stable hash of everything that determines a cell's answer"""
+    payload = json.dumps({"provider": provider, "model": model,
+                          "prompt": {k: prompt.get(k) for k in ("user_prompt", "system_prompt", "content")},
+                          "params": params}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResultCache:
+    """Append-only JSON-lines cache of successful cells, so re-runs only fill in missing cells"""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.records = {}
+        if path and os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # 上次运行中断时最后一行可能不完整
+                        continue
+                    self.records[record["key"]] = record
+
+    def get(self, key):
+        return self.records.get(key)
+
+    def put(self, record):
+        with self.lock:
+            self.records[record["key"]] = record
+            if self.path:
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def run_cell(provider, model, prompt, stream=True, max_tokens=None, temperature=None, prices=None):
+    """Run one prompt on one provider/model and return the cell record"""
+    record = {"provider": provider, "model": model, "prompt": prompt["name"]}
+    start_time = time.time()
+    try:
+        kwargs = {"content": prompt.get("content"), "system_prompt": prompt.get("system_prompt"),
+                  "max_tokens": max_tokens, "temperature": temperature}
+        if stream:
+            response = None
+            for event in openai_based_api.stream_content(provider, prompt["user_prompt"], model, **kwargs):
+                if event["type"] == "done":
+                    response = event["response"]
+        else:
+            response = openai_based_api.process_content(provider, prompt["user_prompt"], model, **kwargs)
+    except Exception as e:
+        record.update({"error": f"{type(e).__name__}: {e}", "latency": time.time() - start_time})
+        return record
+
+    record.update({
+        "answer": response["result"],
+        "latency": response["elapsed_time"],
+        "ttft": response.get("time_to_first_token"),
+        "input_tokens": response["input_tokens"],
+        "output_tokens": response["output_tokens"],
+        "cached_tokens": response.get("cached_tokens", 0),
+        "cost": estimate_cost(model, response["input_tokens"], response["output_tokens"],
+                              response.get("cached_tokens", 0), prices=prices),
+    })
+    return record
+
+
+def run_matrix(targets, prompts, provider_limits=None, default_limit=DEFAULT_PROVIDER_LIMIT,
+               max_workers=DEFAULT_MAX_WORKERS, cache_path=None, stream=True, max_tokens=None, temperature=None,
+               prices=None, progress_callback=None):
+    """
+    Run every prompt on every provider/model concurrently.
+
+    Args:
+        targets: List of "PROVIDER:model" strings or {"provider", "model"} dicts
+        prompts: List of prompt strings or {"name", "user_prompt", "system_prompt", "content"} dicts
+        provider_limits: Optional {provider: max concurrent requests}
+        default_limit: Concurrency limit for providers not in provider_limits
+        max_workers: Overall number of worker threads
+        cache_path: Optional JSON-lines file; cached cells are reused, new successes are appended
+        stream: Use stream_content (reports time to first token) instead of process_content
+        max_tokens: Optional max tokens per answer
+        temperature: Optional temperature
+        prices: Optional price table overriding DEFAULT_PRICES
+        progress_callback: Optional callable(record, completed, total)
+
+    Returns:
+        List of cell records in grid order (targets x prompts); cached cells have "cached": True
+    """
+    targets = [parse_target(target) for target in targets]
+    prompts = [parse_prompt(prompt, i) for i, prompt in enumerate(prompts)]
+    provider_limits = provider_limits or {}
+    semaphores = {provider: threading.BoundedSemaphore(provider_limits.get(provider, default_limit))
+                  for provider, _ in targets}
+    params = {"stream": stream, "max_tokens": max_tokens, "temperature": temperature}
+    cache = ResultCache(cache_path)
+
+    cells = []
+    for provider, model in targets:
+        for prompt in prompts:
+            cells.append((provider, model, prompt, cell_key(provider, model, prompt, params)))
+
+    results = {}
+    pending = []
+    for provider, model, prompt, key in cells:
+        cached = cache.get(key)
+        if cached is not None:
+            results[key] = dict(cached, cached=True, cost=estimate_cost(model, cached["input_tokens"],
+                                                                         cached["output_tokens"],
+                                                                         cached.get("cached_tokens", 0), prices=prices))
+        else:
+            pending.append((provider, model, prompt, key))
+
+    def run(provider, model, prompt, key):
+        with semaphores[provider]:
+            record = run_cell(provider, model, prompt, stream, max_tokens, temperature, prices)
+        record["key"] = key
+        if "error" not in record:
+            cache.put(record)
+        return record
+
+    completed = len(results)
+    if progress_callback:
+        for record in results.values():
+            progress_callback(record, completed, len(cells))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run, *cell) for cell in pending]
+        for future in as_completed(futures):
+            record = future.result()
+            results[record["key"]] = record
+            completed += 1
+            if progress_callback:
+                progress_callback(record, completed, len(cells))
+
+    return [results[key] for _, _, _, key in cells]
+
+
+def format_table(records, answer_width=60):
+    """Render the comparison as one text table per prompt"""
+    lines = []
+    prompts = list(dict.fromkeys(record["prompt"] for record in records))
+    for prompt in prompts:
+        lines.append(f"\n## {prompt}")
+        lines.append(f"{'provider:model':<40}{'latency':>9}{'TTFT':>8}{'in':>8}{'out':>8}{'cost $':>11}  answer")
+        for record in (r for r in records if r["prompt"] == prompt):
+            target = f"{record['provider']}:{record['model']}"
+            if "error" in record:
+                lines.append(f"{target:<40}{record['latency']:>9.2f}{'':>8}{'':>8}{'':>8}{'':>11}  ERROR {record['error']}")
+                continue
+            ttft = f"{record['ttft']:.2f}" if record.get("ttft") is not None else "-"
+            cost = f"{record['cost']:.6f}" if record.get("cost") is not None else "-"
+            answer = " ".join(record["answer"].split())
+            if len(answer) > answer_width:
+                answer = answer[:answer_width - 1] + "…"
+            lines.append(f"{target:<40}{record['latency']:>9.2f}{ttft:>8}{record['input_tokens']:>8}"
+                         f"{record['output_tokens']:>8}{cost:>11}  {answer}")
+    return "\n".join(lines)
+
+
+def write_csv(records, path):
+    fields = ["provider", "model", "prompt", "latency", "ttft", "input_tokens", "output_tokens", "cost", "cached",
+              "answer", "error"]
+    with open(path, "w", encoding="utf-8-sig", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=fields, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(records)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare models across providers on the same prompts")
+    parser.add_argument("--config", help="JSON file with targets, prompts, provider_limits and prices")
+    parser.add_argument("--targets", nargs="*", default=[], help="PROVIDER:model entries")
+    parser.add_argument("--prompts", nargs="*", default=[], help="Prompt texts")
+    parser.add_argument("--workers", type=int, default=DEFAULT_MAX_WORKERS)
+    parser.add_argument("--provider-limit", type=int, default=DEFAULT_PROVIDER_LIMIT)
+    parser.add_argument("--max-tokens", type=int)
+    parser.add_argument("--temperature", type=float)
+    parser.add_argument("--no-stream", action="store_true")
+    parser.add_argument("--cache", default="model_matrix_cache.jsonl")
+    parser.add_argument("--output", help="Write the comparison as CSV")
+    args = parser.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config, encoding="utf-8") as f:
+            config = json.load(f)
+    targets = config.get("targets", []) + args.targets
+    prompts = config.get("prompts", []) + args.prompts
+    if not targets or not prompts:
+        parser.error("at least one target and one prompt are required")
+    prices = dict(DEFAULT_PRICES, **config.get("prices", {}))
+
+    def progress(record, completed, total):
+        status = "cached" if record.get("cached") else record.get("error") or f"{record['latency']:.2f}s"
+        print(f"[{completed}/{total}] {record['provider']}:{record['model']} | {record['prompt']}: {status}",
+              flush=True)
+
+    records = run_matrix(targets, prompts, config.get("provider_limits"), args.provider_limit, args.workers,
+                         args.cache, not args.no_stream, args.max_tokens, args.temperature, prices, progress)
+    print(format_table(records))
+    if args.output:
+        write_csv(records, args.output)
+        print(f"\nComparison written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,41 @@
 import os
 import time
+import asyncio
 import tiktoken
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+from openai.types.chat import ChatCompletionMessageToolCall
 import random
 import sys
 import json
+import logging
+import weakref
+import threading
 import configparser
 
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry, ledger, single_flight, rate_limiter, adaptive_limiter
+from LLM import prompt_cache as prompt_layout
+
+logger = telemetry.get_logger("openai_based_api")
+
 # 调试模式开关
 DEBUG_MODE = False
 # 打印模型输入内容开关
 PRINT_INPUT = False
+# 并发的相同请求合并为一次上游调用
+COALESCE_REQUESTS = True
+# 提示词缓存模式：固定工具与消息的序列化顺序，并为 Claude/Gemini 插入缓存断点
+PROMPT_CACHE = False
+
+# 复用同一服务商的同步客户端及其 HTTP 连接池（按 api_key 和 base_url 区分，修改 PROVIDERS 后自动新建）
+POOL_CLIENTS = True
+CHAT_FLIGHT = single_flight.SingleFlight("chat")
+ASYNC_CHAT_FLIGHT = single_flight.AsyncSingleFlight("chat")
+
+# 限流估算未设置 max_tokens 的请求时假定的输出 token 数（收到响应后按实际用量校正）
+DEFAULT_OUTPUT_ESTIMATE = 512
 
 # Initialize tiktoken encoder
 encoding = tiktoken.get_encoding("o200k_base")
@@ -31,80 +56,108 @@ def load_providers():
             }
         
         if not providers:
-            print("Warning: No providers found in .provider_env file", flush=True)
+            logger.warning("No providers found in .provider_env file")
     except Exception as e:
-        print(f"Error loading providers: {e}", flush=True)
+        logger.error("Error loading providers: %s", e)
     
     return providers
 
 PROVIDERS = load_providers()
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+# 异步客户端绑定在事件循环上，每个事件循环各自复用
+ASYNC_CLIENTS = weakref.WeakKeyDictionary()
 
 def get_openai_client(provider_name):
-    """Get OpenAI client for the specified provider"""
+    """Get OpenAI client for the specified provider (shared by all threads when POOL_CLIENTS is on)"""
     if provider_name not in PROVIDERS:
         raise ValueError(f"Provider '{provider_name}' not found. Available providers: {list(PROVIDERS.keys())}")
     
     provider = PROVIDERS[provider_name]
-    return OpenAI(
-        api_key=provider['api_key'],
-        base_url=provider['base_url']
-    )
+    if not POOL_CLIENTS:
+        return OpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
 
-def process_content(provider_name, user_prompt, model, content=None, system_prompt=None, max_tokens=None, response_format=None, n=1, temperature=None, tools=None, tool_choice=None):
-    """
-    Process content using the specified provider.
+    key = (provider_name, provider['api_key'], provider['base_url'])
+    with CLIENTS_LOCK:
+        client = CLIENTS.get(key)
+        if client is None:
+            client = CLIENTS[key] = OpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+    return client
+
+def get_async_openai_client(provider_name):
+    """Get AsyncOpenAI client for the specified provider (shared within the running event loop when POOL_CLIENTS is on)"""
+    if provider_name not in PROVIDERS:
+        raise ValueError(f"Provider '{provider_name}' not found. Available providers: {list(PROVIDERS.keys())}")
     
-    Args:
-        provider_name: Name of the provider to use
-        user_prompt: The prompt to send to the model
-        model: The model to use
-        content: Optional content to append to the user prompt
-        system_prompt: Optional system prompt (if not provided, no system message is sent)
-        max_tokens: Optional max tokens for the response
-        response_format: Optional response format specification
-        n: Number of completions to generate (default 1)
-        temperature: Optional temperature setting for response generation
-        tools: Optional list of tools available for function calling
-        tool_choice: Optional tool choice setting ("auto", "none", or specific tool)
-        
-    Returns:
-        Dictionary containing the result, token counts, elapsed time, and tool calls if any
+    provider = PROVIDERS[provider_name]
+    if not POOL_CLIENTS:
+        return AsyncOpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+
+    clients = ASYNC_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    key = (provider_name, provider['api_key'], provider['base_url'])
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = AsyncOpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+    return client
+
+def build_messages(user_prompt, content=None, system_prompt=None, history=None):
     """
-    # Get the OpenAI client for the specified provider
-    client = get_openai_client(provider_name)
+    Build the chat messages list sent to the model.
     
-    # Prepare messages
+    The order is always system prompt, history, new user message; with history and an
+    empty user_prompt (e.g. after tool results) no user message is added.
+    """
     messages = []
     
     # Add system message only if provided
     if system_prompt:
         messages.append({"role": "system", "content": system_prompt})
+
+    if history:
+        messages.extend(history)
     
     # Prepare user message
     user_message = user_prompt
     if content:
         user_message = f"{user_prompt}\n\n-----Content START-----\n{content}\n-----Content END-----"
     
-    messages.append({"role": "user", "content": user_message})
+    if user_message or not history:
+        messages.append({"role": "user", "content": user_message})
 
     # 打印模型输入内容
     if PRINT_INPUT:
-        print("\n=== Model Input ===")
         if system_prompt:
-            print("System message:", system_prompt)
-        print("\nUser message:", messages[-1]["content"])
-        if tools:
-            print("Tools:", json.dumps(tools, indent=2))
-        print("=== End Model Input ===\n")
+            logger.info("System message: %s", system_prompt)
+        logger.info("Last message: %s", messages[-1]["content"])
 
-    start_time = time.time()
-    
+    return messages
+
+def message_text(message):
+    """Text of a message whose content may be a string, None or a list of content parts"""
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+def estimate_request_tokens(provider_name, api_params):
+    """Input + output tokens a request may use, for providers with a TPM limit (0 otherwise)"""
+    limit = rate_limiter.LIMITS.get(provider_name)
+    if limit is None or not limit.tpm:
+        return 0
+    input_tokens = sum(len(encoding.encode(message_text(m), disallowed_special=())) for m in api_params["messages"])
+    return input_tokens + (api_params.get("max_tokens") or DEFAULT_OUTPUT_ESTIMATE) * api_params.get("n", 1)
+
+def build_api_params(model, messages, max_tokens=None, response_format=None, n=1, temperature=None, tools=None, tool_choice=None, logprobs=False):
+    """Build the keyword arguments for client.chat.completions.create"""
     api_params = {
         "model": model,
         "messages": messages,
         "n": n,
     }
 
+    if logprobs:
+        api_params["logprobs"] = True
+
     # Add optional parameters if provided
     if max_tokens:
         api_params["max_tokens"] = max_tokens
@@ -115,92 +168,444 @@ def process_content(provider_name, user_prompt, model, content=None, system_prom
     if response_format:
         api_params["response_format"] = response_format
         if PRINT_INPUT:
-            print("Response format:", json.dumps(response_format, indent=2))
+            logger.info("Response format: %s", json.dumps(response_format, indent=2))
     
     # Add tools and tool_choice if provided
     if tools:
         api_params["tools"] = tools
+        if PRINT_INPUT:
+            logger.info("Tools: %s", json.dumps(tools, indent=2))
         if tool_choice:
             api_params["tool_choice"] = tool_choice
         elif tool_choice is None:
             api_params["tool_choice"] = "auto"
 
+    return api_params
+
+def build_request(model, user_prompt, content=None, system_prompt=None, history=None, max_tokens=None, response_format=None, n=1, temperature=None, tools=None, tool_choice=None, prompt_cache=None, logprobs=False):
+    """Build messages and API parameters, in the prompt-cache layout when enabled"""
+    messages = build_messages(user_prompt, content, system_prompt, history)
+    api_params = build_api_params(model, messages, max_tokens, response_format, n, temperature, tools, tool_choice,
+                                  logprobs)
+    if PROMPT_CACHE if prompt_cache is None else prompt_cache:
+        api_params = prompt_layout.apply_prompt_cache(api_params)
+    return api_params
+
+def parse_choice(choice, index=0):
+    """Extract result text, tool calls, finish reason and log probability sum of one choice"""
+    # Handle tool calls if present
+    message = choice.message
+    if hasattr(message, 'tool_calls') and message.tool_calls:
+        tool_calls = message.tool_calls
+        result = message.content or ""
+    else:
+        tool_calls = None
+        result = message.content.strip() if message.content else ""
+
+    parsed = {
+        "index": getattr(choice, 'index', index),
+        "result": result,
+        "tool_calls": tool_calls,
+        "finish_reason": getattr(choice, 'finish_reason', None)
+    }
+    logprobs = getattr(choice, 'logprobs', None)
+    if logprobs is not None and logprobs.content:
+        parsed["logprob_sum"] = sum(token.logprob for token in logprobs.content)
+    return parsed
+
+def parse_completion(completion):
+    """Extract result text, tool calls and token usage from a ChatCompletion (all choices)"""
+    choices = [parse_choice(choice, i) for i, choice in enumerate(completion.choices)]
+
+    return {
+        "result": choices[0]["result"],
+        "tool_calls": choices[0]["tool_calls"],
+        "choices": choices,
+        "input_tokens": completion.usage.prompt_tokens,
+        "output_tokens": completion.usage.completion_tokens,
+        "cached_tokens": prompt_layout.cached_tokens(completion.usage)
+    }
+
+def log_api_error(provider_name, e):
+    """Log a failed attempt; response headers and body are only logged at DEBUG level"""
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    logger.warning("%s API encountered an error (%s, status %s): %s", provider_name, type(e).__name__, status, e)
+    if hasattr(e, 'response') and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Headers: %s", e.response.headers)
+        logger.debug("Content: %s", e.response.text)
+
+def process_content(provider_name, user_prompt, model, content=None, system_prompt=None, max_tokens=None, response_format=None, n=1, temperature=None, tools=None, tool_choice=None, history=None, prompt_cache=None, coalesce=None, logprobs=False):
+    """
+    Process content using the specified provider.
+    
+    Concurrent identical requests (same provider and request parameters) share one
+    upstream call unless coalesce=False; callers that joined an in-flight call get a
+    copy of its response with "coalesced": True.
+    
+    Args:
+        provider_name: Name of the provider to use
+        user_prompt: The prompt to send to the model
+        model: The model to use
+        content: Optional content to append to the user prompt
+        system_prompt: Optional system prompt (if not provided, no system message is sent)
+        max_tokens: Optional max tokens for the response
+        response_format: Optional response format specification
+        n: Number of completions to generate (default 1)
+        temperature: Optional temperature setting for response generation
+        tools: Optional list of tools available for function calling
+        tool_choice: Optional tool choice setting ("auto", "none", or specific tool)
+        history: Optional earlier messages (assistant turns, tool results) placed between
+            the system prompt and the new user message
+        prompt_cache: Use the prompt-cache friendly layout (defaults to PROMPT_CACHE)
+        coalesce: Share an in-flight identical call (defaults to COALESCE_REQUESTS)
+        logprobs: Request token log probabilities and report their sum as "logprob_sum"
+        
+    Returns:
+        Dictionary containing the result, token counts, elapsed time, and tool calls if any.
+        "result"/"tool_calls" are those of the first choice; when the provider returned more
+        than one choice, "choices" lists all of them ({"index", "result", "tool_calls",
+        "finish_reason", "logprob_sum"})
+    """
+    api_params = build_request(model, user_prompt, content, system_prompt, history, max_tokens, response_format, n,
+                               temperature, tools, tool_choice, prompt_cache, logprobs)
+
+    if not (COALESCE_REQUESTS if coalesce is None else coalesce):
+        return send_completion(provider_name, api_params)
+
+    key = single_flight.fingerprint(provider_name, api_params)
+    response, shared = CHAT_FLIGHT.do(key, lambda: send_completion(provider_name, api_params), provider_name, model)
+    return dict(response, coalesced=True) if shared else response
+
+def send_completion(provider_name, api_params):
+    """Send a chat completion request with retries and return the process_content response"""
+    # Get the OpenAI client for the specified provider
+    client = get_openai_client(provider_name)
+    model = api_params["model"]
+
+    start_time = time.time()
+
+    ledger.check_budget(provider_name, model)
+
     max_retries = 5
     base_delay = 30
     input_tokens = 0
     output_tokens = 0
+    cached_tokens = 0
     result = ""
     tool_calls = None
+    choices = None
+    tracker = telemetry.RequestTracker("chat", provider_name, model)
+    estimated_tokens = estimate_request_tokens(provider_name, api_params)
 
     for attempt in range(max_retries):
         try:
-            print(f"Attempt {attempt + 1}: Sending request to {provider_name} API...", flush=True)
-            completion = client.chat.completions.create(**api_params)
+            logger.debug("Attempt %d: Sending request to %s API...", attempt + 1, provider_name)
+            with adaptive_limiter.slot(provider_name), \
+                    rate_limiter.slot(provider_name, estimated_tokens) as permit, tracker.attempt(attempt + 1):
+                completion = client.chat.completions.create(**api_params)
             
-            # 只在调试模式开启时打印原始响应
-            if DEBUG_MODE:
-                print("Raw API response:", flush=True)
-                print(completion, flush=True)
+                # 只在调试模式开启时记录原始响应
+                if DEBUG_MODE:
+                    logger.info("Raw API response: %s", completion)
             
-            if isinstance(completion, str):
-                print("API returned an unexpected string response:", flush=True)
-                print(completion, flush=True)
-                raise ValueError("Unexpected API response format")
+                if isinstance(completion, str):
+                    logger.error("API returned an unexpected string response: %s", completion)
+                    raise ValueError("Unexpected API response format")
             
-            # Handle tool calls if present
-            message = completion.choices[0].message
-            if hasattr(message, 'tool_calls') and message.tool_calls:
-                tool_calls = message.tool_calls
-                result = message.content or ""
-                print(f"Model made {len(tool_calls)} tool call(s)", flush=True)
-            else:
-                result = message.content.strip() if message.content else ""
+                parsed = parse_completion(completion)
+                permit.used_tokens = parsed["input_tokens"] + parsed["output_tokens"]
+            result = parsed["result"]
+            tool_calls = parsed["tool_calls"]
+            choices = parsed["choices"]
+            if tool_calls:
+                logger.debug("Model made %d tool call(s)", len(tool_calls))
             
-            print(f"Successfully received response from {provider_name} API", flush=True)
-            
-            input_tokens = completion.usage.prompt_tokens
-            output_tokens = completion.usage.completion_tokens
+            input_tokens = parsed["input_tokens"]
+            output_tokens = parsed["output_tokens"]
+            cached_tokens = parsed["cached_tokens"]
             
             break
         except Exception as e:
-            print(f"{provider_name} API encountered an error: {e}", flush=True)
-            print("Error details:", flush=True)
-            print(f"Type: {type(e).__name__}", flush=True)
-            print(f"Arguments: {e.args}", flush=True)
-            
-            if hasattr(e, 'response'):
-                print("API Response:", flush=True)
-                print(f"Status: {e.response.status_code}", flush=True)
-                print(f"Headers: {e.response.headers}", flush=True)
-                print(f"Content: {e.response.text}", flush=True)
+            log_api_error(provider_name, e)
             
             if attempt < max_retries - 1:
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 10)
-                print(f"Retrying in {delay:.2f} seconds...", flush=True)
-                sys.stdout.flush()
+                logger.warning("Retrying %s request in %.2f seconds...", provider_name, delay)
+                tracker.backoff(delay)
                 time.sleep(delay)
             else:
-                print(f"Maximum retry attempts reached.", flush=True)
+                logger.error("Maximum retry attempts reached for %s.", provider_name)
+                tracker.finish(error=e)
                 raise
 
     end_time = time.time()
     elapsed_time = end_time - start_time
+    tracker.finish(input_tokens, output_tokens, cached_tokens=cached_tokens)
+    ledger.record_usage(provider_name, model, "chat", input_tokens=input_tokens, output_tokens=output_tokens,
+                        cached_tokens=cached_tokens)
 
-    print(f"Processing {provider_name} API completed. Input tokens: {input_tokens}, Output tokens: {output_tokens}", flush=True)
+    logger.info("Processing %s API completed. Input tokens: %s (cached %s), Output tokens: %s", provider_name, input_tokens, cached_tokens, output_tokens)
 
+    return build_response(result, tool_calls, input_tokens, output_tokens, elapsed_time, cached_tokens, choices)
+
+def build_response(result, tool_calls, input_tokens, output_tokens, elapsed_time, cached_tokens=0, choices=None):
     response_data = {
         "result": result,
         "input_tokens": input_tokens,
         "output_tokens": output_tokens,
+        "cached_tokens": cached_tokens,
+        "uncached_input_tokens": input_tokens - cached_tokens,
         "elapsed_time": elapsed_time
     }
     
     if tool_calls:
         response_data["tool_calls"] = tool_calls
 
+    if choices and "logprob_sum" in choices[0]:
+        response_data["logprob_sum"] = choices[0]["logprob_sum"]
+    if choices and len(choices) > 1:
+        response_data["choices"] = choices
+
     return response_data
 
-print("openai_based_api.py module loaded", flush=True)
+async def process_content_async(provider_name, user_prompt, model, content=None, system_prompt=None, max_tokens=None, response_format=None, n=1, temperature=None, tools=None, tool_choice=None, history=None, prompt_cache=None, coalesce=None, logprobs=False):
+    """
+    Async version of process_content using AsyncOpenAI.
+    
+    Takes the same arguments and returns the same dictionary; retries back off with
+    asyncio.sleep, and concurrent identical requests on the same event loop are coalesced.
+    """
+    api_params = build_request(model, user_prompt, content, system_prompt, history, max_tokens, response_format, n,
+                               temperature, tools, tool_choice, prompt_cache, logprobs)
+
+    if not (COALESCE_REQUESTS if coalesce is None else coalesce):
+        return await send_completion_async(provider_name, api_params)
+
+    key = single_flight.fingerprint(provider_name, api_params)
+    response, shared = await ASYNC_CHAT_FLIGHT.do(key, lambda: send_completion_async(provider_name, api_params),
+                                                  provider_name, model)
+    return dict(response, coalesced=True) if shared else response
+
+async def send_completion_async(provider_name, api_params):
+    """Async version of send_completion"""
+    client = get_async_openai_client(provider_name)
+    model = api_params["model"]
+
+    start_time = time.time()
+
+    delay = ledger.budget_delay(provider_name, model)
+    if delay:
+        await asyncio.sleep(delay)
+
+    max_retries = 5
+    base_delay = 30
+    tracker = telemetry.RequestTracker("chat", provider_name, model)
+    estimated_tokens = estimate_request_tokens(provider_name, api_params)
+
+    try:
+        for attempt in range(max_retries):
+            try:
+                logger.debug("Attempt %d: Sending async request to %s API...", attempt + 1, provider_name)
+                async with adaptive_limiter.slot_async(provider_name), \
+                        rate_limiter.slot_async(provider_name, estimated_tokens) as permit:
+                    with tracker.attempt(attempt + 1):
+                        completion = await client.chat.completions.create(**api_params)
+
+                        if DEBUG_MODE:
+                            logger.info("Raw API response: %s", completion)
+
+                        if isinstance(completion, str):
+                            logger.error("API returned an unexpected string response: %s", completion)
+                            raise ValueError("Unexpected API response format")
+
+                        parsed = parse_completion(completion)
+                        permit.used_tokens = parsed["input_tokens"] + parsed["output_tokens"]
+                break
+            except Exception as e:
+                log_api_error(provider_name, e)
+
+                if attempt < max_retries - 1:
+                    delay = base_delay * (2 ** attempt) + random.uniform(0, 10)
+                    logger.warning("Retrying %s request in %.2f seconds...", provider_name, delay)
+                    tracker.backoff(delay)
+                    await asyncio.sleep(delay)
+                else:
+                    logger.error("Maximum retry attempts reached for %s.", provider_name)
+                    tracker.finish(error=e)
+                    raise
+    finally:
+        if not POOL_CLIENTS:
+            await client.close()
+
+    input_tokens = parsed["input_tokens"]
+    output_tokens = parsed["output_tokens"]
+    cached_tokens = parsed["cached_tokens"]
+    elapsed_time = time.time() - start_time
+    tracker.finish(input_tokens, output_tokens, cached_tokens=cached_tokens)
+    ledger.record_usage(provider_name, model, "chat", input_tokens=input_tokens, output_tokens=output_tokens,
+                        cached_tokens=cached_tokens)
+
+    logger.info("Processing %s API completed. Input tokens: %s (cached %s), Output tokens: %s", provider_name, input_tokens, cached_tokens, output_tokens)
+
+    return build_response(parsed["result"], parsed["tool_calls"], input_tokens, output_tokens, elapsed_time,
+                          cached_tokens, parsed["choices"])
+
+def add_tool_call_fragment(tool_calls, fragment):
+    """Merge one streamed tool call delta into tool_calls ({index: partial call}) and return the call"""
+    call = tool_calls.setdefault(fragment.index, {"id": None, "name": "", "arguments": "", "emitted": False})
+    if fragment.id:
+        call["id"] = fragment.id
+    if fragment.function is not None:
+        if fragment.function.name:
+            call["name"] += fragment.function.name
+        if fragment.function.arguments:
+            call["arguments"] += fragment.function.arguments
+    return call
+
+def tool_arguments_complete(arguments):
+    """True once the streamed arguments form a complete JSON object"""
+    # 只有以 } 结尾时才尝试解析，避免每个片段都做一次完整解析
+    if not arguments.rstrip().endswith("}"):
+        return False
+    try:
+        return isinstance(json.loads(arguments), dict)
+    except json.JSONDecodeError:
+        return False
+
+def build_tool_call(call):
+    return ChatCompletionMessageToolCall.model_validate({
+        "id": call["id"], "type": "function",
+        "function": {"name": call["name"], "arguments": call["arguments"]}
+    })
+
+def stream_content(provider_name, user_prompt, model, content=None, system_prompt=None, max_tokens=None, response_format=None, temperature=None, tools=None, tool_choice=None, history=None, prompt_cache=None):
+    """
+    Stream a completion from the specified provider.
+    
+    Takes the same arguments as process_content (n is always 1). Requests are retried
+    like process_content as long as nothing has been received yet; once streaming has
+    started an error is raised to the caller.
+    
+    Tool calls are assembled from their streamed fragments and yielded as soon as their
+    arguments form a complete JSON object, so callers can start running a tool while the
+    model is still generating the next ones.
+    
+    Yields:
+        {"type": "delta", "content": text} for every content fragment,
+        {"type": "tool_call", "index": i, "tool_call": ChatCompletionMessageToolCall} for
+        every tool call, then
+        {"type": "done", "response": {...}} with the same keys as process_content
+    """
+    client = get_openai_client(provider_name)
+
+    start_time = time.time()
+
+    api_params = build_request(model, user_prompt, content, system_prompt, history, max_tokens, response_format, 1,
+                               temperature, tools, tool_choice, prompt_cache)
+    messages = api_params["messages"]
+    api_params["stream"] = True
+    api_params["stream_options"] = {"include_usage": True}
+
+    ledger.check_budget(provider_name, model)
+
+    max_retries = 5
+    base_delay = 30
+    parts = []
+    tool_calls = {}
+    usage = None
+    first_token_time = None
+    tracker = telemetry.RequestTracker("chat_stream", provider_name, model)
+    estimated_tokens = estimate_request_tokens(provider_name, api_params)
+
+    for attempt in range(max_retries):
+        try:
+            logger.debug("Attempt %d: Sending streaming request to %s API...", attempt + 1, provider_name)
+            with adaptive_limiter.slot(provider_name, latency=False), \
+                    rate_limiter.slot(provider_name, estimated_tokens) as permit, tracker.attempt(attempt + 1):
+                stream = client.chat.completions.create(**api_params)
+
+                for chunk in stream:
+                    if DEBUG_MODE:
+                        logger.info("Raw API chunk: %s", chunk)
+                    if getattr(chunk, 'usage', None):
+                        usage = chunk.usage
+                    if not chunk.choices:
+                        continue
+                    delta = chunk.choices[0].delta
+                    if delta is None or not (delta.content or delta.tool_calls):
+                        continue
+                    if first_token_time is None:
+                        first_token_time = time.time()
+                        tracker.first_token(first_token_time - start_time)
+                    if delta.content:
+                        parts.append(delta.content)
+                        yield {"type": "delta", "content": delta.content}
+                    for fragment in delta.tool_calls or []:
+                        call = add_tool_call_fragment(tool_calls, fragment)
+                        if not call["emitted"] and tool_arguments_complete(call["arguments"]):
+                            call["emitted"] = True
+                            yield {"type": "tool_call", "index": fragment.index, "tool_call": build_tool_call(call)}
+
+                # 参数不是完整 JSON 的工具调用在流结束时补发
+                for index in sorted(tool_calls):
+                    if not tool_calls[index]["emitted"]:
+                        tool_calls[index]["emitted"] = True
+                        yield {"type": "tool_call", "index": index, "tool_call": build_tool_call(tool_calls[index])}
+                if usage is not None:
+                    permit.used_tokens = usage.prompt_tokens + usage.completion_tokens
+            break
+        except GeneratorExit:
+            tracker.finish(outcome="cancelled")
+            raise
+        except Exception as e:
+            log_api_error(provider_name, e)
+
+            if parts or tool_calls or attempt >= max_retries - 1:
+                logger.error("Streaming aborted after %d fragment(s) and %d tool call(s).", len(parts), len(tool_calls))
+                tracker.finish(error=e)
+                raise
+
+            delay = base_delay * (2 ** attempt) + random.uniform(0, 10)
+            logger.warning("Retrying %s request in %.2f seconds...", provider_name, delay)
+            tracker.backoff(delay)
+            time.sleep(delay)
+
+    result = "".join(parts).strip()
+    completed_calls = [build_tool_call(tool_calls[index]) for index in sorted(tool_calls)]
+
+    # 部分网关不支持 stream_options，此时用 tiktoken 估算 token 数
+    if usage is not None:
+        input_tokens = usage.prompt_tokens
+        output_tokens = usage.completion_tokens
+    else:
+        input_tokens = sum(len(encoding.encode(message_text(m), disallowed_special=())) for m in messages)
+        output_tokens = len(encoding.encode(result, disallowed_special=()))
+        output_tokens += sum(len(encoding.encode(call.function.arguments, disallowed_special=()))
+                             for call in completed_calls)
+    cached_tokens = prompt_layout.cached_tokens(usage)
+
+    end_time = time.time()
+    tracker.finish(input_tokens, output_tokens, cached_tokens=cached_tokens)
+    ledger.record_usage(provider_name, model, "chat_stream", input_tokens=input_tokens, output_tokens=output_tokens,
+                        cached_tokens=cached_tokens)
+
+    logger.info("Processing %s API completed. Input tokens: %s, Output tokens: %s", provider_name, input_tokens, output_tokens)
+
+    response_data = {
+        "result": result,
+        "input_tokens": input_tokens,
+        "output_tokens": output_tokens,
+        "cached_tokens": cached_tokens,
+        "uncached_input_tokens": input_tokens - cached_tokens,
+        "elapsed_time": end_time - start_time,
+        "time_to_first_token": (first_token_time - start_time) if first_token_time else None
+    }
+    if completed_calls:
+        response_data["tool_calls"] = completed_calls
+
+    yield {"type": "done", "response": response_data}
+
+logger.debug("openai_based_api.py module loaded")
 
 
 
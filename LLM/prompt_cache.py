@@ -0,0 +1,107 @@
+# 按模型名判断网关使用的缓存方式：
+#   "explicit": Claude / Gemini 需要在请求中用 cache_control 标记缓存断点
+#   "automatic": OpenAI 等模型自动缓存 1024 token 以上的相同前缀，只需保证前缀逐字节一致
+EXPLICIT_CACHE_MODELS = ("claude", "anthropic/", "gemini", "google/")
+CACHE_CONTROL = {"type": "ephemeral"}
+# Anthropic 每个请求最多 4 个缓存断点
+MAX_BREAKPOINTS = 4
+
+
+def cache_style(model):
+    """Return "explicit" for models that need cache_control breakpoints, otherwise "automatic" """
+    name = str(model).lower()
+    return "explicit" if any(marker in name for marker in EXPLICIT_CACHE_MODELS) else "automatic"
+
+
+def canonical(value):
+    """Recursively convert SDK objects to plain data with sorted dict keys"""
+    if hasattr(value, "model_dump"):
+        value = value.model_dump(exclude_none=True)
+    if isinstance(value, dict):
+        return {key: canonical(value[key]) for key in sorted(value)}
+    if isinstance(value, (list, tuple)):
+        return [canonical(item) for item in value]
+    return value
+
+
+def canonical_tools(tools):
+    """Tool schemas sorted by function name with sorted keys, so the serialized prefix never changes"""
+    return sorted((canonical(tool) for tool in tools),
+                  key=lambda tool: (tool.get("type", ""), tool.get("function", {}).get("name", "")))
+
+
+def add_breakpoint(message):
+    """Return a copy of message whose last content part carries cache_control"""
+    message = dict(message)
+    content = message.get("content")
+    if isinstance(content, str):
+        if not content:
+            return message
+        content = [{"type": "text", "text": content}]
+    elif isinstance(content, list) and content:
+        content = [dict(part) for part in content]
+    else:
+        return message
+    content[-1]["cache_control"] = dict(CACHE_CONTROL)
+    message["content"] = content
+    return message
+
+
+def apply_prompt_cache(api_params):
+    """
+    Rewrite chat completion parameters into a prompt-cache friendly layout.
+
+    Tools and messages are canonicalized (sorted tools, sorted keys, SDK objects turned
+    into dicts) so identical prefixes serialize byte for byte. For Claude/Gemini models,
+    cache breakpoints are placed on the last tool, the system prompt and the last message
+    with content, so the next round of a conversation reads everything sent so far from cache.
+
+    Args:
+        api_params: Parameters built by build_api_params (not modified)
+
+    Returns:
+        New parameters dict
+    """
+    params = dict(api_params)
+    messages = [canonical(message) for message in api_params["messages"]]
+    explicit = cache_style(api_params["model"]) == "explicit"
+
+    if api_params.get("tools"):
+        tools = canonical_tools(api_params["tools"])
+        if explicit:
+            tools[-1] = dict(tools[-1], cache_control=dict(CACHE_CONTROL))
+        params["tools"] = tools
+
+    if explicit:
+        breakpoints = [i for i, message in enumerate(messages) if message.get("role") == "system"][:1]
+        # 最后一条有内容的消息：下一轮对话以本次请求的全部消息为前缀
+        with_content = [i for i, message in enumerate(messages) if message.get("content")]
+        if with_content and with_content[-1] not in breakpoints:
+            breakpoints.append(with_content[-1])
+        for i in breakpoints[:MAX_BREAKPOINTS - 1]:
+            messages[i] = add_breakpoint(messages[i])
+
+    params["messages"] = messages
+    return params
+
+
+def cached_tokens(usage):
+    """
+    Input tokens served from the provider's prompt cache.
+
+    Reads usage.prompt_tokens_details.cached_tokens (OpenAI format) and falls back to
+    cache_read_input_tokens reported by Anthropic-compatible gateways.
+    """
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(usage, "cache_read_input_tokens", None)
+        if cached is None and getattr(usage, "model_extra", None):
+            cached = usage.model_extra.get("cache_read_input_tokens")
+    return int(cached or 0)
+
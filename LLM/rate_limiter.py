@@ -0,0 +1,310 @@
+import os
+import sys
+import json
+import time
+import uuid
+import asyncio
+import tempfile
+import threading
+import configparser
+from contextlib import contextmanager, asynccontextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows：退化为进程内的锁
+    fcntl = None
+
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+
+logger = telemetry.get_logger("rate_limiter")
+
+# 同一台机器上所有进程共享的限流状态目录
+STATE_DIR = os.environ.get("LLM_RATE_LIMIT_DIR", os.path.join(tempfile.gettempdir(), "llm_rate_limits"))
+# 令牌桶容量：最多积攒多少秒的配额（避免空闲后一次性打满整分钟的 RPM）
+BURST_SECONDS = 10.0
+# 只受并发数限制时，两次检查之间的等待（秒）
+POLL_INTERVAL = 0.05
+# 收到 429 但没有 Retry-After 时，所有进程暂停的时间（秒）
+DEFAULT_PAUSE = 5.0
+
+
+class RateLimit:
+    """Per-provider limits; None means unlimited"""
+
+    def __init__(self, rpm=None, tpm=None, max_in_flight=None, key=None):
+        """
+        Args:
+            rpm: Requests per minute
+            tpm: Tokens (input + output) per minute
+            max_in_flight: Maximum concurrent requests over all processes
+            key: State shared by providers with the same key (e.g. several sections on one account)
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.max_in_flight = max_in_flight
+        self.key = key
+
+    def __repr__(self):
+        return f"RateLimit(rpm={self.rpm}, tpm={self.tpm}, max_in_flight={self.max_in_flight}, key={self.key!r})"
+
+
+def load_limits():
+    """Read optional rpm / tpm / max_in_flight / rate_limit_key entries of the .provider_env sections"""
+    limits = {}
+    config = configparser.ConfigParser()
+    try:
+        config.read(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), '.provider_env'))
+        for provider in config.sections():
+            section = config[provider]
+            values = {name: section.getfloat(name) for name in ("rpm", "tpm") if name in section}
+            if "max_in_flight" in section:
+                values["max_in_flight"] = section.getint("max_in_flight")
+            if values:
+                limits[provider] = RateLimit(key=section.get("rate_limit_key"), **values)
+    except Exception as e:
+        logger.error("Error loading rate limits: %s", e)
+    return limits
+
+
+LIMITS = load_limits()
+_local_lock = threading.Lock()
+
+
+def set_limit(provider, rpm=None, tpm=None, max_in_flight=None, key=None):
+    """Set (or with no limits, remove) the limits of a provider in this process"""
+    if rpm is None and tpm is None and max_in_flight is None:
+        LIMITS.pop(provider, None)
+    else:
+        LIMITS[provider] = RateLimit(rpm, tpm, max_in_flight, key)
+
+
+def state_path(limit, provider):
+    name = "".join(c if c.isalnum() or c in "-_." else "_" for c in (limit.key or provider))
+    return os.path.join(STATE_DIR, f"{name}.json")
+
+
+def load_state(path):
+    """Read a state file; a missing, truncated or corrupt file is an empty state"""
+    try:
+        with open(path, encoding="utf-8") as f:
+            state = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except ValueError as e:
+        logger.warning("Resetting corrupt rate limit state %s: %s", path, e)
+        return {}
+    if not isinstance(state, dict):
+        logger.warning("Resetting rate limit state %s: expected an object, got %s", path, type(state).__name__)
+        return {}
+    return state
+
+
+@contextmanager
+def locked_state(path):
+    """
+    Load, yield and write back the JSON state file under an exclusive lock shared by all processes.
+
+    The lock is held on a separate <path>.lock file and the new state is written to a temporary
+    file that replaces the old one, so a process dying mid-write never leaves a partial state.
+    """
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with _local_lock, open(path + ".lock", "a", encoding="utf-8") as lock:
+        if fcntl is not None:
+            fcntl.flock(lock.fileno(), fcntl.LOCK_EX)
+        try:
+            state = load_state(path)
+            yield state
+            fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path), suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w", encoding="utf-8") as f:
+                    f.write(json.dumps(state))
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        finally:
+            if fcntl is not None:
+                fcntl.flock(lock.fileno(), fcntl.LOCK_UN)
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class Permit:
+    """One admitted request; set used_tokens to the actual usage before release to settle the TPM bucket"""
+
+    def __init__(self, provider, limit=None, permit_id=None, tokens=0):
+        self.provider = provider
+        self.limit = limit
+        self.permit_id = permit_id
+        self.tokens = tokens
+        self.used_tokens = None
+        self.released = False
+
+
+def try_acquire(provider, limit, tokens, now=None):
+    """
+    Take a request slot if the shared buckets allow it.
+
+    Returns:
+        (Permit, 0.0) when admitted, otherwise (None, seconds to wait before trying again)
+    """
+    now = time.time() if now is None else now
+    with locked_state(state_path(limit, provider)) as state:
+        elapsed = max(0.0, now - state.get("updated", now))
+        state["updated"] = now
+        waits = []
+        if state.get("blocked_until", 0) > now:
+            waits.append(state["blocked_until"] - now)
+
+        if limit.rpm:
+            capacity = max(1.0, limit.rpm * BURST_SECONDS / 60)
+            state["requests"] = min(capacity, state.get("requests", capacity) + elapsed * limit.rpm / 60)
+            if state["requests"] < 1:
+                waits.append((1 - state["requests"]) * 60 / limit.rpm)
+        if limit.tpm:
+            capacity = max(1.0, limit.tpm * BURST_SECONDS / 60)
+            state["tokens"] = min(capacity, state.get("tokens", capacity) + elapsed * limit.tpm / 60)
+            # 超过桶容量的请求在桶满时放行，否则永远等不到
+            needed = min(tokens, capacity)
+            if state["tokens"] < needed:
+                waits.append((needed - state["tokens"]) * 60 / limit.tpm)
+
+        in_flight = state.setdefault("in_flight", {})
+        if limit.max_in_flight and len(in_flight) >= limit.max_in_flight:
+            # 清理崩溃进程留下的占用
+            for permit_id, pid in list(in_flight.items()):
+                if not pid_alive(pid):
+                    del in_flight[permit_id]
+            if len(in_flight) >= limit.max_in_flight:
+                waits.append(POLL_INTERVAL)
+
+        if waits:
+            return None, max(waits)
+        if limit.rpm:
+            state["requests"] -= 1
+        if limit.tpm:
+            state["tokens"] -= tokens
+        permit_id = uuid.uuid4().hex
+        if limit.max_in_flight:
+            in_flight[permit_id] = os.getpid()
+        return Permit(provider, limit, permit_id, tokens), 0.0
+
+
+def release(permit):
+    """Free the in-flight slot and correct the token bucket by used_tokens - estimated tokens"""
+    if permit.limit is None or permit.released:
+        return
+    permit.released = True
+    correction = permit.used_tokens - permit.tokens if permit.limit.tpm and permit.used_tokens is not None else 0
+    if not permit.limit.max_in_flight and not correction:
+        return
+    with locked_state(state_path(permit.limit, permit.provider)) as state:
+        state.get("in_flight", {}).pop(permit.permit_id, None)
+        if correction and "tokens" in state:
+            state["tokens"] -= correction
+
+
+def pause(provider, seconds):
+    """Make every process wait seconds before its next request to provider (after a 429)"""
+    limit = LIMITS.get(provider)
+    if limit is None:
+        return
+    with locked_state(state_path(limit, provider)) as state:
+        state["blocked_until"] = max(state.get("blocked_until", 0), time.time() + seconds)
+    logger.warning("%s rate limited, pausing all processes for %.1f seconds", provider, seconds)
+
+
+def retry_after(exception):
+    """Retry-After of a 429 response in seconds, or DEFAULT_PAUSE"""
+    headers = getattr(getattr(exception, "response", None), "headers", None) or {}
+    try:
+        return float(headers.get("retry-after") or DEFAULT_PAUSE)
+    except (TypeError, ValueError):
+        return DEFAULT_PAUSE
+
+
+def _record_wait(provider, waited):
+    if waited:
+        telemetry.METRICS.inc("llm_rate_limit_wait_seconds_total", waited, provider=provider)
+        logger.debug("Waited %.3f seconds for a %s rate limit slot", waited, provider)
+
+
+def acquire(provider, tokens=0):
+    """Block until provider's limits admit a request of about tokens tokens"""
+    limit = LIMITS.get(provider)
+    if limit is None:
+        return Permit(provider)
+    start = time.time()
+    while True:
+        permit, wait = try_acquire(provider, limit, tokens)
+        if permit is not None:
+            _record_wait(provider, time.time() - start)
+            return permit
+        time.sleep(wait)
+
+
+async def acquire_async(provider, tokens=0):
+    """Async version of acquire; the locked state file is read in a worker thread, not on the event loop"""
+    limit = LIMITS.get(provider)
+    if limit is None:
+        return Permit(provider)
+    start = time.time()
+    while True:
+        permit, wait = await asyncio.to_thread(try_acquire, provider, limit, tokens)
+        if permit is not None:
+            _record_wait(provider, time.time() - start)
+            return permit
+        await asyncio.sleep(wait)
+
+
+def _on_error(provider, exception):
+    if provider in LIMITS and telemetry.classify_error(exception) == "rate_limited":
+        pause(provider, retry_after(exception))
+
+
+@contextmanager
+def slot(provider, tokens=0):
+    """
+    Hold a rate limit slot for one upstream attempt.
+
+    Usage:
+        with rate_limiter.slot(provider_name, estimated_tokens) as permit:
+            completion = client.chat.completions.create(...)
+            permit.used_tokens = completion.usage.total_tokens
+    """
+    permit = acquire(provider, tokens)
+    try:
+        yield permit
+    except Exception as e:
+        _on_error(provider, e)
+        raise
+    finally:
+        release(permit)
+
+
+@asynccontextmanager
+async def slot_async(provider, tokens=0):
+    """Async version of slot; file locking and I/O run in a worker thread, not on the event loop"""
+    permit = await acquire_async(provider, tokens)
+    if permit.limit is None:
+        yield permit
+        return
+    try:
+        yield permit
+    except Exception as e:
+        await asyncio.to_thread(_on_error, provider, e)
+        raise
+    finally:
+        await asyncio.to_thread(release, permit)
@@ -0,0 +1,250 @@
+import os
+import sys
+import time
+import json
+import hashlib
+import threading
+import numpy as np
+
+# Add the parent directory to sys.path to import the LLM and embedding modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from embedding import openai_based_embedding
+
+logger = telemetry.get_logger("semantic_cache")
+
+DEFAULT_THRESHOLD = 0.92
+DEFAULT_MAX_ENTRIES = 10000
+
+
+def hash_text(text):
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class NamespaceIndex:
+    """Vector index of the prompts cached for one namespace (normalized float32 rows)"""
+
+    def __init__(self, dimension, capacity=64):
+        self.vectors = np.zeros((capacity, dimension), dtype=np.float32)
+        self.entries = []
+        self.last_access = np.zeros(capacity, dtype=np.float64)
+        self.by_hash = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def search(self, vector):
+        """Return (row, similarity) of the closest entry, or (None, -1)"""
+        size = len(self.entries)
+        if size == 0:
+            return None, -1.0
+        scores = self.vectors[:size] @ vector
+        row = int(np.argmax(scores))
+        return row, float(scores[row])
+
+    def add(self, vector, entry):
+        size = len(self.entries)
+        if size == len(self.vectors):
+            self.vectors = np.concatenate([self.vectors, np.zeros_like(self.vectors)])
+            self.last_access = np.concatenate([self.last_access, np.zeros_like(self.last_access)])
+        self.vectors[size] = vector
+        self.last_access[size] = time.time()
+        self.entries.append(entry)
+        self.by_hash[entry["prompt_hash"]] = size
+
+    def remove(self, row):
+        """Remove a row by moving the last row into its place"""
+        last = len(self.entries) - 1
+        del self.by_hash[self.entries[row]["prompt_hash"]]
+        if row != last:
+            self.vectors[row] = self.vectors[last]
+            self.last_access[row] = self.last_access[last]
+            self.entries[row] = self.entries[last]
+            self.by_hash[self.entries[row]["prompt_hash"]] = row
+        self.entries.pop()
+
+    def evict_lru(self):
+        size = len(self.entries)
+        self.remove(int(np.argmin(self.last_access[:size])))
+
+
+class SemanticCache:
+    """
+    Semantic cache of completions keyed by prompt embeddings.
+
+    Prompts are embedded through embedding/openai_based_embedding.process_embedding and
+    searched in a per-namespace vector index. The namespace is the model plus a fingerprint
+    of everything else that shapes the answer (content, system prompt, response_format,
+    temperature, max_tokens), so only the wording of user_prompt is matched semantically.
+    """
+
+    def __init__(self, embedding_provider, embedding_model, threshold=DEFAULT_THRESHOLD,
+                 max_entries=DEFAULT_MAX_ENTRIES, ttl=None, dimensions=None):
+        """
+        Args:
+            embedding_provider: Provider used for the embedding calls
+            embedding_model: Embedding model name
+            threshold: Minimum cosine similarity for a cache hit
+            max_entries: Maximum number of entries per namespace (LRU eviction)
+            ttl: Optional time to live of an entry in seconds
+            dimensions: Optional embedding dimensions
+        """
+        self.embedding_provider = embedding_provider
+        self.embedding_model = embedding_model
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.dimensions = dimensions
+        self.namespaces = {}
+        self.lock = threading.Lock()
+        self.stats = {
+            "hits": 0,
+            "exact_hits": 0,
+            "misses": 0,
+            "evictions": 0,
+            "saved_latency": 0.0,
+            "saved_input_tokens": 0,
+            "saved_output_tokens": 0,
+            "embedding_tokens": 0,
+            "embedding_time": 0.0,
+        }
+
+    def embed(self, text):
+        response = openai_based_embedding.process_embedding(
+            provider_name=self.embedding_provider,
+            model=self.embedding_model,
+            input_text=text,
+            dimensions=self.dimensions
+        )
+        vector = np.asarray(response["result"].data[0].embedding, dtype=np.float32)
+        with self.lock:
+            self.stats["embedding_tokens"] += response["total_tokens"] or 0
+            self.stats["embedding_time"] += response["elapsed_time"]
+        return vector / (np.linalg.norm(vector) or 1.0)
+
+    def _expired(self, entry):
+        return self.ttl is not None and time.time() - entry["created_at"] >= self.ttl
+
+    def lookup(self, namespace, prompt):
+        """
+        Find a cached response for a prompt.
+
+        Returns:
+            Tuple of (cached response or None, similarity, prompt embedding or None).
+            The embedding is returned so that a following store() does not embed twice.
+        """
+        prompt_hash = hash_text(prompt)
+        with self.lock:
+            index = self.namespaces.get(namespace)
+            row = index.by_hash.get(prompt_hash) if index else None
+            if row is not None and not self._expired(index.entries[row]):
+                index.last_access[row] = time.time()
+                self._record_hit(index.entries[row], exact=True)
+                return index.entries[row]["response"], 1.0, None
+
+        vector = self.embed(prompt)
+
+        with self.lock:
+            index = self.namespaces.get(namespace)
+            if index is None:
+                self.stats["misses"] += 1
+                return None, -1.0, vector
+            row, similarity = index.search(vector)
+            if row is not None and self._expired(index.entries[row]):
+                index.remove(row)
+                row, similarity = index.search(vector)
+            if row is None or similarity < self.threshold:
+                self.stats["misses"] += 1
+                return None, similarity, vector
+            index.last_access[row] = time.time()
+            self._record_hit(index.entries[row], exact=False)
+            return index.entries[row]["response"], similarity, vector
+
+    def _record_hit(self, entry, exact):
+        response = entry["response"]
+        self.stats["hits"] += 1
+        if exact:
+            self.stats["exact_hits"] += 1
+        self.stats["saved_latency"] += response.get("elapsed_time", 0.0)
+        self.stats["saved_input_tokens"] += response.get("input_tokens", 0)
+        self.stats["saved_output_tokens"] += response.get("output_tokens", 0)
+
+    def store(self, namespace, prompt, response, vector=None):
+        """Add a response to the cache, evicting the least recently used entry if full"""
+        if vector is None:
+            vector = self.embed(prompt)
+        entry = {"prompt_hash": hash_text(prompt), "prompt": prompt, "response": response, "created_at": time.time()}
+        with self.lock:
+            index = self.namespaces.get(namespace)
+            if index is None:
+                index = self.namespaces[namespace] = NamespaceIndex(len(vector))
+            existing = index.by_hash.get(entry["prompt_hash"])
+            if existing is not None:
+                index.remove(existing)
+            while len(index) >= self.max_entries:
+                index.evict_lru()
+                self.stats["evictions"] += 1
+            index.add(vector, entry)
+
+    def clear(self, namespace=None):
+        with self.lock:
+            if namespace is None:
+                self.namespaces.clear()
+            else:
+                self.namespaces.pop(namespace, None)
+
+    def get_stats(self):
+        """Return cache metrics, including hit rate and saved latency/tokens"""
+        with self.lock:
+            stats = dict(self.stats)
+            stats["entries"] = sum(len(index) for index in self.namespaces.values())
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+def make_namespace(model, content=None, system_prompt=None, max_tokens=None, response_format=None, temperature=None):
+    """Build the namespace key: the model plus a fingerprint of the non-prompt parameters"""
+    fingerprint = json.dumps([content, system_prompt, max_tokens, response_format, temperature],
+                             sort_keys=True, ensure_ascii=False, default=str)
+    return f"{model}:{hash_text(fingerprint)[:16]}"
+
+
+def process_content_cached(cache, provider_name, user_prompt, model, content=None, system_prompt=None, max_tokens=None,
+                           response_format=None, n=1, temperature=None, tools=None, tool_choice=None):
+    """
+    process_content with a semantic cache in front of it.
+
+    Requests with tools or n > 1 bypass the cache. On a hit the stored response is
+    returned with "cache_hit": True and the matched "similarity".
+
+    Args:
+        cache: A SemanticCache instance
+        Other arguments: Same as process_content
+
+    Returns:
+        Dictionary with the same keys as process_content plus "cache_hit"
+    """
+    if tools or n != 1:
+        return openai_based_api.process_content(provider_name, user_prompt, model, content, system_prompt, max_tokens,
+                                                response_format, n, temperature, tools, tool_choice)
+
+    start_time = time.time()
+    namespace = make_namespace(model, content, system_prompt, max_tokens, response_format, temperature)
+    cached, similarity, vector = cache.lookup(namespace, user_prompt)
+    if cached is not None:
+        # 命中次数已由 lookup 计入 cache.stats["hits"]
+        logger.debug("Semantic cache hit (similarity %.3f)", similarity)
+        response = dict(cached)
+        response["cache_hit"] = True
+        response["similarity"] = similarity
+        response["elapsed_time"] = time.time() - start_time
+        return response
+
+    response = openai_based_api.process_content(provider_name, user_prompt, model, content, system_prompt, max_tokens,
+                                                response_format, n, temperature)
+    cache.store(namespace, user_prompt, response, vector)
+    response = dict(response)
+    response["cache_hit"] = False
+    return response
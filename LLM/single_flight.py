@@ -0,0 +1,130 @@
+import os
+import sys
+import json
+import asyncio
+import hashlib
+import threading
+
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+
+logger = telemetry.get_logger("single_flight")
+
+COALESCED_METRIC = "llm_coalesced_calls_total"
+
+
+def fingerprint(provider_name, api_params):
+    """Stable hash of a request: provider plus the exact parameters sent upstream"""
+    payload = json.dumps({"provider": provider_name, "params": api_params}, sort_keys=True, ensure_ascii=False,
+                         default=repr)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class _Call:
+    """State of one in-flight call shared by its leader and followers"""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """
+    Thread-based request coalescing: while a call for a key is in flight, identical calls
+    wait for it and receive its result (or its exception) instead of calling upstream again.
+    """
+
+    def __init__(self, kind, registry=None):
+        """
+        Args:
+            kind: Request kind used as metric label ("chat", "embedding", ...)
+            registry: MetricsRegistry to report to (defaults to telemetry.METRICS)
+        """
+        self.kind = kind
+        self.registry = registry or telemetry.METRICS
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def in_flight(self):
+        with self.lock:
+            return len(self.calls)
+
+    def do(self, key, fn, provider="", model=""):
+        """
+        Run fn() once per key among concurrent callers.
+
+        Returns:
+            (result, shared) where shared is True when the result came from another caller's call
+        """
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+            else:
+                call.followers += 1
+
+        if not leader:
+            self.registry.inc(COALESCED_METRIC, kind=self.kind, provider=provider, model=model)
+            logger.debug("Coalesced %s request to %s/%s with an in-flight call", self.kind, provider, model)
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.event.set()
+        return call.result, False
+
+
+class AsyncSingleFlight:
+    """asyncio counterpart of SingleFlight; calls are shared within one event loop"""
+
+    def __init__(self, kind, registry=None):
+        self.kind = kind
+        self.registry = registry or telemetry.METRICS
+        self.calls = {}
+
+    def in_flight(self):
+        return len(self.calls)
+
+    async def do(self, key, coro_fn, provider="", model=""):
+        """
+        Await coro_fn() once per key among concurrent callers.
+
+        The shared call runs in its own task, so cancelling one caller does not cancel it
+        for the others.
+
+        Returns:
+            (result, shared) where shared is True when the result came from another caller's call
+        """
+        loop = asyncio.get_running_loop()
+        call_key = (id(loop), key)
+        task = self.calls.get(call_key)
+        if task is not None:
+            self.registry.inc(COALESCED_METRIC, kind=self.kind, provider=provider, model=model)
+            logger.debug("Coalesced %s request to %s/%s with an in-flight call", self.kind, provider, model)
+            return await asyncio.shield(task), True
+
+        task = loop.create_task(coro_fn())
+        self.calls[call_key] = task
+
+        def done(finished):
+            self.calls.pop(call_key, None)
+            # 所有调用方都已取消时避免 "exception was never retrieved" 警告
+            if not finished.cancelled():
+                finished.exception()
+
+        task.add_done_callback(done)
+        return await asyncio.shield(task), False
@@ -0,0 +1,444 @@
+import os
+import sys
+import json
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+
+logger = telemetry.get_logger("structured_output")
+
+# jsonschema 为可选依赖；未安装时使用内置的子集校验器
+try:
+    import jsonschema
+except ImportError:
+    jsonschema = None
+
+CLOSERS = {"{": "}", "[": "]"}
+SCALAR_DELIMITERS = ",}] \t\r\n"
+
+
+class IncrementalJSONParser:
+    """
+    Incremental JSON parser fed with streamed text fragments.
+
+    Whenever a value nested at most max_depth containers deep is complete, it is
+    returned by feed() as {"path": (...), "value": ...}. With the default max_depth=2,
+    each top-level field of an object and each element of a top-level array (or of an
+    array stored in a top-level field) is reported as soon as it has been generated.
+    Text before the first "{" or "[" (e.g. a ```json fence) is ignored. Once the text is
+    found to be malformed, feed() only keeps buffering (self.failed is set) and the full
+    text is left to parse_structured_result / repair_json.
+    """
+
+    def __init__(self, max_depth=2):
+        self.max_depth = max_depth
+        self.buffer = ""
+        self.pos = 0
+        self.stack = []
+        self.in_string = False
+        self.escape = False
+        self.string_start = None
+        self.scalar_start = None
+        self.started = False
+        self.done = False
+        self.failed = False
+        self.value = None
+
+    def feed(self, text):
+        """Append a fragment and return the list of values completed by it"""
+        self.buffer += text
+        if self.failed:
+            return []
+        events = []
+        try:
+            self._scan(events)
+        except (ValueError, IndexError, KeyError):
+            # 格式错误：不再增量解析，只保留已完成的值，由最终的修复和校验处理全文
+            self.failed = True
+        self.pos = len(self.buffer)
+        return events
+
+    def _scan(self, events):
+        buffer = self.buffer
+        for i in range(self.pos, len(buffer)):
+            if self.done:
+                break
+            c = buffer[i]
+
+            if self.in_string:
+                if self.escape:
+                    self.escape = False
+                elif c == "\\":
+                    self.escape = True
+                elif c == '"':
+                    self.in_string = False
+                    frame = self.stack[-1] if self.stack else None
+                    if frame is not None and frame["type"] == "object" and frame["state"] == "key":
+                        frame["key"] = json.loads(buffer[self.string_start:i + 1])
+                        frame["state"] = "colon"
+                    else:
+                        self._complete(self.string_start, i + 1, events)
+                continue
+
+            if self.scalar_start is not None:
+                if c not in SCALAR_DELIMITERS:
+                    continue
+                self._complete(self.scalar_start, i, events)
+                self.scalar_start = None
+
+            if not self.started:
+                if c in "{[":
+                    self.started = True
+                else:
+                    continue
+
+            if c in " \t\r\n":
+                continue
+            if c == '"':
+                self.in_string = True
+                self.string_start = i
+            elif c in "{[":
+                self._push(c, i)
+            elif c in "}]":
+                frame = self.stack.pop()
+                self._complete(frame["start"], i + 1, events)
+            elif c == ":":
+                self.stack[-1]["state"] = "value"
+            elif c == ",":
+                frame = self.stack[-1]
+                frame["state"] = "key" if frame["type"] == "object" else "value"
+            else:
+                self.scalar_start = i
+
+    def _push(self, c, i):
+        if self.stack:
+            parent = self.stack[-1]
+            path = parent["path"] + (parent["key"] if parent["type"] == "object" else parent["index"],)
+        else:
+            path = ()
+        self.stack.append({
+            "type": "object" if c == "{" else "array",
+            "start": i,
+            "path": path,
+            "key": None,
+            "index": 0,
+            "state": "key" if c == "{" else "value",
+        })
+
+    def _complete(self, start, end, events):
+        if not self.stack:
+            self.value = json.loads(self.buffer[start:end])
+            self.done = True
+            return
+
+        frame = self.stack[-1]
+        if len(self.stack) <= self.max_depth:
+            path = frame["path"] + (frame["key"] if frame["type"] == "object" else frame["index"],)
+            events.append({"path": path, "value": json.loads(self.buffer[start:end])})
+        if frame["type"] == "array":
+            frame["index"] += 1
+        frame["state"] = "after"
+
+
+def strip_code_fence(text):
+    """Drop anything before the first JSON container, e.g. a ```json fence"""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text.strip()
+    text = text[min(starts):].rstrip()
+    if text.endswith("```"):
+        text = text[:-3].rstrip()
+    return text
+
+
+def repair_json(text):
+    """
+    Parse JSON that may have been truncated (e.g. by max_tokens) without another request.
+
+    Open strings are closed and open containers are closed in order. If that does not
+    produce valid JSON, the text is cut back to the last complete value and closed again.
+
+    Args:
+        text: The raw model output
+
+    Returns:
+        Tuple of (parsed value, repaired flag)
+
+    Raises:
+        ValueError: If no prefix of the text can be turned into valid JSON
+    """
+    text = strip_code_fence(text)
+    try:
+        return json.loads(text), False
+    except json.JSONDecodeError:
+        pass
+
+    stack = []
+    in_string = False
+    escape = False
+    key_position = False
+    # (cut position, closers) after each complete value
+    safe_points = []
+
+    for i, c in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif c == "\\":
+                escape = True
+            elif c == '"':
+                in_string = False
+                if not key_position:
+                    safe_points.append((i + 1, "".join(CLOSERS[b] for b in reversed(stack))))
+            continue
+
+        if c == '"':
+            in_string = True
+            key_position = bool(stack) and stack[-1] == "{" and _expects_key(text, i)
+        elif c in "{[":
+            stack.append(c)
+            safe_points.append((i + 1, "".join(CLOSERS[b] for b in reversed(stack))))
+        elif c in "}]":
+            if stack:
+                stack.pop()
+            safe_points.append((i + 1, "".join(CLOSERS[b] for b in reversed(stack))))
+        elif c in ",":
+            # 逗号之前的标量值已完整
+            safe_points.append((i, "".join(CLOSERS[b] for b in reversed(stack))))
+
+    # 第一次尝试：补全当前字符串并闭合所有容器
+    candidate = text
+    if in_string:
+        if escape:
+            candidate = candidate[:-1]
+        candidate += '"'
+    candidate = candidate.rstrip().rstrip(",")
+    try:
+        return json.loads(candidate + "".join(CLOSERS[b] for b in reversed(stack))), True
+    except json.JSONDecodeError:
+        pass
+
+    # 回退到最近的完整值
+    for cut, closers in reversed(safe_points):
+        candidate = text[:cut].rstrip().rstrip(",")
+        try:
+            return json.loads(candidate + closers), True
+        except json.JSONDecodeError:
+            continue
+
+    raise ValueError("Unable to repair JSON output")
+
+
+def _expects_key(text, quote_pos):
+    """Whether the string starting at quote_pos is an object key (preceded by '{' or ',')"""
+    j = quote_pos - 1
+    while j >= 0 and text[j] in " \t\r\n":
+        j -= 1
+    return j >= 0 and text[j] in "{,"
+
+
+def get_schema(response_format):
+    """Extract the JSON schema from an OpenAI style response_format, if any"""
+    if not response_format or response_format.get("type") != "json_schema":
+        return None
+    return response_format.get("json_schema", {}).get("schema")
+
+
+TYPE_CHECKS = {
+    "object": lambda v: isinstance(v, dict),
+    "array": lambda v: isinstance(v, list),
+    "string": lambda v: isinstance(v, str),
+    "integer": lambda v: isinstance(v, int) and not isinstance(v, bool),
+    "number": lambda v: isinstance(v, (int, float)) and not isinstance(v, bool),
+    "boolean": lambda v: isinstance(v, bool),
+    "null": lambda v: v is None,
+}
+
+
+def _format_path(parts):
+    return "$" + "".join(f"[{p}]" if isinstance(p, int) else f".{p}" for p in parts)
+
+
+def validate_schema(instance, schema, root=None, path="$"):
+    """
+    Validate an instance against a JSON schema.
+
+    Uses jsonschema when it is installed, otherwise a built-in subset covering type,
+    enum, const, properties, required, additionalProperties, items, length/size bounds,
+    minimum/maximum, anyOf/oneOf and local $ref.
+
+    Returns:
+        List of error messages (empty if the instance is valid)
+    """
+    if jsonschema is not None and root is None:
+        validator = jsonschema.Draft202012Validator(schema)
+        return [f"{_format_path(e.absolute_path)}: {e.message}" for e in validator.iter_errors(instance)]
+
+    root = root or schema
+    errors = []
+
+    if "$ref" in schema:
+        target = root
+        for part in schema["$ref"].lstrip("#/").split("/"):
+            target = target[part]
+        return validate_schema(instance, target, root, path)
+
+    expected = schema.get("type")
+    if expected:
+        types = expected if isinstance(expected, list) else [expected]
+        if not any(TYPE_CHECKS[t](instance) for t in types):
+            return [f"{path}: expected {expected}, got {type(instance).__name__}"]
+
+    if "enum" in schema and instance not in schema["enum"]:
+        errors.append(f"{path}: {instance!r} is not one of {schema['enum']}")
+    if "const" in schema and instance != schema["const"]:
+        errors.append(f"{path}: expected constant {schema['const']!r}")
+
+    if isinstance(instance, dict):
+        properties = schema.get("properties", {})
+        for name in schema.get("required", []):
+            if name not in instance:
+                errors.append(f"{path}: missing required property '{name}'")
+        additional = schema.get("additionalProperties", True)
+        for name, value in instance.items():
+            if name in properties:
+                errors.extend(validate_schema(value, properties[name], root, f"{path}.{name}"))
+            elif additional is False:
+                errors.append(f"{path}: unexpected property '{name}'")
+            elif isinstance(additional, dict):
+                errors.extend(validate_schema(value, additional, root, f"{path}.{name}"))
+
+    if isinstance(instance, list):
+        if "items" in schema:
+            for index, item in enumerate(instance):
+                errors.extend(validate_schema(item, schema["items"], root, f"{path}[{index}]"))
+        if len(instance) < schema.get("minItems", 0):
+            errors.append(f"{path}: expected at least {schema['minItems']} items")
+        if "maxItems" in schema and len(instance) > schema["maxItems"]:
+            errors.append(f"{path}: expected at most {schema['maxItems']} items")
+
+    if isinstance(instance, str):
+        if len(instance) < schema.get("minLength", 0):
+            errors.append(f"{path}: shorter than {schema['minLength']}")
+        if "maxLength" in schema and len(instance) > schema["maxLength"]:
+            errors.append(f"{path}: longer than {schema['maxLength']}")
+
+    if TYPE_CHECKS["number"](instance):
+        if "minimum" in schema and instance < schema["minimum"]:
+            errors.append(f"{path}: {instance} is less than {schema['minimum']}")
+        if "maximum" in schema and instance > schema["maximum"]:
+            errors.append(f"{path}: {instance} is greater than {schema['maximum']}")
+
+    for keyword in ("anyOf", "oneOf"):
+        if keyword in schema:
+            matches = sum(1 for sub in schema[keyword] if not validate_schema(instance, sub, root, path))
+            if matches == 0 or (keyword == "oneOf" and matches > 1):
+                errors.append(f"{path}: does not match {keyword}")
+
+    return errors
+
+
+def parse_structured_result(result, schema=None):
+    """
+    Parse (and repair if needed) a raw model result, then validate it.
+
+    Returns:
+        Tuple of (parsed value, repaired flag, list of validation errors)
+    """
+    try:
+        parsed, repaired = json.loads(result), False
+    except json.JSONDecodeError:
+        parsed, repaired = repair_json(result)
+    errors = validate_schema(parsed, schema) if schema else []
+    return parsed, repaired, errors
+
+
+def iter_structured_content(provider_name, user_prompt, model, response_format, content=None, system_prompt=None,
+                            max_tokens=None, temperature=None, stream=True, max_depth=2, strict=False):
+    """
+    Request structured output and yield parsed values as soon as they are complete.
+
+    In streaming mode an IncrementalJSONParser is fed with every delta, so completed
+    fields / array elements are yielded before generation finishes. The final response
+    is parsed once (repairing truncated output locally) and validated against the schema
+    contained in response_format.
+
+    Args:
+        provider_name: Name of the provider to use
+        user_prompt: The prompt to send to the model
+        model: The model to use
+        response_format: OpenAI style response_format ("json_schema" or "json_object")
+        content: Optional content to append to the user prompt
+        system_prompt: Optional system prompt
+        max_tokens: Optional max tokens for the response
+        temperature: Optional temperature setting
+        stream: Whether to stream the response (default True)
+        max_depth: Nesting depth up to which completed values are yielded
+        strict: Raise ValueError when the result does not match the schema
+
+    Yields:
+        {"event": "item", "path": (...), "value": ...} for each completed value (streaming only), then
+        {"event": "done", "response": {...}} with process_content keys plus "parsed",
+        "repaired" and "validation_errors"
+    """
+    params = {
+        "provider_name": provider_name,
+        "user_prompt": user_prompt,
+        "model": model,
+        "content": content,
+        "system_prompt": system_prompt,
+        "max_tokens": max_tokens,
+        "response_format": response_format,
+        "temperature": temperature,
+    }
+
+    if stream:
+        parser = IncrementalJSONParser(max_depth)
+        response = None
+        for event in openai_based_api.stream_content(**params):
+            if event["type"] == "delta":
+                for item in parser.feed(event["content"]):
+                    yield {"event": "item", **item}
+            elif event["type"] == "done":
+                response = event["response"]
+    else:
+        response = openai_based_api.process_content(**params)
+
+    schema = get_schema(response_format)
+    parsed, repaired, errors = parse_structured_result(response["result"], schema)
+    if repaired:
+        logger.warning("Structured output was truncated or malformed and has been repaired locally")
+    if errors and strict:
+        raise ValueError(f"Structured output does not match schema: {errors}")
+
+    response["parsed"] = parsed
+    response["repaired"] = repaired
+    response["validation_errors"] = errors
+    yield {"event": "done", "response": response}
+
+
+def process_structured_content(provider_name, user_prompt, model, response_format, on_item=None, **kwargs):
+    """
+    Request structured output and return the parsed, validated response.
+
+    Args:
+        provider_name: Name of the provider to use
+        user_prompt: The prompt to send to the model
+        model: The model to use
+        response_format: OpenAI style response_format
+        on_item: Optional callable receiving each completed value event while streaming
+        **kwargs: Any other argument accepted by iter_structured_content
+
+    Returns:
+        Dictionary with process_content keys plus "parsed", "repaired" and "validation_errors"
+    """
+    response = None
+    for event in iter_structured_content(provider_name, user_prompt, model, response_format, **kwargs):
+        if event["event"] == "item":
+            if on_item:
+                on_item(event)
+        else:
+            response = event["response"]
+    return response
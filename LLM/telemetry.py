@@ -0,0 +1,437 @@
+import os
+import time
+import random
+import logging
+import threading
+import contextvars
+from collections import deque
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# 所有模块的日志都挂在这个 logger 之下，便于统一设置级别
+LOGGER_NAME = "api_test"
+# 设置该环境变量（如 DEBUG/INFO/WARNING）后，导入时自动配置日志输出
+LOG_LEVEL_ENV = "API_TEST_LOG_LEVEL"
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+# 指标开关，关闭后记录操作直接返回
+METRICS_ENABLED = True
+
+# 延迟直方图的桶边界（秒）
+DEFAULT_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+METRIC_HELP = {
+    "llm_requests_total": ("counter", "Requests by provider, model, kind and final outcome"),
+    "llm_request_duration_seconds": ("histogram", "End-to-end request latency including retries and backoff"),
+    "llm_attempts_total": ("counter", "Individual API attempts by outcome"),
+    "llm_attempt_duration_seconds": ("histogram", "Latency of a single API attempt"),
+    "llm_retries_total": ("counter", "Retries scheduled after a failed attempt"),
+    "llm_backoff_seconds_total": ("counter", "Time spent sleeping in retry backoff"),
+    "llm_tokens_total": ("counter", "Tokens consumed, by direction (input/output)"),
+    "llm_input_tokens_total": ("counter", "Input tokens split by prompt cache status (cached/uncached)"),
+    "llm_time_to_first_token_seconds": ("histogram", "Time until the first streamed content fragment"),
+    "gateway_embedding_batch_inputs": ("histogram", "Inputs per upstream embedding call sent by the local gateway"),
+    "job_queue_jobs_total": ("counter", "Queued jobs processed by workers, by outcome (done/retried/failed/duplicate)"),
+    "llm_rate_limit_wait_seconds_total": ("counter", "Time spent waiting for a shared rate limit slot"),
+    "llm_concurrency_limit": ("gauge", "Current adaptive concurrency limit per provider"),
+    "llm_concurrency_in_flight": ("gauge", "Requests holding an adaptive concurrency slot per provider"),
+    "llm_concurrency_decreases_total": ("counter", "Adaptive concurrency cuts by reason (rate_limited/timeout/latency/...)"),
+    "agent_tool_calls_total": ("counter", "Agent tool calls by tool and cache status (hit/miss/deduplicated)"),
+    "llm_coalesced_calls_total": ("counter", "Calls served by an identical in-flight request instead of upstream"),
+}
+
+
+def get_logger(name):
+    """Return the logger of a module, e.g. get_logger("openai_based_api")"""
+    return logging.getLogger(f"{LOGGER_NAME}.{name}")
+
+
+def configure_logging(level=None, fmt=LOG_FORMAT):
+    """
+    Send the log records of all modules to stderr at the given level.
+
+    Args:
+        level: Level name or number; defaults to $API_TEST_LOG_LEVEL, then INFO
+    """
+    level = level or os.environ.get(LOG_LEVEL_ENV) or "INFO"
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.setLevel(level)
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter(fmt))
+        logger.addHandler(handler)
+    return logger
+
+
+class Histogram:
+    """Cumulative bucket counts plus sum and count, as in Prometheus"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        total = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            total += count
+            yield bound, total
+
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms keyed by metric name and label set"""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    @staticmethod
+    def _key(name, labels):
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name, value=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    def observe(self, name, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram(self.buckets)
+            histogram.observe(value)
+
+    def get(self, name, **labels):
+        """Counter or gauge value (0 when never recorded)"""
+        key = self._key(name, labels)
+        with self.lock:
+            return self.counters.get(key, self.gauges.get(key, 0))
+
+    def get_histogram(self, name, **labels):
+        """Return {"count", "sum", "buckets"} of a histogram, or None"""
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                return None
+            return {"count": histogram.count, "sum": histogram.sum, "buckets": list(histogram.cumulative())}
+
+    def total(self, name, **labels):
+        """Sum a counter over all label sets matching the given labels"""
+        wanted = {(k, str(v)) for k, v in labels.items()}
+        with self.lock:
+            return sum(value for (metric, key), value in self.counters.items()
+                       if metric == name and wanted <= set(key))
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+            self.gauges.clear()
+
+    def render_prometheus(self):
+        """Render all metrics in the Prometheus text exposition format"""
+        def fmt_labels(labels, extra=()):
+            items = list(labels) + list(extra)
+            if not items:
+                return ""
+            escaped = (str(v).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n") for _, v in items)
+            return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+        def fmt_bound(bound):
+            return "+Inf" if bound == float("inf") else repr(float(bound))
+
+        with self.lock:
+            series = {}
+            for (name, labels), value in self.counters.items():
+                series.setdefault(name, []).append(f"{name}{fmt_labels(labels)} {value}")
+            for (name, labels), value in self.gauges.items():
+                series.setdefault(name, []).append(f"{name}{fmt_labels(labels)} {value}")
+            for (name, labels), histogram in self.histograms.items():
+                lines = series.setdefault(name, [])
+                for bound, count in histogram.cumulative():
+                    lines.append(f"{name}_bucket{fmt_labels(labels, [('le', fmt_bound(bound))])} {count}")
+                lines.append(f"{name}_sum{fmt_labels(labels)} {histogram.sum}")
+                lines.append(f"{name}_count{fmt_labels(labels)} {histogram.count}")
+            metric_types = {name: "gauge" for name, _ in self.gauges}
+            metric_types.update({name: "counter" for name, _ in self.counters})
+            metric_types.update({name: "histogram" for name, _ in self.histograms})
+
+        output = []
+        for name in sorted(series):
+            metric_type, help_text = METRIC_HELP.get(name, (metric_types[name], name))
+            output.append(f"# HELP {name} {help_text}")
+            output.append(f"# TYPE {name} {metric_type}")
+            output.extend(sorted(series[name]))
+        return "\n".join(output) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+
+def start_metrics_server(port=9464, host="0.0.0.0", registry=None):
+    """Serve registry.render_prometheus() at http://host:port/metrics in a daemon thread"""
+    registry = registry or METRICS
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = registry.render_prometheus().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Tracing
+# ---------------------------------------------------------------------------
+
+# 已结束的 span 会交给这些导出函数（callable(span)）
+SPAN_EXPORTERS = []
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """A timed operation with OpenTelemetry-style ids, attributes, events and status"""
+
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else f"{random.getrandbits(128):032x}"
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.attributes = dict(attributes or {})
+        self.events = []
+        self.status = "UNSET"
+        self.status_message = None
+        self.start_time = time.time()
+        self.end_time = None
+
+    def set_attribute(self, key, value):
+        self.attributes[key] = value
+
+    def add_event(self, name, **attributes):
+        self.events.append({"name": name, "time": time.time(), "attributes": attributes})
+
+    def record_exception(self, exception):
+        self.status = "ERROR"
+        self.status_message = f"{type(exception).__name__}: {exception}"
+        self.add_event("exception", type=type(exception).__name__, message=str(exception))
+
+    def end(self, status=None):
+        if self.end_time is not None:
+            return
+        self.end_time = time.time()
+        if status:
+            self.status = status
+        elif self.status == "UNSET":
+            self.status = "OK"
+        for exporter in SPAN_EXPORTERS:
+            try:
+                exporter(self)
+            except Exception:
+                get_logger("telemetry").exception("Span exporter failed")
+
+    @property
+    def duration(self):
+        return (self.end_time or time.time()) - self.start_time
+
+    def to_dict(self):
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_span_id": self.parent.span_id if self.parent else None,
+            "start_time_unix_nano": int(self.start_time * 1e9),
+            "end_time_unix_nano": int(self.end_time * 1e9) if self.end_time else None,
+            "attributes": self.attributes,
+            "events": self.events,
+            "status": {"code": self.status, "message": self.status_message},
+        }
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def span(name, parent=None, **attributes):
+    """
+    Run a block inside a span; the span becomes the parent of spans started inside it.
+
+    Exceptions are recorded on the span and re-raised.
+    """
+    current = Span(name, parent or _current_span.get(), attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.record_exception(e)
+        raise
+    finally:
+        _current_span.reset(token)
+        current.end()
+
+
+class InMemorySpanExporter:
+    """Keep the most recent finished spans, e.g. for tests or a debug endpoint"""
+
+    def __init__(self, max_spans=10000):
+        self.spans = deque(maxlen=max_spans)
+
+    def __call__(self, finished):
+        self.spans.append(finished)
+
+    def clear(self):
+        self.spans.clear()
+
+
+def log_span_exporter(finished):
+    """Log every finished span at DEBUG level"""
+    logger = get_logger("trace")
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("span %s %.3fs %s %s", finished.name, finished.duration, finished.status, finished.attributes)
+
+
+# ---------------------------------------------------------------------------
+# Request instrumentation
+# ---------------------------------------------------------------------------
+
+def classify_error(exception):
+    """Map an exception to a low-cardinality outcome label"""
+    status = getattr(exception, "status_code", None)
+    if status is None:
+        response = getattr(exception, "response", None)
+        status = getattr(response, "status_code", None)
+    if status == 429:
+        return "rate_limited"
+    if isinstance(status, int):
+        return f"http_{status}"
+    if "timeout" in type(exception).__name__.lower():
+        return "timeout"
+    return "error"
+
+
+class RequestTracker:
+    """
+    Metrics and spans of one logical request (all its attempts).
+
+    Usage inside a retry loop:
+
+        tracker = RequestTracker("chat", provider_name, model)
+        for attempt in range(max_retries):
+            try:
+                with tracker.attempt(attempt + 1):
+                    ...
+                break
+            except Exception as e:
+                if attempt < max_retries - 1:
+                    tracker.backoff(delay)
+                    time.sleep(delay)
+                else:
+                    tracker.finish(error=e)
+                    raise
+        tracker.finish(input_tokens=..., output_tokens=..., cached_tokens=...)
+    """
+
+    def __init__(self, kind, provider, model, registry=None):
+        self.registry = registry or METRICS
+        self.labels = {"kind": kind, "provider": provider, "model": str(model)}
+        self.start_time = time.time()
+        self.attempts = 0
+        self.span = Span(f"{kind}.request", _current_span.get(), {"provider": provider, "model": str(model)})
+
+    @contextmanager
+    def attempt(self, number):
+        self.attempts = number
+        start = time.time()
+        # 不设置 current span：stream_content 会在此代码块内 yield
+        attempt_span = Span(f"{self.labels['kind']}.attempt", self.span, {"attempt": number})
+        try:
+            yield attempt_span
+        except BaseException as e:
+            outcome = classify_error(e) if isinstance(e, Exception) else "cancelled"
+            attempt_span.set_attribute("outcome", outcome)
+            attempt_span.record_exception(e)
+            attempt_span.end()
+            self.registry.inc("llm_attempts_total", **self.labels, outcome=outcome)
+            self.registry.observe("llm_attempt_duration_seconds", time.time() - start, **self.labels,
+                                  outcome=outcome)
+            raise
+        attempt_span.set_attribute("outcome", "success")
+        attempt_span.end()
+        self.registry.inc("llm_attempts_total", **self.labels, outcome="success")
+        self.registry.observe("llm_attempt_duration_seconds", time.time() - start, **self.labels, outcome="success")
+
+    def backoff(self, delay):
+        self.span.add_event("backoff", delay=delay)
+        self.registry.inc("llm_retries_total", **self.labels)
+        self.registry.inc("llm_backoff_seconds_total", delay, **self.labels)
+
+    def first_token(self, elapsed):
+        self.span.set_attribute("time_to_first_token", elapsed)
+        self.registry.observe("llm_time_to_first_token_seconds", elapsed, **self.labels)
+
+    def finish(self, input_tokens=0, output_tokens=0, error=None, outcome=None, cached_tokens=0):
+        if self.span.end_time is not None:
+            return
+        outcome = outcome or (classify_error(error) if error is not None else "success")
+        elapsed = time.time() - self.start_time
+        self.registry.inc("llm_requests_total", **self.labels, outcome=outcome)
+        self.registry.observe("llm_request_duration_seconds", elapsed, **self.labels, outcome=outcome)
+        if input_tokens:
+            self.registry.inc("llm_tokens_total", input_tokens, **self.labels, direction="input")
+            self.registry.inc("llm_input_tokens_total", input_tokens - cached_tokens, **self.labels, cache="uncached")
+            if cached_tokens:
+                self.registry.inc("llm_input_tokens_total", cached_tokens, **self.labels, cache="cached")
+        if output_tokens:
+            self.registry.inc("llm_tokens_total", output_tokens, **self.labels, direction="output")
+        self.span.set_attribute("attempts", self.attempts)
+        self.span.set_attribute("input_tokens", input_tokens)
+        self.span.set_attribute("output_tokens", output_tokens)
+        self.span.set_attribute("cached_tokens", cached_tokens)
+        if error is not None:
+            self.span.record_exception(error)
+        self.span.end()
+
+
+if os.environ.get(LOG_LEVEL_ENV):
+    configure_logging()
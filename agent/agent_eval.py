@@ -0,0 +1,215 @@
+import sys
+import os
+import json
+import time
+import argparse
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+
+AGENT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CASES_PATH = os.path.join(AGENT_DIR, "agent_cases.json")
+DEFAULT_TOOLS_PATH = os.path.join(AGENT_DIR, "Agent_Tools.json")
+
+
+def load_cases(path=DEFAULT_CASES_PATH):
+    """
+    Load evaluation cases.
+
+    The file is a JSON object {"system_prompt": str, "cases": [{"name", "query", "expected_tools"}, ...]}
+    or a JSON list of cases.
+
+    Returns:
+        Tuple of (system_prompt or None, cases)
+    """
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    if isinstance(data, list):
+        return None, data
+    return data.get("system_prompt"), data["cases"]
+
+
+def load_tools(path=DEFAULT_TOOLS_PATH):
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)["tools"]
+
+
+def score_tools(used_tools, expected_tools):
+    """
+    Score tool selection as set precision / recall.
+
+    A case that expects no tools scores 1.0 only when no tool is called, and a case that
+    expects tools scores 0.0 when none is called.
+
+    Returns:
+        Dictionary with precision, recall, f1, exact (bool) and tp/fp/fn counts
+    """
+    used, expected = set(used_tools), set(expected_tools)
+    tp = len(used & expected)
+    fp = len(used - expected)
+    fn = len(expected - used)
+    if not used and not expected:
+        precision = recall = 1.0
+    else:
+        precision = tp / len(used) if used else 0.0
+        recall = tp / len(expected) if expected else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1, "exact": used == expected,
+            "tp": tp, "fp": fp, "fn": fn}
+
+
+def percentiles(values):
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": float(p50), "p95": float(p95), "p99": float(p99)}
+
+
+def run_case(provider_name, model, system_prompt, case, tools, repeat):
+    """Run one case once (first turn only) and score the tools the model chose"""
+    start_time = time.time()
+    run = {"case": case["name"], "model": model, "repeat": repeat}
+    try:
+        response = openai_based_api.process_content(provider_name, case["query"], model,
+                                                    system_prompt=system_prompt, tools=tools, tool_choice="auto",
+                                                    coalesce=False)
+    except Exception as e:
+        run.update({"error": f"{type(e).__name__}: {e}", "latency": time.time() - start_time})
+        return run
+
+    used_tools = [call.function.name for call in response.get("tool_calls") or []]
+    run.update({
+        "latency": time.time() - start_time,
+        "input_tokens": response["input_tokens"],
+        "output_tokens": response["output_tokens"],
+        "tool_calls": len(used_tools),
+        "used_tools": sorted(set(used_tools)),
+        "scores": score_tools(used_tools, case.get("expected_tools", [])),
+    })
+    return run
+
+
+def summarize_runs(runs):
+    """Aggregate scores, latency percentiles and tokens over a list of runs"""
+    ok = [run for run in runs if "error" not in run]
+    summary = {"runs": len(runs), "errors": len(runs) - len(ok)}
+    if not ok:
+        return summary
+    f1 = [run["scores"]["f1"] for run in ok]
+    tp = sum(run["scores"]["tp"] for run in ok)
+    fp = sum(run["scores"]["fp"] for run in ok)
+    fn = sum(run["scores"]["fn"] for run in ok)
+    summary.update({
+        "precision": float(np.mean([run["scores"]["precision"] for run in ok])),
+        "recall": float(np.mean([run["scores"]["recall"] for run in ok])),
+        "f1": float(np.mean(f1)),
+        "f1_stddev": float(np.std(f1)),
+        "exact_match_rate": float(np.mean([run["scores"]["exact"] for run in ok])),
+        "micro_precision": tp / (tp + fp) if tp + fp else 1.0,
+        "micro_recall": tp / (tp + fn) if tp + fn else 1.0,
+        "latency": percentiles([run["latency"] for run in ok]),
+        "input_tokens": sum(run["input_tokens"] for run in ok),
+        "output_tokens": sum(run["output_tokens"] for run in ok),
+    })
+    return summary
+
+
+def run_evaluation(provider_name, models, cases, tools, system_prompt=None, repeats=3, max_workers=4,
+                   progress_callback=None):
+    """
+    Run every case repeats times for every model with bounded concurrency.
+
+    Args:
+        provider_name: Name of the provider to use
+        models: Model name or list of model names
+        cases: List of {"name", "query", "expected_tools"}
+        tools: Tool definitions passed to the model
+        system_prompt: Optional system prompt
+        repeats: Number of runs per case (to estimate variance)
+        max_workers: Maximum number of concurrent requests
+        progress_callback: Optional callable(run, completed, total)
+
+    Returns:
+        Report dictionary: {"config", "models": {model: {"summary", "cases": {name: {..., "runs"}}}}}
+    """
+    if isinstance(models, str):
+        models = [models]
+    jobs = [(model, case, repeat) for model in models for case in cases for repeat in range(repeats)]
+    runs = []
+    start_time = time.time()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = [executor.submit(run_case, provider_name, model, system_prompt, case, tools, repeat)
+                   for model, case, repeat in jobs]
+        for future in as_completed(futures):
+            run = future.result()
+            runs.append(run)
+            if progress_callback:
+                progress_callback(run, len(runs), len(jobs))
+
+    report = {
+        "config": {"provider": provider_name, "models": models, "repeats": repeats, "max_workers": max_workers,
+                   "cases": len(cases), "created_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+                   "elapsed_time": time.time() - start_time},
+        "models": {},
+    }
+    for model in models:
+        model_runs = [run for run in runs if run["model"] == model]
+        case_reports = {}
+        for case in cases:
+            case_runs = sorted((run for run in model_runs if run["case"] == case["name"]),
+                               key=lambda run: run["repeat"])
+            case_reports[case["name"]] = dict(summarize_runs(case_runs),
+                                              expected_tools=case.get("expected_tools", []), runs=case_runs)
+        report["models"][model] = {"summary": summarize_runs(model_runs), "cases": case_reports}
+    return report
+
+
+def print_report(report):
+    for model, model_report in report["models"].items():
+        summary = model_report["summary"]
+        print(f"\n{model}: f1={summary.get('f1', 0):.3f} precision={summary.get('precision', 0):.3f} "
+              f"recall={summary.get('recall', 0):.3f} exact={summary.get('exact_match_rate', 0):.2f} "
+              f"errors={summary['errors']}/{summary['runs']}")
+        print(f"{'case':<20}{'f1':>8}{'±':>7}{'exact':>8}{'p50 s':>9}{'p95 s':>9}{'tokens in/out':>18}")
+        for name, case in model_report["cases"].items():
+            if "f1" not in case:
+                print(f"{name:<20}{'all runs failed':>40}")
+                continue
+            tokens = f"{case['input_tokens']}/{case['output_tokens']}"
+            print(f"{name:<20}{case['f1']:>8.3f}{case['f1_stddev']:>7.3f}{case['exact_match_rate']:>8.2f}"
+                  f"{case['latency']['p50']:>9.2f}{case['latency']['p95']:>9.2f}{tokens:>18}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate agent tool selection against expected_tools")
+    parser.add_argument("--provider", default="YUNWU-Dev")
+    parser.add_argument("--models", nargs="+", default=["gpt-4.1-2025-04-14"])
+    parser.add_argument("--cases", default=DEFAULT_CASES_PATH)
+    parser.add_argument("--tools", default=DEFAULT_TOOLS_PATH)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--output", default="agent_eval_report.json")
+    args = parser.parse_args()
+
+    system_prompt, cases = load_cases(args.cases)
+    tools = load_tools(args.tools)
+
+    def progress(run, completed, total):
+        status = run.get("error") or f"f1={run['scores']['f1']:.2f} tools={run['used_tools']}"
+        print(f"[{completed}/{total}] {run['model']} | {run['case']} #{run['repeat']}: {status}", flush=True)
+
+    report = run_evaluation(args.provider, args.models, cases, tools, system_prompt, args.repeats, args.workers,
+                            progress)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print_report(report)
+    print(f"\nReport written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from agent.tool_cache import ToolResultCache
+
+logger = telemetry.get_logger("agent_runtime")
+
+DEFAULT_MAX_WORKERS = 8
+# 工具调度方式：
+#   "sequential": 收到完整回复后逐个执行工具
+#   "parallel":   收到完整回复后并行执行所有工具
+#   "streaming":  流式接收回复，每个工具调用的参数一完整就立即开始执行
+DISPATCH_MODES = ("sequential", "parallel", "streaming")
+
+
+def parse_arguments(tool_call):
+    try:
+        arguments = json.loads(tool_call.function.arguments or "{}")
+    except json.JSONDecodeError:
+        return {}
+    return arguments if isinstance(arguments, dict) else {}
+
+
+def assistant_message(response):
+    message = {"role": "assistant", "content": response["result"]}
+    if response.get("tool_calls"):
+        message["tool_calls"] = [call.model_dump(exclude_none=True) if hasattr(call, "model_dump") else call
+                                 for call in response["tool_calls"]]
+    return message
+
+
+def tool_message(tool_call, result, context=None):
+    content = context.tool_content(result) if context is not None else json.dumps(result, ensure_ascii=False)
+    return {"role": "tool", "tool_call_id": tool_call.id, "content": content}
+
+
+class AgentSession:
+    """
+    Multi-round tool-calling conversation with one model.
+
+    Usage:
+        session = AgentSession("YUNWU-Dev", "gpt-4.1", tools, {"vector_search": search_fn},
+                               system_prompt=system_prompt)
+        response = session.run("用户问题")
+        session.turns  # per-round timings
+    """
+
+    def __init__(self, provider_name, model, tools, tool_functions, system_prompt=None, dispatch="streaming",
+                 max_workers=DEFAULT_MAX_WORKERS, tool_cache=None, tool_cache_ttl=None, tool_ttls=None,
+                 context=None, **call_kwargs):
+        """
+        Args:
+            provider_name: Name of the provider to use
+            model: The model to use
+            tools: Tool schemas sent to the model
+            tool_functions: {tool name: callable(arguments dict) -> JSON-serializable result}
+            system_prompt: Optional system prompt, sent unchanged every round
+            dispatch: "sequential", "parallel" or "streaming" (see DISPATCH_MODES)
+            max_workers: Maximum number of tools running at the same time
+            tool_cache: ToolResultCache to use, None for a new per-session cache, False to disable
+            tool_cache_ttl: Default lifetime in seconds of cached tool results (None: whole session)
+            tool_ttls: {tool name: seconds} for non-deterministic tools (0: never reuse results)
+            context: ContextManager keeping the history under a token budget (None: send everything)
+            **call_kwargs: Extra process_content / stream_content arguments (e.g. prompt_cache)
+        """
+        if dispatch not in DISPATCH_MODES:
+            raise ValueError(f"dispatch must be one of {DISPATCH_MODES}")
+        self.provider_name = provider_name
+        self.model = model
+        self.tools = tools
+        self.tool_functions = tool_functions
+        self.system_prompt = system_prompt
+        self.dispatch = dispatch
+        self.call_kwargs = dict(call_kwargs)
+        self.call_kwargs.setdefault("tool_choice", "auto")
+        if tool_cache is None:
+            tool_cache = ToolResultCache(tools, tool_cache_ttl, tool_ttls)
+        self.tool_cache = tool_cache or None
+        self.context = context
+        if context is not None and context.provider_name is None:
+            context.provider_name, context.model = provider_name, model
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        self.lock = threading.Lock()
+        self.history = []
+        self.responses = []
+        self.turns = []
+
+    def execute_tool(self, tool_call, turn):
+        """
+        Run one tool call (or reuse the session's cached result) and record its timing,
+        relative to the turn start, and cache status in turn["tools"]
+        """
+        name = tool_call.function.name
+        arguments = parse_arguments(tool_call)
+        start = time.time()
+        status = None
+        function = self.tool_functions.get(name)
+        if function is None:
+            result = {"error": f"Unknown tool: {name}"}
+        else:
+            try:
+                if self.tool_cache is not None:
+                    result, status = self.tool_cache.get_or_run(name, arguments, lambda: function(arguments))
+                else:
+                    result = function(arguments)
+            except Exception as e:
+                logger.warning("Tool %s failed: %s", name, e)
+                result = {"error": f"{type(e).__name__}: {e}"}
+        with self.lock:
+            turn["tools"].append({"name": name, "start": start - turn["started_at"],
+                                  "end": time.time() - turn["started_at"], "cache": status})
+        return result
+
+    def request(self):
+        history = self.context.prepare(self.history) if self.context is not None else self.history
+        return {"system_prompt": self.system_prompt, "history": history, "tools": self.tools, **self.call_kwargs}
+
+    def run_turn(self):
+        """
+        One model call plus the tools it requested.
+
+        Returns:
+            (response, tool messages in tool call order)
+        """
+        turn = {"round": len(self.turns) + 1, "started_at": time.time(), "tools": []}
+        request = self.request()
+        if self.context is not None:
+            turn["context_tokens"] = self.context.history_tokens(request["history"])
+        if self.dispatch == "streaming":
+            response = None
+            calls = []
+            futures = []
+            for event in openai_based_api.stream_content(self.provider_name, "", self.model, **request):
+                if event["type"] == "tool_call":
+                    calls.append(event["tool_call"])
+                    futures.append(self.executor.submit(self.execute_tool, event["tool_call"], turn))
+                elif event["type"] == "done":
+                    response = event["response"]
+            turn["model_time"] = time.time() - turn["started_at"]
+            results = [future.result() for future in futures]
+        else:
+            response = openai_based_api.process_content(self.provider_name, "", self.model, **request)
+            turn["model_time"] = time.time() - turn["started_at"]
+            calls = response.get("tool_calls") or []
+            if self.dispatch == "sequential":
+                results = [self.execute_tool(call, turn) for call in calls]
+            else:
+                results = list(self.executor.map(lambda call: self.execute_tool(call, turn), calls))
+
+        turn["turn_time"] = time.time() - turn["started_at"]
+        self.turns.append(turn)
+        return response, [tool_message(call, result, self.context) for call, result in zip(calls, results)]
+
+    def run(self, user_query, max_rounds=3):
+        """
+        Add a user message and call the model until it stops requesting tools.
+
+        Returns:
+            The last model response
+        """
+        self.history.append({"role": "user", "content": user_query})
+        response = None
+        for _ in range(max_rounds):
+            response, tool_messages = self.run_turn()
+            self.responses.append(response)
+            self.history.append(assistant_message(response))
+            if not tool_messages:
+                break
+            self.history.extend(tool_messages)
+        return response
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        if self.context is not None:
+            self.context.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
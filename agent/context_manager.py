@@ -0,0 +1,297 @@
+import os
+import sys
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from LLM.openai_based_api import encoding
+from LLM.map_reduce import count_tokens
+
+logger = telemetry.get_logger("context_manager")
+
+# 默认上下文预算（以token计，只计算历史消息，不含系统提示词和工具定义）
+DEFAULT_MAX_TOKENS = 16000
+# 单个工具结果最多占用的token数
+DEFAULT_MAX_TOOL_TOKENS = 1500
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+# 历史超过预算的该比例时，在后台开始总结较早的轮次
+DEFAULT_SUMMARIZE_RATIO = 0.75
+# 搜索结果中表示相关度的字段
+SCORE_KEYS = ("score", "similarity", "relevance_score")
+# 压缩搜索结果时，每个文本字段至少保留的token数
+MIN_FIELD_TOKENS = 32
+TRUNCATION_MARKER = "…[truncated {} tokens]"
+SUMMARY_PREFIX = "Summary of the earlier conversation and tool results:\n"
+
+DEFAULT_SUMMARY_PROMPT = (
+    "Summarize the conversation below for an assistant that will continue it without seeing the original. "
+    "Keep the user's goals, decisions made, and every fact from tool results that may still be needed "
+    "(names, numbers, document titles). Be concise and do not add new information."
+)
+
+
+def truncate_text(text, max_tokens):
+    """Cut text to at most max_tokens tokens, ending with a marker saying how many were dropped"""
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    keep = max(0, max_tokens - count_tokens(TRUNCATION_MARKER.format(len(tokens))))
+    # 切在多字节字符中间时 decode 会产生替换字符
+    return encoding.decode(tokens[:keep]).rstrip("\ufffd") + TRUNCATION_MARKER.format(len(tokens) - keep)
+
+
+def shorten_hit(hit, max_tokens):
+    """Copy of a search hit with every string field cut to max_tokens"""
+    if not isinstance(hit, dict):
+        return hit
+    return {key: truncate_text(value, max_tokens) if isinstance(value, str) else value for key, value in hit.items()}
+
+
+def hit_score(hit):
+    """Relevance score of one search hit, or None when it has none"""
+    if isinstance(hit, dict):
+        for key in SCORE_KEYS:
+            if isinstance(hit.get(key), (int, float)):
+                return hit[key]
+    return None
+
+
+def render_message(message):
+    """Plain text form of a chat message, used for summarization"""
+    parts = []
+    content = message.get("content")
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    if content:
+        parts.append(content)
+    for call in message.get("tool_calls") or []:
+        function = call["function"] if isinstance(call, dict) else call.function.model_dump()
+        parts.append(f"[call {function['name']}({function['arguments']})]")
+    return f"{message.get('role')}: {' '.join(parts)}"
+
+
+class ContextManager:
+    """
+    Keeps an agent conversation under a token budget.
+
+    - Tool results are compacted before they enter the history: hits below min_score are
+      dropped, long text fields of the hits are shortened, then trailing hits and as a last
+      resort the serialized text itself are cut to fit max_tool_tokens.
+    - When the history grows past summarize_ratio of the budget, older turns are summarized
+      in a background thread; the summary replaces them once it is ready, so no round waits
+      for it.
+    - Until then (or without summarization), the oldest turns are left out of the request
+      whenever the history exceeds max_tokens. The latest user message and the last
+      keep_recent turns are always sent, and tool messages stay with their assistant message.
+
+    Usage:
+        context = ContextManager(max_tokens=8000, min_score=0.5)
+        session = AgentSession(provider_name, model, tools, tool_functions, context=context)
+    """
+
+    def __init__(self, max_tokens=DEFAULT_MAX_TOKENS, max_tool_tokens=DEFAULT_MAX_TOOL_TOKENS, min_score=None,
+                 keep_recent=2, summarize=True, summarize_ratio=DEFAULT_SUMMARIZE_RATIO, provider_name=None,
+                 model=None, summary_prompt=DEFAULT_SUMMARY_PROMPT, summary_max_tokens=500):
+        """
+        Args:
+            max_tokens: Token budget for the history sent each round
+            max_tool_tokens: Maximum tokens of one tool result
+            min_score: Drop search hits scoring below this (None keeps all hits)
+            keep_recent: Number of most recent turns never trimmed or summarized
+            summarize: Summarize older turns in the background instead of only dropping them
+            summarize_ratio: Fraction of max_tokens at which summarization starts
+            provider_name, model: Used for summaries (AgentSession fills in its own when None)
+            summary_prompt: Instruction for the summarization call
+            summary_max_tokens: max_tokens of the summarization call
+        """
+        self.max_tokens = max_tokens
+        self.max_tool_tokens = max_tool_tokens
+        self.min_score = min_score
+        self.keep_recent = keep_recent
+        self.summarize = summarize
+        self.summarize_ratio = summarize_ratio
+        self.provider_name = provider_name
+        self.model = model
+        self.summary_prompt = summary_prompt
+        self.summary_max_tokens = summary_max_tokens
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+        # id(message) -> (message, tokens)；保留消息引用，避免 id 被复用
+        self.sizes = {}
+        self.pending = None
+        self.stats = {"summaries": 0, "summarized_messages": 0, "trimmed_messages": 0, "compacted_tool_results": 0}
+
+    # ----- 工具结果 -----
+
+    def tool_content(self, result):
+        """
+        Serialize a tool result for a tool message, compacted to max_tool_tokens.
+
+        Returns:
+            The JSON string (or truncated text) to use as the message content
+        """
+        original = json.dumps(result, ensure_ascii=False)
+        hits = result.get("results") if isinstance(result, dict) else None
+        if not isinstance(hits, list) or (self.min_score is None and count_tokens(original) <= self.max_tool_tokens):
+            return truncate_text(original, self.max_tool_tokens)
+
+        def dump(kept):
+            compacted = dict(result, results=kept)
+            if len(kept) < len(hits):
+                compacted["omitted_results"] = len(hits) - len(kept)
+            return json.dumps(compacted, ensure_ascii=False)
+
+        kept = hits
+        if self.min_score is not None:
+            kept = [hit for hit in hits if hit_score(hit) is None or hit_score(hit) >= self.min_score]
+        content = dump(kept)
+        if kept and count_tokens(content) > self.max_tool_tokens:
+            # 先截短每条结果的长文本，仍然超出时再从末尾丢弃结果
+            field_tokens = max(MIN_FIELD_TOKENS, self.max_tool_tokens // (2 * len(kept)))
+            kept = [shorten_hit(hit, field_tokens) for hit in kept]
+            content = dump(kept)
+        while len(kept) > 1 and count_tokens(content) > self.max_tool_tokens:
+            kept = kept[:-1]
+            content = dump(kept)
+        content = truncate_text(content, self.max_tool_tokens)
+        if content != original:
+            self.stats["compacted_tool_results"] += 1
+        return content
+
+    # ----- token 计数 -----
+
+    def message_tokens(self, message):
+        entry = self.sizes.get(id(message))
+        if entry is not None and entry[0] is message:
+            return entry[1]
+        tokens = MESSAGE_OVERHEAD_TOKENS + count_tokens(render_message(message))
+        self.sizes[id(message)] = (message, tokens)
+        return tokens
+
+    def history_tokens(self, history):
+        return sum(self.message_tokens(message) for message in history)
+
+    # ----- 轮次划分 -----
+
+    @staticmethod
+    def units(history):
+        """Group the history into turns: an assistant message with its tool messages, or a single message"""
+        units = []
+        for message in history:
+            if message.get("role") == "tool" and units:
+                units[-1].append(message)
+            else:
+                units.append([message])
+        return units
+
+    def protected(self, units):
+        """Indexes of the turns that are always sent verbatim"""
+        keep = set(range(max(0, len(units) - self.keep_recent), len(units)))
+        users = [i for i, unit in enumerate(units) if unit[0].get("role") == "user"]
+        if users:
+            keep.add(users[-1])
+        return keep
+
+    # ----- 总结 -----
+
+    def summarize_transcript(self, transcript):
+        response = openai_based_api.process_content(self.provider_name, self.summary_prompt, self.model,
+                                                    content=transcript, max_tokens=self.summary_max_tokens)
+        return response["result"]
+
+    def apply_summary(self, history):
+        """Replace summarized messages with their summary if the background job finished"""
+        with self.lock:
+            pending = self.pending
+            if pending is None or not pending["future"].done():
+                return
+            self.pending = None
+        try:
+            summary = pending["future"].result()
+        except Exception as e:
+            logger.warning("Context summarization failed, trimming instead: %s", e)
+            return
+        ids = pending["ids"]
+        present = {id(message) for message in history}
+        if not ids <= present:
+            return
+        remaining = [message for message in history if id(message) not in ids]
+        history[:] = [{"role": "system", "content": SUMMARY_PREFIX + summary}] + remaining
+        for message_id in ids:
+            self.sizes.pop(message_id, None)
+        self.stats["summaries"] += 1
+        self.stats["summarized_messages"] += len(ids)
+        logger.info("Replaced %d messages with a summary", len(ids))
+
+    def schedule_summary(self, history, units, total):
+        """Start summarizing the oldest unprotected turns when the history is getting large"""
+        if not self.summarize or self.provider_name is None or self.pending is not None:
+            return
+        if total <= self.max_tokens * self.summarize_ratio:
+            return
+        keep = self.protected(units)
+        # 总结到剩余历史不超过预算的一半为止
+        selected = []
+        for i, unit in enumerate(units):
+            if total <= self.max_tokens / 2:
+                break
+            if i not in keep:
+                selected.extend(unit)
+                total -= sum(self.message_tokens(message) for message in unit)
+        if len(selected) < 2:
+            return
+        transcript = "\n\n".join(render_message(message) for message in selected)
+        future = self.executor.submit(self.summarize_transcript, transcript)
+        with self.lock:
+            self.pending = {"future": future, "ids": {id(message) for message in selected}}
+        logger.info("Summarizing %d older messages in the background", len(selected))
+
+    # ----- 请求 -----
+
+    def prepare(self, history):
+        """
+        Messages to send this round.
+
+        Applies a finished summary to history (in place), schedules a new one if needed and
+        returns the history with the oldest unprotected turns left out while it exceeds
+        max_tokens. The returned list shares message objects with history.
+        """
+        self.apply_summary(history)
+        units = self.units(history)
+        total = self.history_tokens(history)
+        self.schedule_summary(history, units, total)
+        if total <= self.max_tokens:
+            return list(history)
+
+        keep = self.protected(units)
+        dropped = set()
+        for i, unit in enumerate(units):
+            if total <= self.max_tokens:
+                break
+            if i not in keep:
+                dropped.add(i)
+                total -= sum(self.message_tokens(message) for message in unit)
+        if total > self.max_tokens:
+            logger.warning("Context still has %d tokens after trimming (budget %d)", total, self.max_tokens)
+        trimmed = sum(len(units[i]) for i in dropped)
+        self.stats["trimmed_messages"] += trimmed
+        logger.debug("Left %d old messages out of the request", trimmed)
+        return [message for i, unit in enumerate(units) if i not in dropped for message in unit]
+
+    def wait(self):
+        """Block until a running summarization finishes (mainly for tests and shutdown)"""
+        pending = self.pending
+        if pending is not None:
+            try:
+                pending["future"].result()
+            except Exception:
+                pass
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+
@@ -0,0 +1,137 @@
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import Future
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+
+logger = telemetry.get_logger("tool_cache")
+
+
+def normalize_text(text):
+    """Trim and collapse whitespace, so "机器学习 " and "机器学习" are the same argument"""
+    return " ".join(text.split())
+
+
+def canonical_arguments(arguments, parameters=None):
+    """
+    Canonical form of tool arguments used as cache key.
+
+    Missing arguments are filled with their schema default (e.g. limit=10), strings are
+    whitespace-normalized, string lists (keyword lists) are de-duplicated and sorted, and
+    integral floats of integer parameters become ints. Keys are sorted when serialized.
+    """
+    parameters = parameters or {}
+    properties = parameters.get("properties", {})
+    canonical = {}
+    for name, schema in properties.items():
+        if "default" in schema and name not in arguments:
+            canonical[name] = schema["default"]
+    for name, value in arguments.items():
+        canonical[name] = _canonical_value(value, properties.get(name, {}))
+    return canonical
+
+
+def _canonical_value(value, schema):
+    if isinstance(value, str):
+        return normalize_text(value)
+    if isinstance(value, float) and schema.get("type") == "integer" and value.is_integer():
+        return int(value)
+    if isinstance(value, list):
+        items = [_canonical_value(item, schema.get("items", {})) for item in value]
+        if items and all(isinstance(item, str) for item in items):
+            return sorted(set(item for item in items if item))
+        return items
+    if isinstance(value, dict):
+        properties = schema.get("properties", {})
+        return {key: _canonical_value(item, properties.get(key, {})) for key, item in value.items()}
+    return value
+
+
+class ToolResultCache:
+    """
+    Memoizes tool results by tool name plus canonical arguments.
+
+    Identical calls that run at the same time (parallel tool calls of one turn) are
+    collapsed into one execution; finished results are reused by later rounds until their
+    TTL expires. Failed calls are not cached.
+    """
+
+    def __init__(self, tools=None, ttl=None, tool_ttls=None, registry=None):
+        """
+        Args:
+            tools: Tool schemas; their parameter defaults are filled in before keying
+            ttl: Default lifetime of a result in seconds (None keeps it for the whole session)
+            tool_ttls: {tool name: seconds} for non-deterministic tools; 0 disables caching
+                but still collapses identical concurrent calls
+            registry: MetricsRegistry to report to (defaults to telemetry.METRICS)
+        """
+        self.parameters = {tool["function"]["name"]: tool["function"].get("parameters") for tool in tools or []}
+        self.ttl = ttl
+        self.tool_ttls = tool_ttls or {}
+        self.registry = registry or telemetry.METRICS
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.in_flight = {}
+        self.stats = {"hit": 0, "miss": 0, "deduplicated": 0}
+
+    def key(self, name, arguments):
+        canonical = canonical_arguments(arguments, self.parameters.get(name))
+        return json.dumps([name, canonical], sort_keys=True, ensure_ascii=False)
+
+    def _count(self, name, status):
+        self.stats[status] += 1
+        self.registry.inc("agent_tool_calls_total", tool=name, cache=status)
+
+    def get_or_run(self, name, arguments, function):
+        """
+        Return the cached result of name(arguments), or run function() to produce it.
+
+        Returns:
+            (result, status) with status "hit", "deduplicated" or "miss"
+        """
+        key = self.key(name, arguments)
+        now = time.time()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, result = entry
+                if expires_at is None or expires_at > now:
+                    self._count(name, "hit")
+                    return result, "hit"
+                del self.entries[key]
+            future = self.in_flight.get(key)
+            leader = future is None
+            if leader:
+                future = self.in_flight[key] = Future()
+                self._count(name, "miss")
+            else:
+                self._count(name, "deduplicated")
+
+        if not leader:
+            logger.debug("Collapsed duplicate %s call %s", name, key)
+            return future.result(), "deduplicated"
+
+        try:
+            result = function()
+        except BaseException as e:
+            with self.lock:
+                del self.in_flight[key]
+            future.set_exception(e)
+            raise
+        ttl = self.tool_ttls.get(name, self.ttl)
+        with self.lock:
+            if ttl != 0:
+                self.entries[key] = (None if ttl is None else time.time() + ttl, result)
+            del self.in_flight[key]
+        future.set_result(result)
+        return result, "miss"
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
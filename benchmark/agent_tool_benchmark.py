@@ -0,0 +1,85 @@
+import sys
+import os
+import json
+import time
+import argparse
+import numpy as np
+
+# Add the parent directory to sys.path to import the agent and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.agent_runtime import AgentSession, DISPATCH_MODES
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers, TOOLS_PATH
+
+# 桩工具的执行耗时（秒）；未列出的工具使用 --tool-latency
+DEFAULT_TOOL_LATENCIES = {"full_text_search": 0.3, "keyword_search": 0.1, "vector_search": 0.2}
+
+
+def make_stub_tools(tools, latencies, default_latency):
+    """Tool functions that sleep for a fixed time and echo their arguments"""
+    def make(name):
+        def stub(arguments):
+            time.sleep(latencies.get(name, default_latency))
+            return {"tool": name, "arguments": arguments, "results": []}
+        return stub
+    return {tool["function"]["name"]: make(tool["function"]["name"]) for tool in tools}
+
+
+def run_mode(provider_name, tools, tool_functions, dispatch, turns):
+    """Run single tool-calling turns and return their timings"""
+    turn_times, model_times, first_tool_starts = [], [], []
+    with AgentSession(provider_name, "mock-model", tools, tool_functions, dispatch=dispatch) as session:
+        for i in range(turns):
+            session.history = [{"role": "user", "content": f"查找关于机器学习的文档 {i}"}]
+            session.run_turn()
+            turn = session.turns[-1]
+            turn_times.append(turn["turn_time"])
+            model_times.append(turn["model_time"])
+            if turn["tools"]:
+                first_tool_starts.append(min(tool["start"] for tool in turn["tools"]))
+    return {
+        "turn_ms": float(np.mean(turn_times) * 1000),
+        "model_ms": float(np.mean(model_times) * 1000),
+        "first_tool_start_ms": float(np.mean(first_tool_starts) * 1000) if first_tool_starts else None,
+        "tools_per_turn": len(session.turns[-1]["tools"]) if session.turns else 0,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare tool dispatch modes against the streaming mock server")
+    parser.add_argument("--turns", type=int, default=5)
+    parser.add_argument("--modes", nargs="*", default=list(DISPATCH_MODES))
+    parser.add_argument("--token-interval", type=float, default=0.01,
+                        help="Delay between streamed fragments of the mock server")
+    parser.add_argument("--parallel-tool-calls", type=int, default=3)
+    parser.add_argument("--tool-latency", type=float, default=0.2, help="Latency of tools without a preset")
+    parser.add_argument("--tool-latencies", help="JSON {tool name: seconds} overriding the presets")
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    with open(TOOLS_PATH, encoding="utf-8") as f:
+        tools = json.load(f)["tools"]
+    latencies = dict(DEFAULT_TOOL_LATENCIES, **json.loads(args.tool_latencies or "{}"))
+    tool_functions = make_stub_tools(tools, latencies, args.tool_latency)
+
+    config = {"token_interval": args.token_interval, "parallel_tool_calls": args.parallel_tool_calls}
+    results = {}
+    with MockServer(**config) as server:
+        configure_providers(server.url)
+        print(f"\n{'mode':<12}{'turn ms':>10}{'model ms':>10}{'1st tool ms':>13}{'tools':>7}")
+        for mode in args.modes:
+            result = run_mode("MOCK", tools, tool_functions, mode, args.turns)
+            results[mode] = result
+            first_tool = f"{result['first_tool_start_ms']:.1f}" if result["first_tool_start_ms"] is not None else "-"
+            print(f"{mode:<12}{result['turn_ms']:>10.1f}{result['model_ms']:>10.1f}{first_tool:>13}"
+                  f"{result['tools_per_turn']:>7}", flush=True)
+
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"mock_config": config, "tool_latencies": latencies, "turns": args.turns,
+                       "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,207 @@
+import sys
+import os
+import json
+import time
+import platform
+import argparse
+import subprocess
+import urllib.request
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM, embedding and sync_api modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from embedding import openai_based_embedding
+from sync_api import feishu_spreadsheet
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BASELINE = os.path.join(BENCHMARK_DIR, "baselines", "api_benchmark.json")
+TOOLS_PATH = os.path.join(os.path.dirname(BENCHMARK_DIR), "agent", "Agent_Tools.json")
+
+# 与基线相比允许的相对波动，超过则视为回归
+DEFAULT_TOLERANCE = 0.2
+
+
+def start_mock_server(port, config):
+    """Run benchmark/mock_server.py in a separate process so its CPU time is not counted"""
+    command = [sys.executable, os.path.join(BENCHMARK_DIR, "mock_server.py"), "--port", str(port),
+               "--config", json.dumps(config)]
+    process = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/mock/stats", timeout=1).read()
+            return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("Mock server did not start")
+
+
+def configure_providers(url, provider_name="MOCK"):
+    """Point the MOCK provider of every module at the mock server"""
+    provider = {"api_key": "mock-key", "base_url": f"{url}/v1"}
+    openai_based_api.PROVIDERS[provider_name] = provider
+    openai_based_embedding.PROVIDERS[provider_name] = provider
+    feishu_spreadsheet.FEISHU_BASE_URL = url
+
+
+def build_call_paths(provider_name="MOCK", embedding_batch=16):
+    """Return {name: callable} for every benchmarked call path"""
+    with open(TOOLS_PATH, encoding="utf-8") as f:
+        tools = json.load(f)["tools"]
+    texts = [f"benchmark sentence number {i} for the embedding path" for i in range(embedding_batch)]
+
+    # 基准测试的并发请求完全相同，关闭请求合并以测量真实的上游调用
+    def chat():
+        openai_based_api.process_content(provider_name, "Summarize the content.", "mock-model",
+                                         content="Lorem ipsum dolor sit amet. " * 50, coalesce=False)
+
+    def chat_tools():
+        openai_based_api.process_content(provider_name, "查找关于机器学习的文档", "mock-model", tools=tools,
+                                         coalesce=False)
+
+    def chat_stream():
+        for _ in openai_based_api.stream_content(provider_name, "Summarize the content.", "mock-model",
+                                                 content="Lorem ipsum dolor sit amet. " * 50):
+            pass
+
+    def embedding():
+        openai_based_embedding.process_embedding(provider_name, "mock-embedding", texts, dimensions=1024,
+                                                 coalesce=False)
+
+    def feishu_read():
+        feishu_spreadsheet.read_data("mock-spreadsheet", sheet_name="Sheet1")
+
+    return {"chat": chat, "chat_tools": chat_tools, "chat_stream": chat_stream, "embedding": embedding,
+            "feishu_read": feishu_read}
+
+
+def run_path(func, requests, concurrency, warmup=5):
+    """
+    Call func `requests` times with the given concurrency.
+
+    Returns:
+        Dictionary with throughput (req/s), p50/p95/p99 latency (ms), CPU per request (ms)
+        of this process, and the number of errors
+    """
+    for _ in range(warmup):
+        func()
+
+    def timed(_):
+        start = time.perf_counter()
+        try:
+            func()
+            return time.perf_counter() - start, None
+        except Exception as e:
+            return time.perf_counter() - start, e
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(timed, range(requests)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    latencies = np.array([latency for latency, _ in results]) * 1000
+    return {
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": sum(1 for _, error in results if error is not None),
+        "throughput": requests / wall,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+        "cpu_per_request_ms": cpu / requests * 1000,
+    }
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """Return a list of human-readable regressions against a stored baseline"""
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        for key in ("p50_ms", "p95_ms", "cpu_per_request_ms"):
+            if result[key] > base[key] * (1 + tolerance):
+                regressions.append(f"{name}: {key} {result[key]:.2f} > baseline {base[key]:.2f}")
+        if result["throughput"] < base["throughput"] * (1 - tolerance):
+            regressions.append(f"{name}: throughput {result['throughput']:.1f} < baseline {base['throughput']:.1f}")
+    return regressions
+
+
+def environment_info():
+    return {"python": platform.python_version(), "machine": platform.machine(), "system": platform.system(),
+            "processor": platform.processor(), "cpu_count": os.cpu_count()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the API call paths against a local mock server")
+    parser.add_argument("--paths", nargs="*", help="Call paths to run (default: all)")
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.02, help="Fixed mock server latency in seconds")
+    parser.add_argument("--mock-config", help="JSON overriding the mock server configuration")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="Store the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument("--output", help="Also write the results as JSON to this file")
+    args = parser.parse_args()
+
+    config = {"latency": {"distribution": "fixed", "value": args.latency}}
+    config.update(json.loads(args.mock_config or "{}"))
+    process, url = start_mock_server(args.port, config)
+    try:
+        configure_providers(url)
+        paths = build_call_paths()
+        selected = args.paths or list(paths)
+
+        print(f"\n{'path':<14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'CPU ms/req':>12}{'errors':>8}")
+        results = {}
+        for name in selected:
+            result = run_path(paths[name], args.requests, args.concurrency)
+            results[name] = result
+            print(f"{name:<14}{result['throughput']:>10.1f}{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}"
+                  f"{result['p99_ms']:>10.1f}{result['cpu_per_request_ms']:>12.2f}{result['errors']:>8}", flush=True)
+    finally:
+        process.terminate()
+        process.wait()
+
+    report = {"created_at": time.strftime("%Y-%m-%d %H:%M:%S"), "environment": environment_info(),
+              "mock_config": config, "requests": args.requests, "concurrency": args.concurrency,
+              "results": results}
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print("\nNo baseline found, run with --save-baseline to create one")
+        return
+    with open(args.baseline, encoding="utf-8") as f:
+        baseline = json.load(f)
+    if baseline.get("environment") != report["environment"]:
+        print("\nWarning: baseline was recorded on a different environment", baseline.get("environment"))
+    if (baseline.get("mock_config"), baseline.get("concurrency")) != (config, args.concurrency):
+        print("Warning: baseline was recorded with a different mock configuration or concurrency")
+    regressions = compare(results, baseline, args.tolerance)
+    if regressions:
+        print("\nRegressions against baseline:")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions against baseline ({baseline['created_at']})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+import sys
+import os
+import time
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.openai_based_api import process_content
+from LLM.map_reduce import process_content_map_reduce, count_tokens
+
+
+def load_document(path=None, target_tokens=60000):
+    """读取测试文档；未提供路径时生成一个合成的长文档"""
+    if path:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+
+    paragraph = (
+        "第{i}节：本节记录了项目在第{i}个迭代中的进展，包括接口调整、性能测试结果以及遗留问题。"
+        "Section {i}: the team reviewed latency regressions, token usage and retry behaviour of the API wrappers.\n"
+    )
+    parts = []
+    i = 0
+    text = ""
+    while count_tokens(text) < target_tokens:
+        parts.extend(paragraph.format(i=i + j) for j in range(200))
+        i += 200
+        text = "".join(parts)
+    return text
+
+
+def print_progress(event):
+    if event["event"] == "chunked":
+        print(f"Split into {event['total_chunks']} chunks ({event['total_tokens']} tokens)", flush=True)
+    elif event["event"] == "map":
+        print(f"Chunk {event['index'] + 1} done ({event['completed']}/{event['total_chunks']})", flush=True)
+    elif event["event"] == "reduce":
+        print(f"Reducing {event['partials']} partial answers...", flush=True)
+
+
+def main():
+    provider_name = "YUNWU-Dev"
+    model = "gpt-4.1-2025-04-14"
+    user_prompt = "请总结以下文档的要点，列出不超过10条。"
+    document = load_document(sys.argv[1] if len(sys.argv) > 1 else None)
+
+    print(f"Document size: {count_tokens(document)} tokens")
+
+    # 单次整体请求
+    start = time.time()
+    single = process_content(provider_name=provider_name, user_prompt=user_prompt, model=model, content=document)
+    single_time = time.time() - start
+
+    # map-reduce 请求
+    start = time.time()
+    chunked = process_content_map_reduce(
+        provider_name=provider_name,
+        user_prompt=user_prompt,
+        model=model,
+        content=document,
+        chunk_tokens=8000,
+        overlap_tokens=200,
+        max_workers=8,
+        progress_callback=print_progress
+    )
+    map_reduce_time = time.time() - start
+
+    print("\n===== Benchmark Result =====")
+    print(f"{'mode':<12}{'wall clock (s)':>16}{'input tokens':>16}{'output tokens':>16}")
+    print(f"{'single':<12}{single_time:>16.2f}{single['input_tokens']:>16}{single['output_tokens']:>16}")
+    print(f"{'map-reduce':<12}{map_reduce_time:>16.2f}{chunked['input_tokens']:>16}{chunked['output_tokens']:>16}")
+    print(f"Chunks: {chunked['chunks']}, speedup: {single_time / map_reduce_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
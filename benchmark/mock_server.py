@@ -0,0 +1,503 @@
+import json
+import time
+import uuid
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from urllib.parse import urlparse, parse_qs
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONFIG = {
+    # 每个请求的延迟分布（秒），见 sample_latency
+    "latency": {"distribution": "fixed", "value": 0.0},
+    # 流式响应中相邻两个 chunk 之间的间隔（秒）
+    "token_interval": 0.0,
+    # 以 HTTP 500 响应的请求比例
+    "error_rate": 0.0,
+    # 以 HTTP 429 响应的请求比例
+    "rate_limit_rate": 0.0,
+    "retry_after": 1,
+    # 同时处理的请求上限，超出的请求直接返回 429（None 表示不限制）
+    "max_concurrency": None,
+    "response_text": "This is a mock response from the local OpenAI-compatible server.",
+    # 多个 choice 依次使用的回复文本（原样返回，不做 JSON 包装）；None 表示都用 response_text
+    "choice_texts": None,
+    # False 时忽略 n 参数，只返回一个 choice（模拟不支持 n 的服务商）
+    "supports_n": True,
+    # "auto": 请求带 tools 且 tool_choice 不是 "none" 时返回工具调用；"never": 从不调用
+    "tool_calls": "auto",
+    # 一次响应中调用的工具个数（依次取 tools 中的前几个）
+    "parallel_tool_calls": 1,
+    "embedding_dimensions": 1536,
+    # 模拟上游前缀缓存：与之前请求逐字节相同的 tools + 消息前缀计入 cached_tokens
+    "prompt_cache": False,
+    # 命中缓存所需的最小前缀 token 数（OpenAI 为 1024）
+    "prompt_cache_min_tokens": 0,
+    "seed": 0,
+}
+
+DEFAULT_SHEETS = {
+    "mock-sheet-1": {
+        "title": "Sheet1",
+        "values": [["question", "answer"], ["What is the capital of France?", "Paris"], ["2 + 2", "4"]],
+    },
+}
+
+
+def sample_latency(spec, rng):
+    """
+    Draw one latency in seconds.
+
+    Supported specs:
+        {"distribution": "fixed", "value": 0.1}
+        {"distribution": "uniform", "low": 0.05, "high": 0.2}
+        {"distribution": "normal", "mean": 0.1, "stddev": 0.02}
+        {"distribution": "lognormal", "median": 0.1, "sigma": 0.5}
+    A plain number is treated as a fixed latency.
+    """
+    if isinstance(spec, (int, float)):
+        return float(spec)
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "fixed":
+        return float(spec.get("value", 0.0))
+    if distribution == "uniform":
+        return rng.uniform(spec["low"], spec["high"])
+    if distribution == "normal":
+        return max(0.0, rng.gauss(spec["mean"], spec["stddev"]))
+    if distribution == "lognormal":
+        return rng.lognormvariate(np.log(spec["median"]), spec["sigma"])
+    raise ValueError(f"Unknown latency distribution '{distribution}'")
+
+
+def estimate_tokens(text):
+    """Cheap token estimate (about 4 characters per token), avoids tokenizer cost in the server"""
+    return max(1, len(text) // 4) if text else 0
+
+
+def message_text(message):
+    content = message.get("content") or ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def stream_fragments(message):
+    """Number of delayed fragments a message is streamed in (8 characters of tool arguments or one word)"""
+    calls = message.get("tool_calls") or []
+    words = len(message["content"].split(" ")) if message.get("content") else 0
+    return sum(-(-len(call["function"]["arguments"]) // 8) for call in calls) + words
+
+
+def mock_logprob(token):
+    """Deterministic fake log probability of a token (longer tokens are less likely)"""
+    return -0.05 * len(token)
+
+
+def strip_cache_control(value):
+    """Drop cache_control markers, which do not take part in prefix matching"""
+    if isinstance(value, dict):
+        return {key: strip_cache_control(item) for key, item in value.items() if key != "cache_control"}
+    if isinstance(value, list):
+        return [strip_cache_control(item) for item in value]
+    return value
+
+
+def mock_arguments(parameters, text):
+    """Build arguments matching a tool's JSON schema from the last user message"""
+    arguments = {}
+    properties = (parameters or {}).get("properties", {})
+    for name, schema in properties.items():
+        if "default" in schema:
+            arguments[name] = schema["default"]
+        elif "enum" in schema:
+            arguments[name] = schema["enum"][0]
+        elif schema.get("type") == "string":
+            arguments[name] = text[:64]
+        elif schema.get("type") == "array":
+            arguments[name] = text.split()[:3]
+        elif schema.get("type") in ("integer", "number"):
+            arguments[name] = 10
+        elif schema.get("type") == "boolean":
+            arguments[name] = True
+    return arguments
+
+
+def embedding_vector(text, dimensions):
+    """Deterministic unit vector for a text"""
+    seed = int.from_bytes(hashlib.md5(str(text).encode("utf-8")).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    """Routes OpenAI-compatible, Feishu and /mock control requests to the owning MockServer"""
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def mock(self):
+        return self.server.mock
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(length)) if length else {}
+
+    def send_json(self, payload, status=200, headers=None):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, str(value))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_chunk(self, data):
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        self.dispatch("GET")
+
+    def do_POST(self):
+        self.dispatch("POST")
+
+    def dispatch(self, method):
+        url = urlparse(self.path)
+        path = url.path
+        body = self.read_json() if method == "POST" else {}
+        if path.startswith("/mock/"):
+            return self.handle_control(method, path, body)
+
+        mock = self.mock
+        if not mock.acquire():
+            mock.record(path, 429)
+            return self.send_json({"error": {"message": "Server overloaded", "type": "rate_limit_error",
+                                             "code": "rate_limit_exceeded"}}, 429,
+                                  {"Retry-After": mock.config["retry_after"]})
+        try:
+            config = mock.config
+            time.sleep(sample_latency(config["latency"], mock.rng))
+            roll = mock.rng.random()
+            if roll < config["rate_limit_rate"]:
+                mock.record(path, 429)
+                return self.send_json({"error": {"message": "Rate limit exceeded", "type": "rate_limit_error",
+                                                 "code": "rate_limit_exceeded"}}, 429,
+                                      {"Retry-After": config["retry_after"]})
+            if roll < config["rate_limit_rate"] + config["error_rate"]:
+                mock.record(path, 500)
+                return self.send_json({"error": {"message": "Mock internal error", "type": "server_error"}}, 500)
+
+            if path.endswith("/chat/completions") and method == "POST":
+                self.handle_chat(body)
+            elif path.endswith("/embeddings") and method == "POST":
+                self.handle_embeddings(body)
+            elif path.startswith("/open-apis/"):
+                self.handle_feishu(method, path, parse_qs(url.query), body)
+            else:
+                mock.record(path, 404)
+                return self.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+            mock.record(path, 200)
+        finally:
+            mock.release()
+
+    def handle_control(self, method, path, body):
+        if path == "/mock/config":
+            if method == "POST":
+                self.mock.update(**body)
+            self.send_json(self.mock.config)
+        elif path == "/mock/stats":
+            self.send_json(self.mock.get_stats())
+        elif path == "/mock/reset":
+            self.mock.reset_stats()
+            self.send_json({"ok": True})
+        else:
+            self.send_json({"error": {"message": f"Unknown path {path}"}}, 404)
+
+    # ----- chat completions -----
+
+    def build_choice_message(self, body, index=0):
+        config = self.mock.config
+        messages = body.get("messages", [])
+        last_user = next((message_text(m) for m in reversed(messages) if m.get("role") == "user"), "")
+        tools = body.get("tools") or []
+        tool_choice = body.get("tool_choice", "auto")
+        answered = bool(messages) and messages[-1].get("role") == "tool"
+
+        if tools and config["tool_calls"] == "auto" and tool_choice != "none" and not answered:
+            if isinstance(tool_choice, dict):
+                name = tool_choice["function"]["name"]
+                selected = [t for t in tools if t["function"]["name"] == name]
+            else:
+                selected = tools[:max(1, config["parallel_tool_calls"])]
+            calls = [{"id": f"call_{uuid.uuid4().hex[:24]}", "type": "function",
+                      "function": {"name": tool["function"]["name"],
+                                   "arguments": json.dumps(mock_arguments(tool["function"].get("parameters"),
+                                                                          last_user), ensure_ascii=False)}}
+                     for tool in selected]
+            return {"role": "assistant", "content": None, "tool_calls": calls}, "tool_calls"
+
+        text = config["response_text"]
+        response_format = body.get("response_format") or {}
+        if config["choice_texts"]:
+            text = config["choice_texts"][index % len(config["choice_texts"])]
+        elif response_format.get("type") in ("json_object", "json_schema"):
+            text = json.dumps({"answer": text})
+        max_tokens = body.get("max_tokens") or body.get("max_completion_tokens")
+        if max_tokens and estimate_tokens(text) > max_tokens:
+            return {"role": "assistant", "content": text[:max_tokens * 4]}, "length"
+        return {"role": "assistant", "content": text}, "stop"
+
+    def handle_chat(self, body):
+        prompt_tokens = sum(estimate_tokens(message_text(m)) for m in body.get("messages", []))
+        choices = []
+        n = (body.get("n") or 1) if self.mock.config["supports_n"] else 1
+        for index in range(n):
+            message, finish_reason = self.build_choice_message(body, index)
+            logprobs = None
+            if body.get("logprobs") and message.get("content"):
+                logprobs = {"content": [{"token": word, "logprob": mock_logprob(word), "bytes": None,
+                                         "top_logprobs": []} for word in message["content"].split(" ")]}
+            choices.append({"index": index, "message": message, "finish_reason": finish_reason,
+                            "logprobs": logprobs})
+        completion_tokens = sum(estimate_tokens(c["message"]["content"] or "") +
+                                sum(estimate_tokens(call["function"]["arguments"])
+                                    for call in c["message"].get("tool_calls", []))
+                                for c in choices)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+        if self.mock.config["prompt_cache"]:
+            usage["prompt_tokens_details"] = {"cached_tokens": self.mock.cached_prefix_tokens(body)}
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+        created = int(time.time())
+        model = body.get("model", "mock-model")
+
+        interval = self.mock.config["token_interval"]
+        if not body.get("stream"):
+            # 非流式响应同样要等待整段生成完成：按流式的片段数计算生成时间
+            time.sleep(interval * sum(stream_fragments(c["message"]) for c in choices))
+            return self.send_json({"id": completion_id, "object": "chat.completion", "created": created,
+                                   "model": model, "choices": choices, "usage": usage})
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+        def event(choice_delta=None, finish_reason=None, index=0, extra=None):
+            chunk = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                     "choices": [] if choice_delta is None else
+                     [{"index": index, "delta": choice_delta, "finish_reason": finish_reason}]}
+            chunk.update(extra or {})
+            self.send_chunk(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+
+        for choice in choices:
+            message, index = choice["message"], choice["index"]
+            event({"role": "assistant", "content": ""}, index=index)
+            for position, call in enumerate(message.get("tool_calls") or []):
+                event({"tool_calls": [{"index": position, "id": call["id"], "type": "function",
+                                       "function": {"name": call["function"]["name"], "arguments": ""}}]},
+                      index=index)
+                arguments = call["function"]["arguments"]
+                for start in range(0, len(arguments), 8):
+                    time.sleep(interval)
+                    event({"tool_calls": [{"index": position,
+                                           "function": {"arguments": arguments[start:start + 8]}}]}, index=index)
+            content = message.get("content") or ""
+            for word in content.split(" "):
+                time.sleep(interval)
+                event({"content": word + " "}, index=index)
+            event({}, choice["finish_reason"], index=index)
+        if (body.get("stream_options") or {}).get("include_usage"):
+            event(extra={"usage": usage})
+        self.send_chunk(b"data: [DONE]\n\n")
+        self.send_chunk(b"")
+
+    # ----- embeddings -----
+
+    def handle_embeddings(self, body):
+        inputs = body.get("input", "")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        dimensions = body.get("dimensions") or self.mock.config["embedding_dimensions"]
+        data = []
+        for index, text in enumerate(inputs):
+            vector = embedding_vector(text, dimensions)
+            if body.get("encoding_format") == "base64":
+                embedding = base64.b64encode(vector.tobytes()).decode("ascii")
+            else:
+                embedding = vector.tolist()
+            data.append({"object": "embedding", "index": index, "embedding": embedding})
+        tokens = sum(estimate_tokens(text) if isinstance(text, str) else len(text) for text in inputs)
+        self.send_json({"object": "list", "data": data, "model": body.get("model", "mock-embedding"),
+                        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}})
+
+    # ----- Feishu sheets -----
+
+    def handle_feishu(self, method, path, query, body):
+        parts = path.strip("/").split("/")
+        sheets = self.mock.sheets
+        if path == "/open-apis/auth/v3/tenant_access_token/internal":
+            return self.send_json({"code": 0, "msg": "ok", "tenant_access_token": "t-mock-token", "expire": 7200})
+        if self.headers.get("Authorization") != "Bearer t-mock-token":
+            return self.send_json({"code": 99991663, "msg": "Invalid access token"}, 400)
+        if parts[1:3] == ["sheets", "v3"] and parts[-1] == "query":
+            return self.send_json({"code": 0, "msg": "success", "data": {"sheets": [
+                {"sheet_id": sheet_id, "title": sheet["title"], "index": i, "resource_type": "sheet"}
+                for i, (sheet_id, sheet) in enumerate(sheets.items())]}})
+        if parts[1:3] == ["sheets", "v3"] and parts[-2] == "sheets":
+            sheet = sheets.get(parts[-1])
+            if sheet is None:
+                return self.send_json({"code": 1310214, "msg": "sheet not found"})
+            return self.send_json({"code": 0, "msg": "success", "data": {"sheet": {
+                "sheet_id": parts[-1], "title": sheet["title"], "resource_type": "sheet"}}})
+        if parts[1:3] == ["sheets", "v2"] and parts[-2] == "values":
+            sheet_id = parts[-1].split("!")[0]
+            values = sheets.get(sheet_id, {}).get("values", [])
+            return self.send_json({"code": 0, "msg": "success", "data": {
+                "revision": len(values), "spreadsheetToken": parts[4],
+                "valueRange": {"majorDimension": "ROWS", "range": parts[-1], "values": values}}})
+        if parts[1:3] == ["sheets", "v2"] and parts[-1] == "values_append" and method == "POST":
+            value_range = body.get("valueRange", {})
+            sheet_id = value_range.get("range", "").split("!")[0]
+            with self.mock.lock:
+                sheets.setdefault(sheet_id, {"title": sheet_id, "values": []})["values"].extend(
+                    value_range.get("values", []))
+            return self.send_json({"code": 0, "msg": "success", "data": {
+                "spreadsheetToken": parts[4], "tableRange": value_range.get("range"),
+                "updates": {"updatedRows": len(value_range.get("values", []))}}})
+        return self.send_json({"code": 404, "msg": f"Unknown Feishu path {path}"}, 404)
+
+
+class MockServer:
+    """
+    Local OpenAI-compatible server (chat completions with streaming and tool calls,
+    embeddings) plus a Feishu sheets stub, for tests and benchmarks.
+
+    Usage:
+        with MockServer(latency={"distribution": "lognormal", "median": 0.05, "sigma": 0.3}) as server:
+            openai_based_api.PROVIDERS["MOCK"] = {"api_key": "mock", "base_url": server.base_url}
+
+    The configuration can be changed while running with update() or by POSTing JSON to
+    /mock/config; /mock/stats returns request counts per path and status.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, sheets=None, **config):
+        self.config = json.loads(json.dumps(DEFAULT_CONFIG))
+        self.config.update(config)
+        self.sheets = json.loads(json.dumps(sheets or DEFAULT_SHEETS))
+        self.rng = random.Random(self.config["seed"])
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.prefix_cache = set()
+        self.reset_stats()
+        self.httpd = ThreadingHTTPServer((host, port), MockHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def base_url(self):
+        return f"{self.url}/v1"
+
+    def update(self, **config):
+        with self.lock:
+            self.config.update(config)
+            if "seed" in config:
+                self.rng = random.Random(config["seed"])
+
+    def acquire(self):
+        with self.lock:
+            limit = self.config["max_concurrency"]
+            if limit is not None and self.in_flight >= limit:
+                return False
+            self.in_flight += 1
+            self.stats["peak_in_flight"] = max(self.stats["peak_in_flight"], self.in_flight)
+            return True
+
+    def release(self):
+        with self.lock:
+            self.in_flight -= 1
+
+    def cached_prefix_tokens(self, body):
+        """Tokens of the longest tools + messages prefix already seen in an earlier request"""
+        digest = hashlib.sha256(json.dumps(strip_cache_control(body.get("tools"))).encode("utf-8"))
+        cached = tokens = 0
+        prefixes = []
+        for message in body.get("messages", []):
+            digest.update(json.dumps(strip_cache_control(message)).encode("utf-8"))
+            tokens += estimate_tokens(message_text(message))
+            prefixes.append((digest.hexdigest(), tokens))
+        with self.lock:
+            for prefix, prefix_tokens in prefixes:
+                if prefix in self.prefix_cache:
+                    cached = prefix_tokens
+            self.prefix_cache.update(prefix for prefix, _ in prefixes)
+        return cached if cached >= self.config["prompt_cache_min_tokens"] else 0
+
+    def record(self, path, status):
+        with self.lock:
+            key = f"{path} {status}"
+            self.stats["requests"][key] = self.stats["requests"].get(key, 0) + 1
+
+    def reset_stats(self):
+        with self.lock:
+            self.stats = {"requests": {}, "peak_in_flight": 0}
+
+    def get_stats(self):
+        with self.lock:
+            return json.loads(json.dumps(self.stats))
+
+    def count(self, path_suffix, status=None):
+        """Number of requests whose path ends with path_suffix (optionally with a given status)"""
+        stats = self.get_stats()["requests"]
+        return sum(n for key, n in stats.items()
+                   if key.rsplit(" ", 1)[0].endswith(path_suffix) and (status is None or key.endswith(f" {status}")))
+
+    def start(self):
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def serve_forever(self):
+        self.httpd.serve_forever()
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI-compatible / Feishu server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--config", help="JSON object overriding DEFAULT_CONFIG")
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, **json.loads(args.config or "{}"))
+    print(f"Mock server listening on {server.url} (OpenAI base_url: {server.base_url})", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import sys
+import os
+import time
+import argparse
+import resource
+import tempfile
+import tracemalloc
+import numpy as np
+
+# Add the parent directory to sys.path to import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding.similarity import top_k, QuantizedIndex
+
+
+def create_docs(path, num_docs, dim, chunk_size=65536):
+    """在磁盘上生成随机文档向量（memmap），避免一次性占用内存"""
+    docs = np.lib.format.open_memmap(path, mode="w+", dtype=np.float32, shape=(num_docs, dim))
+    rng = np.random.default_rng(0)
+    for start in range(0, num_docs, chunk_size):
+        end = min(start + chunk_size, num_docs)
+        docs[start:end] = rng.standard_normal((end - start, dim), dtype=np.float32)
+    docs.flush()
+    return np.load(path, mmap_mode="r")
+
+
+def measure(name, func, num_docs, num_queries):
+    """运行一次并记录耗时与峰值内存（tracemalloc 统计 numpy 分配）"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = func()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{name:<28}{elapsed:>10.2f}s{num_docs * num_queries / elapsed / 1e6:>14.1f}M pairs/s"
+          f"{num_queries / elapsed:>12.1f} q/s{peak / 2 ** 20:>12.1f} MB", flush=True)
+    return result
+
+
+def recall(found, expected):
+    return np.mean([len(set(a) & set(b)) / len(b) for a, b in zip(found, expected)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Similarity / top-k benchmark")
+    parser.add_argument("--docs", type=int, default=1_000_000)
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--queries", type=int, default=64)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--chunk-size", type=int, default=65536)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        print(f"Generating {args.docs} x {args.dim} float32 documents...", flush=True)
+        docs = create_docs(os.path.join(tmp, "docs.npy"), args.docs, args.dim)
+        queries = np.random.default_rng(1).standard_normal((args.queries, args.dim), dtype=np.float32)
+
+        print(f"\n{'method':<28}{'time':>11}{'throughput':>24}{'queries':>16}{'peak mem':>15}")
+        exact, _ = measure("float32 top_k (memmap)",
+                           lambda: top_k(queries, docs, args.k, chunk_size=args.chunk_size), args.docs, args.queries)
+
+        for storage in ("float16", "int8"):
+            start = time.perf_counter()
+            index = QuantizedIndex(docs, storage=storage, full_precision=docs, chunk_size=args.chunk_size)
+            print(f"  built {storage} index in {time.perf_counter() - start:.2f}s, "
+                  f"{index.nbytes / 2 ** 20:.0f} MB (float32: {docs.nbytes / 2 ** 20:.0f} MB)", flush=True)
+
+            found, _ = measure(f"{storage} search",
+                               lambda: index.search(queries, args.k, rescore_factor=1), args.docs, args.queries)
+            print(f"  recall@{args.k}: {recall(found, exact):.3f}")
+            found, _ = measure(f"{storage} search + rescore",
+                               lambda: index.search(queries, args.k, rescore_factor=4), args.docs, args.queries)
+            print(f"  recall@{args.k}: {recall(found, exact):.3f}")
+            del index
+
+    print(f"\nProcess peak RSS: {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
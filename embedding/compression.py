@@ -0,0 +1,400 @@
+import os
+import sys
+import json
+import numpy as np
+
+# Add the parent directory to sys.path to import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding.similarity import embeddings_to_matrix, normalize_rows, top_k, DEFAULT_CHUNK_SIZE
+
+DEFAULT_SHARD_SIZE = 100000
+
+
+class TruncateStage:
+    """Matryoshka-style truncation to the first `dimensions` components, then renormalization"""
+
+    kind = "truncate"
+
+    def __init__(self, dimensions):
+        self.dimensions = dimensions
+
+    def fit(self, sample):
+        return self
+
+    def transform(self, matrix):
+        return normalize_rows(matrix[:, :self.dimensions])
+
+    def get_params(self):
+        return {"dimensions": self.dimensions}
+
+
+class PCAStage:
+    """PCA projection fitted on a sample (SVD of the centered data), then renormalization"""
+
+    kind = "pca"
+
+    def __init__(self, dimensions, mean=None, components=None):
+        self.dimensions = dimensions
+        self.mean = None if mean is None else np.asarray(mean, dtype=np.float32)
+        self.components = None if components is None else np.asarray(components, dtype=np.float32)
+
+    def fit(self, sample):
+        self.mean = sample.mean(axis=0)
+        _, _, vt = np.linalg.svd(sample - self.mean, full_matrices=False)
+        self.components = vt[:self.dimensions].astype(np.float32)
+        return self
+
+    def transform(self, matrix):
+        return normalize_rows((matrix - self.mean) @ self.components.T)
+
+    def get_params(self):
+        return {"dimensions": self.dimensions, "mean": self.mean, "components": self.components}
+
+
+class ScalarQuantizer:
+    """
+    8-bit scalar quantization with per-dimension ranges learned from a sample.
+
+    The stage is named "int8" for 8-bit storage (like the "int8" storage of similarity.py and
+    the name kept in saved pipelines); the codes themselves are unsigned uint8 offsets from low.
+    """
+
+    kind = "int8"
+
+    def __init__(self, low=None, scale=None):
+        self.low = None if low is None else np.asarray(low, dtype=np.float32)
+        self.scale = None if scale is None else np.asarray(scale, dtype=np.float32)
+
+    def fit(self, sample):
+        self.low = np.percentile(sample, 0.1, axis=0).astype(np.float32)
+        high = np.percentile(sample, 99.9, axis=0).astype(np.float32)
+        self.scale = np.maximum(high - self.low, 1e-8) / 255.0
+        return self
+
+    def encode(self, matrix):
+        return np.clip(np.round((matrix - self.low) / self.scale), 0, 255).astype(np.uint8)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.low
+
+    def search(self, queries, codes, k, chunk_size=DEFAULT_CHUNK_SIZE):
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_indices = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(codes), chunk_size):
+            indices, scores = top_k(queries, self.decode(codes[start:start + chunk_size]), k, metric="dot")
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_indices = np.concatenate([best_indices, indices + start], axis=1)
+        return _select_best(best_indices, best_scores, k)
+
+    def get_params(self):
+        return {"low": self.low, "scale": self.scale}
+
+
+class ProductQuantizer:
+    """
+    Product quantization: the vector is split into `subspaces` parts, each encoded as the
+    id (uint8) of its nearest centroid in a per-part codebook of 256 entries. Search uses
+    asymmetric distance computation: per-query lookup tables of inner products.
+    """
+
+    kind = "pq"
+
+    def __init__(self, subspaces=16, iterations=20, codebooks=None, seed=0):
+        self.subspaces = subspaces
+        self.iterations = iterations
+        self.seed = seed
+        self.codebooks = None if codebooks is None else np.asarray(codebooks, dtype=np.float32)
+
+    def _split(self, matrix):
+        if matrix.shape[1] % self.subspaces:
+            raise ValueError(f"Dimension {matrix.shape[1]} is not divisible by {self.subspaces} subspaces")
+        return matrix.reshape(len(matrix), self.subspaces, -1)
+
+    def fit(self, sample):
+        parts = self._split(np.asarray(sample, dtype=np.float32))
+        rng = np.random.default_rng(self.seed)
+        centroids = min(256, len(sample))
+        codebooks = np.zeros((self.subspaces, 256, parts.shape[2]), dtype=np.float32)
+        for j in range(self.subspaces):
+            data = parts[:, j, :]
+            centers = data[rng.choice(len(data), centroids, replace=False)].copy()
+            for _ in range(self.iterations):
+                assignment = _nearest(data, centers)
+                sums = np.stack([np.bincount(assignment, weights=data[:, d], minlength=centroids)
+                                 for d in range(data.shape[1])], axis=1)
+                counts = np.bincount(assignment, minlength=centroids)[:, None]
+                empty = counts[:, 0] == 0
+                centers = np.where(empty[:, None], centers, sums / np.maximum(counts, 1))
+            codebooks[j, :centroids] = centers
+            # 样本不足256个时用已有中心填充，避免全零中心被选中
+            codebooks[j, centroids:] = centers[0]
+        self.codebooks = codebooks
+        return self
+
+    def encode(self, matrix):
+        parts = self._split(np.asarray(matrix, dtype=np.float32))
+        codes = np.empty((len(matrix), self.subspaces), dtype=np.uint8)
+        for j in range(self.subspaces):
+            codes[:, j] = _nearest(parts[:, j, :], self.codebooks[j])
+        return codes
+
+    def decode(self, codes):
+        return self.codebooks[np.arange(self.subspaces), codes].reshape(len(codes), -1)
+
+    def search(self, queries, codes, k, chunk_size=DEFAULT_CHUNK_SIZE):
+        # 查找表: (queries, subspaces, 256)
+        tables = np.einsum("qjd,jcd->qjc", self._split(queries), self.codebooks)
+        best_scores = np.full((len(queries), 0), -np.inf, dtype=np.float32)
+        best_indices = np.empty((len(queries), 0), dtype=np.int64)
+        for start in range(0, len(codes), chunk_size):
+            chunk = codes[start:start + chunk_size]
+            scores = np.zeros((len(queries), len(chunk)), dtype=np.float32)
+            for j in range(self.subspaces):
+                scores += tables[:, j, chunk[:, j]]
+            best_scores = np.concatenate([best_scores, scores], axis=1)
+            best_indices = np.concatenate(
+                [best_indices, np.broadcast_to(np.arange(start, start + len(chunk)), scores.shape)], axis=1)
+            best_indices, best_scores = _select_best(best_indices, best_scores, k)
+        return best_indices, best_scores
+
+    def get_params(self):
+        return {"subspaces": self.subspaces, "codebooks": self.codebooks}
+
+
+STAGES = {stage.kind: stage for stage in (TruncateStage, PCAStage, ScalarQuantizer, ProductQuantizer)}
+
+
+def _nearest(data, centers):
+    distances = (np.einsum("ij,ij->i", data, data)[:, None] - 2.0 * data @ centers.T
+                 + np.einsum("ij,ij->i", centers, centers)[None, :])
+    return distances.argmin(axis=1)
+
+
+def _select_best(indices, scores, k):
+    if scores.shape[1] > k:
+        part = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        indices = np.take_along_axis(indices, part, axis=1)
+        scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-scores, axis=1)
+    return np.take_along_axis(indices, order, axis=1), np.take_along_axis(scores, order, axis=1)
+
+
+class CompressionPipeline:
+    """
+    Chain of float stages (truncate, pca) optionally followed by one quantizer (int8, pq).
+
+    Stages are given as (kind, params) tuples, e.g.
+        [("truncate", {"dimensions": 512}), ("pca", {"dimensions": 128}), ("pq", {"subspaces": 16})]
+    Similarity is cosine: float stages renormalize their output, so scores are inner products.
+    """
+
+    def __init__(self, stages):
+        self.stages = [STAGES[kind](**params) if isinstance(params, dict) else params for kind, params in stages]
+        self.quantizer = None
+        if self.stages and self.stages[-1].kind in ("int8", "pq"):
+            self.quantizer = self.stages.pop()
+
+    def fit(self, sample):
+        """Fit every stage on a sample of full-precision embeddings"""
+        matrix = normalize_rows(embeddings_to_matrix(sample))
+        for stage in self.stages:
+            matrix = stage.fit(matrix).transform(matrix)
+        if self.quantizer is not None:
+            self.quantizer.fit(matrix)
+        return self
+
+    def transform_float(self, matrix):
+        matrix = normalize_rows(embeddings_to_matrix(matrix))
+        for stage in self.stages:
+            matrix = stage.transform(matrix)
+        return matrix
+
+    def encode(self, batch):
+        """Compress one batch (matrix or process_embedding response)"""
+        matrix = self.transform_float(batch)
+        if self.quantizer is None:
+            return matrix.astype(np.float16)
+        return self.quantizer.encode(matrix)
+
+    def search(self, queries, codes, k=10):
+        """Top-k search of full-precision queries against compressed vectors"""
+        queries = self.transform_float(queries)
+        if self.quantizer is None:
+            return top_k(queries, codes, k, metric="dot")
+        return self.quantizer.search(queries, codes, k)
+
+    def bytes_per_vector(self, dimensions):
+        if self.quantizer is not None and self.quantizer.kind == "pq":
+            return self.quantizer.subspaces
+        for stage in self.stages:
+            dimensions = stage.dimensions
+        return dimensions * (1 if self.quantizer is not None else 2)
+
+    def save(self, path):
+        """Save the fitted parameters to a .npz file"""
+        arrays = {}
+        config = []
+        stages = self.stages + ([self.quantizer] if self.quantizer is not None else [])
+        for i, stage in enumerate(stages):
+            params = {}
+            for name, value in stage.get_params().items():
+                if isinstance(value, np.ndarray):
+                    arrays[f"{i}_{name}"] = value
+                else:
+                    params[name] = value
+            config.append([stage.kind, params])
+        np.savez(path, config=json.dumps(config), **arrays)
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        stages = []
+        for i, (kind, params) in enumerate(json.loads(str(data["config"]))):
+            prefix = f"{i}_"
+            params.update({name[len(prefix):]: data[name] for name in data.files if name.startswith(prefix)})
+            stages.append((kind, STAGES[kind](**params)))
+        return cls(stages)
+
+
+def write_shards(pipeline, batches, output_dir, shard_size=DEFAULT_SHARD_SIZE):
+    """
+    Compress embedding batches and write them to fixed-size shards.
+
+    Args:
+        pipeline: A fitted CompressionPipeline
+        batches: Iterable of embedding batches (matrices or process_embedding responses)
+        output_dir: Directory for the shards, the pipeline parameters and manifest.json
+        shard_size: Number of vectors per shard
+
+    Returns:
+        The manifest dictionary
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    pipeline.save(os.path.join(output_dir, "pipeline.npz"))
+    manifest = {"shards": [], "count": 0}
+    pending = []
+    pending_count = 0
+
+    def flush(codes):
+        name = f"shard-{len(manifest['shards']):05d}.npy"
+        np.save(os.path.join(output_dir, name), codes)
+        manifest["shards"].append({"file": name, "start": manifest["count"], "count": len(codes)})
+        manifest["count"] += len(codes)
+
+    for batch in batches:
+        pending.append(pipeline.encode(batch))
+        pending_count += len(pending[-1])
+        while pending_count >= shard_size:
+            codes = np.concatenate(pending)
+            flush(codes[:shard_size])
+            pending = [codes[shard_size:]]
+            pending_count = len(pending[0])
+    if pending_count:
+        flush(np.concatenate(pending))
+
+    with open(os.path.join(output_dir, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+class ShardedCodes:
+    """
+    Read-only row view over memmapped shards, indexed by the manifest offsets.
+
+    len() and contiguous row slices (what the search functions use) only read the shards
+    they touch, so the codes never have to fit in RAM. np.asarray(view) loads everything.
+    """
+
+    def __init__(self, shards, starts):
+        self.shards = shards
+        self.starts = starts
+        self.count = starts[-1] + len(shards[-1]) if shards else 0
+        self.shape = (self.count,) + shards[0].shape[1:]
+        self.dtype = shards[0].dtype
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if isinstance(index, slice) and index.step in (None, 1):
+            start, stop, _ = index.indices(self.count)
+            parts = [shard[max(start - offset, 0):max(stop - offset, 0)]
+                     for shard, offset in zip(self.shards, self.starts)
+                     if offset < stop and offset + len(shard) > start]
+            if len(parts) == 1:
+                return parts[0]
+            return np.concatenate(parts) if parts else self.shards[0][:0]
+        if isinstance(index, (int, np.integer)):
+            row = int(index) + self.count if index < 0 else int(index)
+            if not 0 <= row < self.count:
+                raise IndexError(f"Row {index} out of range for {self.count} vectors")
+            shard = int(np.searchsorted(self.starts, row, side="right")) - 1
+            return self.shards[shard][row - self.starts[shard]]
+        return np.asarray(self)[index]
+
+    def __array__(self, dtype=None, copy=None):
+        codes = np.concatenate(self.shards)
+        return codes if dtype is None else codes.astype(dtype)
+
+
+def load_shards(output_dir, mmap=True):
+    """
+    Load the pipeline and all shards written by write_shards.
+
+    With mmap=True the codes are a ShardedCodes view over the memmapped shard files (nothing
+    is copied into RAM); with mmap=False they are loaded into one array.
+    """
+    with open(os.path.join(output_dir, "manifest.json"), encoding="utf-8") as f:
+        manifest = json.load(f)
+    pipeline = CompressionPipeline.load(os.path.join(output_dir, "pipeline.npz"))
+    shards = [np.load(os.path.join(output_dir, shard["file"]), mmap_mode="r" if mmap else None)
+              for shard in manifest["shards"]]
+    if not shards:
+        return pipeline, None
+    if mmap:
+        return pipeline, ShardedCodes(shards, [shard["start"] for shard in manifest["shards"]])
+    return pipeline, np.concatenate(shards)
+
+
+def recall_size_report(docs, queries, configs, k=10, fit_sample=20000):
+    """
+    Measure recall@k and storage size of compression configs against full precision.
+
+    Args:
+        docs: (n, d) full-precision document embeddings
+        queries: (m, d) query embeddings
+        configs: Dict of name -> stage list (see CompressionPipeline)
+        k: Number of results compared
+        fit_sample: Number of documents used to fit each pipeline
+
+    Returns:
+        List of dicts with name, bytes_per_vector, compression ratio and recall
+        (see format_report for a printable table)
+    """
+    docs = embeddings_to_matrix(docs)
+    queries = embeddings_to_matrix(queries)
+    expected, _ = top_k(queries, docs, k, metric="cosine")
+    full_bytes = docs.shape[1] * 4
+    rows = [{"name": "float32", "bytes_per_vector": full_bytes, "compression": 1.0, "recall": 1.0}]
+
+    sample = docs[np.random.default_rng(0).choice(len(docs), min(fit_sample, len(docs)), replace=False)]
+    for name, stages in configs.items():
+        pipeline = CompressionPipeline(stages).fit(sample)
+        codes = np.concatenate([pipeline.encode(docs[start:start + DEFAULT_CHUNK_SIZE])
+                                for start in range(0, len(docs), DEFAULT_CHUNK_SIZE)])
+        found, _ = pipeline.search(queries, codes, k)
+        recall = np.mean([len(set(a) & set(b)) / k for a, b in zip(found, expected)])
+        size = pipeline.bytes_per_vector(docs.shape[1])
+        rows.append({"name": name, "bytes_per_vector": size, "compression": full_bytes / size, "recall": float(recall)})
+
+    return rows
+
+
+def format_report(rows, k=10):
+    """Format the rows of recall_size_report as a plain text table"""
+    lines = [f"{'config':<28}{'bytes/vec':>10}{'ratio':>8}{'recall@' + str(k):>12}"]
+    for row in rows:
+        lines.append(f"{row['name']:<28}{row['bytes_per_vector']:>10}{row['compression']:>7.1f}x"
+                     f"{row['recall']:>12.3f}")
+    return "\n".join(lines)
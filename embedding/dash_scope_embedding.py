@@ -6,8 +6,18 @@ import configparser
 import dashscope
 from http import HTTPStatus
 
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry, ledger, single_flight, rate_limiter, adaptive_limiter
+
+logger = telemetry.get_logger("dash_scope_embedding")
+
 # 调试模式开关
 DEBUG_MODE = False
+# 并发的相同请求合并为一次上游调用
+COALESCE_REQUESTS = True
+EMBEDDING_FLIGHT = single_flight.SingleFlight("dash_scope_embedding")
 
 # Load providers from .provider_env file
 def load_providers():
@@ -25,9 +35,9 @@ def load_providers():
             }
         
         if not providers:
-            print("Warning: No providers found in .provider_env file", flush=True)
+            logger.warning("No providers found in .provider_env file")
     except Exception as e:
-        print(f"Error loading providers: {e}", flush=True)
+        logger.error("Error loading providers: %s", e)
     
     return providers
 
@@ -41,9 +51,19 @@ def set_dashscope_api_key(provider_name="ALIYUN"):
     provider = PROVIDERS[provider_name]
     dashscope.api_key = provider['api_key']
 
-def process_embedding(provider_name, model, input_text=None, image_url=None, video_url=None, dimensions=None, output_type=None):
+class DashScopeAPIError(Exception):
+    """Non-OK DashScope response; status_code lets telemetry classify 429s"""
+
+    def __init__(self, response):
+        super().__init__(f"API Error: {response}")
+        self.status_code = getattr(response, 'status_code', None)
+
+def process_embedding(provider_name, model, input_text=None, image_url=None, video_url=None, dimensions=None, output_type=None, inputs=None, coalesce=None):
     """
     Generate embeddings using DashScope API.
+
+    Concurrent identical requests share one upstream call unless coalesce=False;
+    callers that joined an in-flight call get a copy with "coalesced": True.
     
     Args:
         provider_name: Name of the provider (should be ALIYUN)
@@ -53,31 +73,30 @@ def process_embedding(provider_name, model, input_text=None, image_url=None, vid
         video_url: URL of video to generate embeddings for (optional)
         dimensions: Optional embedding dimensions (not used for multimodal embeddings)
         output_type: Format for the embedding output (not used for multimodal embeddings)
+        inputs: Optional list of prebuilt multimodal input items (e.g. [{"image": data_uri}, ...]),
+                used instead of input_text/image_url/video_url to embed several items in one call
+        coalesce: Share an in-flight identical call (defaults to COALESCE_REQUESTS)
         
     Returns:
         Dictionary containing the embedding data and elapsed time
     """
-    # Set the API key for DashScope
-    set_dashscope_api_key(provider_name)
-    
-    start_time = time.time()
-    
     # Check if we're using the multimodal embedding model
     is_multimodal = "multimodal" in model if isinstance(model, str) else False
     
     if is_multimodal:
         # Prepare input for multimodal embedding
-        if not any([input_text, image_url, video_url]):
-            raise ValueError("At least one of input_text, image_url, or video_url must be provided")
+        if not any([input_text, image_url, video_url, inputs]):
+            raise ValueError("At least one of input_text, image_url, video_url or inputs must be provided")
         
         # For SDK, input should be a list of dictionaries
-        inputs = []
-        if input_text:
-            inputs.append({"text": input_text})
-        if image_url:
-            inputs.append({"image": image_url})
-        if video_url:
-            inputs.append({"video": video_url})
+        if inputs is None:
+            inputs = []
+            if input_text:
+                inputs.append({"text": input_text})
+            if image_url:
+                inputs.append({"image": image_url})
+            if video_url:
+                inputs.append({"video": video_url})
         
         api_params = {
             "model": model,
@@ -98,51 +117,81 @@ def process_embedding(provider_name, model, input_text=None, image_url=None, vid
         if output_type:
             api_params["output_type"] = output_type
 
+    if not (COALESCE_REQUESTS if coalesce is None else coalesce):
+        return send_embedding(provider_name, api_params, is_multimodal)
+
+    key = single_flight.fingerprint(provider_name, api_params)
+    response, shared = EMBEDDING_FLIGHT.do(key, lambda: send_embedding(provider_name, api_params, is_multimodal),
+                                           provider_name, model)
+    return dict(response, coalesced=True) if shared and response else response
+
+def estimate_input_tokens(provider_name, api_params):
+    """Rough input tokens (about 3 characters per token) for providers with a TPM limit (0 otherwise)"""
+    limit = rate_limiter.LIMITS.get(provider_name)
+    if limit is None or not limit.tpm:
+        return 0
+    inputs = api_params["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+    texts = [item.get("text", "") if isinstance(item, dict) else item for item in inputs or []]
+    return sum(len(text) // 3 + 1 for text in texts if isinstance(text, str))
+
+def send_embedding(provider_name, api_params, is_multimodal):
+    """Send an embedding request with retries and return the process_embedding response"""
+    # Set the API key for DashScope
+    set_dashscope_api_key(provider_name)
+    model = api_params["model"]
+
+    start_time = time.time()
+
+    ledger.check_budget(provider_name, model)
+
     max_retries = 5
     base_delay = 30
     result = None
+    tracker = telemetry.RequestTracker("multimodal_embedding" if is_multimodal else "embedding", provider_name, model)
+    estimated_tokens = estimate_input_tokens(provider_name, api_params)
 
     for attempt in range(max_retries):
         try:
-            print(f"Attempt {attempt + 1}: Sending embedding request to DashScope API...", flush=True)
+            logger.debug("Attempt %d: Sending embedding request to DashScope API...", attempt + 1)
             
-            if is_multimodal:
-                response = dashscope.MultiModalEmbedding.call(**api_params)
-            else:
-                response = dashscope.TextEmbedding.call(**api_params)
+            with adaptive_limiter.slot(provider_name), \
+                    rate_limiter.slot(provider_name, estimated_tokens) as permit, tracker.attempt(attempt + 1):
+                if is_multimodal:
+                    response = dashscope.MultiModalEmbedding.call(**api_params)
+                else:
+                    response = dashscope.TextEmbedding.call(**api_params)
             
-            # Only print raw response in debug mode
-            if DEBUG_MODE:
-                print("Raw API response:", flush=True)
-                print(response, flush=True)
+                # Only log raw response in debug mode
+                if DEBUG_MODE:
+                    logger.info("Raw API response: %s", response)
             
-            if response.status_code == HTTPStatus.OK:
-                result = response
-                print("Successfully received embedding from DashScope API", flush=True)
-                break
-            else:
-                raise Exception(f"API Error: {response}")
+                if response.status_code != HTTPStatus.OK:
+                    raise DashScopeAPIError(response)
+                usage = getattr(response, 'usage', None)
+                permit.used_tokens = getattr(usage, 'total_tokens', None) or getattr(usage, 'input_tokens', None)
+            result = response
+            break
             
         except Exception as e:
-            print(f"DashScope API encountered an error: {e}", flush=True)
-            print("Error details:", flush=True)
-            print(f"Type: {type(e).__name__}", flush=True)
-            print(f"Arguments: {e.args}", flush=True)
+            logger.warning("DashScope API encountered an error (%s): %s", type(e).__name__, e)
             
             if attempt < max_retries - 1:
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 10)
-                print(f"Retrying in {delay:.2f} seconds...", flush=True)
-                sys.stdout.flush()
+                logger.warning("Retrying DashScope embedding request in %.2f seconds...", delay)
+                tracker.backoff(delay)
                 time.sleep(delay)
             else:
-                print(f"Maximum retry attempts reached.", flush=True)
+                logger.error("Maximum retry attempts reached for DashScope.")
+                tracker.finish(error=e)
                 raise
 
     end_time = time.time()
     elapsed_time = end_time - start_time
 
     if result:
-        print(f"Embedding processing completed", flush=True)
+        logger.info("Embedding processing completed")
         
         # Extract usage information based on model type
         if is_multimodal:
@@ -150,6 +199,9 @@ def process_embedding(provider_name, model, input_text=None, image_url=None, vid
             prompt_tokens = token_count  # For multimodal, input_tokens is equivalent to prompt_tokens
             image_count = result.usage.image_count if hasattr(result, 'usage') and hasattr(result.usage, 'image_count') else 0
             video_duration = result.usage.duration if hasattr(result, 'usage') and hasattr(result.usage, 'duration') else 0
+            tracker.finish(input_tokens=token_count or 0)
+            ledger.record_usage(provider_name, model, "multimodal_embedding", input_tokens=token_count,
+                                image_count=image_count, video_duration=video_duration)
             
             return {
                 "result": result,
@@ -162,6 +214,8 @@ def process_embedding(provider_name, model, input_text=None, image_url=None, vid
         else:
             token_count = result.usage.total_tokens if hasattr(result, 'usage') and hasattr(result.usage, 'total_tokens') else None
             prompt_tokens = result.usage.input_tokens if hasattr(result, 'usage') and hasattr(result.usage, 'input_tokens') else None
+            tracker.finish(input_tokens=token_count or 0)
+            ledger.record_usage(provider_name, model, "embedding", input_tokens=token_count)
             
             return {
                 "result": result,
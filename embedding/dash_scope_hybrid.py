@@ -0,0 +1,183 @@
+import os
+import sys
+import time
+import numpy as np
+
+# Add the parent directory to sys.path to import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding import dash_scope_embedding
+
+# text-embedding-v3 单次请求最多10条文本
+MAX_TEXTS_PER_REQUEST = 10
+DEFAULT_ALPHA = 0.7
+
+
+class SparseMatrix:
+    """
+    Compact CSR matrix of sparse (lexical) embeddings.
+
+    Row i holds the non-zero token weights of text i: column ids are
+    indices[indptr[i]:indptr[i + 1]] (sorted) with the matching values.
+    """
+
+    def __init__(self, indices, values, indptr, num_columns=None):
+        self.indices = np.asarray(indices, dtype=np.int32)
+        self.values = np.asarray(values, dtype=np.float32)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        if num_columns is None:
+            num_columns = int(self.indices.max()) + 1 if len(self.indices) else 0
+        self.shape = (len(self.indptr) - 1, num_columns)
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Build from a list of rows, each a list of {"index": int, "value": float} dicts"""
+        lengths = np.fromiter((len(row) for row in rows), dtype=np.int64, count=len(rows))
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        indices = np.fromiter((item["index"] for row in rows for item in row), dtype=np.int32, count=int(indptr[-1]))
+        values = np.fromiter((item["value"] for row in rows for item in row), dtype=np.float32, count=int(indptr[-1]))
+        # 每行内按列号排序，便于后续 searchsorted 匹配
+        row_ids = np.repeat(np.arange(len(rows)), lengths)
+        order = np.lexsort((indices, row_ids))
+        return cls(indices[order], values[order], indptr)
+
+    @classmethod
+    def vstack(cls, matrices):
+        matrices = list(matrices)
+        offsets = np.cumsum([0] + [m.indptr[-1] for m in matrices[:-1]])
+        indptr = np.concatenate([[0]] + [m.indptr[1:] + offset for m, offset in zip(matrices, offsets)])
+        return cls(np.concatenate([m.indices for m in matrices]), np.concatenate([m.values for m in matrices]),
+                   indptr, max((m.shape[1] for m in matrices), default=0))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def row(self, i):
+        start, end = self.indptr[i], self.indptr[i + 1]
+        return self.indices[start:end], self.values[start:end]
+
+    def select(self, rows):
+        """Return a new SparseMatrix made of the given rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        starts = self.indptr[rows]
+        lengths = self.indptr[rows + 1] - starts
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=indptr[1:])
+        positions = np.repeat(starts - indptr[:-1], lengths) + np.arange(indptr[-1])
+        return SparseMatrix(self.indices[positions], self.values[positions], indptr, self.shape[1])
+
+    def row_ids(self):
+        """Row number of every stored value"""
+        return np.repeat(np.arange(len(self), dtype=np.int32), np.diff(self.indptr))
+
+    def dot(self, other):
+        """
+        Sparse-sparse product self @ other.T as a dense (len(self), len(other)) array.
+
+        For each row of self, matching columns in all rows of other are found at once with
+        searchsorted and the products are summed per row with bincount, so there is no
+        per-token Python loop.
+        """
+        scores = np.zeros((len(self), len(other)), dtype=np.float32)
+        if len(other) == 0 or len(other.indices) == 0:
+            return scores
+        other_rows = other.row_ids()
+        for i in range(len(self)):
+            query_indices, query_values = self.row(i)
+            if len(query_indices) == 0:
+                continue
+            positions = np.searchsorted(query_indices, other.indices)
+            positions[positions == len(query_indices)] = 0
+            matched = query_indices[positions] == other.indices
+            contributions = np.where(matched, query_values[positions] * other.values, 0.0)
+            scores[i] = np.bincount(other_rows, weights=contributions, minlength=len(other))
+        return scores
+
+    def to_dict(self):
+        return {"indices": self.indices, "values": self.values, "indptr": self.indptr, "shape": self.shape}
+
+
+def normalize_hybrid_output(result):
+    """
+    Convert a DashScope dense&sparse TextEmbedding response into compact arrays.
+
+    Args:
+        result: The "result" object returned by process_embedding with output_type="dense&sparse"
+
+    Returns:
+        Tuple of (dense float32 matrix of shape (n, d), SparseMatrix with n rows)
+    """
+    embeddings = sorted(result.output["embeddings"], key=lambda item: item.get("text_index", 0))
+    dense = np.asarray([item["embedding"] for item in embeddings], dtype=np.float32)
+    sparse = SparseMatrix.from_rows([item.get("sparse_embedding") or [] for item in embeddings])
+    return dense, sparse
+
+
+def process_hybrid_embedding(provider_name, model, texts, dimensions=None):
+    """
+    Generate dense+sparse embeddings for a list of texts with DashScope.
+
+    Texts are sent in batches of MAX_TEXTS_PER_REQUEST and the outputs are stacked.
+
+    Args:
+        provider_name: Name of the provider (should be ALIYUN)
+        model: The text embedding model (e.g. text-embedding-v3)
+        texts: List of texts
+        dimensions: Optional dense embedding dimensions
+
+    Returns:
+        Dictionary containing "dense" (float32 matrix), "sparse" (SparseMatrix),
+        total tokens and elapsed time
+    """
+    start_time = time.time()
+    dense_parts = []
+    sparse_parts = []
+    total_tokens = 0
+
+    for start in range(0, len(texts), MAX_TEXTS_PER_REQUEST):
+        response = dash_scope_embedding.process_embedding(
+            provider_name=provider_name,
+            model=model,
+            input_text=texts[start:start + MAX_TEXTS_PER_REQUEST],
+            dimensions=dimensions,
+            output_type="dense&sparse"
+        )
+        dense, sparse = normalize_hybrid_output(response["result"])
+        dense_parts.append(dense)
+        sparse_parts.append(sparse)
+        total_tokens += response.get("total_tokens") or 0
+
+    return {
+        "dense": np.concatenate(dense_parts) if dense_parts else np.zeros((0, 0), dtype=np.float32),
+        "sparse": SparseMatrix.vstack(sparse_parts) if sparse_parts else SparseMatrix([], [], [0]),
+        "total_tokens": total_tokens,
+        "elapsed_time": time.time() - start_time
+    }
+
+
+def normalize_rows(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def hybrid_scores(query_dense, query_sparse, doc_dense, doc_sparse, alpha=DEFAULT_ALPHA):
+    """
+    Score queries against documents with a weighted sum of dense and sparse similarity.
+
+    score = alpha * cosine(dense) + (1 - alpha) * dot(sparse)
+
+    Args:
+        query_dense: (m, d) dense query embeddings
+        query_sparse: SparseMatrix with m rows
+        doc_dense: (n, d) dense document embeddings
+        doc_sparse: SparseMatrix with n rows
+        alpha: Weight of the dense (semantic) score
+
+    Returns:
+        (m, n) float32 score matrix
+    """
+    dense_scores = normalize_rows(np.asarray(query_dense, dtype=np.float32)) @ \
+        normalize_rows(np.asarray(doc_dense, dtype=np.float32)).T
+    return alpha * dense_scores + (1.0 - alpha) * query_sparse.dot(doc_sparse)
@@ -0,0 +1,185 @@
+import os
+import io
+import sys
+import time
+import base64
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+# Add the parent directory to sys.path to import the LLM and embedding modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+from embedding import dash_scope_embedding
+
+logger = telemetry.get_logger("dash_scope_multimodal_batch")
+
+# Pillow 为可选依赖，只有本地图片预处理需要
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+
+# 模型内部会把图片缩放到较小尺寸，上传更大的图片只会浪费带宽
+DEFAULT_MAX_SIDE = 512
+DEFAULT_QUALITY = 85
+# 单次请求的限制（条目数和请求体大小）
+MAX_ITEMS_PER_REQUEST = 8
+MAX_BYTES_PER_REQUEST = 6 * 1024 * 1024
+REMOTE_PREFIXES = ("http://", "https://", "oss://", "data:")
+
+
+def preprocess_image(source, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY):
+    """
+    Resize and recompress a local image and encode it as a data URI.
+
+    Runs in a worker process. JPEG files are decoded at reduced size with draft mode,
+    and images already small enough in JPEG format are sent unchanged.
+
+    Args:
+        source: Path of a local image file or the raw image bytes
+        max_side: Maximum length of the longest side in pixels
+        quality: JPEG quality used when recompressing
+
+    Returns:
+        "data:image/jpeg;base64,..." string
+    """
+    if Image is None:
+        raise ImportError("Pillow is required for local image preprocessing: pip install pillow")
+
+    if isinstance(source, (bytes, bytearray)):
+        data = bytes(source)
+    else:
+        with open(source, "rb") as f:
+            data = f.read()
+
+    image = Image.open(io.BytesIO(data))
+    if image.format == "JPEG" and max(image.size) <= max_side:
+        return "data:image/jpeg;base64," + base64.b64encode(data).decode("ascii")
+
+    if image.format == "JPEG":
+        image.draft("RGB", (max_side, max_side))
+    image = ImageOps.exif_transpose(image)
+    if max(image.size) > max_side:
+        image.thumbnail((max_side, max_side), Image.BICUBIC)
+
+    output = io.BytesIO()
+    image.convert("RGB").save(output, "JPEG", quality=quality, optimize=True)
+    return "data:image/jpeg;base64," + base64.b64encode(output.getvalue()).decode("ascii")
+
+
+def is_local_image(value):
+    return isinstance(value, (bytes, bytearray)) or not str(value).startswith(REMOTE_PREFIXES)
+
+
+def iter_ready_inputs(pool, items, max_side, quality, max_pending):
+    """
+    Yield (index, input item) as soon as each item is ready to upload.
+
+    Text, video and remote image items are ready immediately; local images are
+    preprocessed in the process pool with at most max_pending in flight, and yielded
+    in completion order.
+    """
+    local_images = []
+    for index, item in enumerate(items):
+        if "image" in item and is_local_image(item["image"]):
+            local_images.append((index, item["image"]))
+        else:
+            yield index, item
+
+    queue = iter(local_images)
+    pending = {}
+    while True:
+        while len(pending) < max_pending:
+            next_item = next(queue, None)
+            if next_item is None:
+                break
+            pending[pool.submit(preprocess_image, next_item[1], max_side, quality)] = next_item[0]
+        if not pending:
+            break
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            yield pending.pop(future), {"image": future.result()}
+
+
+def embed_batch(provider_name, model, batch, dimensions):
+    """Embed one batch of (index, input item) and return (indices, response)"""
+    response = dash_scope_embedding.process_embedding(
+        provider_name=provider_name,
+        model=model,
+        inputs=[item for _, item in batch],
+        dimensions=dimensions
+    )
+    return [index for index, _ in batch], response
+
+
+def process_multimodal_embeddings(provider_name, model, items, max_side=DEFAULT_MAX_SIDE, quality=DEFAULT_QUALITY,
+                                  batch_size=MAX_ITEMS_PER_REQUEST, max_batch_bytes=MAX_BYTES_PER_REQUEST,
+                                  preprocess_workers=None, upload_workers=2, dimensions=None):
+    """
+    Generate multimodal embeddings for many items with DashScope.
+
+    Local images (file paths or bytes) are resized and recompressed in a process pool and
+    sent as data URIs; remote URLs, text and video items are passed through. Ready items are
+    grouped into batches within the request limits and uploaded by a thread pool while the
+    remaining images are still being preprocessed.
+
+    Args:
+        provider_name: Name of the provider (should be ALIYUN)
+        model: The multimodal embedding model to use
+        items: List of input items, each {"text": str}, {"image": path | bytes | url} or {"video": url}
+        max_side: Maximum image side in pixels after resizing
+        quality: JPEG quality used when recompressing
+        batch_size: Maximum number of items per request
+        max_batch_bytes: Maximum encoded size of the items in one request
+        preprocess_workers: Number of preprocessing processes (default: CPU count)
+        upload_workers: Number of concurrent embedding requests
+        dimensions: Optional embedding dimensions
+
+    Returns:
+        Dictionary containing the embeddings (in item order), token and image counts,
+        number of batches and elapsed time
+    """
+    start_time = time.time()
+    embeddings = [None] * len(items)
+    uploads = []
+
+    with ProcessPoolExecutor(max_workers=preprocess_workers) as pool, \
+            ThreadPoolExecutor(max_workers=upload_workers) as uploader:
+        max_pending = 2 * (preprocess_workers or os.cpu_count() or 1)
+        batch = []
+        batch_bytes = 0
+        for index, item in iter_ready_inputs(pool, items, max_side, quality, max_pending):
+            item_bytes = sum(len(value) for value in item.values() if isinstance(value, str))
+            if batch and (len(batch) >= batch_size or batch_bytes + item_bytes > max_batch_bytes):
+                uploads.append(uploader.submit(embed_batch, provider_name, model, batch, dimensions))
+                batch = []
+                batch_bytes = 0
+            batch.append((index, item))
+            batch_bytes += item_bytes
+        if batch:
+            uploads.append(uploader.submit(embed_batch, provider_name, model, batch, dimensions))
+
+        total_tokens = 0
+        image_count = 0
+        for future in uploads:
+            indices, response = future.result()
+            for embedding in response["result"].output["embeddings"]:
+                embeddings[indices[embedding["index"]]] = embedding["embedding"]
+            total_tokens += response.get("total_tokens") or 0
+            image_count += response.get("image_count") or 0
+
+    elapsed_time = time.time() - start_time
+    logger.info("Embedded %d items in %d batch(es), %.2f seconds", len(items), len(uploads), elapsed_time)
+
+    return {
+        "embeddings": embeddings,
+        "total_tokens": total_tokens,
+        "image_count": image_count,
+        "batches": len(uploads),
+        "elapsed_time": elapsed_time
+    }
+
+
+def process_image_embeddings(provider_name, model, images, **kwargs):
+    """Convenience wrapper: embed a list of image paths, bytes or URLs"""
+    return process_multimodal_embeddings(provider_name, model, [{"image": image} for image in images], **kwargs)
@@ -0,0 +1,386 @@
+import os
+import sys
+import json
+import time
+import queue
+import itertools
+import threading
+import numpy as np
+
+# Add the parent directory to sys.path to import the LLM and embedding modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry
+from LLM.map_reduce import chunk_content
+from embedding import openai_based_embedding, dash_scope_embedding
+from embedding.similarity import embeddings_to_matrix
+
+logger = telemetry.get_logger("ingestion_pipeline")
+
+DEFAULT_CHUNK_TOKENS = 512
+DEFAULT_OVERLAP_TOKENS = 64
+DEFAULT_BATCH_SIZE = 10
+DEFAULT_QUEUE_SIZE = 64
+DEFAULT_EXTENSIONS = (".txt", ".md")
+# 队列操作的超时，用于定期检查停止信号
+POLL_INTERVAL = 0.1
+
+# 各阶段之间传递的结束标记
+DONE = object()
+
+
+def make_embed_fn(backend, provider_name, model, dimensions=None):
+    """
+    Build the batch embedding function used by the pipeline.
+
+    Args:
+        backend: "openai" (embedding/openai_based_embedding) or "dashscope" (embedding/dash_scope_embedding)
+        provider_name: Name of the provider
+        model: The embedding model to use
+        dimensions: Optional embedding dimensions
+
+    Returns:
+        Callable taking a list of texts and returning (float32 matrix, token count)
+    """
+    def embed(texts):
+        if backend == "openai":
+            response = openai_based_embedding.process_embedding(provider_name, model, texts, dimensions=dimensions)
+        elif backend == "dashscope":
+            response = dash_scope_embedding.process_embedding(provider_name, model, input_text=texts,
+                                                              dimensions=dimensions)
+        else:
+            raise ValueError(f"Unknown embedding backend '{backend}'")
+        if response is None:
+            raise RuntimeError(f"Embedding request to {provider_name} failed")
+        return embeddings_to_matrix(response), response.get("total_tokens") or 0
+
+    return embed
+
+
+def list_files(paths, extensions=DEFAULT_EXTENSIONS):
+    """Expand files and directories into a sorted list of text files"""
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            for root, _, names in os.walk(path):
+                files.extend(os.path.join(root, name) for name in names if name.endswith(extensions))
+        else:
+            files.append(path)
+    return sorted(files)
+
+
+class VectorStore:
+    """
+    Append-only on-disk vector index: raw float32 rows (vectors.f32), one JSON metadata
+    line per row (metadata.jsonl) and a checkpoint of completed files (checkpoint.json).
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.vectors_path = os.path.join(directory, "vectors.f32")
+        self.metadata_path = os.path.join(directory, "metadata.jsonl")
+        self.checkpoint_path = os.path.join(directory, "checkpoint.json")
+        self.checkpoint = {"rows": 0, "dimension": None, "done_files": {}}
+        if os.path.exists(self.checkpoint_path):
+            with open(self.checkpoint_path, encoding="utf-8") as f:
+                self.checkpoint = json.load(f)
+        self.lock = threading.Lock()
+        self._truncate_to_checkpoint()
+        self.vectors_file = open(self.vectors_path, "ab")
+        self.metadata_file = open(self.metadata_path, "a", encoding="utf-8")
+
+    def _truncate_to_checkpoint(self):
+        """Drop rows written after the last checkpoint (e.g. by a crashed run)"""
+        rows = self.checkpoint["rows"]
+        dimension = self.checkpoint["dimension"] or 0
+        if os.path.exists(self.metadata_path):
+            with open(self.metadata_path, encoding="utf-8") as f:
+                lines = list(itertools.islice(f, rows))
+            if len(lines) < rows:
+                # 元数据尚未落盘时崩溃，元数据可能比检查点记录的行数短
+                logger.warning("Metadata of %s has %d of %d checkpointed rows, truncating the index",
+                               self.directory, len(lines), rows)
+                rows = self.checkpoint["rows"] = len(lines)
+            with open(self.metadata_path, "w", encoding="utf-8") as f:
+                f.writelines(lines)
+        if os.path.exists(self.vectors_path):
+            with open(self.vectors_path, "r+b") as f:
+                f.truncate(rows * dimension * 4)
+
+    def is_done(self, path, signature):
+        return self.checkpoint["done_files"].get(path) == signature
+
+    def append_file(self, path, signature, vectors, metadata):
+        """Append all rows of one file and checkpoint it atomically"""
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self.lock:
+            if self.checkpoint["dimension"] is None:
+                self.checkpoint["dimension"] = int(vectors.shape[1])
+            self.vectors_file.write(vectors.tobytes())
+            self.metadata_file.writelines(json.dumps(item, ensure_ascii=False) + "\n" for item in metadata)
+            self.vectors_file.flush()
+            self.metadata_file.flush()
+            os.fsync(self.vectors_file.fileno())
+            os.fsync(self.metadata_file.fileno())
+
+            self.checkpoint["rows"] += len(vectors)
+            self.checkpoint["done_files"][path] = signature
+            self._save_checkpoint()
+
+    def mark_done(self, path, signature):
+        """Checkpoint a file that produced no rows (empty or whitespace only)"""
+        with self.lock:
+            self.checkpoint["done_files"][path] = signature
+            self._save_checkpoint()
+
+    def _save_checkpoint(self):
+        temp_path = self.checkpoint_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as f:
+            json.dump(self.checkpoint, f)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def close(self):
+        self.vectors_file.close()
+        self.metadata_file.close()
+
+    def load(self):
+        """Return (memmap of shape (rows, dimension), list of metadata dicts)"""
+        rows, dimension = self.checkpoint["rows"], self.checkpoint["dimension"]
+        if not rows:
+            return np.zeros((0, dimension or 0), dtype=np.float32), []
+        vectors = np.memmap(self.vectors_path, dtype=np.float32, mode="r", shape=(rows, dimension))
+        with open(self.metadata_path, encoding="utf-8") as f:
+            metadata = [json.loads(line) for line in f]
+        return vectors, metadata
+
+
+class StageStats:
+    """Per-stage counters: items processed and time spent working vs waiting"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_time = 0.0
+        self.lock = threading.Lock()
+
+    def add(self, items, busy_time):
+        with self.lock:
+            self.items += items
+            self.busy_time += busy_time
+
+    def report(self, wall_time):
+        return {
+            "items": self.items,
+            "busy_time": self.busy_time,
+            "items_per_sec": self.items / wall_time if wall_time else 0.0,
+            "utilization": self.busy_time / wall_time if wall_time else 0.0,
+        }
+
+
+class IngestionPipeline:
+    """
+    Streaming corpus ingestion: read files -> chunk -> batch -> embed -> write index.
+
+    Every stage runs in its own thread(s) and the stages are connected by bounded
+    queues, so file parsing, embedding requests and index writes overlap, and a slow
+    stage blocks the ones before it instead of letting memory grow (backpressure).
+    Files already recorded in the store checkpoint are skipped, so an interrupted run
+    can be resumed by starting it again.
+    """
+
+    def __init__(self, embed_fn, store_dir, chunk_tokens=DEFAULT_CHUNK_TOKENS, overlap_tokens=DEFAULT_OVERLAP_TOKENS,
+                 batch_size=DEFAULT_BATCH_SIZE, embed_workers=4, queue_size=DEFAULT_QUEUE_SIZE, batch_timeout=0.5):
+        """
+        Args:
+            embed_fn: Callable(list of texts) -> (matrix, tokens), see make_embed_fn
+            store_dir: Directory of the VectorStore
+            chunk_tokens: Maximum tokens per chunk
+            overlap_tokens: Overlap between consecutive chunks
+            batch_size: Maximum number of chunks per embedding request
+            embed_workers: Number of concurrent embedding requests
+            queue_size: Capacity of every inter-stage queue
+            batch_timeout: Seconds to wait before sending an incomplete batch
+        """
+        self.embed_fn = embed_fn
+        self.store_dir = store_dir
+        self.chunk_tokens = chunk_tokens
+        self.overlap_tokens = overlap_tokens
+        self.batch_size = batch_size
+        self.embed_workers = embed_workers
+        self.queue_size = queue_size
+        self.batch_timeout = batch_timeout
+
+    def run(self, paths):
+        """
+        Ingest files and directories.
+
+        Returns:
+            Report dictionary with files/chunks/tokens counts and per-stage throughput
+
+        Raises:
+            The first exception raised by any stage (progress up to the last completed
+            file is kept in the checkpoint)
+        """
+        start_time = time.time()
+        store = VectorStore(self.store_dir)
+        self.stop = threading.Event()
+        self.errors = []
+        self.tokens = 0
+        self.tokens_lock = threading.Lock()
+        self.stats = {name: StageStats(name) for name in ("read", "chunk", "embed", "write")}
+        self.skipped = 0
+
+        files = list_files(paths)
+        file_queue = queue.Queue(self.queue_size)
+        chunk_queue = queue.Queue(self.queue_size)
+        batch_queue = queue.Queue(max(2, self.queue_size // self.batch_size))
+        result_queue = queue.Queue(self.queue_size)
+
+        threads = [
+            threading.Thread(target=self._guard, args=(self._read, files, store, file_queue)),
+            threading.Thread(target=self._guard, args=(self._chunk, file_queue, chunk_queue, store)),
+            threading.Thread(target=self._guard, args=(self._batch, chunk_queue, batch_queue)),
+            threading.Thread(target=self._guard, args=(self._write, result_queue, store)),
+        ]
+        embedders = [threading.Thread(target=self._guard, args=(self._embed, batch_queue, result_queue))
+                     for _ in range(self.embed_workers)]
+        for thread in threads + embedders:
+            thread.start()
+        for thread in embedders:
+            thread.join()
+        self._put(result_queue, DONE)
+        for thread in threads:
+            thread.join()
+        store.close()
+
+        if self.errors:
+            raise self.errors[0]
+
+        wall_time = time.time() - start_time
+        report = {
+            "files": len(files),
+            "skipped_files": self.skipped,
+            "chunks": self.stats["write"].items,
+            "tokens": self.tokens,
+            "elapsed_time": wall_time,
+            "stages": {name: stats.report(wall_time) for name, stats in self.stats.items()},
+        }
+        logger.info("Ingested %d chunks from %d file(s) in %.2f seconds (%d already done)",
+                    report["chunks"], len(files) - self.skipped, wall_time, self.skipped)
+        return report
+
+    def _guard(self, target, *args):
+        try:
+            target(*args)
+        except Exception as e:
+            logger.exception("Ingestion stage %s failed: %s", target.__name__, e)
+            self.errors.append(e)
+            self.stop.set()
+
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=POLL_INTERVAL)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q, timeout=None):
+        deadline = None if timeout is None else time.time() + timeout
+        while not self.stop.is_set():
+            try:
+                return q.get(timeout=POLL_INTERVAL)
+            except queue.Empty:
+                if deadline is not None and time.time() >= deadline:
+                    raise
+        return DONE
+
+    def _read(self, files, store, file_queue):
+        for path in files:
+            stat = os.stat(path)
+            signature = f"{stat.st_size}:{int(stat.st_mtime)}"
+            if store.is_done(path, signature):
+                self.skipped += 1
+                continue
+            start = time.time()
+            with open(path, encoding="utf-8", errors="replace") as f:
+                text = f.read()
+            self.stats["read"].add(1, time.time() - start)
+            if not self._put(file_queue, (path, signature, text)):
+                return
+        self._put(file_queue, DONE)
+
+    def _chunk(self, file_queue, chunk_queue, store):
+        while True:
+            item = self._get(file_queue)
+            if item is DONE:
+                break
+            path, signature, text = item
+            start = time.time()
+            chunks = [chunk for chunk in chunk_content(text, self.chunk_tokens, self.overlap_tokens) if chunk.strip()]
+            self.stats["chunk"].add(len(chunks), time.time() - start)
+            if not chunks:
+                # 空文件不发送给 embedding API（空输入会被拒绝），直接记为完成
+                store.mark_done(path, signature)
+                continue
+            for index, chunk in enumerate(chunks):
+                if not self._put(chunk_queue, {"path": path, "signature": signature, "chunk_index": index,
+                                               "chunk_count": len(chunks), "text": chunk}):
+                    return
+        self._put(chunk_queue, DONE)
+
+    def _batch(self, chunk_queue, batch_queue):
+        batch = []
+        while True:
+            try:
+                item = self._get(chunk_queue, timeout=self.batch_timeout if batch else None)
+            except queue.Empty:
+                item = None
+            if item is DONE:
+                break
+            if item is not None:
+                batch.append(item)
+            if batch and (item is None or len(batch) >= self.batch_size):
+                if not self._put(batch_queue, batch):
+                    return
+                batch = []
+        if batch:
+            self._put(batch_queue, batch)
+        for _ in range(self.embed_workers):
+            self._put(batch_queue, DONE)
+
+    def _embed(self, batch_queue, result_queue):
+        while True:
+            batch = self._get(batch_queue)
+            if batch is DONE:
+                break
+            start = time.time()
+            vectors, tokens = self.embed_fn([item["text"] for item in batch])
+            self.stats["embed"].add(len(batch), time.time() - start)
+            with self.tokens_lock:
+                self.tokens += tokens
+            if not self._put(result_queue, (batch, vectors)):
+                return
+
+    def _write(self, result_queue, store):
+        # 按文件缓存，文件的全部块到齐后一次性写入并记录检查点
+        pending = {}
+        while True:
+            item = self._get(result_queue)
+            if item is DONE:
+                break
+            batch, vectors = item
+            for chunk, vector in zip(batch, vectors):
+                entry = pending.setdefault(chunk["path"], {"signature": chunk["signature"], "rows": {}})
+                entry["rows"][chunk["chunk_index"]] = (vector, {"path": chunk["path"],
+                                                                "chunk_index": chunk["chunk_index"],
+                                                                "text": chunk["text"]})
+                if len(entry["rows"]) == chunk["chunk_count"]:
+                    start = time.time()
+                    rows = [entry["rows"][i] for i in range(chunk["chunk_count"])]
+                    store.append_file(chunk["path"], entry["signature"], np.stack([row[0] for row in rows]),
+                                      [row[1] for row in rows])
+                    self.stats["write"].add(len(rows), time.time() - start)
+                    del pending[chunk["path"]]
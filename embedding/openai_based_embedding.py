@@ -1,12 +1,30 @@
 import os
 import time
+import asyncio
 import random
 import sys
+import logging
+import weakref
+import threading
 import configparser
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
+
+# Add the parent directory to sys.path to import the telemetry module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import telemetry, ledger, single_flight, rate_limiter, adaptive_limiter
+
+logger = telemetry.get_logger("openai_based_embedding")
 
 # 调试模式开关
 DEBUG_MODE = False
+# 并发的相同请求合并为一次上游调用
+COALESCE_REQUESTS = True
+
+# 复用同一服务商的同步客户端及其 HTTP 连接池（按 api_key 和 base_url 区分，修改 PROVIDERS 后自动新建）
+POOL_CLIENTS = True
+EMBEDDING_FLIGHT = single_flight.SingleFlight("embedding")
+ASYNC_EMBEDDING_FLIGHT = single_flight.AsyncSingleFlight("embedding")
 
 # Load providers from .provider_env file
 def load_providers():
@@ -24,44 +42,79 @@ def load_providers():
             }
         
         if not providers:
-            print("Warning: No providers found in .provider_env file", flush=True)
+            logger.warning("No providers found in .provider_env file")
     except Exception as e:
-        print(f"Error loading providers: {e}", flush=True)
+        logger.error("Error loading providers: %s", e)
     
     return providers
 
 PROVIDERS = load_providers()
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+# 异步客户端绑定在事件循环上，每个事件循环各自复用
+ASYNC_CLIENTS = weakref.WeakKeyDictionary()
 
 def get_openai_client(provider_name):
-    """Get OpenAI client for the specified provider"""
+    """Get OpenAI client for the specified provider (shared by all threads when POOL_CLIENTS is on)"""
+    if provider_name not in PROVIDERS:
+        raise ValueError(f"Provider '{provider_name}' not found. Available providers: {list(PROVIDERS.keys())}")
+    
+    provider = PROVIDERS[provider_name]
+    if not POOL_CLIENTS:
+        return OpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+
+    key = (provider_name, provider['api_key'], provider['base_url'])
+    with CLIENTS_LOCK:
+        client = CLIENTS.get(key)
+        if client is None:
+            client = CLIENTS[key] = OpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+    return client
+
+def get_async_openai_client(provider_name):
+    """Get AsyncOpenAI client for the specified provider (shared within the running event loop when POOL_CLIENTS is on)"""
     if provider_name not in PROVIDERS:
         raise ValueError(f"Provider '{provider_name}' not found. Available providers: {list(PROVIDERS.keys())}")
     
     provider = PROVIDERS[provider_name]
-    return OpenAI(
-        api_key=provider['api_key'],
-        base_url=provider['base_url']
-    )
+    if not POOL_CLIENTS:
+        return AsyncOpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+
+    clients = ASYNC_CLIENTS.setdefault(asyncio.get_running_loop(), {})
+    key = (provider_name, provider['api_key'], provider['base_url'])
+    client = clients.get(key)
+    if client is None:
+        client = clients[key] = AsyncOpenAI(api_key=provider['api_key'], base_url=provider['base_url'])
+    return client
 
-def process_embedding(provider_name, model, input_text, dimensions=None, encoding_format="float"):
+def process_embedding(provider_name, model, input_text, dimensions=None, encoding_format="float", coalesce=None):
     """
     Generate embeddings using the specified provider.
     
+    Concurrent identical requests share one upstream call unless coalesce=False;
+    callers that joined an in-flight call get a copy with "coalesced": True.
+    
     Args:
         provider_name: Name of the provider to use
         model: The embedding model to use
         input_text: Text to generate embeddings for
         dimensions: Optional embedding dimensions (supported by models like text-embedding-v3)
         encoding_format: Format for the embedding output (default "float")
+        coalesce: Share an in-flight identical call (defaults to COALESCE_REQUESTS)
         
     Returns:
         Dictionary containing the embedding data, token counts, and elapsed time
     """
-    # Get the OpenAI client for the specified provider
-    client = get_openai_client(provider_name)
-    
-    start_time = time.time()
-    
+    api_params = build_api_params(model, input_text, dimensions, encoding_format)
+
+    if not (COALESCE_REQUESTS if coalesce is None else coalesce):
+        return send_embedding(provider_name, api_params)
+
+    key = single_flight.fingerprint(provider_name, api_params)
+    response, shared = EMBEDDING_FLIGHT.do(key, lambda: send_embedding(provider_name, api_params), provider_name, model)
+    return dict(response, coalesced=True) if shared and response else response
+
+def build_api_params(model, input_text, dimensions=None, encoding_format="float"):
+    """Build the keyword arguments for client.embeddings.create"""
     api_params = {
         "model": model,
         "input": input_text,
@@ -72,50 +125,80 @@ def process_embedding(provider_name, model, input_text, dimensions=None, encodin
     if dimensions:
         api_params["dimensions"] = dimensions
 
+    return api_params
+
+def estimate_input_tokens(provider_name, api_params):
+    """Rough input tokens (about 3 characters per token) for providers with a TPM limit (0 otherwise)"""
+    limit = rate_limiter.LIMITS.get(provider_name)
+    if limit is None or not limit.tpm:
+        return 0
+    inputs = api_params["input"]
+    if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+        inputs = [inputs]
+    return sum(len(text) // 3 + 1 if isinstance(text, str) else len(text) for text in inputs)
+
+def log_api_error(provider_name, e):
+    """Log a failed attempt; response headers and body are only logged at DEBUG level"""
+    status = getattr(getattr(e, 'response', None), 'status_code', None)
+    logger.warning("%s API encountered an error (%s, status %s): %s", provider_name, type(e).__name__, status, e)
+    if hasattr(e, 'response') and logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Headers: %s", e.response.headers)
+        logger.debug("Content: %s", e.response.text)
+
+def send_embedding(provider_name, api_params):
+    """Send an embedding request with retries and return the process_embedding response"""
+    # Get the OpenAI client for the specified provider
+    client = get_openai_client(provider_name)
+    model = api_params["model"]
+    
+    start_time = time.time()
+
+    ledger.check_budget(provider_name, model)
+
     max_retries = 5
     base_delay = 30
     result = None
+    tracker = telemetry.RequestTracker("embedding", provider_name, model)
+    estimated_tokens = estimate_input_tokens(provider_name, api_params)
 
     for attempt in range(max_retries):
         try:
-            print(f"Attempt {attempt + 1}: Sending embedding request to {provider_name} API...", flush=True)
-            completion = client.embeddings.create(**api_params)
+            logger.debug("Attempt %d: Sending embedding request to %s API...", attempt + 1, provider_name)
+            with adaptive_limiter.slot(provider_name), \
+                    rate_limiter.slot(provider_name, estimated_tokens) as permit, tracker.attempt(attempt + 1):
+                completion = client.embeddings.create(**api_params)
+                permit.used_tokens = completion.usage.total_tokens
             
-            # Only print raw response in debug mode
+            # Only log raw response in debug mode
             if DEBUG_MODE:
-                print("Raw API response:", flush=True)
-                print(completion, flush=True)
+                logger.info("Raw API response: %s", completion)
             
             result = completion
-            print(f"Successfully received embedding from {provider_name} API", flush=True)
             break
             
         except Exception as e:
-            print(f"{provider_name} API encountered an error: {e}", flush=True)
-            print("Error details:", flush=True)
-            print(f"Type: {type(e).__name__}", flush=True)
-            print(f"Arguments: {e.args}", flush=True)
-            
-            if hasattr(e, 'response'):
-                print("API Response:", flush=True)
-                print(f"Status: {e.response.status_code}", flush=True)
-                print(f"Headers: {e.response.headers}", flush=True)
-                print(f"Content: {e.response.text}", flush=True)
+            log_api_error(provider_name, e)
             
             if attempt < max_retries - 1:
                 delay = base_delay * (2 ** attempt) + random.uniform(0, 10)
-                print(f"Retrying in {delay:.2f} seconds...", flush=True)
-                sys.stdout.flush()
+                logger.warning("Retrying %s embedding request in %.2f seconds...", provider_name, delay)
+                tracker.backoff(delay)
                 time.sleep(delay)
             else:
-                print(f"Maximum retry attempts reached.", flush=True)
+                logger.error("Maximum retry attempts reached for %s.", provider_name)
+                tracker.finish(error=e)
                 raise
 
+    return finish_embedding(provider_name, model, result, tracker, start_time)
+
+def finish_embedding(provider_name, model, result, tracker, start_time):
     end_time = time.time()
     elapsed_time = end_time - start_time
 
     if result:
-        print(f"Embedding processing completed with {result.usage.prompt_tokens} tokens", flush=True)
+        tracker.finish(input_tokens=result.usage.prompt_tokens)
+        ledger.record_usage(provider_name, model, "embedding", input_tokens=result.usage.prompt_tokens)
+        logger.info("Embedding processing completed with %s tokens", result.usage.prompt_tokens)
         return {
             "result": result,
             "prompt_tokens": result.usage.prompt_tokens,
@@ -125,6 +208,66 @@ def process_embedding(provider_name, model, input_text, dimensions=None, encodin
     
     return None
 
+async def process_embedding_async(provider_name, model, input_text, dimensions=None, encoding_format="float", coalesce=None):
+    """Async version of process_embedding using AsyncOpenAI (same arguments and return value)"""
+    api_params = build_api_params(model, input_text, dimensions, encoding_format)
+
+    if not (COALESCE_REQUESTS if coalesce is None else coalesce):
+        return await send_embedding_async(provider_name, api_params)
+
+    key = single_flight.fingerprint(provider_name, api_params)
+    response, shared = await ASYNC_EMBEDDING_FLIGHT.do(key, lambda: send_embedding_async(provider_name, api_params),
+                                                       provider_name, model)
+    return dict(response, coalesced=True) if shared and response else response
+
+async def send_embedding_async(provider_name, api_params):
+    """Async version of send_embedding"""
+    client = get_async_openai_client(provider_name)
+    model = api_params["model"]
+
+    start_time = time.time()
+
+    delay = ledger.budget_delay(provider_name, model)
+    if delay:
+        await asyncio.sleep(delay)
+
+    max_retries = 5
+    base_delay = 30
+    result = None
+    tracker = telemetry.RequestTracker("embedding", provider_name, model)
+    estimated_tokens = estimate_input_tokens(provider_name, api_params)
+
+    try:
+        for attempt in range(max_retries):
+            try:
+                logger.debug("Attempt %d: Sending async embedding request to %s API...", attempt + 1, provider_name)
+                async with adaptive_limiter.slot_async(provider_name), \
+                        rate_limiter.slot_async(provider_name, estimated_tokens) as permit:
+                    with tracker.attempt(attempt + 1):
+                        result = await client.embeddings.create(**api_params)
+                        permit.used_tokens = result.usage.total_tokens
+
+                if DEBUG_MODE:
+                    logger.info("Raw API response: %s", result)
+                break
+            except Exception as e:
+                log_api_error(provider_name, e)
+
+                if attempt < max_retries - 1:
+                    delay = base_delay * (2 ** attempt) + random.uniform(0, 10)
+                    logger.warning("Retrying %s embedding request in %.2f seconds...", provider_name, delay)
+                    tracker.backoff(delay)
+                    await asyncio.sleep(delay)
+                else:
+                    logger.error("Maximum retry attempts reached for %s.", provider_name)
+                    tracker.finish(error=e)
+                    raise
+    finally:
+        if not POOL_CLIENTS:
+            await client.close()
+
+    return finish_embedding(provider_name, model, result, tracker, start_time)
+
 # # Example usage
 # if __name__ == "__main__":
 #     response = process_embedding(
@@ -0,0 +1,239 @@
+import numpy as np
+
+# 每次处理的文档行数，控制中间结果的内存占用
+DEFAULT_CHUNK_SIZE = 65536
+METRICS = ("cosine", "dot", "l2")
+
+
+def _get(obj, key):
+    """Read a field from SDK objects and plain dictionaries alike"""
+    if isinstance(obj, dict):
+        return obj.get(key)
+    return getattr(obj, key, None)
+
+
+def embeddings_to_matrix(response, dtype=np.float32):
+    """
+    Convert embedding results of either provider into an (n, d) matrix.
+
+    Accepts:
+        - the dict returned by embedding/openai_based_embedding.process_embedding
+        - the dict returned by embedding/dash_scope_embedding.process_embedding (text or multimodal)
+        - the dict returned by process_multimodal_embeddings ("embeddings") or
+          process_hybrid_embedding ("dense")
+        - an SDK result object, a list of vectors or an array
+
+    Returns:
+        Contiguous matrix of the requested dtype
+    """
+    if isinstance(response, dict) and "dense" in response:
+        return np.ascontiguousarray(response["dense"], dtype=dtype)
+    if isinstance(response, dict) and "embeddings" in response:
+        return np.asarray(response["embeddings"], dtype=dtype)
+    if isinstance(response, dict) and "result" in response:
+        response = response["result"]
+    if isinstance(response, np.ndarray):
+        return np.ascontiguousarray(response, dtype=dtype)
+    if isinstance(response, list):
+        return np.asarray(response, dtype=dtype)
+
+    # OpenAI 兼容接口: result.data[i].embedding
+    data = _get(response, "data")
+    if data is not None:
+        data = sorted(data, key=lambda item: _get(item, "index") or 0)
+        return np.asarray([_get(item, "embedding") for item in data], dtype=dtype)
+
+    # DashScope: result.output["embeddings"][i]["embedding"]
+    embeddings = _get(_get(response, "output"), "embeddings")
+    if embeddings is None:
+        raise ValueError("Unrecognized embedding result")
+    embeddings = sorted(embeddings, key=lambda item: _get(item, "text_index") or _get(item, "index") or 0)
+    return np.asarray([_get(item, "embedding") for item in embeddings], dtype=dtype)
+
+
+def normalize_rows(matrix):
+    """Return the rows scaled to unit L2 norm (zero rows stay zero)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def _prepare_queries(queries, metric):
+    queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+    if metric not in METRICS:
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+    return normalize_rows(queries) if metric == "cosine" else queries
+
+
+def _score_chunk(queries, chunk, metric, query_sq_norms=None):
+    """Score one chunk of documents; higher is better (l2 returns negative squared distance)"""
+    chunk = np.asarray(chunk, dtype=np.float32)
+    if metric == "cosine":
+        return queries @ normalize_rows(chunk).T
+    scores = queries @ chunk.T
+    if metric == "l2":
+        doc_sq_norms = np.einsum("ij,ij->i", chunk, chunk)
+        scores = 2.0 * scores - query_sq_norms[:, None] - doc_sq_norms[None, :]
+    return scores
+
+
+def _to_metric(scores, metric):
+    if metric == "l2":
+        return np.sqrt(np.maximum(-scores, 0.0))
+    return scores
+
+
+def similarity_matrix(queries, docs, metric="cosine", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Compute the full (m, n) similarity (cosine/dot) or distance (l2) matrix.
+
+    Documents are processed chunk_size rows at a time so temporary arrays stay bounded;
+    the output itself is m x n float32.
+    """
+    queries = _prepare_queries(queries, metric)
+    query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+    output = np.empty((len(queries), len(docs)), dtype=np.float32)
+    for start in range(0, len(docs), chunk_size):
+        scores = _score_chunk(queries, docs[start:start + chunk_size], metric, query_sq_norms)
+        output[:, start:start + scores.shape[1]] = _to_metric(scores, metric)
+    return output
+
+
+def _merge_top_k(best_scores, best_indices, scores, offset, k):
+    """Merge the running top-k with the scores of a new chunk using argpartition"""
+    candidate_scores = np.concatenate([best_scores, scores], axis=1)
+    candidate_indices = np.concatenate(
+        [best_indices, np.broadcast_to(np.arange(offset, offset + scores.shape[1]), scores.shape)], axis=1)
+    if candidate_scores.shape[1] > k:
+        part = np.argpartition(-candidate_scores, k - 1, axis=1)[:, :k]
+        candidate_scores = np.take_along_axis(candidate_scores, part, axis=1)
+        candidate_indices = np.take_along_axis(candidate_indices, part, axis=1)
+    return candidate_scores, candidate_indices
+
+
+def top_k(queries, docs, k=10, metric="cosine", chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Find the k best documents for every query in bounded memory.
+
+    Only a (m, chunk_size) score block and the running (m, k) result are kept at any time,
+    so docs can be a np.memmap larger than RAM.
+
+    Args:
+        queries: (m, d) or (d,) query embeddings
+        docs: (n, d) document embeddings (array or memmap)
+        k: Number of results per query
+        metric: "cosine", "dot" or "l2"
+        chunk_size: Number of document rows scored at once
+
+    Returns:
+        Tuple of (indices, scores), both (m, k), best first. For l2, scores are distances.
+    """
+    queries = _prepare_queries(queries, metric)
+    query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+    k = min(k, len(docs))
+    best_scores = np.empty((len(queries), 0), dtype=np.float32)
+    best_indices = np.empty((len(queries), 0), dtype=np.int64)
+
+    for start in range(0, len(docs), chunk_size):
+        scores = _score_chunk(queries, docs[start:start + chunk_size], metric, query_sq_norms)
+        best_scores, best_indices = _merge_top_k(best_scores, best_indices, scores, start, k)
+
+    order = np.argsort(-best_scores, axis=1)
+    best_scores = np.take_along_axis(best_scores, order, axis=1)
+    best_indices = np.take_along_axis(best_indices, order, axis=1)
+    return best_indices, _to_metric(best_scores, metric)
+
+
+class QuantizedIndex:
+    """
+    Compact in-memory storage of document embeddings for top-k search.
+
+    Vectors are stored as float16 or as int8 with one scale per row (symmetric scalar
+    quantization). Search runs top_k over the quantized rows (dequantized one chunk at a
+    time), then optionally rescores rescore_factor * k candidates per query against the
+    full-precision vectors, which can be kept on disk as a np.memmap.
+    """
+
+    def __init__(self, docs, storage="int8", metric="cosine", full_precision=None, chunk_size=DEFAULT_CHUNK_SIZE):
+        """
+        Args:
+            docs: (n, d) document embeddings
+            storage: "float16" or "int8"
+            metric: "cosine", "dot" or "l2"
+            full_precision: Optional (n, d) float32 array / memmap used for rescoring
+            chunk_size: Number of rows quantized and scored at once
+        """
+        if storage not in ("float16", "int8"):
+            raise ValueError("storage must be 'float16' or 'int8'")
+        self.storage = storage
+        self.metric = metric
+        self.full_precision = full_precision
+        self.chunk_size = chunk_size
+
+        n, d = docs.shape
+        if storage == "float16":
+            self.vectors = np.empty((n, d), dtype=np.float16)
+        else:
+            self.vectors = np.empty((n, d), dtype=np.int8)
+            self.scales = np.empty(n, dtype=np.float32)
+
+        for start in range(0, n, chunk_size):
+            chunk = np.asarray(docs[start:start + chunk_size], dtype=np.float32)
+            if metric == "cosine":
+                chunk = normalize_rows(chunk)
+            if storage == "float16":
+                self.vectors[start:start + len(chunk)] = chunk
+            else:
+                scales = np.abs(chunk).max(axis=1) / 127.0
+                scales[scales == 0] = 1.0
+                self.scales[start:start + len(chunk)] = scales
+                self.vectors[start:start + len(chunk)] = np.round(chunk / scales[:, None]).astype(np.int8)
+
+    def __len__(self):
+        return len(self.vectors)
+
+    @property
+    def nbytes(self):
+        return self.vectors.nbytes + (self.scales.nbytes if self.storage == "int8" else 0)
+
+    def _dequantized_chunks(self):
+        for start in range(0, len(self.vectors), self.chunk_size):
+            chunk = self.vectors[start:start + self.chunk_size].astype(np.float32)
+            if self.storage == "int8":
+                chunk *= self.scales[start:start + self.chunk_size, None]
+            yield start, chunk
+
+    def search(self, queries, k=10, rescore_factor=4):
+        """
+        Return (indices, scores) of the k best documents per query, best first.
+
+        When full-precision vectors are available, rescore_factor * k candidates are
+        retrieved from the quantized rows and rescored exactly.
+        """
+        # 存储的向量已归一化，cosine 等价于点积
+        metric = "dot" if self.metric == "cosine" else self.metric
+        queries = _prepare_queries(queries, self.metric)
+        query_sq_norms = np.einsum("ij,ij->i", queries, queries)
+        rescore = self.full_precision is not None and rescore_factor > 1
+        candidates = min(len(self), k * rescore_factor if rescore else k)
+
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_indices = np.empty((len(queries), 0), dtype=np.int64)
+        for start, chunk in self._dequantized_chunks():
+            scores = _score_chunk(queries, chunk, metric, query_sq_norms)
+            best_scores, best_indices = _merge_top_k(best_scores, best_indices, scores, start, candidates)
+
+        if rescore:
+            exact = np.empty_like(best_scores)
+            for row, indices in enumerate(best_indices):
+                order = np.argsort(indices)
+                vectors = np.asarray(self.full_precision[indices[order]], dtype=np.float32)
+                exact[row, order] = _score_chunk(queries[row:row + 1], vectors, self.metric,
+                                                 query_sq_norms[row:row + 1])[0]
+            best_scores = exact
+
+        order = np.argsort(-best_scores, axis=1)[:, :k]
+        best_scores = np.take_along_axis(best_scores, order, axis=1)
+        best_indices = np.take_along_axis(best_indices, order, axis=1)
+        return best_indices, _to_metric(best_scores, self.metric)
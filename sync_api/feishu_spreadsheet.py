@@ -2,6 +2,8 @@ import requests, datetime, sys
 import pandas as pd
 import os
 
+# 飞书开放平台地址（测试时可指向本地模拟服务）
+FEISHU_BASE_URL = "https://open.feishu.cn"
 
 def get_tenant_access_token():
     """
@@ -9,7 +11,7 @@ def get_tenant_access_token():
     返回:
         str: 访问令牌。
     """
-    url = "https://open.feishu.cn/open-apis/auth/v3/tenant_access_token/internal"
+    url = f"{FEISHU_BASE_URL}/open-apis/auth/v3/tenant_access_token/internal"
     # 准备请求数据，包含应用的ID和密钥
     headers = {"Content-Type": "application/json; charset=utf-8"}
     post_data = {"app_id": "cli_a760e38bc64cd01c", "app_secret": "lRVMaU0CGiZLU4oEmSORUc0GUYsVKBgx"}
@@ -42,7 +44,7 @@ def get_sheet_id(spreadsheet_token, access_token=None):
     if access_token is None:
         access_token = get_tenant_access_token()
     
-    url = f"https://open.feishu.cn/open-apis/sheets/v3/spreadsheets/{spreadsheet_token}/sheets/query"
+    url = f"{FEISHU_BASE_URL}/open-apis/sheets/v3/spreadsheets/{spreadsheet_token}/sheets/query"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json; charset=utf-8"
@@ -97,7 +99,7 @@ def read_data(spreadsheet_token, sheet_id=None, sheet_name=None, access_token=No
         return pd.DataFrame()
     
     # 1. 先获取工作表信息，检查工作表类型和属性
-    url = f"https://open.feishu.cn/open-apis/sheets/v3/spreadsheets/{spreadsheet_token}/sheets/{sheet_id}"
+    url = f"{FEISHU_BASE_URL}/open-apis/sheets/v3/spreadsheets/{spreadsheet_token}/sheets/{sheet_id}"
     headers = {
         "Authorization": f"Bearer {access_token}",
         "Content-Type": "application/json; charset=utf-8"
@@ -123,7 +125,7 @@ def read_data(spreadsheet_token, sheet_id=None, sheet_name=None, access_token=No
         return pd.DataFrame()
     
     # 3. 获取工作表数据
-    url = f"https://open.feishu.cn/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values/{sheet_id}"
+    url = f"{FEISHU_BASE_URL}/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values/{sheet_id}"
     params = {
         'valueRenderOption': 'ToString',
         'dateTimeRenderOption': 'FormattedString'
@@ -186,7 +188,7 @@ def add_data(spreadsheet_token, sheet_id=None, sheet_name=None, column="A", valu
         return {}
     
     # 构建API请求URL - 使用values_append端点
-    url = f"https://open.feishu.cn/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values_append"
+    url = f"{FEISHU_BASE_URL}/open-apis/sheets/v2/spreadsheets/{spreadsheet_token}/values_append"
     
     # 构建请求头
     headers = {
@@ -0,0 +1,146 @@
+import sys
+import os
+import time
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM, embedding and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, adaptive_limiter, telemetry
+from embedding import openai_based_embedding
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+
+class RateLimited(Exception):
+    status_code = 429
+
+
+def test_additive_increase_multiplicative_decrease():
+    limiter = adaptive_limiter.AdaptiveLimiter("UNIT", initial=4, max_limit=10, registry=telemetry.MetricsRegistry())
+    # 窗口保持用满时，每完成一整个窗口的成功请求上限加 1（4 -> 9 约需 30 个请求）
+    starts = deque(limiter.acquire() for _ in range(4))
+    for _ in range(30):
+        limiter.release(starts.popleft())
+        while limiter.get_stats()["in_flight"] < int(limiter.limit):
+            starts.append(limiter.acquire())
+    while starts:
+        limiter.release(starts.popleft())
+    limit = limiter.get_stats()["limit"]
+    assert 8 <= limit <= 10
+    assert limiter.registry.get("llm_concurrency_limit", provider="UNIT") == limit
+
+    # 同一批请求的多个 429 只算一次拥塞
+    before = limiter.limit
+    starts = [limiter.acquire() for _ in range(limit)]
+    for start in starts:
+        limiter.release(start, RateLimited())
+    assert abs(limiter.limit - before * adaptive_limiter.DECREASE_FACTOR) < 1e-9
+    limit = limiter.get_stats()["limit"]
+    assert limiter.registry.get("llm_concurrency_decreases_total", provider="UNIT", reason="rate_limited") == 1
+
+    # 空闲（窗口没用到一半）时上限不增长
+    for _ in range(20):
+        limiter.release(limiter.acquire())
+    assert limiter.get_stats() == dict(limiter.get_stats(), limit=limit, in_flight=0)
+
+    # 与 429 无关的错误不降低上限
+    limiter.release(limiter.acquire(), ValueError("bad response"))
+    assert limiter.get_stats()["limit"] == limit
+
+
+def test_latency_inflation():
+    limiter = adaptive_limiter.AdaptiveLimiter("UNIT", initial=8, registry=telemetry.MetricsRegistry())
+    for _ in range(adaptive_limiter.MIN_SAMPLES):
+        starts = [limiter.acquire() for _ in range(8)]
+        for start in starts:
+            limiter.release(start - 0.01)
+    assert limiter.get_stats()["limit"] >= 8
+    # 延迟从 10ms 涨到 100ms：排队的迹象，降低并发
+    before = limiter.limit
+    for _ in range(8):
+        limiter.release(limiter.acquire() - 0.1)
+    assert limiter.limit < before
+    assert limiter.registry.get("llm_concurrency_decreases_total", provider="UNIT", reason="latency") >= 1
+
+
+def run_phase(client, seconds, workers=24):
+    """Call the mock server through the MOCK limiter from many threads; returns (successes, 429s)"""
+    counts = {"ok": 0, "rate_limited": 0}
+    lock = threading.Lock()
+    deadline = time.time() + seconds
+
+    def loop():
+        while time.time() < deadline:
+            try:
+                with adaptive_limiter.slot("MOCK"):
+                    client.chat.completions.create(model="mock-model", messages=[{"role": "user", "content": "hi"}])
+                outcome = "ok"
+            except Exception as e:
+                assert telemetry.classify_error(e) == "rate_limited", e
+                outcome = "rate_limited"
+            with lock:
+                counts[outcome] += 1
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for future in [executor.submit(loop) for _ in range(workers)]:
+            future.result()
+    return counts["ok"], counts["rate_limited"]
+
+
+def test_tracks_shifting_capacity():
+    limiter = adaptive_limiter.configure("MOCK", initial=2)
+    try:
+        with MockServer(latency={"distribution": "fixed", "value": 0.05}, max_concurrency=12) as server:
+            configure_providers(server.url)
+            # 不使用 SDK 自身的重试，429 直接交给限流器
+            client = openai_based_api.get_openai_client("MOCK").with_options(max_retries=0)
+            limits = []
+            results = []
+            for capacity in (12, 4, 16):
+                server.update(max_concurrency=capacity)
+                results.append(run_phase(client, 2.0))
+                limits.append(limiter.get_stats()["limit"])
+    finally:
+        adaptive_limiter.configure("MOCK")
+
+    # 上限跟随服务端容量：从 2 升高，容量降为 4 后回落，容量升到 16 后再次增长
+    # （客户端开销使服务端实际并发略低于上限，所以上限可以略高于容量）
+    assert 6 <= limits[0] <= 24
+    assert limits[1] <= 7
+    assert limits[2] >= 9
+    ok = sum(r[0] for r in results)
+    rate_limited = sum(r[1] for r in results)
+    assert rate_limited > 0 and rate_limited < ok * 0.2
+    assert telemetry.METRICS.get("llm_concurrency_decreases_total", provider="MOCK", reason="rate_limited") > 0
+
+
+def test_process_content_dispatch():
+    limiter = adaptive_limiter.configure("MOCK", initial=2, max_limit=6)
+    try:
+        with MockServer(latency={"distribution": "fixed", "value": 0.02}) as server:
+            configure_providers(server.url)
+            with ThreadPoolExecutor(max_workers=16) as executor:
+                responses = list(executor.map(
+                    lambda i: openai_based_api.process_content("MOCK", f"问题 {i}", "mock-model", coalesce=False),
+                    range(80)))
+            embedding = openai_based_embedding.process_embedding("MOCK", "mock-embedding", "你好", coalesce=False)
+            peak = server.get_stats()["peak_in_flight"]
+    finally:
+        adaptive_limiter.configure("MOCK")
+
+    assert all(r["result"] == server.config["response_text"] for r in responses)
+    assert embedding["prompt_tokens"] > 0
+    # 起始上限为 2，随后增长但不超过 max_limit
+    assert 2 < peak <= 6
+    assert limiter.get_stats() == dict(limiter.get_stats(), limit=6, in_flight=0)
+    assert telemetry.METRICS.get("llm_concurrency_limit", provider="MOCK") == 6
+
+
+if __name__ == "__main__":
+    test_additive_increase_multiplicative_decrease()
+    test_latency_inflation()
+    test_tracks_shifting_capacity()
+    test_process_content_dispatch()
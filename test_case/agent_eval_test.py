@@ -0,0 +1,95 @@
+import sys
+import os
+import json
+import time
+import threading
+from types import SimpleNamespace
+
+# Add the parent directory to sys.path to import the agent module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent import agent_eval
+from agent.agent_eval import load_cases, load_tools, score_tools, run_evaluation
+
+CASES = [
+    {"name": "no tools", "query": "你能干什么？", "expected_tools": []},
+    {"name": "two tools", "query": "search twice", "expected_tools": ["full_text_search", "vector_search"]},
+    {"name": "broken", "query": "fail", "expected_tools": ["keyword_search"]},
+]
+
+
+def test_score_tools():
+    assert score_tools([], [])["f1"] == 1.0
+    assert score_tools(["vector_search"], [])["f1"] == 0.0
+    assert score_tools([], ["vector_search"])["recall"] == 0.0
+    scores = score_tools(["full_text_search", "full_text_search", "keyword_search"],
+                         ["full_text_search", "vector_search"])
+    assert scores["precision"] == 0.5 and scores["recall"] == 0.5 and not scores["exact"]
+    assert (scores["tp"], scores["fp"], scores["fn"]) == (1, 1, 1)
+    assert score_tools(["a", "b"], ["b", "a"])["exact"]
+
+
+def test_load_bundled_cases():
+    system_prompt, cases = load_cases()
+    assert "AweMinds" in system_prompt
+    assert len(cases) == 10 and all({"name", "query", "expected_tools"} <= set(case) for case in cases)
+    assert [tool["function"]["name"] for tool in load_tools()] == ["full_text_search", "keyword_search",
+                                                                    "vector_search"]
+
+
+def test_run_evaluation_concurrent():
+    state = {"active": 0, "peak": 0, "calls": 0, "per_model": {}}
+    lock = threading.Lock()
+
+    def fake_process_content(provider_name, user_prompt, model, content=None, system_prompt=None, tools=None,
+                             tool_choice=None, **kwargs):
+        with lock:
+            state["active"] += 1
+            state["calls"] += 1
+            state["peak"] = max(state["peak"], state["active"])
+            key = (model, user_prompt)
+            state["per_model"][key] = call_number = state["per_model"].get(key, 0) + 1
+        time.sleep(0.02)
+        with lock:
+            state["active"] -= 1
+        if user_prompt == "fail":
+            raise RuntimeError("provider down")
+        names = []
+        if user_prompt == "search twice":
+            # 交替返回不同的工具组合，制造方差
+            names = ["full_text_search", "vector_search"] if call_number % 2 else ["full_text_search"]
+        calls = [SimpleNamespace(id=f"call_{i}", function=SimpleNamespace(name=name, arguments="{}"))
+                 for i, name in enumerate(names)]
+        return {"result": "", "tool_calls": calls or None, "input_tokens": 100, "output_tokens": 10,
+                "elapsed_time": 0.02}
+
+    original = agent_eval.openai_based_api.process_content
+    agent_eval.openai_based_api.process_content = fake_process_content
+    progress = []
+    try:
+        report = run_evaluation("FAKE", ["model-a", "model-b"], CASES, tools=[], repeats=4, max_workers=3,
+                                progress_callback=lambda run, done, total: progress.append((done, total)))
+    finally:
+        agent_eval.openai_based_api.process_content = original
+
+    assert state["calls"] == 2 * 3 * 4 and state["peak"] == 3
+    assert progress[-1] == (24, 24)
+    json.dumps(report)
+
+    model_report = report["models"]["model-a"]
+    assert model_report["cases"]["no tools"]["f1"] == 1.0
+    two = model_report["cases"]["two tools"]
+    assert len(two["runs"]) == 4 and [run["repeat"] for run in two["runs"]] == [0, 1, 2, 3]
+    assert two["recall"] < 1.0 and two["precision"] == 1.0 and two["f1_stddev"] > 0
+    assert two["latency"]["p50"] >= 0.02 and two["input_tokens"] == 400
+    assert model_report["cases"]["broken"]["errors"] == 4 and "f1" not in model_report["cases"]["broken"]
+
+    summary = model_report["summary"]
+    assert summary["runs"] == 12 and summary["errors"] == 4
+    assert summary["input_tokens"] == 800 and summary["output_tokens"] == 80
+
+
+if __name__ == "__main__":
+    test_score_tools()
+    test_load_bundled_cases()
+    test_run_evaluation_concurrent()
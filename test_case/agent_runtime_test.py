@@ -0,0 +1,86 @@
+import sys
+import os
+import json
+import time
+
+# Add the parent directory to sys.path to import the LLM, agent and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from agent.agent_runtime import AgentSession
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers, TOOLS_PATH
+from benchmark.agent_tool_benchmark import make_stub_tools
+
+with open(TOOLS_PATH, encoding="utf-8") as f:
+    TOOLS = json.load(f)["tools"]
+
+
+def test_stream_content_yields_tool_calls_early():
+    with MockServer(token_interval=0.01, parallel_tool_calls=3) as server:
+        configure_providers(server.url)
+        start = time.time()
+        events = []
+        for event in openai_based_api.stream_content("MOCK", "查找机器学习文档", "mock-model", tools=TOOLS):
+            events.append((time.time() - start, event))
+
+    tool_events = [(t, event) for t, event in events if event["type"] == "tool_call"]
+    done_time, done = events[-1]
+    assert done["type"] == "done" and len(tool_events) == 3
+    assert [event["index"] for _, event in tool_events] == [0, 1, 2]
+    assert all(json.loads(event["tool_call"].function.arguments) is not None for _, event in tool_events)
+    # 前面的工具调用在流结束之前就已完整
+    assert tool_events[0][0] < tool_events[1][0] < tool_events[2][0]
+    assert done_time - tool_events[0][0] > 0.1
+    assert [call.function.name for call in done["response"]["tool_calls"]] == \
+           [event["tool_call"].function.name for _, event in tool_events]
+    assert done["response"]["tool_calls"][0].id == tool_events[0][1]["tool_call"].id
+
+
+def test_streaming_dispatch_overlaps_tools_with_generation():
+    tool_functions = make_stub_tools(TOOLS, {"full_text_search": 0.3}, 0.1)
+    timings = {}
+    with MockServer(token_interval=0.01, parallel_tool_calls=3) as server:
+        configure_providers(server.url)
+        for mode in ("parallel", "streaming"):
+            with AgentSession("MOCK", "mock-model", TOOLS, tool_functions, dispatch=mode) as session:
+                session.history = [{"role": "user", "content": "查找机器学习文档"}]
+                response, tool_messages = session.run_turn()
+            turn = session.turns[0]
+            assert len(tool_messages) == 3 and len(turn["tools"]) == 3
+            assert [m["tool_call_id"] for m in tool_messages] == [call.id for call in response["tool_calls"]]
+            timings[mode] = turn
+
+    streaming = timings["streaming"]
+    assert min(tool["start"] for tool in streaming["tools"]) < streaming["model_time"]
+    assert min(tool["start"] for tool in timings["parallel"]["tools"]) >= timings["parallel"]["model_time"]
+    assert streaming["turn_time"] < timings["parallel"]["turn_time"]
+
+
+def test_multi_round_run():
+    calls = []
+
+    def search(arguments):
+        calls.append(arguments)
+        return {"results": ["doc"]}
+
+    def broken(arguments):
+        raise RuntimeError("index offline")
+
+    with MockServer(parallel_tool_calls=2) as server:
+        configure_providers(server.url)
+        with AgentSession("MOCK", "mock-model", TOOLS, {"full_text_search": search, "keyword_search": broken},
+                          system_prompt="system") as session:
+            response = session.run("查找机器学习文档")
+
+    assert response["result"] == server.config["response_text"]
+    assert [m["role"] for m in session.history] == ["user", "assistant", "tool", "tool", "assistant"]
+    assert len(calls) == 1 and len(session.turns) == 2
+    assert "index offline" in session.history[3]["content"]
+    assert isinstance(session.history[1]["tool_calls"][0], dict)
+
+
+if __name__ == "__main__":
+    test_stream_content_yields_tool_calls_early()
+    test_streaming_dispatch_overlaps_tools_with_generation()
+    test_multi_round_run()
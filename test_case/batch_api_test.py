@@ -0,0 +1,165 @@
+import sys
+import os
+import json
+import time
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from LLM.batch_api import process_content_batch, write_batch_files
+
+
+class FakeBatchHandler(BaseHTTPRequestHandler):
+    """本地模拟的 OpenAI Batch API：文件上传、创建批任务、轮询、下载结果"""
+
+    files = {}
+    batches = {}
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, payload, status=200):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers["Content-Length"]))
+        if self.path == "/v1/files":
+            boundary = self.headers["Content-Type"].split("boundary=")[1].encode()
+            part = next(p for p in body.split(b"--" + boundary) if b'name="file"' in p)
+            content = part.split(b"\r\n\r\n", 1)[1].rsplit(b"\r\n", 1)[0]
+            file_id = f"file-{len(self.files)}"
+            self.files[file_id] = content
+            self.send_json({"id": file_id, "object": "file", "bytes": len(content), "created_at": int(time.time()),
+                            "filename": "batch.jsonl", "purpose": "batch", "status": "processed"})
+        elif self.path == "/v1/batches":
+            request = json.loads(body)
+            batch_id = f"batch-{len(self.batches)}"
+            self.batches[batch_id] = {"id": batch_id, "object": "batch", "endpoint": request["endpoint"],
+                                      "input_file_id": request["input_file_id"], "completion_window": "24h",
+                                      "status": "validating", "created_at": int(time.time()), "polls": 0}
+            self.send_json(self.public(self.batches[batch_id]))
+        else:
+            self.send_json({"error": {"message": "not found"}}, 404)
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts[1] == "batches":
+            batch = self.batches[parts[2]]
+            batch["polls"] += 1
+            # 第一次轮询返回 in_progress，第二次完成
+            if batch["polls"] >= 2 and batch["status"] not in ("completed", "expired"):
+                self.complete(batch)
+            elif batch["status"] not in ("completed", "expired"):
+                batch["status"] = "in_progress"
+            self.send_json(self.public(batch))
+        elif parts[1] == "files" and parts[3] == "content":
+            content = self.files[parts[2]]
+            self.send_response(200)
+            self.send_header("Content-Type", "application/octet-stream")
+            self.send_header("Content-Length", str(len(content)))
+            self.end_headers()
+            self.wfile.write(content)
+        else:
+            self.send_json({"error": {"message": "not found"}}, 404)
+
+    def public(self, batch):
+        return {k: v for k, v in batch.items() if k != "polls"}
+
+    def complete(self, batch):
+        lines = self.files[batch["input_file_id"]].decode("utf-8").splitlines()
+        if any("EXPIRE" in line for line in lines):
+            # 过期的批任务没有输出文件和错误文件
+            batch["status"] = "expired"
+            batch["expired_at"] = int(time.time())
+            return
+        outputs, errors = [], []
+        for line in lines:
+            request = json.loads(line)
+            prompt = request["body"]["messages"][-1]["content"]
+            if "FAIL" in prompt:
+                errors.append({"custom_id": request["custom_id"], "response": {"status_code": 400, "body": {
+                    "error": {"message": "bad request"}}}, "error": None})
+                continue
+            outputs.append({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": {
+                "id": "chatcmpl-1", "object": "chat.completion", "created": int(time.time()),
+                "model": request["body"]["model"],
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": f" echo: {prompt} "}}],
+                "usage": {"prompt_tokens": len(prompt), "completion_tokens": 3, "total_tokens": len(prompt) + 3}}}})
+        batch["output_file_id"] = f"file-{len(self.files)}"
+        self.files[batch["output_file_id"]] = "\n".join(json.dumps(o) for o in outputs).encode("utf-8")
+        batch["error_file_id"] = f"file-{len(self.files)}"
+        self.files[batch["error_file_id"]] = "\n".join(json.dumps(e) for e in errors).encode("utf-8")
+        batch["status"] = "completed"
+        batch["completed_at"] = int(time.time())
+        batch["request_counts"] = {"total": len(outputs) + len(errors), "completed": len(outputs),
+                                   "failed": len(errors)}
+
+
+def start_fake_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeBatchHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    openai_based_api.PROVIDERS["FAKE-BATCH"] = {
+        "api_key": "test-key",
+        "base_url": f"http://127.0.0.1:{server.server_address[1]}/v1"
+    }
+    return server
+
+
+def test_write_batch_files():
+    specs = [{"user_prompt": f"q{i}", "model": "m", "content": "c", "custom_id": f"id-{i}"} for i in range(3)]
+    with tempfile.TemporaryDirectory() as tmp:
+        files = write_batch_files(specs, tmp)
+        assert len(files) == 1 and files[0][1] == ["id-0", "id-1", "id-2"]
+        with open(files[0][0], encoding="utf-8") as f:
+            first = json.loads(f.readline())
+    assert first["url"] == "/v1/chat/completions"
+    assert first["body"]["messages"][-1]["content"].startswith("q0\n\n-----Content START-----")
+
+
+def test_process_content_batch():
+    server = start_fake_server()
+    specs = [{"user_prompt": f"问题 {i}", "model": "gpt-4.1-mini"} for i in range(5)]
+    specs.append({"user_prompt": "FAIL please", "model": "gpt-4.1-mini", "custom_id": "bad"})
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = dict(process_content_batch("FAKE-BATCH", specs, tmp, poll_interval=0.01))
+    finally:
+        server.shutdown()
+
+    assert len(results) == 6
+    assert results["request-3"]["result"] == "echo: 问题 3"
+    assert results["request-3"]["output_tokens"] == 3
+    assert set(results["request-0"]) == {"result", "input_tokens", "output_tokens", "cached_tokens",
+                                         "uncached_input_tokens", "elapsed_time"}
+    assert results["bad"]["error"]["message"] == "bad request"
+    assert set(results["bad"]) == set(results["request-0"]) | {"error"}
+
+
+def test_expired_batch_reports_every_request():
+    server = start_fake_server()
+    specs = [{"user_prompt": f"EXPIRE {i}", "model": "gpt-4.1-mini"} for i in range(3)]
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            results = dict(process_content_batch("FAKE-BATCH", specs, tmp, poll_interval=0.01))
+    finally:
+        server.shutdown()
+
+    assert sorted(results) == ["request-0", "request-1", "request-2"]
+    assert all(r["result"] == "" and r["error"]["code"] == "batch_expired" for r in results.values())
+    assert results["request-0"]["uncached_input_tokens"] == 0
+
+
+if __name__ == "__main__":
+    test_write_batch_files()
+    test_process_content_batch()
+    test_expired_batch_reports_every_request()
@@ -0,0 +1,77 @@
+import sys
+import os
+import json
+
+# Add the parent directory to sys.path to import the LLM and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, best_of_n
+from LLM.best_of_n import process_content_best_of_n, generate_choices, schema_scorer, lexicographic, json_scorer
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+SCHEMA = {"type": "object", "properties": {"answer": {"type": "string"}, "confidence": {"type": "number"}},
+          "required": ["answer", "confidence"]}
+RESPONSE_FORMAT = {"type": "json_schema", "json_schema": {"name": "answer", "schema": SCHEMA}}
+TEXTS = ['{"answer": "partial"', '{"answer": "no confidence"}', '```json\n{"answer": "ok", "confidence": 0.9}\n```',
+         '{"answer": "also ok", "confidence": 0.5}']
+
+
+def test_all_choices_returned():
+    with MockServer(choice_texts=["first", "second", "third"]) as server:
+        configure_providers(server.url)
+        response = openai_based_api.process_content("MOCK", "hi", "mock-model", n=3, logprobs=True)
+        assert [choice["result"] for choice in response["choices"]] == ["first", "second", "third"]
+        assert response["result"] == "first" and response["logprob_sum"] == response["choices"][0]["logprob_sum"]
+        assert all(choice["finish_reason"] == "stop" for choice in response["choices"])
+        single = openai_based_api.process_content("MOCK", "hi", "mock-model")
+        assert "choices" not in single and "logprob_sum" not in single
+        assert server.count("/chat/completions") == 2
+
+
+def test_best_of_n_with_schema_and_logprob_scorers():
+    with MockServer(choice_texts=TEXTS) as server:
+        configure_providers(server.url)
+        response = process_content_best_of_n("MOCK", "answer", "mock-model", n=4, scorer="schema",
+                                             response_format=RESPONSE_FORMAT, temperature=1.0)
+        assert server.count("/chat/completions") == 1 and response["requests"] == 1
+        assert response["scores"] == [0.0, 0.5, 1.0, 1.0]
+        # 同分时取最先出现的 choice
+        assert response["best_index"] == 2 and json.loads(best_of_n.strip_code_fence(response["result"]))["answer"] == "ok"
+
+        # 同分时用 logprob 打破平局：较短的回复 logprob 之和更大
+        scorer = lexicographic(schema_scorer(SCHEMA), best_of_n.logprob_scorer)
+        response = process_content_best_of_n("MOCK", "answer", "mock-model", n=4, scorer=scorer,
+                                             response_format=RESPONSE_FORMAT)
+        assert all("logprob_sum" in choice for choice in response["choices"])
+        assert response["best_index"] == 3 and response["logprob_sum"] == response["choices"][3]["logprob_sum"]
+
+        assert json_scorer({"result": TEXTS[0]}) == 0.0 and json_scorer({"result": TEXTS[2]}) == 1.0
+
+
+def test_parallel_fallback_when_n_unsupported():
+    best_of_n.SINGLE_CHOICE_PROVIDERS.discard("MOCK")
+    with MockServer(choice_texts=TEXTS, supports_n=False, latency=0.2) as server:
+        configure_providers(server.url)
+        try:
+            response = generate_choices("MOCK", "answer", "mock-model", n=4)
+            assert len(response["choices"]) == 4 and response["requests"] == 4
+            assert [choice["index"] for choice in response["choices"]] == [0, 1, 2, 3]
+            assert "MOCK" in best_of_n.SINGLE_CHOICE_PROVIDERS
+            # 三个补齐请求并行发出，没有被请求合并吞掉
+            assert server.count("/chat/completions") == 4 and server.get_stats()["peak_in_flight"] == 3
+            single = openai_based_api.process_content("MOCK", "answer", "mock-model", coalesce=False)
+            assert response["input_tokens"] == 4 * single["input_tokens"]
+
+            # 之后的调用直接并行
+            response = process_content_best_of_n("MOCK", "answer", "mock-model", n=3, scorer="json")
+            assert server.count("/chat/completions") == 8 and server.get_stats()["peak_in_flight"] == 3
+            assert len(response["choices"]) == 3 and response["elapsed_time"] < 0.6
+        finally:
+            best_of_n.SINGLE_CHOICE_PROVIDERS.discard("MOCK")
+
+
+if __name__ == "__main__":
+    test_all_choices_returned()
+    test_best_of_n_with_schema_and_logprob_scorers()
+    test_parallel_fallback_when_n_unsupported()
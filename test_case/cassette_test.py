@@ -0,0 +1,101 @@
+import sys
+import os
+import gzip
+import json
+import time
+import asyncio
+import tempfile
+
+import requests
+
+# Add the parent directory to sys.path to import the LLM, embedding, sync_api and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from LLM.cassette import Cassette, CassetteMiss
+from embedding import openai_based_embedding
+from sync_api import feishu_spreadsheet
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+
+def run_calls():
+    """Chat (sync, async and streaming), embeddings and Feishu calls against the MOCK provider"""
+    chat = openai_based_api.process_content("MOCK", "strawberry中有几个r？", "mock-model", coalesce=False)
+    chat_async = asyncio.run(openai_based_api.process_content_async("MOCK", "你好", "mock-model", coalesce=False))
+    events = list(openai_based_api.stream_content("MOCK", "讲个故事", "mock-model"))
+    embedding = openai_based_embedding.process_embedding("MOCK", "mock-embedding", ["第一条", "第二条"],
+                                                         coalesce=False)
+    sheet = feishu_spreadsheet.read_data("mock-spreadsheet", sheet_name="Sheet1")
+    return {
+        "chat": chat["result"],
+        "chat_async": chat_async["result"],
+        "stream": [e["content"] for e in events if e["type"] == "content"],
+        "stream_result": events[-1]["response"]["result"],
+        "embedding": [item.embedding for item in embedding["result"].data],
+        "sheet": sheet.values.tolist(),
+    }
+
+
+def test_record_and_replay_offline():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "calls.jsonl.gz")
+        with MockServer(latency={"distribution": "fixed", "value": 0.1}, token_interval=0.01,
+                        embedding_dimensions=8) as server:
+            configure_providers(server.url)
+            with Cassette(path, mode="auto") as cassette:
+                assert cassette.mode == "record"
+                recorded = run_calls()
+            assert server.count("/chat/completions") == 3 and server.count("/embeddings") == 1
+
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            text = f.read()
+        # 请求中的密钥和响应中的令牌都不写入录像
+        assert "mock-key" not in text and "app_secret" not in text
+        assert "t-mock-token" not in text and "tenant_access_token" in text
+        lines = [json.loads(line) for line in text.splitlines()[1:]]
+        assert len(lines) == cassette.stats["recorded"] and len(lines) >= 7
+        stream = next(line for line in lines if len(line["chunks"]) > 1)
+        assert "text/event-stream" in stream["headers"]["content-type"]
+
+        # 服务已关闭：回放不访问网络，也不等待录制时的延迟
+        start = time.time()
+        with Cassette(path, mode="auto") as cassette:
+            assert cassette.mode == "replay"
+            replayed = run_calls()
+        assert time.time() - start < 0.5
+        assert replayed == recorded
+        assert cassette.stats["replayed"] == len(lines) and cassette.stats["loose_matches"] == 0
+
+        # 按录制时的延迟回放：每个请求至少 0.1 秒
+        start = time.time()
+        with Cassette(path, mode="replay", replay_latency=True):
+            openai_based_api.process_content("MOCK", "strawberry中有几个r？", "mock-model", coalesce=False)
+        assert time.time() - start >= 0.1
+
+
+def test_replay_miss_and_skipped_errors():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "errors.jsonl.gz")
+        with MockServer(error_rate=1.0) as server:
+            url = f"{server.url}/open-apis/sheets/v3/spreadsheets/s/sheets/query"
+            with Cassette(path, mode="record"):
+                assert requests.get(url).status_code == 500
+                server.update(error_rate=0.0)
+                assert requests.get(url).status_code == 400
+
+        with Cassette(path, mode="replay") as cassette:
+            # 录制时的 500 被跳过，直接回放重试后的响应
+            response = requests.get(url)
+            assert response.status_code == 400 and response.json()["code"] == 99991663
+            assert cassette.stats["skipped_errors"] == 1
+            try:
+                openai_based_api.process_content("MOCK", "没有录过的问题", "mock-model", coalesce=False)
+                assert False, "expected CassetteMiss"
+            except CassetteMiss:
+                pass
+
+
+if __name__ == "__main__":
+    test_record_and_replay_offline()
+    test_replay_miss_and_skipped_errors()
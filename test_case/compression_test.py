@@ -0,0 +1,78 @@
+import sys
+import os
+import tempfile
+import numpy as np
+
+# Add the parent directory to the path so we can import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding.similarity import top_k
+from embedding.compression import CompressionPipeline, write_shards, load_shards, recall_size_report, \
+    format_report
+
+
+def make_embeddings(count, dim=128, rank=24, seed=0):
+    """生成低秩+噪声的向量，模拟真实嵌入的能量集中在少数方向"""
+    rng = np.random.default_rng(seed)
+    basis = rng.standard_normal((rank, dim)).astype(np.float32)
+    weights = rng.standard_normal((count, rank)).astype(np.float32) * np.linspace(3, 0.5, rank, dtype=np.float32)
+    return weights @ basis + 0.05 * rng.standard_normal((count, dim)).astype(np.float32)
+
+
+DOCS = make_embeddings(4000)
+QUERIES = DOCS[:20] + 0.01
+
+
+def recall(pipeline, codes, k=10):
+    expected, _ = top_k(QUERIES, DOCS, k)
+    found, _ = pipeline.search(QUERIES, codes, k)
+    return np.mean([len(set(a) & set(b)) / k for a, b in zip(found, expected)])
+
+
+def test_pipelines_keep_recall():
+    configs = {
+        "pca64-fp16": [("pca", {"dimensions": 64})],
+        "pca64-int8": [("pca", {"dimensions": 64}), ("int8", {})],
+        "pca64-pq16": [("pca", {"dimensions": 64}), ("pq", {"subspaces": 16, "iterations": 10})],
+    }
+    report = recall_size_report(DOCS, QUERIES, configs, k=10, fit_sample=2000)
+    print(format_report(report, k=10))
+    rows = {row["name"]: row for row in report}
+    assert rows["pca64-fp16"]["recall"] >= 0.9
+    assert rows["pca64-int8"]["recall"] >= 0.85 and rows["pca64-int8"]["bytes_per_vector"] == 64
+    assert rows["pca64-pq16"]["bytes_per_vector"] == 16 and rows["pca64-pq16"]["recall"] >= 0.4
+    assert format_report(report).splitlines()[1].startswith("float32")
+
+
+def test_truncate_renormalizes():
+    pipeline = CompressionPipeline([("truncate", {"dimensions": 32})]).fit(DOCS[:100])
+    encoded = pipeline.encode(DOCS[:10]).astype(np.float32)
+    assert encoded.shape == (10, 32)
+    assert np.allclose(np.linalg.norm(encoded, axis=1), 1.0, atol=1e-2)
+
+
+def test_write_and_load_shards():
+    pipeline = CompressionPipeline([("pca", {"dimensions": 32}), ("int8", {})]).fit(DOCS[:1000])
+    batches = (DOCS[start:start + 700] for start in range(0, len(DOCS), 700))
+    with tempfile.TemporaryDirectory() as tmp:
+        manifest = write_shards(pipeline, batches, tmp, shard_size=1500)
+        assert [shard["count"] for shard in manifest["shards"]] == [1500, 1500, 1000]
+        loaded, codes = load_shards(tmp)
+        assert codes.dtype == np.uint8 and codes.shape == (4000, 32)
+        # 默认只是内存映射分片上的视图，切片只读取涉及的分片
+        assert all(isinstance(shard, np.memmap) for shard in codes.shards)
+        assert isinstance(codes[1500:2000], np.memmap)
+        expected = pipeline.encode(DOCS)
+        assert np.array_equal(codes[1400:1600], expected[1400:1600])
+        assert np.array_equal(codes[-1], expected[-1])
+        assert np.array_equal(codes, expected)
+        assert recall(loaded, codes) == recall(pipeline, expected)
+
+        _, in_memory = load_shards(tmp, mmap=False)
+        assert isinstance(in_memory, np.ndarray) and np.array_equal(in_memory, expected)
+
+
+if __name__ == "__main__":
+    test_pipelines_keep_recall()
+    test_truncate_renormalizes()
+    test_write_and_load_shards()
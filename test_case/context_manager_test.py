@@ -0,0 +1,98 @@
+import sys
+import os
+import json
+
+# Add the parent directory to sys.path to import the LLM, agent and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.map_reduce import count_tokens
+from agent.agent_runtime import AgentSession
+from agent.context_manager import ContextManager, SUMMARY_PREFIX
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers, TOOLS_PATH
+
+with open(TOOLS_PATH, encoding="utf-8") as f:
+    TOOLS = json.load(f)["tools"]
+
+
+def tool_turn(i, text):
+    call = {"id": f"call_{i}", "type": "function",
+            "function": {"name": "full_text_search", "arguments": json.dumps({"query": f"q{i}"})}}
+    return [{"role": "assistant", "content": None, "tool_calls": [call]},
+            {"role": "tool", "tool_call_id": f"call_{i}", "content": text}]
+
+
+def test_tool_content_compaction():
+    context = ContextManager(max_tool_tokens=200, min_score=0.5)
+    result = {"results": [{"title": f"文档{i}", "content": "机器学习 " * 40, "score": 1 - i * 0.1} for i in range(8)],
+              "total": 8}
+    content = json.loads(context.tool_content(result))
+    assert count_tokens(json.dumps(content, ensure_ascii=False)) <= 200
+    assert 1 <= len(content["results"]) < 6 and content["omitted_results"] == 8 - len(content["results"])
+    assert [hit["title"] for hit in content["results"]] == [f"文档{i}" for i in range(len(content["results"]))]
+
+    small = {"results": [{"title": "a", "similarity": 0.9}, {"title": "b", "similarity": 0.2}]}
+    assert [hit["title"] for hit in json.loads(context.tool_content(small))["results"]] == ["a"]
+    text = context.tool_content("x " * 1000)
+    assert text.endswith("tokens]") and count_tokens(text) < 220
+
+
+def test_trimming_keeps_turns_whole():
+    context = ContextManager(max_tokens=300, summarize=False, keep_recent=1)
+    history = [{"role": "user", "content": "查找机器学习文档"}]
+    for i in range(6):
+        history.extend(tool_turn(i, "结果 " * 60))
+    sent = context.prepare(history)
+
+    assert len(history) == 13
+    assert context.history_tokens(sent) <= 300
+    assert sent[0] is history[0] and sent[-2:] == history[-2:]
+    for i, message in enumerate(sent):
+        if message["role"] == "tool":
+            assert sent[i - 1]["role"] in ("assistant", "tool")
+    assert context.stats["trimmed_messages"] == 13 - len(sent)
+
+
+def test_background_summary_replaces_old_turns():
+    with MockServer(response_text="用户在找机器学习文档，已搜索 q0-q4。") as server:
+        configure_providers(server.url)
+        context = ContextManager(max_tokens=400, keep_recent=1, provider_name="MOCK", model="mock-model")
+        history = [{"role": "user", "content": "查找机器学习文档"}]
+        for i in range(6):
+            history.extend(tool_turn(i, "结果 " * 60))
+        recent = history[-2:]
+        context.prepare(history)
+        assert context.pending is not None and len(history) == 13
+        context.wait()
+        sent = context.prepare(history)
+        context.close()
+
+    assert history[0]["role"] == "system" and history[0]["content"].startswith(SUMMARY_PREFIX)
+    assert "q0-q4" in history[0]["content"]
+    assert history[1]["content"] == "查找机器学习文档" and history[-2:] == recent
+    assert context.history_tokens(history) <= 400 and sent == history
+    assert context.stats["summaries"] == 1
+
+
+def test_session_with_context():
+    def search(arguments):
+        return {"results": [{"title": f"文档{i}", "content": "内容 " * 100, "score": 0.9} for i in range(10)]}
+
+    with MockServer(parallel_tool_calls=1) as server:
+        configure_providers(server.url)
+        context = ContextManager(max_tokens=2000, max_tool_tokens=300)
+        with AgentSession("MOCK", "mock-model", TOOLS, {"full_text_search": search}, context=context) as session:
+            for i in range(3):
+                session.run(f"查找机器学习文档 {i}")
+
+    assert context.provider_name == "MOCK"
+    tool_messages = [m for m in session.history if m["role"] == "tool"]
+    assert tool_messages and all(count_tokens(m["content"]) <= 300 for m in tool_messages)
+    assert all("context_tokens" in turn for turn in session.turns)
+
+
+if __name__ == "__main__":
+    test_tool_content_compaction()
+    test_trimming_keeps_turns_whole()
+    test_background_summary_replaces_old_turns()
+    test_session_with_context()
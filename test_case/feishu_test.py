@@ -7,6 +7,10 @@ parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(parent_dir)
 
 from sync_api.feishu_spreadsheet import get_tenant_access_token, get_sheet_id, read_data, add_data
+from LLM import cassette
+
+# LLM_CASSETTE_MODE=record / replay 时录制或离线回放本脚本的请求
+cassette.from_env(__file__)
 
 def test_get_tenant_access_token():
     """Test function to get and print the tenant access token."""
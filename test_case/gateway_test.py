@@ -0,0 +1,104 @@
+import sys
+import os
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import openai
+
+# Add the parent directory to sys.path to import the LLM, embedding and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from LLM.gateway import Gateway
+from embedding import openai_based_embedding
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers, TOOLS_PATH
+
+
+def use_gateway(gateway):
+    """Point the GATEWAY provider at the gateway; the API key names the upstream provider"""
+    provider = {"api_key": "MOCK", "base_url": gateway.base_url}
+    openai_based_api.PROVIDERS["GATEWAY"] = provider
+    openai_based_embedding.PROVIDERS["GATEWAY"] = provider
+
+
+def test_embedding_micro_batching():
+    texts = [f"第 {i} 条文本" for i in range(20)]
+    with MockServer(latency={"distribution": "fixed", "value": 0.05}) as server:
+        configure_providers(server.url)
+        direct = openai_based_embedding.process_embedding("MOCK", "mock-embedding", texts[:3], coalesce=False)
+        server.reset_stats()
+        # 窗口足够长，批次只会因为达到 10 条而发送
+        with Gateway(window=2.0, max_batch_inputs=10) as gateway:
+            use_gateway(gateway)
+            with ThreadPoolExecutor(max_workers=20) as executor:
+                responses = list(executor.map(
+                    lambda text: openai_based_embedding.process_embedding("GATEWAY", "mock-embedding", text,
+                                                                          coalesce=False), texts))
+            upstream_calls = server.count("/embeddings")
+            repeated = openai_based_embedding.process_embedding("GATEWAY", "mock-embedding", texts[:3],
+                                                                coalesce=False)
+            stats = gateway.get_stats()
+
+    assert len(responses) == 20 and all(len(r["result"].data) == 1 for r in responses)
+    # 20 个单条请求合并为每批 10 条
+    assert upstream_calls == 2
+    assert stats["inputs_per_upstream_call"] == 10
+    assert responses[0]["result"].data[0].embedding == direct["result"].data[0].embedding
+    assert [item.embedding for item in repeated["result"].data] == [item.embedding for item in direct["result"].data]
+    assert stats["cache_hits"] == 3 and stats["upstream_calls"] == 2
+    assert repeated["prompt_tokens"] > 0
+
+
+def test_chat_through_gateway():
+    with open(TOOLS_PATH, encoding="utf-8") as f:
+        tools = json.load(f)["tools"]
+    with MockServer(token_interval=0.001) as server:
+        configure_providers(server.url)
+        with Gateway() as gateway:
+            use_gateway(gateway)
+            response = openai_based_api.process_content("GATEWAY", "你好", "mock-model", n=2, coalesce=False)
+            events = list(openai_based_api.stream_content("GATEWAY", "查找机器学习文档", "mock-model", tools=tools))
+            text_events = list(openai_based_api.stream_content("GATEWAY", "你好", "mock-model"))
+
+    assert response["result"] == server.config["response_text"]
+    assert len(response["choices"]) == 2 and response["input_tokens"] > 0
+    done = events[-1]["response"]
+    assert [e["tool_call"].function.name for e in events if e["type"] == "tool_call"] == ["full_text_search"]
+    assert done["tool_calls"][0].function.name == "full_text_search"
+    assert json.loads(done["tool_calls"][0].function.arguments)["query"]
+    assert text_events[-1]["response"]["result"] == server.config["response_text"]
+    assert server.count("/chat/completions") == 3
+
+
+def test_stream_error_after_headers():
+    def failing_stream(*args, **kwargs):
+        yield {"type": "delta", "content": "部分"}
+        raise RuntimeError("upstream connection reset")
+
+    original = openai_based_api.stream_content
+    with Gateway() as gateway:
+        use_gateway(gateway)
+        client = openai_based_api.get_openai_client("GATEWAY")
+        openai_based_api.stream_content = failing_stream
+        try:
+            stream = client.chat.completions.create(model="mock-model", stream=True,
+                                                    messages=[{"role": "user", "content": "你好"}])
+            received = []
+            try:
+                for chunk in stream:
+                    received.append(chunk.choices[0].delta.content)
+                assert False, "expected the SSE error event to raise"
+            except openai.APIError as e:
+                assert "upstream connection reset" in str(e)
+        finally:
+            openai_based_api.stream_content = original
+
+    # 错误之前的内容已经送达，响应以 SSE error 事件结束而不是损坏的分块
+    assert "部分" in received
+
+
+if __name__ == "__main__":
+    test_embedding_micro_batching()
+    test_chat_through_gateway()
+    test_stream_error_after_headers()
@@ -0,0 +1,87 @@
+import sys
+import os
+import random
+import numpy as np
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding import dash_scope_hybrid
+from embedding.dash_scope_hybrid import SparseMatrix, normalize_hybrid_output, hybrid_scores, process_hybrid_embedding
+
+
+def make_rows(count, vocabulary=500, seed=0):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(count):
+        indices = rng.sample(range(vocabulary), rng.randint(0, 12))
+        rows.append([{"index": i, "value": rng.random(), "token": f"t{i}"} for i in indices])
+    return rows
+
+
+def naive_dot(rows_a, rows_b):
+    scores = np.zeros((len(rows_a), len(rows_b)))
+    for i, a in enumerate(rows_a):
+        weights = {item["index"]: item["value"] for item in a}
+        for j, b in enumerate(rows_b):
+            scores[i, j] = sum(weights.get(item["index"], 0.0) * item["value"] for item in b)
+    return scores
+
+
+def fake_response(texts, dimension=8):
+    embeddings = []
+    rows = make_rows(len(texts), seed=texts[0])
+    for i, text in enumerate(texts):
+        embeddings.append({"text_index": i, "embedding": [float(len(text))] * dimension, "sparse_embedding": rows[i]})
+    embeddings.reverse()
+    return SimpleNamespace(output={"embeddings": embeddings})
+
+
+def test_sparse_dot_matches_naive():
+    queries, docs = make_rows(5, seed=1), make_rows(40, seed=2)
+    scores = SparseMatrix.from_rows(queries).dot(SparseMatrix.from_rows(docs))
+    assert np.allclose(scores, naive_dot(queries, docs), atol=1e-5)
+
+
+def test_normalize_and_stack():
+    dense, sparse = normalize_hybrid_output(fake_response(["a", "bb", "ccc"]))
+    assert dense.dtype == np.float32 and dense.shape == (3, 8)
+    assert dense[2, 0] == 3.0
+    assert sparse.indptr[0] == 0 and sparse.indptr[-1] == len(sparse.indices)
+
+    stacked = SparseMatrix.vstack([sparse, sparse])
+    assert len(stacked) == 6
+    assert np.array_equal(stacked.row(4)[0], sparse.row(1)[0])
+
+
+def test_process_hybrid_embedding_batches():
+    calls = []
+
+    def fake_process_embedding(provider_name, model, input_text=None, dimensions=None, output_type=None, **kwargs):
+        calls.append((len(input_text), output_type))
+        return {"result": fake_response(input_text), "total_tokens": len(input_text), "elapsed_time": 0.0}
+
+    original = dash_scope_hybrid.dash_scope_embedding.process_embedding
+    dash_scope_hybrid.dash_scope_embedding.process_embedding = fake_process_embedding
+    try:
+        response = process_hybrid_embedding("ALIYUN", "text-embedding-v3", [f"text {i}" for i in range(23)])
+    finally:
+        dash_scope_hybrid.dash_scope_embedding.process_embedding = original
+
+    assert calls == [(10, "dense&sparse"), (10, "dense&sparse"), (3, "dense&sparse")]
+    assert response["dense"].shape == (23, 8) and len(response["sparse"]) == 23
+    assert response["total_tokens"] == 23
+
+    queries = response["sparse"].select([0, 15])
+    assert np.array_equal(queries.row(1)[0], response["sparse"].row(15)[0])
+    scores = hybrid_scores(response["dense"][[0, 15]], queries, response["dense"], response["sparse"], alpha=0.5)
+    assert scores.shape == (2, 23)
+    # 查询与自身的得分最高
+    assert scores[1].argmax() == 15
+
+
+if __name__ == "__main__":
+    test_sparse_dot_matches_naive()
+    test_normalize_and_stack()
+    test_process_hybrid_embedding_batches()
@@ -0,0 +1,156 @@
+import sys
+import os
+import time
+import tempfile
+import threading
+import numpy as np
+
+# Add the parent directory to the path so we can import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding.ingestion_pipeline import IngestionPipeline, VectorStore, make_embed_fn
+from embedding import openai_based_embedding
+
+
+def fake_vector(text, dim=8):
+    return np.random.default_rng(abs(hash(text)) % 2 ** 32).standard_normal(dim).astype(np.float32)
+
+
+def write_corpus(directory, num_files=6):
+    for i in range(num_files):
+        with open(os.path.join(directory, f"doc{i}.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(f"Document {i} sentence {j} about topic {j % 7}." for j in range(200)))
+
+
+def test_pipeline_ingests_all_chunks():
+    calls = []
+    lock = threading.Lock()
+
+    def embed(texts):
+        with lock:
+            calls.append(len(texts))
+        time.sleep(0.01)
+        return np.stack([fake_vector(text) for text in texts]), 10 * len(texts)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "corpus")
+        os.makedirs(corpus)
+        write_corpus(corpus)
+        pipeline = IngestionPipeline(embed, os.path.join(tmp, "index"), chunk_tokens=200, overlap_tokens=20,
+                                     batch_size=4, embed_workers=3, queue_size=4)
+        report = pipeline.run([corpus])
+
+        assert report["files"] == 6 and report["skipped_files"] == 0
+        assert report["chunks"] == sum(calls) > 6
+        assert max(calls) <= 4
+        assert report["tokens"] == 10 * report["chunks"]
+        assert set(report["stages"]) == {"read", "chunk", "embed", "write"}
+        assert report["stages"]["embed"]["items_per_sec"] > 0
+
+        store = VectorStore(os.path.join(tmp, "index"))
+        vectors, metadata = store.load()
+        assert vectors.shape == (report["chunks"], 8)
+        for vector, item in zip(vectors, metadata):
+            assert np.allclose(vector, fake_vector(item["text"]))
+        # 同一文件的块按顺序连续写入
+        for path in {item["path"] for item in metadata}:
+            indices = [item["chunk_index"] for item in metadata if item["path"] == path]
+            assert indices == list(range(len(indices)))
+        store.close()
+
+        # 再次运行时所有文件均已完成
+        report = pipeline.run([corpus])
+        assert report["skipped_files"] == 6 and report["chunks"] == 0
+
+
+def test_pipeline_resumes_after_failure():
+    state = {"batches": 0}
+
+    def flaky_embed(texts):
+        state["batches"] += 1
+        if state["batches"] == 8:
+            raise RuntimeError("connection reset")
+        return np.stack([fake_vector(text) for text in texts]), 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "corpus")
+        os.makedirs(corpus)
+        write_corpus(corpus)
+        index_dir = os.path.join(tmp, "index")
+        pipeline = IngestionPipeline(flaky_embed, index_dir, chunk_tokens=200, overlap_tokens=20,
+                                     batch_size=2, embed_workers=1, queue_size=2)
+        try:
+            pipeline.run([corpus])
+            assert False, "expected the embedding failure to propagate"
+        except RuntimeError:
+            pass
+
+        report = pipeline.run([corpus])
+        assert report["skipped_files"] >= 1
+
+        store = VectorStore(index_dir)
+        vectors, metadata = store.load()
+        keys = [(item["path"], item["chunk_index"]) for item in metadata]
+        assert len(keys) == len(set(keys)) == len(vectors)
+        assert len({item["path"] for item in metadata}) == 6
+        store.close()
+
+
+def test_empty_files_and_short_metadata():
+    texts = []
+
+    def embed(batch):
+        texts.extend(batch)
+        return np.stack([fake_vector(text) for text in batch]), 0
+
+    with tempfile.TemporaryDirectory() as tmp:
+        corpus = os.path.join(tmp, "corpus")
+        os.makedirs(corpus)
+        write_corpus(corpus, num_files=2)
+        for name, content in (("empty.txt", ""), ("blank.txt", "  \n\t\n")):
+            with open(os.path.join(corpus, name), "w", encoding="utf-8") as f:
+                f.write(content)
+        index_dir = os.path.join(tmp, "index")
+        report = IngestionPipeline(embed, index_dir, chunk_tokens=200, overlap_tokens=20).run([corpus])
+        # 空文件不请求 embedding，但记为完成
+        assert all(text.strip() for text in texts)
+        assert report["chunks"] == len(texts)
+
+        store = VectorStore(index_dir)
+        empty = os.path.join(corpus, "empty.txt")
+        assert store.is_done(empty, f"0:{int(os.stat(empty).st_mtime)}")
+        rows = store.checkpoint["rows"]
+        store.close()
+
+        # 模拟崩溃：元数据比检查点短，仍然可以恢复
+        with open(os.path.join(index_dir, "metadata.jsonl"), encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(os.path.join(index_dir, "metadata.jsonl"), "w", encoding="utf-8") as f:
+            f.writelines(lines[:rows - 3])
+        store = VectorStore(index_dir)
+        vectors, metadata = store.load()
+        assert len(vectors) == len(metadata) == rows - 3
+        store.close()
+
+
+def test_make_embed_fn_openai():
+    from types import SimpleNamespace
+    original = openai_based_embedding.process_embedding
+
+    def fake_process_embedding(provider_name, model, input_text, dimensions=None, encoding_format="float"):
+        data = [SimpleNamespace(index=i, embedding=[float(len(text)), 1.0]) for i, text in enumerate(input_text)]
+        return {"result": SimpleNamespace(data=data), "total_tokens": 5}
+
+    openai_based_embedding.process_embedding = fake_process_embedding
+    try:
+        vectors, tokens = make_embed_fn("openai", "FAKE", "text-embedding-3-small")(["a", "bcd"])
+        assert vectors.tolist() == [[1.0, 1.0], [3.0, 1.0]] and tokens == 5
+    finally:
+        openai_based_embedding.process_embedding = original
+
+
+if __name__ == "__main__":
+    test_pipeline_ingests_all_chunks()
+    test_pipeline_resumes_after_failure()
+    test_empty_files_and_short_metadata()
+    test_make_embed_fn_openai()
@@ -0,0 +1,76 @@
+import sys
+import os
+import time
+import tempfile
+
+# Add the parent directory to sys.path to import the LLM and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM.job_queue import JobQueue, run_worker_pool
+from benchmark.mock_server import MockServer
+
+
+def word_count(response):
+    """Post-processing hook run inside the worker processes"""
+    return dict(response, words=len(response["result"].split()))
+
+
+def test_lease_ack_retry():
+    with tempfile.TemporaryDirectory() as tmp:
+        queue = JobQueue(os.path.join(tmp, "jobs.db"))
+        assert queue.enqueue({"user_prompt": "a", "model": "m"}, key="a")
+        assert not queue.enqueue({"user_prompt": "a again", "model": "m"}, key="a")
+        assert queue.enqueue_many([{"user_prompt": p, "model": "m", "custom_id": p} for p in "bc"], max_attempts=2) == 2
+
+        first = queue.lease("w1", limit=2, visibility_timeout=0.2)
+        assert [job["key"] for job in first] == ["a", "b"] and first[0]["attempts"] == 1
+        second = queue.lease("w2", limit=5)
+        assert [job["key"] for job in second] == ["c"]
+
+        # w1 崩溃：租约过期后任务重新可被领取
+        time.sleep(0.25)
+        again = queue.lease("w2", limit=5)
+        assert sorted(job["key"] for job in again) == ["a", "b"] and again[0]["attempts"] == 2
+
+        assert queue.ack(again[0]["id"], "w2", {"result": "from w2"})
+        # 迟到的旧结果不会覆盖已写入的结果
+        assert not queue.ack(first[0]["id"], "w1", {"result": "late"})
+        assert queue.fail(again[1]["id"], "w1", "not my lease") is None
+        assert queue.fail(again[1]["id"], "w2", "boom") == "failed"
+        assert queue.fail(second[0]["id"], "w2", "boom", retry_delay=0.05) == "pending"
+        assert queue.lease("w2") == []
+        time.sleep(0.06)
+        assert [job["key"] for job in queue.lease("w2")] == ["c"]
+
+        status = queue.status()
+        assert (status["done"], status["failed"], status["leased"], status["total"]) == (1, 1, 1, 3)
+        assert dict(queue.results()) == {"a": {"result": "from w2"}}
+        assert queue.retry_failed() == 1 and queue.status()["pending"] == 1
+        queue.close()
+
+
+def test_worker_pool():
+    with tempfile.TemporaryDirectory() as tmp, \
+            MockServer(latency={"distribution": "fixed", "value": 0.05}) as server:
+        db_path = os.path.join(tmp, "jobs.db")
+        queue = JobQueue(db_path)
+        queue.enqueue_many([{"user_prompt": f"问题 {i}", "model": "mock-model", "custom_id": f"job-{i}"}
+                            for i in range(24)])
+        providers = {"MOCK": {"api_key": "mock-key", "base_url": server.base_url}}
+        status = run_worker_pool(db_path, "MOCK", processes=2, concurrency=4, poll_interval=0.05,
+                                 postprocess=word_count, providers=providers)
+        results = dict(queue.results())
+        queue.close()
+
+    assert status["done"] == 24 and status["pending"] == status["leased"] == status["failed"] == 0
+    assert len(status["workers"]) == 2 and status["throughput"] > 0
+    assert results["job-0"]["result"] == server.config["response_text"]
+    assert all(result["words"] == len(server.config["response_text"].split()) for result in results.values())
+    assert server.count("/chat/completions") == 24
+    # 两个进程各自 4 路并发，同时在途的请求超过单个进程的上限
+    assert 4 < server.get_stats()["peak_in_flight"] <= 8
+
+
+if __name__ == "__main__":
+    test_lease_ack_retry()
+    test_worker_pool()
@@ -0,0 +1,129 @@
+import sys
+import os
+import time
+import sqlite3
+import tempfile
+import threading
+
+# Add the parent directory to sys.path to import the LLM, embedding and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import ledger, openai_based_api
+from LLM.ledger import Ledger, BudgetExceeded, estimate_cost
+from embedding import openai_based_embedding
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+
+def test_cost_with_cached_tokens():
+    # gpt-4.1: input 2.00, cached 0.50, output 8.00 per 1M
+    assert abs(estimate_cost("gpt-4.1-2025-04-14", 1_000_000, 1_000_000, cached_tokens=400_000) - 9.4) < 1e-9
+    # 未给出 cached_input 的模型按默认折扣计费
+    prices = {"custom": {"input": 1.0, "output": 2.0, "image": 0.001}}
+    assert abs(estimate_cost("custom-v1", 1_000_000, 0, cached_tokens=1_000_000, image_count=10,
+                             prices=prices) - 0.51) < 1e-9
+    assert estimate_cost("unknown", 10, 10) is None
+
+
+def test_concurrent_record_and_query():
+    book = Ledger()
+
+    def worker(i):
+        with ledger.tags("eval", f"worker-{i % 2}"):
+            for _ in range(500):
+                book.record("P1" if i % 2 else "P2", "gpt-4o-mini", "chat", input_tokens=100, output_tokens=10)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    book.record("P1", "text-embedding-3-small", "embedding", input_tokens=1000)
+
+    total = book.query()
+    assert total["calls"] == 4001 and total["input_tokens"] == 401000 and total["output_tokens"] == 40000
+    assert book.query(provider="P1", kind="chat")["calls"] == 2000
+    assert book.query(tag="eval")["calls"] == 4000
+    assert book.query(tag="worker-1")["calls"] == 2000
+    assert book.query(model="text-embedding-3-small")["cost"] == 1000 * 0.02 / 1e6
+    assert set(book.breakdown("tag")) == {"eval", "worker-0", "worker-1"}
+    assert abs(book.query(kind="chat")["cost"] - 4000 * (100 * 0.15 + 10 * 0.6) / 1e6) < 1e-9
+
+
+def test_budgets_reject_and_throttle():
+    book = Ledger()
+    book.add_budget("eval tokens", limit_tokens=1000, tag="eval")
+    book.add_budget("p2 spend", limit_cost=0.004, provider="P2", action="throttle", throttle_delay=0.25)
+
+    with ledger.tags("eval"):
+        book.check("P1", "gpt-4o")
+        book.record("P1", "gpt-4o", input_tokens=900, output_tokens=100)
+        try:
+            book.check("P1", "gpt-4o")
+            assert False, "expected the eval budget to reject"
+        except BudgetExceeded as e:
+            assert e.budget.name == "eval tokens"
+    # 不带 eval 标签的调用不受该预算限制
+    assert book.check("P1", "gpt-4o") == 0
+
+    book.record("P2", "gpt-4o", input_tokens=1000)
+    assert book.check("P2", "gpt-4o") == 0
+    book.record("P2", "gpt-4o", input_tokens=1000)
+    assert book.check("P2", "gpt-4o") == 0.25
+
+    windowed = Ledger()
+    budget = windowed.add_budget("per second", limit_tokens=10, period=0.2)
+    windowed.record("P", "m", input_tokens=10)
+    assert budget.exceeded
+    time.sleep(0.25)
+    assert windowed.check("P", "m") == 0 and not budget.exceeded
+
+
+def test_sqlite_flush():
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "ledger.db")
+        book = Ledger(db_path, flush_interval=0.1)
+        with ledger.tags("batch"):
+            for _ in range(5):
+                book.record("P1", "gpt-4.1", input_tokens=10, output_tokens=5)
+        time.sleep(0.4)
+        with sqlite3.connect(db_path) as conn:
+            assert conn.execute("SELECT COUNT(*), SUM(input_tokens) FROM usage").fetchone() == (5, 50)
+        book.record("P1", "gpt-4.1", input_tokens=10, output_tokens=5)
+        book.close()
+        with sqlite3.connect(db_path) as conn:
+            rows = conn.execute("SELECT provider, model, kind, tags FROM usage").fetchall()
+        assert len(rows) == 6 and rows[-1] == ("P1", "gpt-4.1", "chat", '[]') and rows[0][3] == '["batch"]'
+
+
+def test_api_calls_record_to_default_ledger():
+    book = ledger.set_default_ledger(Ledger())
+    try:
+        with MockServer() as server:
+            configure_providers(server.url)
+            with ledger.tags("smoke"):
+                openai_based_api.process_content("MOCK", "hi", "gpt-4.1")
+                list(openai_based_api.stream_content("MOCK", "hi", "gpt-4.1"))
+                openai_based_embedding.process_embedding("MOCK", "text-embedding-3-small", ["a", "b"])
+            assert book.query(tag="smoke")["calls"] == 3
+            assert book.query(kind="chat")["calls"] == 1 and book.query(kind="chat_stream")["calls"] == 1
+            assert book.query(kind="embedding")["input_tokens"] > 0
+            assert book.query(model="gpt-4.1")["cost"] > 0
+
+            book.add_budget("stop", limit_cost=0.0, model="gpt-4.1")
+            try:
+                openai_based_api.process_content("MOCK", "hi", "gpt-4.1")
+                assert False, "expected the budget to reject the call"
+            except BudgetExceeded:
+                pass
+            assert server.count("/chat/completions") == 2
+    finally:
+        ledger.set_default_ledger(None)
+
+
+if __name__ == "__main__":
+    test_cost_with_cached_tokens()
+    test_concurrent_record_and_query()
+    test_budgets_reject_and_throttle()
+    test_sqlite_flush()
+    test_api_calls_record_to_default_ledger()
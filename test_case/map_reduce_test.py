@@ -0,0 +1,98 @@
+import sys
+import os
+import threading
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import map_reduce
+from LLM.map_reduce import chunk_content, count_tokens, process_content_map_reduce
+
+
+def fake_process_content(provider_name, user_prompt, model, content=None, **kwargs):
+    """离线替身：返回内容的前缀，并记录调用"""
+    with fake_process_content.lock:
+        fake_process_content.calls.append(content)
+    return {
+        "result": f"summary of: {(content or '')[:20]}",
+        "input_tokens": count_tokens(content or ""),
+        "output_tokens": 5,
+        "elapsed_time": 0.0
+    }
+
+
+fake_process_content.lock = threading.Lock()
+fake_process_content.calls = []
+
+
+def test_chunk_content():
+    """Chunks respect the token budget, overlap, and cover the whole content."""
+    content = "".join(f"第{i}句话，讲述一个关于性能优化的小故事。Sentence {i} ends here.\n" for i in range(300))
+    chunks = chunk_content(content, chunk_tokens=200, overlap_tokens=20)
+
+    assert len(chunks) > 1
+    assert all(count_tokens(chunk) <= 200 for chunk in chunks)
+    assert chunks[0] == content[:len(chunks[0])]
+    assert content.endswith(chunks[-1])
+    # 相邻块之间存在重叠
+    assert chunks[1][:10] in chunks[0]
+    print(f"Split {count_tokens(content)} tokens into {len(chunks)} chunks")
+
+
+def test_short_content_single_chunk():
+    assert chunk_content("short text", chunk_tokens=100, overlap_tokens=10) == ["short text"]
+
+
+def test_map_reduce_progress():
+    """Map calls run for every chunk, then one reduce call combines them."""
+    original = map_reduce.openai_based_api.process_content
+    map_reduce.openai_based_api.process_content = fake_process_content
+    fake_process_content.calls.clear()
+    events = []
+    try:
+        content = "这是一个很长的文档。\n" * 500
+        response = process_content_map_reduce(
+            provider_name="MOCK",
+            user_prompt="总结",
+            model="mock-model",
+            content=content,
+            chunk_tokens=1000,
+            overlap_tokens=50,
+            max_workers=4,
+            progress_callback=events.append
+        )
+    finally:
+        map_reduce.openai_based_api.process_content = original
+
+    kinds = [event["event"] for event in events]
+    assert kinds[0] == "chunked" and kinds[-1] == "done"
+    assert kinds.count("map") == response["chunks"]
+    assert len(fake_process_content.calls) == response["chunks"] + 1
+    assert response["result"].startswith("summary of:")
+    assert response["input_tokens"] > 0
+
+
+def test_map_reduce_local_reduce():
+    original = map_reduce.openai_based_api.process_content
+    map_reduce.openai_based_api.process_content = fake_process_content
+    try:
+        response = process_content_map_reduce(
+            provider_name="MOCK",
+            user_prompt="总结",
+            model="mock-model",
+            content="段落内容。\n" * 400,
+            chunk_tokens=200,
+            overlap_tokens=0,
+            reduce_fn=lambda results: "\n".join(r["result"] for r in results)
+        )
+    finally:
+        map_reduce.openai_based_api.process_content = original
+
+    assert response["result"].count("summary of:") == response["chunks"]
+
+
+if __name__ == "__main__":
+    test_chunk_content()
+    test_short_content_single_chunk()
+    test_map_reduce_progress()
+    test_map_reduce_local_reduce()
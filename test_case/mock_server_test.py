@@ -0,0 +1,139 @@
+import sys
+import os
+import json
+import time
+import threading
+import openai
+
+# Add the parent directory to sys.path to import the LLM, embedding, sync_api and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api
+from embedding import openai_based_embedding
+from sync_api import feishu_spreadsheet
+from benchmark.mock_server import MockServer, sample_latency
+from benchmark.api_benchmark import configure_providers, run_path, compare
+
+TOOLS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "agent", "Agent_Tools.json")
+
+
+def test_chat_embedding_and_feishu_paths():
+    with MockServer() as server:
+        configure_providers(server.url)
+
+        response = openai_based_api.process_content("MOCK", "Say hi", "mock-model", content="some content")
+        assert response["result"] == server.config["response_text"]
+        assert response["input_tokens"] > 0 and response["output_tokens"] > 0
+
+        with open(TOOLS_PATH, encoding="utf-8") as f:
+            tools = json.load(f)["tools"]
+        response = openai_based_api.process_content("MOCK", "查找机器学习文档", "mock-model", tools=tools)
+        call = response["tool_calls"][0]
+        assert call.function.name == "full_text_search"
+        assert json.loads(call.function.arguments) == {"query": "查找机器学习文档", "limit": 10}
+
+        events = list(openai_based_api.stream_content("MOCK", "Say hi", "mock-model"))
+        assert [e["type"] for e in events].count("delta") > 3
+        assert events[-1]["response"]["result"] == server.config["response_text"]
+        assert events[-1]["response"]["output_tokens"] > 0
+
+        response = openai_based_embedding.process_embedding("MOCK", "mock-embedding", ["a", "b", "a"], dimensions=32)
+        vectors = [item.embedding for item in response["result"].data]
+        assert len(vectors) == 3 and len(vectors[0]) == 32 and vectors[0] == vectors[2] != vectors[1]
+
+        df = feishu_spreadsheet.read_data("mock-spreadsheet", sheet_name="Sheet1")
+        assert list(df.columns) == ["question", "answer"] and len(df) == 2
+        result = feishu_spreadsheet.add_data("mock-spreadsheet", sheet_name="Sheet1", column="A", value="new")
+        assert result["updates"]["updatedRows"] == 1
+        assert len(feishu_spreadsheet.read_data("mock-spreadsheet", sheet_id="mock-sheet-1")) == 3
+
+        assert server.count("/chat/completions", 200) == 3
+        assert server.count("/embeddings", 200) == 1
+
+
+def test_streamed_tool_calls_and_multiple_choices():
+    with MockServer(parallel_tool_calls=2) as server:
+        client = openai.OpenAI(api_key="mock", base_url=server.base_url)
+        with open(TOOLS_PATH, encoding="utf-8") as f:
+            tools = json.load(f)["tools"]
+        stream = client.chat.completions.create(model="mock-model", messages=[{"role": "user", "content": "hi"}],
+                                                tools=tools, stream=True)
+        arguments = {}
+        for chunk in stream:
+            for delta in (chunk.choices[0].delta.tool_calls or []) if chunk.choices else []:
+                arguments[delta.index] = arguments.get(delta.index, "") + (delta.function.arguments or "")
+        assert len(arguments) == 2
+        assert json.loads(arguments[0]) == {"query": "hi", "limit": 10}
+        assert json.loads(arguments[1]) == {"keywords": ["hi"], "match_type": "any", "limit": 10}
+
+        completion = client.chat.completions.create(model="mock-model", n=3,
+                                                    messages=[{"role": "user", "content": "hi"}])
+        assert [choice.index for choice in completion.choices] == [0, 1, 2]
+
+
+def test_error_injection_and_capacity():
+    with MockServer(rate_limit_rate=1.0) as server:
+        client = openai.OpenAI(api_key="mock", base_url=server.base_url, max_retries=0)
+        try:
+            client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+            assert False, "expected a rate limit error"
+        except openai.RateLimitError:
+            pass
+
+        server.update(rate_limit_rate=0.0, error_rate=1.0)
+        try:
+            client.embeddings.create(model="m", input="hi")
+            assert False, "expected a server error"
+        except openai.InternalServerError:
+            pass
+
+        server.update(error_rate=0.0, max_concurrency=2, latency=0.2)
+        outcomes = []
+
+        def call():
+            try:
+                client.chat.completions.create(model="m", messages=[{"role": "user", "content": "hi"}])
+                outcomes.append("ok")
+            except openai.RateLimitError:
+                outcomes.append("429")
+
+        threads = [threading.Thread(target=call) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert outcomes.count("ok") == 2 and outcomes.count("429") == 3
+        assert server.get_stats()["peak_in_flight"] == 2
+
+
+def test_latency_distributions():
+    import random
+    rng = random.Random(0)
+    assert sample_latency(0.5, rng) == 0.5
+    samples = [sample_latency({"distribution": "uniform", "low": 0.1, "high": 0.2}, rng) for _ in range(100)]
+    assert 0.1 <= min(samples) and max(samples) <= 0.2
+    samples = [sample_latency({"distribution": "lognormal", "median": 0.1, "sigma": 0.5}, rng) for _ in range(2000)]
+    assert 0.08 < sorted(samples)[1000] < 0.12
+
+
+def test_benchmark_run_and_compare():
+    with MockServer(latency=0.01) as server:
+        configure_providers(server.url)
+        start = time.time()
+        result = run_path(lambda: openai_based_api.process_content("MOCK", "hi", "mock-model", coalesce=False), 20, 4,
+                          warmup=1)
+        assert time.time() - start < 30
+        assert result["errors"] == 0 and result["p50_ms"] >= 10 and result["p99_ms"] >= result["p50_ms"]
+
+    baseline = {"results": {"chat": dict(result)}}
+    assert compare({"chat": result}, baseline) == []
+    slower = dict(result, p50_ms=result["p50_ms"] * 2, throughput=result["throughput"] / 2)
+    assert len(compare({"chat": slower}, baseline)) == 2
+
+
+if __name__ == "__main__":
+    test_chat_embedding_and_feishu_paths()
+    test_streamed_tool_calls_and_multiple_choices()
+    test_error_injection_and_capacity()
+    test_latency_distributions()
+    test_benchmark_run_and_compare()
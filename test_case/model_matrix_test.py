@@ -0,0 +1,92 @@
+import sys
+import os
+import time
+import tempfile
+import threading
+
+# Add the parent directory to sys.path to import the LLM and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import model_matrix, openai_based_api
+from LLM.model_matrix import run_matrix, get_price, estimate_cost, format_table
+from benchmark.mock_server import MockServer
+
+
+def test_price_lookup():
+    assert get_price("gpt-4.1-2025-04-14")["input"] == 2.0
+    assert get_price("gpt-4.1-mini-2025-04-14")["output"] == 1.6
+    assert get_price("unknown-model") is None
+    assert abs(estimate_cost("gpt-4.1", 1_000_000, 500_000) - 6.0) < 1e-9
+
+
+def test_matrix_limits_and_cache():
+    state = {"active": {}, "peak": {}, "calls": 0, "fail": True}
+    lock = threading.Lock()
+
+    def fake_stream_content(provider_name, user_prompt, model, **kwargs):
+        with lock:
+            state["calls"] += 1
+            state["active"][provider_name] = state["active"].get(provider_name, 0) + 1
+            state["peak"][provider_name] = max(state["peak"].get(provider_name, 0), state["active"][provider_name])
+        time.sleep(0.03)
+        with lock:
+            state["active"][provider_name] -= 1
+        if model == "flaky" and state["fail"]:
+            raise RuntimeError("gateway timeout")
+        yield {"type": "delta", "content": "ok"}
+        yield {"type": "done", "response": {"result": f"{model} says {user_prompt}", "input_tokens": 1000,
+                                            "output_tokens": 100, "cached_tokens": 400, "elapsed_time": 0.03,
+                                            "time_to_first_token": 0.01}}
+
+    targets = ["P1:gpt-4.1", "P1:gpt-4o-mini", "P2:claude-sonnet-4", "P2:flaky"]
+    prompts = ["one", "two", {"name": "third", "user_prompt": "three", "system_prompt": "be brief"}]
+    original = model_matrix.openai_based_api.stream_content
+    model_matrix.openai_based_api.stream_content = fake_stream_content
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            cache_path = os.path.join(tmp, "cache.jsonl")
+            records = run_matrix(targets, prompts, provider_limits={"P1": 3, "P2": 1}, max_workers=8,
+                                 cache_path=cache_path)
+            assert state["calls"] == 12
+            assert state["peak"] == {"P1": 3, "P2": 1}
+            assert [(r["model"], r["prompt"]) for r in records][:3] == [("gpt-4.1", "prompt-1"),
+                                                                        ("gpt-4.1", "prompt-2"),
+                                                                        ("gpt-4.1", "third")]
+            first = records[0]
+            assert first["answer"] == "gpt-4.1 says one" and first["ttft"] == 0.01
+            # 400 个缓存命中的输入 token 按 cached_input 价格计费
+            assert first["cached_tokens"] == 400
+            assert abs(first["cost"] - (600 * 2 + 400 * 0.5 + 100 * 8) / 1e6) < 1e-12
+            assert sum("error" in r for r in records) == 3
+
+            table = format_table(records)
+            assert "## third" in table and "ERROR RuntimeError" in table
+
+            # 重新运行时只补齐失败的单元格
+            state["fail"] = False
+            records = run_matrix(targets, prompts, provider_limits={"P1": 3, "P2": 1}, cache_path=cache_path)
+            assert state["calls"] == 15
+            assert sum(bool(r.get("cached")) for r in records) == 9
+            # 从缓存读出的单元格费用与首次运行相同
+            assert records[0]["cached"] and records[0]["cost"] == first["cost"]
+            assert not any("error" in r for r in records)
+
+            run_matrix(targets, prompts, cache_path=cache_path)
+            assert state["calls"] == 15
+    finally:
+        model_matrix.openai_based_api.stream_content = original
+
+
+def test_matrix_against_mock_server():
+    with MockServer(token_interval=0.005) as server:
+        for name in ("MOCK-A", "MOCK-B"):
+            openai_based_api.PROVIDERS[name] = {"api_key": "mock", "base_url": server.base_url}
+        records = run_matrix(["MOCK-A:gpt-4o", "MOCK-B:gemini-2.5-flash"], ["Hello"], max_workers=2)
+        assert all(r["answer"] == server.config["response_text"] for r in records)
+        assert all(0 < r["ttft"] <= r["latency"] and r["cost"] > 0 for r in records)
+
+
+if __name__ == "__main__":
+    test_price_lookup()
+    test_matrix_limits_and_cache()
+    test_matrix_against_mock_server()
@@ -0,0 +1,85 @@
+import sys
+import os
+import io
+import base64
+import tempfile
+import threading
+from types import SimpleNamespace
+
+from PIL import Image
+
+# Add the parent directory to the path so we can import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding import dash_scope_multimodal_batch
+from embedding.dash_scope_multimodal_batch import preprocess_image, process_multimodal_embeddings
+
+calls = []
+calls_lock = threading.Lock()
+
+
+def fake_process_embedding(provider_name, model, inputs=None, dimensions=None, **kwargs):
+    """离线替身：每个条目的向量为 [输入长度, 批内序号]"""
+    with calls_lock:
+        calls.append(inputs)
+    embeddings = [{"index": i, "type": list(item)[0], "embedding": [float(len(list(item.values())[0])), float(i)]}
+                  for i, item in enumerate(inputs)]
+    # DashScope 返回的条目顺序不保证与输入一致
+    embeddings.reverse()
+    return {
+        "result": SimpleNamespace(output={"embeddings": embeddings}),
+        "total_tokens": 10,
+        "image_count": sum(1 for item in inputs if "image" in item),
+        "elapsed_time": 0.0
+    }
+
+
+def make_image(width, height, fmt="PNG"):
+    buffer = io.BytesIO()
+    Image.new("RGB", (width, height), (200, 30, 30)).save(buffer, fmt)
+    return buffer.getvalue()
+
+
+def decode_data_uri(uri):
+    assert uri.startswith("data:image/jpeg;base64,")
+    return Image.open(io.BytesIO(base64.b64decode(uri.split(",", 1)[1])))
+
+
+def test_preprocess_image():
+    image = decode_data_uri(preprocess_image(make_image(2000, 1000), max_side=256))
+    assert image.format == "JPEG" and image.size == (256, 128)
+
+    # 已经足够小的JPEG原样发送
+    small = make_image(100, 80, "JPEG")
+    assert preprocess_image(small, max_side=256) == "data:image/jpeg;base64," + base64.b64encode(small).decode()
+
+
+def test_process_multimodal_embeddings():
+    original = dash_scope_multimodal_batch.dash_scope_embedding.process_embedding
+    dash_scope_multimodal_batch.dash_scope_embedding.process_embedding = fake_process_embedding
+    calls.clear()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "local.png")
+            with open(path, "wb") as f:
+                f.write(make_image(1200, 900))
+            items = [{"text": "通用多模态表征模型示例"}, {"image": path},
+                     {"image": "https://example.com/image.jpg"}] + [{"image": make_image(640, 480)} for _ in range(6)]
+            response = process_multimodal_embeddings("ALIYUN", "multimodal-embedding-v1", items, max_side=128,
+                                                     batch_size=4, preprocess_workers=2)
+    finally:
+        dash_scope_multimodal_batch.dash_scope_embedding.process_embedding = original
+
+    assert response["batches"] == 3 and all(len(batch) <= 4 for batch in calls)
+    assert response["image_count"] == 8
+    sent = {list(item.values())[0] for batch in calls for item in batch}
+    assert "https://example.com/image.jpg" in sent and "通用多模态表征模型示例" in sent
+    # 向量按输入顺序返回
+    assert response["embeddings"][0][0] == len("通用多模态表征模型示例")
+    assert response["embeddings"][2][0] == len("https://example.com/image.jpg")
+    assert all(embedding is not None for embedding in response["embeddings"])
+
+
+if __name__ == "__main__":
+    test_preprocess_image()
+    test_process_multimodal_embeddings()
@@ -0,0 +1,108 @@
+import sys
+import os
+import json
+from types import SimpleNamespace
+
+# Add the parent directory to sys.path to import the LLM and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry, ledger
+from LLM.prompt_cache import apply_prompt_cache, cached_tokens, cache_style
+from LLM.openai_based_api import build_request
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+TOOLS = [
+    {"type": "function", "function": {"name": "vector_search", "description": "Semantic search",
+                                      "parameters": {"type": "object", "properties": {"query": {"type": "string"}}}}},
+    {"type": "function", "function": {"name": "keyword_search", "description": "Keyword search",
+                                      "parameters": {"properties": {"keywords": {"type": "array"}}, "type": "object"}}},
+]
+
+
+def shuffled_tools():
+    """Same tools in another order and with another key order"""
+    return [{"function": dict(reversed(list(tool["function"].items()))), "type": "function"}
+            for tool in reversed(TOOLS)]
+
+
+def test_layout_is_deterministic():
+    history = [{"role": "user", "content": "find documents"}]
+    first = build_request("gpt-4.1", "", system_prompt="system", history=history, tools=TOOLS, prompt_cache=True)
+    second = build_request("gpt-4.1", "", system_prompt="system", history=history, tools=shuffled_tools(),
+                           prompt_cache=True)
+    assert json.dumps(first["tools"]) == json.dumps(second["tools"])
+    assert [tool["function"]["name"] for tool in first["tools"]] == ["keyword_search", "vector_search"]
+    assert first["messages"] == [{"content": "system", "role": "system"}, {"content": "find documents", "role": "user"}]
+    assert "cache_control" not in json.dumps(first)
+    # 不开启时保持原有请求格式
+    plain = build_request("gpt-4.1", "", system_prompt="system", history=history, tools=TOOLS)
+    assert plain["tools"] is TOOLS and plain["messages"][1] is history[0]
+
+
+def test_breakpoints_for_claude_and_gemini():
+    tool_call = SimpleNamespace(model_dump=lambda exclude_none=True: {"type": "function", "id": "call_1",
+                                                                       "function": {"name": "vector_search",
+                                                                                    "arguments": "{}"}})
+    messages = [{"role": "system", "content": "system"}, {"role": "user", "content": "question"},
+                {"role": "assistant", "content": "", "tool_calls": [tool_call]},
+                {"role": "tool", "tool_call_id": "call_1", "content": "[]"}]
+    params = {"model": "anthropic/claude-sonnet-4", "messages": messages, "tools": TOOLS}
+    cached = apply_prompt_cache(params)
+    assert params["messages"][0]["content"] == "system" and "cache_control" not in params["tools"][-1]
+    assert cached["messages"][0]["content"] == [{"type": "text", "text": "system",
+                                                 "cache_control": {"type": "ephemeral"}}]
+    assert cached["messages"][3]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert cached["messages"][1]["content"] == "question"
+    assert cached["messages"][2]["tool_calls"][0]["function"] == {"arguments": "{}", "name": "vector_search"}
+    assert cached["tools"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert cache_style("gemini-2.5-flash") == "explicit" and cache_style("gpt-4o") == "automatic"
+
+
+def test_cached_tokens_from_usage():
+    assert cached_tokens(None) == 0
+    assert cached_tokens(SimpleNamespace(prompt_tokens_details=SimpleNamespace(cached_tokens=1024))) == 1024
+    assert cached_tokens(SimpleNamespace(prompt_tokens_details={"cached_tokens": 5})) == 5
+    assert cached_tokens(SimpleNamespace(prompt_tokens_details=None, cache_read_input_tokens=7)) == 7
+
+
+def test_cached_tokens_reported_against_mock_server():
+    book = ledger.set_default_ledger(ledger.Ledger())
+    labels = {"kind": "chat", "provider": "MOCK", "model": "gpt-4.1"}
+    try:
+        with MockServer(prompt_cache=True, tool_calls="never") as server:
+            configure_providers(server.url)
+            before = telemetry.METRICS.get("llm_input_tokens_total", **labels, cache="cached")
+            history = [{"role": "user", "content": "find documents about prompt caching " * 20}]
+
+            first = openai_based_api.process_content("MOCK", "", "gpt-4.1", system_prompt="system " * 200,
+                                                     history=history, tools=TOOLS, prompt_cache=True)
+            assert first["cached_tokens"] == 0 and first["uncached_input_tokens"] == first["input_tokens"]
+
+            history += [{"role": "assistant", "content": first["result"]}, {"role": "user", "content": "more"}]
+            second = openai_based_api.process_content("MOCK", "", "gpt-4.1", system_prompt="system " * 200,
+                                                      history=history, tools=shuffled_tools(), prompt_cache=True)
+            assert second["cached_tokens"] == first["input_tokens"]
+            assert second["uncached_input_tokens"] == second["input_tokens"] - second["cached_tokens"]
+
+            # 不开启缓存模式时，工具顺序变化导致前缀不一致
+            third = openai_based_api.process_content("MOCK", "", "gpt-4.1", system_prompt="system " * 200,
+                                                     history=history, tools=shuffled_tools())
+            assert third["cached_tokens"] == 0
+
+            events = list(openai_based_api.stream_content("MOCK", "", "gpt-4.1", system_prompt="system " * 200,
+                                                          history=history, tools=TOOLS, prompt_cache=True))
+            assert events[-1]["response"]["cached_tokens"] == second["input_tokens"]
+
+            assert (telemetry.METRICS.get("llm_input_tokens_total", **labels, cache="cached") - before ==
+                    second["cached_tokens"])
+            assert book.query(model="gpt-4.1")["cached_tokens"] == first["input_tokens"] + second["input_tokens"]
+    finally:
+        ledger.set_default_ledger(None)
+
+
+if __name__ == "__main__":
+    test_layout_is_deterministic()
+    test_breakpoints_for_claude_and_gemini()
+    test_cached_tokens_from_usage()
+    test_cached_tokens_reported_against_mock_server()
@@ -0,0 +1,192 @@
+import sys
+import os
+import json
+import time
+import asyncio
+import tempfile
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+
+import dashscope
+
+# Add the parent directory to sys.path to import the LLM and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, rate_limiter
+from embedding import dash_scope_embedding
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+
+def with_limits(test):
+    """Run test with a private state directory and a short burst window, then remove the limits"""
+    def run():
+        saved = rate_limiter.STATE_DIR, rate_limiter.BURST_SECONDS
+        with tempfile.TemporaryDirectory() as tmp:
+            rate_limiter.STATE_DIR, rate_limiter.BURST_SECONDS = tmp, 0.5
+            try:
+                test()
+            finally:
+                rate_limiter.STATE_DIR, rate_limiter.BURST_SECONDS = saved
+                for provider in ("LIMITED", "MOCK"):
+                    rate_limiter.set_limit(provider)
+    run.__name__ = test.__name__
+    return run
+
+
+@with_limits
+def test_request_bucket():
+    # 1200 RPM = 每秒 20 个，桶容量为 0.5 秒的量（10 个）
+    rate_limiter.set_limit("LIMITED", rpm=1200)
+    start = time.time()
+    times = []
+    for _ in range(20):
+        rate_limiter.release(rate_limiter.acquire("LIMITED"))
+        times.append(time.time() - start)
+    assert times[9] < 0.1
+    assert 0.4 < times[-1] < 0.8
+
+
+@with_limits
+def test_token_bucket_settles_actual_usage():
+    # 12000 TPM = 每秒 200 token，桶容量 100 token
+    rate_limiter.set_limit("LIMITED", tpm=12000)
+    permit = rate_limiter.acquire("LIMITED", 80)
+    # 实际只用了 10 个 token，多估的部分退回桶中
+    permit.used_tokens = 10
+    rate_limiter.release(permit)
+    start = time.time()
+    rate_limiter.release(rate_limiter.acquire("LIMITED", 80))
+    assert time.time() - start < 0.05
+    rate_limiter.release(rate_limiter.acquire("LIMITED", 80))
+    assert time.time() - start > 0.2
+
+
+@with_limits
+def test_pause_and_dead_holders():
+    rate_limiter.set_limit("LIMITED", max_in_flight=1)
+    child = multiprocessing.get_context("fork").Process(
+        target=lambda: (rate_limiter.acquire("LIMITED"), os._exit(0)))
+    child.start()
+    child.join()
+    # 崩溃的进程没有释放名额，检查时会被清理
+    start = time.time()
+    permit = rate_limiter.acquire("LIMITED")
+    assert time.time() - start < 0.2
+    rate_limiter.release(permit)
+
+    rate_limiter.pause("LIMITED", 0.3)
+    start = time.time()
+    rate_limiter.release(rate_limiter.acquire("LIMITED"))
+    assert time.time() - start >= 0.29
+
+
+@with_limits
+def test_corrupt_state_is_reset():
+    rate_limiter.set_limit("LIMITED", rpm=1200)
+    path = rate_limiter.state_path(rate_limiter.LIMITS["LIMITED"], "LIMITED")
+    # 写到一半时进程崩溃留下的状态文件
+    for text in ('{"requests": 3.0, "upd', '[1, 2]'):
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(text)
+        rate_limiter.release(rate_limiter.acquire("LIMITED"))
+        with open(path, encoding="utf-8") as f:
+            assert isinstance(json.load(f), dict)
+    assert not [name for name in os.listdir(rate_limiter.STATE_DIR) if name.endswith(".tmp")]
+
+
+def call_mock(count):
+    for i in range(count):
+        openai_based_api.process_content("MOCK", f"问题 {os.getpid()} {i}", "mock-model", coalesce=False)
+
+
+@with_limits
+def test_async_slot_keeps_file_io_off_the_event_loop():
+    rate_limiter.set_limit("LIMITED", rpm=1200, max_in_flight=1)
+    threads = []
+    original = rate_limiter.locked_state
+
+    def recording_locked_state(path):
+        threads.append(threading.get_ident())
+        return original(path)
+
+    async def main():
+        async with rate_limiter.slot_async("LIMITED"):
+            pass
+        return threading.get_ident()
+
+    rate_limiter.locked_state = recording_locked_state
+    try:
+        loop_thread = asyncio.run(main())
+    finally:
+        rate_limiter.locked_state = original
+    # 获取和释放都读写了状态文件，且都不在事件循环线程中
+    assert len(threads) >= 2 and loop_thread not in threads
+
+
+@with_limits
+def test_dash_scope_embedding_limits_and_coalesces():
+    rate_limiter.set_limit("LIMITED", max_in_flight=1, tpm=60000)
+    lock = threading.Lock()
+    state = {"calls": 0, "in_flight": 0, "peak": 0}
+
+    def fake_call(**params):
+        with lock:
+            state["calls"] += 1
+            state["in_flight"] += 1
+            state["peak"] = max(state["peak"], state["in_flight"])
+        time.sleep(0.05)
+        with lock:
+            state["in_flight"] -= 1
+        return SimpleNamespace(status_code=200, output={"embeddings": []},
+                               usage=SimpleNamespace(total_tokens=3, input_tokens=3))
+
+    original_call = dashscope.TextEmbedding.call
+    dashscope.TextEmbedding.call = fake_call
+    dash_scope_embedding.PROVIDERS["LIMITED"] = {"api_key": "limited-key", "base_url": ""}
+    try:
+        with ThreadPoolExecutor(max_workers=6) as executor:
+            # 3 个不同的文本各请求两次：相同请求合并，不同请求受 max_in_flight=1 限制依次发送
+            responses = list(executor.map(
+                lambda i: dash_scope_embedding.process_embedding("LIMITED", "text-embedding-v3", f"文本 {i % 3}"),
+                range(6)))
+    finally:
+        dashscope.TextEmbedding.call = original_call
+        dash_scope_embedding.PROVIDERS.pop("LIMITED", None)
+
+    assert all(r["total_tokens"] == 3 for r in responses)
+    assert state["peak"] == 1
+    assert state["calls"] + sum(1 for r in responses if r.get("coalesced")) == 6
+    assert 3 <= state["calls"] < 6
+
+
+@with_limits
+def test_in_flight_limit_across_processes():
+    with MockServer(latency={"distribution": "fixed", "value": 0.05}, max_concurrency=2) as server:
+        configure_providers(server.url)
+        rate_limiter.set_limit("MOCK", max_in_flight=2, rpm=60000)
+        context = multiprocessing.get_context("fork")
+        workers = [context.Process(target=call_mock, args=(5,)) for _ in range(4)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        stats = server.get_stats()
+
+    assert all(worker.exitcode == 0 for worker in workers)
+    # 服务端并发上限为 2：没有限流时 4 个进程会收到 429，受限后全部成功
+    assert server.count("/chat/completions", 200) == 20
+    assert server.count("/chat/completions", 429) == 0
+    assert stats["peak_in_flight"] <= 2
+
+
+if __name__ == "__main__":
+    test_request_bucket()
+    test_token_bucket_settles_actual_usage()
+    test_pause_and_dead_holders()
+    test_corrupt_state_is_reset()
+    test_async_slot_keeps_file_io_off_the_event_loop()
+    test_dash_scope_embedding_limits_and_coalesces()
+    test_in_flight_limit_across_processes()
@@ -0,0 +1,86 @@
+import sys
+import os
+import numpy as np
+from types import SimpleNamespace
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import semantic_cache
+from LLM.semantic_cache import SemanticCache, process_content_cached
+
+
+def fake_process_embedding(provider_name, model, input_text, dimensions=None, encoding_format="float"):
+    """离线替身：按字符计数生成向量，措辞相近的文本相似度高"""
+    vector = np.zeros(64, dtype=np.float32)
+    for ch in input_text.lower():
+        vector[ord(ch) % 64] += 1
+    return {
+        "result": SimpleNamespace(data=[SimpleNamespace(embedding=vector.tolist())]),
+        "prompt_tokens": len(input_text),
+        "total_tokens": len(input_text),
+        "elapsed_time": 0.001
+    }
+
+
+def fake_process_content(provider_name, user_prompt, model, *args, **kwargs):
+    fake_process_content.calls += 1
+    return {"result": f"answer to {user_prompt}", "input_tokens": 100, "output_tokens": 20, "elapsed_time": 1.5}
+
+
+def run_with_fakes(func):
+    originals = (semantic_cache.openai_based_embedding.process_embedding, semantic_cache.openai_based_api.process_content)
+    semantic_cache.openai_based_embedding.process_embedding = fake_process_embedding
+    semantic_cache.openai_based_api.process_content = fake_process_content
+    fake_process_content.calls = 0
+    try:
+        func()
+    finally:
+        (semantic_cache.openai_based_embedding.process_embedding,
+         semantic_cache.openai_based_api.process_content) = originals
+
+
+def test_semantic_hit_and_metrics():
+    def body():
+        cache = SemanticCache("MOCK", "mock-embedding", threshold=0.95)
+        first = process_content_cached(cache, "MOCK", "What is the capital of France?", "model-a")
+        second = process_content_cached(cache, "MOCK", "what is the capital of France", "model-a")
+        exact = process_content_cached(cache, "MOCK", "What is the capital of France?", "model-a")
+        other_model = process_content_cached(cache, "MOCK", "What is the capital of France?", "model-b")
+        unrelated = process_content_cached(cache, "MOCK", "Explain quantum tunnelling in detail", "model-a")
+
+        assert first["cache_hit"] is False
+        assert second["cache_hit"] is True and second["result"] == first["result"]
+        assert exact["cache_hit"] is True and exact["similarity"] == 1.0
+        assert other_model["cache_hit"] is False
+        assert unrelated["cache_hit"] is False
+        assert fake_process_content.calls == 3
+
+        stats = cache.get_stats()
+        assert stats["hits"] == 2 and stats["exact_hits"] == 1 and stats["misses"] == 3
+        assert abs(stats["hit_rate"] - 0.4) < 1e-9
+        assert stats["saved_input_tokens"] == 200 and stats["saved_output_tokens"] == 40
+        assert stats["saved_latency"] == 3.0
+
+    run_with_fakes(body)
+
+
+def test_lru_eviction_and_ttl():
+    def body():
+        cache = SemanticCache("MOCK", "mock-embedding", threshold=0.99, max_entries=2)
+        for prompt in ["aaaa", "bbbb", "cccc"]:
+            process_content_cached(cache, "MOCK", prompt, "model-a")
+        stats = cache.get_stats()
+        assert stats["entries"] == 2 and stats["evictions"] == 1
+        assert process_content_cached(cache, "MOCK", "aaaa", "model-a")["cache_hit"] is False
+
+        cache = SemanticCache("MOCK", "mock-embedding", ttl=0)
+        process_content_cached(cache, "MOCK", "dddd", "model-a")
+        assert process_content_cached(cache, "MOCK", "dddd", "model-a")["cache_hit"] is False
+
+    run_with_fakes(body)
+
+
+if __name__ == "__main__":
+    test_semantic_hit_and_metrics()
+    test_lru_eviction_and_ttl()
@@ -0,0 +1,72 @@
+import sys
+import os
+import numpy as np
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the embedding module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from embedding.similarity import embeddings_to_matrix, similarity_matrix, top_k, QuantizedIndex
+
+rng = np.random.default_rng(0)
+DOCS = rng.standard_normal((5000, 64)).astype(np.float32)
+QUERIES = rng.standard_normal((7, 64)).astype(np.float32)
+
+
+def brute_force(queries, docs, metric):
+    if metric == "cosine":
+        q = queries / np.linalg.norm(queries, axis=1, keepdims=True)
+        d = docs / np.linalg.norm(docs, axis=1, keepdims=True)
+        return q @ d.T
+    if metric == "dot":
+        return queries @ docs.T
+    return np.linalg.norm(queries[:, None, :] - docs[None, :, :], axis=2)
+
+
+def test_embeddings_to_matrix():
+    openai_result = {"result": SimpleNamespace(data=[SimpleNamespace(index=1, embedding=[3.0, 4.0]),
+                                                     SimpleNamespace(index=0, embedding=[1.0, 2.0])])}
+    dashscope_result = {"result": SimpleNamespace(output={"embeddings": [{"text_index": 0, "embedding": [1.0, 2.0]},
+                                                                         {"text_index": 1, "embedding": [3.0, 4.0]}]})}
+    expected = np.array([[1.0, 2.0], [3.0, 4.0]], dtype=np.float32)
+    assert np.array_equal(embeddings_to_matrix(openai_result), expected)
+    assert np.array_equal(embeddings_to_matrix(dashscope_result), expected)
+    assert np.array_equal(embeddings_to_matrix({"embeddings": [[1, 2], [3, 4]]}), expected)
+
+
+def test_similarity_matrix_chunked():
+    for metric in ("cosine", "dot", "l2"):
+        result = similarity_matrix(QUERIES, DOCS[:500], metric=metric, chunk_size=128)
+        assert np.allclose(result, brute_force(QUERIES, DOCS[:500], metric), atol=1e-3)
+
+
+def test_top_k_matches_brute_force():
+    for metric in ("cosine", "dot", "l2"):
+        indices, scores = top_k(QUERIES, DOCS, k=10, metric=metric, chunk_size=777)
+        full = brute_force(QUERIES, DOCS, metric)
+        expected = np.argsort(full if metric == "l2" else -full, axis=1)[:, :10]
+        assert np.array_equal(indices, expected)
+        assert np.allclose(scores, np.take_along_axis(full, expected, axis=1), atol=1e-3)
+
+
+def test_quantized_index_recall():
+    expected = np.argsort(-brute_force(QUERIES, DOCS, "cosine"), axis=1)[:, :10]
+    for storage in ("float16", "int8"):
+        index = QuantizedIndex(DOCS, storage=storage, chunk_size=1000)
+        assert index.nbytes < DOCS.nbytes / 1.9
+
+        indices, _ = index.search(QUERIES, k=10)
+        recall = np.mean([len(set(a) & set(b)) / 10 for a, b in zip(indices, expected)])
+        assert recall >= 0.9
+
+        rescored = QuantizedIndex(DOCS, storage=storage, full_precision=DOCS)
+        indices, scores = rescored.search(QUERIES, k=10, rescore_factor=4)
+        assert np.array_equal(indices, expected)
+        assert np.all(np.diff(scores, axis=1) <= 1e-6)
+
+
+if __name__ == "__main__":
+    test_embeddings_to_matrix()
+    test_similarity_matrix_chunked()
+    test_top_k_matches_brute_force()
+    test_quantized_index_recall()
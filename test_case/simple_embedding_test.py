@@ -7,6 +7,10 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from embedding.dash_scope_embedding import process_embedding
 import dashscope
+from LLM import cassette
+
+# LLM_CASSETTE_MODE=record / replay 时录制或离线回放本脚本的请求
+cassette.from_env(__file__)
 
 def test_text_embedding():
     print("\n===== Testing Text Embedding =====")
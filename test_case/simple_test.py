@@ -5,6 +5,10 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from LLM.openai_based_api import process_content
+from LLM import cassette
+
+# LLM_CASSETTE_MODE=record / replay 时录制或离线回放本脚本的请求
+cassette.from_env(__file__)
 
 def main():
     provider_name = "YUNWU-Dev"
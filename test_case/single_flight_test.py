@@ -0,0 +1,109 @@
+import sys
+import os
+import time
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM, embedding and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+from LLM.single_flight import SingleFlight, fingerprint
+from embedding import openai_based_embedding
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers
+
+
+def coalesced(kind):
+    return telemetry.METRICS.total("llm_coalesced_calls_total", kind=kind)
+
+
+def test_single_flight_shares_result_and_error():
+    flight = SingleFlight("test")
+    calls = []
+    barrier = threading.Barrier(5)
+
+    def slow(value):
+        calls.append(value)
+        time.sleep(0.2)
+        if value == "bad":
+            raise RuntimeError("upstream failed")
+        return {"value": value}
+
+    def worker(value):
+        barrier.wait()
+        try:
+            return flight.do(value, lambda: slow(value))
+        except RuntimeError as e:
+            return str(e)
+
+    with ThreadPoolExecutor(max_workers=5) as executor:
+        results = list(executor.map(worker, ["a", "a", "a", "bad", "bad"]))
+    assert sorted(calls) == ["a", "bad"]
+    assert [shared for _, shared in results[:3]].count(False) == 1
+    assert all(result is results[0][0] for result, _ in results[:3])
+    assert results[3:] == ["upstream failed", "upstream failed"]
+    assert flight.in_flight() == 0
+
+    # 调用结束后同一个 key 会重新发起请求
+    assert flight.do("a", lambda: slow("a")) == ({"value": "a"}, False)
+    assert fingerprint("P", {"b": 1, "a": [1, 2]}) == fingerprint("P", {"a": [1, 2], "b": 1})
+    assert fingerprint("P", {"a": 1}) != fingerprint("Q", {"a": 1})
+
+
+def test_threaded_calls_against_mock_server():
+    with MockServer(latency=0.3) as server:
+        configure_providers(server.url)
+        before_chat, before_embedding = coalesced("chat"), coalesced("embedding")
+        with ThreadPoolExecutor(max_workers=11) as executor:
+            chats = [executor.submit(openai_based_api.process_content, "MOCK", "same question", "mock-model")
+                     for _ in range(6)]
+            other = executor.submit(openai_based_api.process_content, "MOCK", "other question", "mock-model")
+            embeddings = [executor.submit(openai_based_embedding.process_embedding, "MOCK", "mock-embedding",
+                                          ["a", "b"], dimensions=8) for _ in range(4)]
+            chats = [future.result() for future in chats]
+            other.result()
+            embeddings = [future.result() for future in embeddings]
+
+        assert server.count("/chat/completions") == 2
+        assert server.count("/embeddings") == 1
+        assert sum(bool(r.get("coalesced")) for r in chats) == 5
+        assert len({r["result"] for r in chats}) == 1 and all(r["input_tokens"] > 0 for r in chats)
+        assert len({id(r["result"]) for r in embeddings}) == 1
+        assert coalesced("chat") - before_chat == 5
+        assert coalesced("embedding") - before_embedding == 3
+
+        # 关闭合并后每个调用都会请求上游
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            list(executor.map(lambda _: openai_based_api.process_content("MOCK", "same question", "mock-model",
+                                                                         coalesce=False), range(3)))
+        assert server.count("/chat/completions") == 5
+
+
+def test_async_calls_against_mock_server():
+    async def run():
+        chat = [openai_based_api.process_content_async("MOCK", "async question", "mock-model") for _ in range(5)]
+        embed = [openai_based_embedding.process_embedding_async("MOCK", "mock-embedding", "hello", dimensions=8)
+                 for _ in range(3)]
+        return await asyncio.gather(*chat, *embed)
+
+    with MockServer(latency=0.2) as server:
+        configure_providers(server.url)
+        before = coalesced("chat")
+        results = asyncio.run(run())
+        assert server.count("/chat/completions") == 1 and server.count("/embeddings") == 1
+        assert coalesced("chat") - before == 4
+        assert sum(bool(r.get("coalesced")) for r in results) == 6
+        assert results[0]["result"] == server.config["response_text"]
+        assert len(results[-1]["result"].data[0].embedding) == 8
+
+        # 不同事件循环之间不会共享调用
+        asyncio.run(run())
+        assert server.count("/chat/completions") == 2
+
+
+if __name__ == "__main__":
+    test_single_flight_shares_result_and_error()
+    test_threaded_calls_against_mock_server()
+    test_async_calls_against_mock_server()
@@ -0,0 +1,131 @@
+import sys
+import os
+import json
+
+# Add the parent directory to sys.path to import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import structured_output
+from LLM.structured_output import (IncrementalJSONParser, repair_json, validate_schema,
+                                   process_structured_content)
+
+SCHEMA = {
+    "type": "object",
+    "properties": {
+        "title": {"type": "string"},
+        "score": {"type": "number", "minimum": 0, "maximum": 1},
+        "tags": {"type": "array", "items": {"type": "string"}},
+    },
+    "required": ["title", "tags"],
+    "additionalProperties": False
+}
+
+DOCUMENT = {"title": "报告 \"A\"", "score": 0.75, "tags": ["性能", "json", "流式"], "meta": {"nested": [1, 2]}}
+
+
+def test_incremental_parser_emits_before_end():
+    """Fields and array elements are reported as soon as they are complete."""
+    text = "```json\n" + json.dumps(DOCUMENT, ensure_ascii=False) + "\n```"
+    parser = IncrementalJSONParser(max_depth=2)
+    seen = []
+    for i in range(0, len(text), 3):
+        for item in parser.feed(text[i:i + 3]):
+            seen.append((i, item["path"], item["value"]))
+
+    paths = [path for _, path, _ in seen]
+    assert ("title",) in paths and ("tags", 0) in paths and ("tags",) in paths
+    assert ("meta", "nested") in paths
+    # title 在整个文本结束前就已解析出来
+    title_offset = next(i for i, path, _ in seen if path == ("title",))
+    assert title_offset < len(text) // 2
+    assert seen[0][2] == DOCUMENT["title"]
+    assert parser.done and parser.value == DOCUMENT
+
+
+def test_incremental_parser_malformed_input():
+    """Malformed streamed JSON stops incremental parsing instead of raising."""
+    for text in ('{"a": [1, 2]]}', '{"a": 01}'):
+        parser = IncrementalJSONParser()
+        items = [item for c in text for item in parser.feed(c)]
+        assert parser.failed and not parser.done
+        assert parser.buffer == text
+    assert [item["value"] for item in items] == []
+
+
+def test_repair_truncated_json():
+    full = json.dumps(DOCUMENT, ensure_ascii=False)
+    # 在字符串中间截断
+    value, repaired = repair_json(full[:full.index("流式") + 1])
+    assert repaired and value["tags"][-1] == "流"
+    # 在键之后截断
+    value, repaired = repair_json('{"title": "x", "tags": ["a"], "sco')
+    assert repaired and value == {"title": "x", "tags": ["a"]}
+    # 在冒号之后截断
+    value, repaired = repair_json('{"title": "x", "score":')
+    assert value == {"title": "x"}
+    # 完整的JSON不需要修复
+    assert repair_json(full) == (DOCUMENT, False)
+
+
+def test_validate_schema():
+    assert validate_schema({"title": "t", "tags": ["a"], "score": 0.5}, SCHEMA) == []
+    errors = validate_schema({"title": 1, "score": 3, "extra": True}, SCHEMA)
+    assert len(errors) >= 3
+
+
+def test_process_structured_content_streaming():
+    """Streaming mode yields items through on_item and validates the final result."""
+    text = json.dumps({"title": "t", "tags": ["a", "b"], "score": 0.5})
+
+    def fake_stream_content(**kwargs):
+        for i in range(0, len(text), 4):
+            yield {"type": "delta", "content": text[i:i + 4]}
+        yield {"type": "done", "response": {"result": text, "input_tokens": 1, "output_tokens": 1, "elapsed_time": 0}}
+
+    original = structured_output.openai_based_api.stream_content
+    structured_output.openai_based_api.stream_content = fake_stream_content
+    items = []
+    try:
+        response = process_structured_content(
+            provider_name="MOCK",
+            user_prompt="生成JSON",
+            model="mock-model",
+            response_format={"type": "json_schema", "json_schema": {"name": "doc", "schema": SCHEMA}},
+            on_item=items.append
+        )
+    finally:
+        structured_output.openai_based_api.stream_content = original
+
+    assert [item["path"] for item in items][:2] == [("title",), ("tags", 0)]
+    assert response["parsed"]["tags"] == ["a", "b"]
+    assert response["validation_errors"] == [] and response["repaired"] is False
+
+
+def test_streaming_malformed_json_is_repaired():
+    text = '{"title": "t", "tags": ["a"]]}'
+
+    def fake_stream_content(**kwargs):
+        for c in text:
+            yield {"type": "delta", "content": c}
+        yield {"type": "done", "response": {"result": text, "input_tokens": 1, "output_tokens": 1, "elapsed_time": 0}}
+
+    original = structured_output.openai_based_api.stream_content
+    structured_output.openai_based_api.stream_content = fake_stream_content
+    try:
+        events = list(structured_output.iter_structured_content(
+            "MOCK", "生成JSON", "mock-model", {"type": "json_schema", "json_schema": {"name": "doc", "schema": SCHEMA}}))
+    finally:
+        structured_output.openai_based_api.stream_content = original
+
+    assert [e["path"] for e in events if e["event"] == "item"] == [("title",), ("tags", 0), ("tags",)]
+    response = events[-1]["response"]
+    assert response["repaired"] and response["parsed"] == {"title": "t", "tags": ["a"]}
+
+
+if __name__ == "__main__":
+    test_incremental_parser_emits_before_end()
+    test_incremental_parser_malformed_input()
+    test_repair_truncated_json()
+    test_validate_schema()
+    test_process_structured_content_streaming()
+    test_streaming_malformed_json_is_repaired()
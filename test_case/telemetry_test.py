@@ -0,0 +1,140 @@
+import sys
+import os
+import time
+import logging
+import urllib.request
+from types import SimpleNamespace
+
+# Add the parent directory to the path so we can import the LLM module
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from LLM import openai_based_api, telemetry
+
+
+class RateLimitError(Exception):
+    status_code = 429
+
+
+def fake_completion(text="hello"):
+    message = SimpleNamespace(content=text, tool_calls=None)
+    return SimpleNamespace(choices=[SimpleNamespace(message=message)],
+                           usage=SimpleNamespace(prompt_tokens=12, completion_tokens=3))
+
+
+def make_client(outcomes):
+    """Client whose create() raises or returns the given outcomes in order"""
+    def create(**kwargs):
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    return SimpleNamespace(chat=SimpleNamespace(completions=SimpleNamespace(create=create)))
+
+
+def run_with_client(outcomes, **kwargs):
+    original_client, original_time = openai_based_api.get_openai_client, openai_based_api.time
+    openai_based_api.get_openai_client = lambda provider_name: make_client(outcomes)
+    # 跳过重试等待
+    openai_based_api.time = SimpleNamespace(time=time.time, sleep=lambda seconds: None)
+    try:
+        return openai_based_api.process_content("FAKE", "hi", "fake-model", **kwargs)
+    finally:
+        openai_based_api.get_openai_client, openai_based_api.time = original_client, original_time
+
+
+def test_metrics_and_spans_for_retried_request():
+    telemetry.METRICS.reset()
+    exporter = telemetry.InMemorySpanExporter()
+    telemetry.SPAN_EXPORTERS.append(exporter)
+    try:
+        with telemetry.span("caller") as caller:
+            response = run_with_client([RateLimitError("slow down"), fake_completion()])
+    finally:
+        telemetry.SPAN_EXPORTERS.remove(exporter)
+
+    assert response["result"] == "hello"
+    labels = {"kind": "chat", "provider": "FAKE", "model": "fake-model"}
+    metrics = telemetry.METRICS
+    assert metrics.get("llm_attempts_total", **labels, outcome="rate_limited") == 1
+    assert metrics.get("llm_attempts_total", **labels, outcome="success") == 1
+    assert metrics.get("llm_retries_total", **labels) == 1
+    assert metrics.get("llm_backoff_seconds_total", **labels) >= 30
+    assert metrics.get("llm_requests_total", **labels, outcome="success") == 1
+    assert metrics.get("llm_tokens_total", **labels, direction="input") == 12
+    assert metrics.get("llm_tokens_total", **labels, direction="output") == 3
+    assert metrics.get_histogram("llm_request_duration_seconds", **labels, outcome="success")["count"] == 1
+
+    spans = {s.name: s for s in exporter.spans if s.name != "chat.attempt"}
+    attempts = [s for s in exporter.spans if s.name == "chat.attempt"]
+    request = spans["chat.request"]
+    assert len(attempts) == 2
+    assert [s.attributes["outcome"] for s in attempts] == ["rate_limited", "success"]
+    assert attempts[0].status == "ERROR" and attempts[1].status == "OK"
+    assert all(s.parent is request for s in attempts)
+    assert request.parent is caller and request.trace_id == caller.trace_id
+    assert request.attributes["attempts"] == 2
+    assert [event["name"] for event in request.events] == ["backoff"]
+
+
+def test_failed_request_outcome():
+    telemetry.METRICS.reset()
+    try:
+        run_with_client([RuntimeError("boom")] * 5)
+        assert False, "expected the last error to be raised"
+    except RuntimeError:
+        pass
+    labels = {"kind": "chat", "provider": "FAKE", "model": "fake-model"}
+    assert telemetry.METRICS.get("llm_attempts_total", **labels, outcome="error") == 5
+    assert telemetry.METRICS.get("llm_retries_total", **labels) == 4
+    assert telemetry.METRICS.get("llm_requests_total", **labels, outcome="error") == 1
+    assert telemetry.METRICS.total("llm_requests_total", provider="FAKE") == 1
+
+
+def test_prometheus_exporter():
+    registry = telemetry.MetricsRegistry(buckets=(0.1, 1.0))
+    registry.inc("llm_requests_total", provider="A", model='m"1', outcome="success")
+    registry.observe("llm_request_duration_seconds", 0.5, provider="A")
+    registry.observe("llm_request_duration_seconds", 5, provider="A")
+    text = registry.render_prometheus()
+    assert "# TYPE llm_requests_total counter" in text
+    assert 'llm_requests_total{model="m\\"1",outcome="success",provider="A"} 1' in text
+    assert 'llm_request_duration_seconds_bucket{provider="A",le="0.1"} 0' in text
+    assert 'llm_request_duration_seconds_bucket{provider="A",le="1.0"} 1' in text
+    assert 'llm_request_duration_seconds_bucket{provider="A",le="+Inf"} 2' in text
+    assert 'llm_request_duration_seconds_count{provider="A"} 2' in text
+
+    server = telemetry.start_metrics_server(port=0, host="127.0.0.1", registry=registry)
+    try:
+        with urllib.request.urlopen(f"http://127.0.0.1:{server.server_address[1]}/metrics") as response:
+            assert response.read().decode("utf-8") == text
+    finally:
+        server.shutdown()
+
+
+def test_logging_levels():
+    records = []
+
+    class ListHandler(logging.Handler):
+        def emit(self, record):
+            records.append(record)
+
+    logger = telemetry.configure_logging("WARNING")
+    handler = ListHandler()
+    logger.addHandler(handler)
+    try:
+        run_with_client([RateLimitError("slow down"), fake_completion()])
+        assert records and all(record.levelno >= logging.WARNING for record in records)
+        records.clear()
+        telemetry.configure_logging("DEBUG")
+        run_with_client([fake_completion()])
+        assert any(record.levelno == logging.DEBUG for record in records)
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+
+
+if __name__ == "__main__":
+    test_metrics_and_spans_for_retried_request()
+    test_failed_request_outcome()
+    test_prometheus_exporter()
+    test_logging_levels()
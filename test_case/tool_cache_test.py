@@ -0,0 +1,106 @@
+import sys
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the parent directory to sys.path to import the LLM, agent and benchmark modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from agent.agent_runtime import AgentSession
+from agent.tool_cache import ToolResultCache
+from benchmark.mock_server import MockServer
+from benchmark.api_benchmark import configure_providers, TOOLS_PATH
+
+with open(TOOLS_PATH, encoding="utf-8") as f:
+    TOOLS = json.load(f)["tools"]
+
+
+def test_canonical_key():
+    cache = ToolResultCache(TOOLS)
+    assert cache.key("full_text_search", {"query": " 机器学习  入门"}) == \
+           cache.key("full_text_search", {"limit": 10.0, "query": "机器学习 入门"})
+    assert cache.key("keyword_search", {"keywords": ["b", "a", "a"], "match_type": "any"}) == \
+           cache.key("keyword_search", {"keywords": ["a", " b"]})
+    assert cache.key("full_text_search", {"query": "机器学习"}) != \
+           cache.key("full_text_search", {"query": "机器学习", "limit": 5})
+    assert cache.key("full_text_search", {"query": "x"}) != cache.key("vector_search", {"query": "x"})
+
+
+def test_concurrent_duplicates_run_once():
+    cache = ToolResultCache(TOOLS)
+    runs = []
+    lock = threading.Lock()
+
+    def search():
+        with lock:
+            runs.append(1)
+        time.sleep(0.2)
+        return {"results": ["doc"]}
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(cache.get_or_run, "vector_search", {"query": "q", "limit": 10}, search)
+                   for _ in range(4)]
+        outcomes = [future.result() for future in futures]
+
+    assert len(runs) == 1
+    assert all(result == {"results": ["doc"]} for result, _ in outcomes)
+    assert sorted(status for _, status in outcomes) == ["deduplicated"] * 3 + ["miss"]
+    assert cache.get_or_run("vector_search", {"query": "q"}, search) == ({"results": ["doc"]}, "hit")
+
+
+def test_ttl_and_failures():
+    cache = ToolResultCache(TOOLS, tool_ttls={"vector_search": 0.1, "keyword_search": 0})
+    counter = {"n": 0}
+
+    def search():
+        counter["n"] += 1
+        return counter["n"]
+
+    assert cache.get_or_run("vector_search", {"query": "q"}, search) == (1, "miss")
+    assert cache.get_or_run("vector_search", {"query": "q"}, search) == (1, "hit")
+    time.sleep(0.15)
+    assert cache.get_or_run("vector_search", {"query": "q"}, search) == (2, "miss")
+    assert cache.get_or_run("keyword_search", {"keywords": ["q"]}, search) == (3, "miss")
+    assert cache.get_or_run("keyword_search", {"keywords": ["q"]}, search) == (4, "miss")
+
+    def broken():
+        raise RuntimeError("index offline")
+
+    try:
+        cache.get_or_run("full_text_search", {"query": "q"}, broken)
+        assert False, "error expected"
+    except RuntimeError:
+        pass
+    assert cache.get_or_run("full_text_search", {"query": "q"}, search) == (5, "miss")
+
+
+def test_session_reuses_results_across_rounds():
+    calls = []
+
+    def search(arguments):
+        calls.append(arguments)
+        return {"results": ["doc"]}
+
+    with MockServer(parallel_tool_calls=1) as server:
+        configure_providers(server.url)
+        with AgentSession("MOCK", "mock-model", TOOLS, {"full_text_search": search}) as session:
+            session.run("查找机器学习文档")
+            session.run("查找机器学习文档")
+        with AgentSession("MOCK", "mock-model", TOOLS, {"full_text_search": search}, tool_cache=False) as uncached:
+            uncached.run("查找机器学习文档")
+
+    assert len(calls) == 2
+    statuses = [tool["cache"] for turn in session.turns for tool in turn["tools"]]
+    assert statuses == ["miss", "hit"]
+    assert [tool["cache"] for turn in uncached.turns for tool in turn["tools"]] == [None]
+    # 命中缓存的调用仍然要回复对应的 tool_call_id
+    assert [m["role"] for m in session.history].count("tool") == 2
+
+
+if __name__ == "__main__":
+    test_canonical_key()
+    test_concurrent_duplicates_run_once()
+    test_ttl_and_failures()
+    test_session_reuses_results_across_rounds()